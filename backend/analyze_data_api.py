@@ -6,7 +6,7 @@ API_BASE_URL = f"http://localhost:{API_PORT}"
 
 
 def call_analyze_data(prompt, data, is_csv):
-    url = f"{API_BASE_URL}/analyze-data"
+    url = f"{API_BASE_URL}/conversations/analyze-data"
     payload = {
         "question_or_prompt": prompt,
         "data": data,
@@ -17,11 +17,11 @@ def call_analyze_data(prompt, data, is_csv):
     return response.json()
 
 
-def call_ask_question(question_or_prompt, context):
-    url = f"{API_BASE_URL}/ask-question"
+def call_ask_question(question_or_prompt, conversation_id):
+    url = f"{API_BASE_URL}/conversations/ask-question"
     payload = {
         "question_or_prompt": question_or_prompt,
-        "context": context
+        "conversation_id": conversation_id
     }
     response = requests.post(url, json=payload)
     response.raise_for_status()
@@ -53,7 +53,7 @@ def main():
 
         response = call_ask_question(
             question_or_prompt=user_message,
-            context=response['updated_context']
+            conversation_id=response['conversation_id']
         )
 
         print(f"AI: {response['response']}")
@@ -3,7 +3,7 @@ import os
 from src.ai_tasks.ai_tasks import AiTasks
 from src.ai_utils.ai_context_loader import ContextBuilder
 from src.shared.config import ensure_env_is_loaded, SAMPLE_DATASETS_FOLDER
-from src.shared.loggers import log_json_to_folder
+from src.shared.log_writer import BufferedJsonlLogger
 
 
 def main():
@@ -19,7 +19,7 @@ def main():
         api_endpoint=os.getenv("AI_API_URL"),
         api_key= os.getenv("AI_API_KEY"),
         default_model=os.getenv("MODEL_NAME"),
-        response_logger=log_json_to_folder
+        response_logger=BufferedJsonlLogger()
     )
 
     prompt = ("Analyze the following data and give me the top 3 profiles that will most likely "
@@ -1,31 +1,148 @@
+import asyncio
+import csv
+import json
+import math
 import os
-from uuid import uuid4
+import tempfile
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from timeit import default_timer as timer
 from pydantic import BaseModel
-from typing import List, Optional, Union, Dict
+from typing import List, Optional, Union, Dict, Tuple, AsyncIterator, Any
+from weakref import WeakValueDictionary
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 
-from src.ai_tasks.ai_tasks import AiTasks
-from src.ai_tasks.types import ChatContextItem, AiResponse
+from src.ai_tasks.async_ai_tasks import AsyncAiTasks
+from src.ai_tasks.batch import async_run_batch
+from src.ai_tasks.provider_pool import ProviderPool
+from src.ai_tasks.response_cache import get_response_cache
+from src.ai_tasks.types import ChatContextItem, AiResponse, ResponseCacheStats, AiProviderStats, AiBatchResult, \
+    AiStreamChunk
 from src.ai_utils.ai_context_loader import ContextBuilder
-from src.shared.config import API_PORT, ensure_env_is_loaded
-from src.shared.loggers import log_json_to_folder
+from src.ai_utils.context_window import ContextWindowManager
+from src.ai_utils.token_counter import get_token_counter
+from src.conversations.conversation_store import get_conversation_store, ConversationConflictError
+from src.datasets.columnar import ColumnarDataset
+from src.datasets.types import DatasetEncoding
+from src.datasets.upload_store import UploadStore, TEMPORARY_UPLOAD_SUFFIX
+from src.decorators.retry import CircuitOpenError
+from src.conversations.types import Conversation, ConversationTurnResponse, ConversationStreamChunk
+from src.shared.config import API_PORT, UPLOADS_FOLDER, ensure_env_is_loaded
+from src.shared.log_index import InteractionLogIndex
+from src.shared.log_writer import BufferedJsonlLogger
+from src.shared.loggers import log_fields
+from src.shared.http_sessions import close_async_clients, configure_host
+import src.shared.json_codec as json_codec
+from src.shared.metrics import GLOBAL_METRICS, GLOBAL_METRICS_CONTENT_TYPE, HTTP_REQUEST_DURATION
+from src.shared.rate_limiter import configure_rate_limit
+from src.shared.types import InteractionLogEntry, InteractionLogGroupBy, InteractionLogStats
 
 ensure_env_is_loaded()
 
-ai_tasker = AiTasks(
-    api_endpoint=os.getenv("AI_API_URL"),
-    api_key=os.getenv("AI_API_KEY"),
-    default_model=os.getenv("MODEL_NAME"),
-    response_logger=log_json_to_folder
+# orjson (if installed) or json. Used for the requests to the AI, its responses, our responses and the logs.
+json_codec.configure_json_backend(os.getenv("JSON_BACKEND", "auto"))
+
+# Optionally, requests can be spread between multiple providers (endpoint + key + model). See the readme.
+hedge_percentile = float(os.getenv("AI_HEDGE_PERCENTILE", "0.95"))
+provider_pool = ProviderPool.from_json_file(
+    os.getenv("AI_PROVIDERS_FILE"),
+    hedge_percentile=hedge_percentile if hedge_percentile > 0 else None
+) if os.getenv("AI_PROVIDERS_FILE") else None
+
+# With a provider pool, AI_API_URL/AI_API_KEY/MODEL_NAME are optional. The first provider is used in their place.
+default_provider = provider_pool.providers[0] if provider_pool is not None else None
+ai_api_url = os.getenv("AI_API_URL") or (default_provider.api_endpoint if default_provider else None)
+ai_api_key = os.getenv("AI_API_KEY") or (default_provider.api_key if default_provider else None)
+model_name = os.getenv("MODEL_NAME") or (default_provider.model if default_provider else None)
+
+ai_api_urls = {ai_api_url} if ai_api_url else set()
+if provider_pool is not None:
+    ai_api_urls.update(provider.api_endpoint for provider in provider_pool.providers)
+
+for url in ai_api_urls:
+    configure_host(url, http2=os.getenv("AI_API_HTTP2", "false").lower() == "true")
+
+    # Requests to the AI API wait in line to stay within its rate limits, instead of getting 429s and burning retries.
+    # Limits not informed are learned from the rate limit headers of the API. (The limits are per host)
+    if os.getenv("AI_RATE_LIMIT", "true").lower() == "true":
+        configure_rate_limit(
+            url,
+            requests_per_minute=int(os.getenv("AI_RATE_LIMIT_RPM")) if os.getenv("AI_RATE_LIMIT_RPM") else None,
+            tokens_per_minute=int(os.getenv("AI_RATE_LIMIT_TPM")) if os.getenv("AI_RATE_LIMIT_TPM") else None,
+            max_concurrency=int(os.getenv("AI_MAX_CONCURRENT_REQUESTS")) if os.getenv("AI_MAX_CONCURRENT_REQUESTS")
+            else None
+        )
+
+# If we know the size of the context window of the model, old messages are dropped to make the context fit in it.
+context_window = ContextWindowManager(
+    max_tokens=int(os.getenv("AI_CONTEXT_WINDOW_TOKENS")),
+    reserved_for_completion=int(os.getenv("AI_RESERVED_COMPLETION_TOKENS", "0")),
+    token_counter=get_token_counter(model_name)
+) if os.getenv("AI_CONTEXT_WINDOW_TOKENS") else None
+
+# Responses of the AI model can be cached, so repeated requests (like the same analysis over and over) are free.
+response_cache_ttl_seconds = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+response_cache = get_response_cache(
+    cache_type=os.getenv("RESPONSE_CACHE"),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=response_cache_ttl_seconds if response_cache_ttl_seconds > 0 else None
+) if os.getenv("RESPONSE_CACHE", "none").lower() != "none" else None
+
+# Interactions with the AI are logged by a background thread, in batches, to JSONL segments (see the readme).
+interaction_logger = BufferedJsonlLogger(
+    max_queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    overflow_policy=os.getenv("LOG_OVERFLOW_POLICY", "drop_newest"),
+    max_segment_bytes=int(os.getenv("LOG_SEGMENT_MAX_MB", "64")) * 1024 * 1024,
+    compress=os.getenv("LOG_COMPRESS", "false").lower() == "true"
+)
+
+# Index of the logs above, to search and aggregate the interactions (/logs/...). Updated when queried.
+interaction_log_index = InteractionLogIndex()
+
+ai_tasker = AsyncAiTasks(
+    api_endpoint=ai_api_url,
+    api_key=ai_api_key,
+    default_model=model_name,
+    response_logger=interaction_logger,
+    context_window=context_window,
+    response_cache=response_cache,
+    # Identical requests that arrive at the same time (e.g.: many users refreshing the same analysis) share one call.
+    coalesce_requests=os.getenv("AI_COALESCE_REQUESTS", "true").lower() == "true",
+    provider_pool=provider_pool
 )
 
 cb_loader = ContextBuilder()
 agent = cb_loader.load_agent("data-analyst")
 
-files: Dict[str, str] = {}
+# Uploaded files, already parsed. The data lives on disk (memory-mapped) and is shared by all the workers.
+upload_ttl_seconds = int(os.getenv("UPLOAD_STORE_TTL_SECONDS", str(24 * 60 * 60)))
+upload_store = UploadStore(
+    max_total_bytes=int(os.getenv("UPLOAD_STORE_MAX_BYTES", str(2 * 1024 ** 3))),
+    ttl_seconds=upload_ttl_seconds if upload_ttl_seconds > 0 else None,
+    max_open_datasets=int(os.getenv("UPLOAD_STORE_MAX_OPEN_DATASETS", "16"))
+)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# How many chunks of a dataset are sent to the AI model at the same time, in the chunked analysis.
+chunked_analysis_max_concurrency = int(os.getenv("AI_CHUNKED_ANALYSIS_MAX_CONCURRENCY", "4"))
+
+# How many items of a batch (/ask-question/batch, /analyze-data/batch) are sent to the AI model at the same time.
+# Requests can ask for less, but not for more.
+batch_max_concurrency = int(os.getenv("AI_BATCH_MAX_CONCURRENCY", "8"))
+batch_max_items = int(os.getenv("AI_BATCH_MAX_ITEMS", "1000"))
+
+conversation_store = get_conversation_store(
+    store_type=os.getenv("CONVERSATION_STORE", "memory"),
+    max_conversations=int(os.getenv("CONVERSATION_STORE_MAX_CONVERSATIONS", "1000"))
+)
+# One lock per conversation that has a turn running. (They go away by themselves once nobody is using them)
+conversation_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
 
 app = FastAPI()
 
@@ -40,6 +157,18 @@ app.add_middleware(
 )
 
 
+class FastJSONResponse(Response):
+    """
+    Encodes the response with the JSON backend. Returning one of these skips FastAPI's validation and encoding of the
+    response_model (which is still used for the docs): our responses are built from data that was validated when it
+    came in, so validating them again on the way out only costs time.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return json_codec.dumps(content)
+
+
 class AiRequest(BaseModel):
     messages: List[ChatContextItem]
     model: str
@@ -51,6 +180,9 @@ class AskQuestionRequest(BaseModel):
     context: Optional[List[ChatContextItem]] = None
     ruleset: Optional[str] = "chat"
     character_variant: Optional[str] = None
+    conversation_id: Optional[str] = None
+    # Set to False to skip the response cache (if enabled) for this request.
+    use_cache: Optional[bool] = True
 
 
 class AnalyzeDataRequest(BaseModel):
@@ -61,6 +193,30 @@ class AnalyzeDataRequest(BaseModel):
     query: Optional[str] = None
     file_id: Optional[str] = None
     context: Optional[List[ChatContextItem]] = None
+    conversation_id: Optional[str] = None
+    dataset_encoding: Optional[DatasetEncoding] = None
+    # For datasets that don't fit in the context window: split them in chunks, analyze each one and combine the answers.
+    chunked: Optional[bool] = False
+    chunk_max_tokens: Optional[int] = None
+    # Send a summary of the tables (computed locally) instead of all the rows. Takes precedence over chunked.
+    summarize_datasets: Optional[bool] = False
+    # Set to False to skip the response cache (if enabled) for this request.
+    use_cache: Optional[bool] = True
+
+
+class AskQuestionBatchRequest(BaseModel):
+    # Independent questions. conversation_id is ignored: batches don't touch the stored conversations.
+    items: List[AskQuestionRequest]
+    max_concurrency: Optional[int] = None
+    # Send the results as server-sent events, as soon as each one is ready, instead of all of them at the end.
+    stream: Optional[bool] = False
+
+
+class AnalyzeDataBatchRequest(BaseModel):
+    # Same as AskQuestionBatchRequest.
+    items: List[AnalyzeDataRequest]
+    max_concurrency: Optional[int] = None
+    stream: Optional[bool] = False
 
 
 class UpdateContextRequest(BaseModel):
@@ -74,59 +230,518 @@ class UploadDatafileResponse(BaseModel):
     file_id: str
 
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started_at = timer()
+    response = await call_next(request)
+
+    # The route template (e.g.: /conversations/{conversation_id}), not the path, to keep the number of series small.
+    route = request.scope.get("route")
+    HTTP_REQUEST_DURATION.observe(
+        timer() - started_at,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=str(response.status_code)
+    )
+
+    return response
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_error_handler(request: Request, e: CircuitOpenError):
+    # The AI API is down, no point waiting for it. Tell the client when to come back.
+    return FastJSONResponse(
+        {"detail": str(e)}, status_code=503, headers={"Retry-After": str(math.ceil(e.retry_in))}
+    )
+
+
+@contextmanager
+def _unexpected_errors_as_500():
+    """
+    Turn any unexpected error into a 500, with the error as the detail. The ones that already have their status code
+    (HTTPException, or CircuitOpenError for circuit_open_error_handler) go through as they are.
+    """
+    try:
+        yield
+    except (HTTPException, CircuitOpenError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_async_clients()
+    # Writing whatever is still in the queue.
+    await asyncio.to_thread(interaction_logger.close)
+
+
 @app.get("/ping")
 async def ping():
     return {"message": "pong"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Latency per stage, requests and tokens per provider/model, retries, cache hits, etc. in the Prometheus format.
+    The metrics are per process: with more than one worker, each one has its own.
+    """
+    return Response(content=GLOBAL_METRICS.render(), media_type=GLOBAL_METRICS_CONTENT_TYPE)
+
+
 @app.post("/upload-data-file", response_model=UploadDatafileResponse)
 async def update_data_file(file: UploadFile = File(...)):
-    file_id = str(uuid4())
-    file_content = await file.read()
-    files[file_id] = file_content.decode('utf-8')
+    # Streaming the upload to disk, so we never hold the whole file in memory.
+    output = tempfile.NamedTemporaryFile(dir=UPLOADS_FOLDER, suffix=TEMPORARY_UPLOAD_SUFFIX, delete=False)
+    source_file = Path(output.name)
+
+    # Everything inside the try, so the file is deleted even if the client disconnects in the middle of the upload.
+    try:
+        with output:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(output.write, chunk)
+
+        # Parsing it once, into typed columns. Every analysis of this file will read from them.
+        file_id = await asyncio.to_thread(upload_store.add_csv_file, source_file)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Failed to parse the file as CSV: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        source_file.unlink(missing_ok=True)
+
+    return {"file_id": file_id}
+
+
+@app.delete("/upload-data-file/{file_id}")
+async def delete_data_file(file_id: str):
+    if not await asyncio.to_thread(upload_store.delete, file_id):
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found.")
+
     return {"file_id": file_id}
 
 
+async def _load_uploaded_file(file_id: Optional[str]) -> Optional[ColumnarDataset]:
+    """
+    Get an uploaded file from the store.
+    :param file_id: The id of the file. (Optional)
+    :return: The file, or None if no id was informed. Raises a 404 if the file doesn't exist (or was evicted).
+    """
+    if not file_id:
+        return None
+
+    dataset = await asyncio.to_thread(upload_store.get, file_id)
+
+    if dataset is None:
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found. It may have expired, upload it again.")
+
+    return dataset
+
+
+async def _analyze_data(
+        request: AnalyzeDataRequest,
+        context: Optional[List[ChatContextItem]],
+        file_content: Optional[ColumnarDataset]) -> AiResponse:
+    if not request.chunked or request.summarize_datasets:
+        return await ai_tasker.analyze_data(
+            question_or_prompt=request.question_or_prompt,
+            data=request.data,
+            is_csv=request.is_csv,
+            data_before_prompt=request.data_before_prompt,
+            agent=agent,
+            context=context,
+            query=request.query,
+            data_from_file=file_content,
+            dataset_encoding=request.dataset_encoding,
+            summarize_datasets=request.summarize_datasets,
+            use_cache=request.use_cache
+        )
+
+    return await ai_tasker.analyze_data_chunked(
+        question_or_prompt=request.question_or_prompt,
+        data=request.data,
+        is_csv=request.is_csv,
+        data_before_prompt=request.data_before_prompt,
+        agent=agent,
+        context=context,
+        query=request.query,
+        data_from_file=file_content,
+        dataset_encoding=request.dataset_encoding,
+        chunk_max_tokens=request.chunk_max_tokens,
+        max_concurrency=chunked_analysis_max_concurrency,
+        use_cache=request.use_cache
+    )
+
+
+def _load_system_context(request: AskQuestionRequest) -> Optional[str]:
+    # Retrieve system_context based on character_name if provided
+    if not request.character_name:
+        return None
+
+    return cb_loader.load_personality(
+        request.character_name,
+        request.character_variant,
+        request.ruleset
+    )
+
+
 @app.post("/ask-question", response_model=AiResponse)
 async def ask_question(request: AskQuestionRequest):
-    try:
-        # Retrieve system_context based on character_name if provided
-        system_context = None
-        if request.character_name:
-            system_context = cb_loader.load_personality(
-                request.character_name,
-                request.character_variant,
-                request.ruleset
-            )
-
-        response = ai_tasker.ask_a_question(
+    with _unexpected_errors_as_500():
+        system_context = _load_system_context(request)
+
+        response = await ai_tasker.ask_a_question(
             question_or_prompt=request.question_or_prompt,
             system_context=system_context,
-            context=request.context
+            context=request.context,
+            use_cache=request.use_cache
         )
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return FastJSONResponse(response)
+
+
+@app.post("/ask-question/stream")
+async def ask_question_stream(request: AskQuestionRequest):
+    """
+    Same as /ask-question, but the response is sent as server-sent events while it's being generated.
+    Every event carries an AiStreamChunk. The last one has done=True and the complete AiResponse.
+    """
+    system_context = _load_system_context(request)
+
+    async def event_stream():
+        try:
+            async for chunk in ai_tasker.ask_a_question_stream(
+                    question_or_prompt=request.question_or_prompt,
+                    system_context=system_context,
+                    context=request.context
+            ):
+                yield f"data: {chunk.model_dump_json()}\n\n"
+        except Exception as e:
+            # Headers are already gone at this point, so we can't change the status code anymore.
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @app.post("/analyze-data", response_model=AiResponse)
 async def analyze_data(request: AnalyzeDataRequest):
-    try:
-        file_content = files.get(request.file_id) if request.file_id else None
+    file_content = await _load_uploaded_file(request.file_id)
 
-        response = ai_tasker.analyze_data(
-            question_or_prompt=request.question_or_prompt,
-            data=request.data,
-            is_csv=request.is_csv,
-            data_before_prompt=request.data_before_prompt,
-            agent=agent,
-            context=request.context,
-            query=request.query,
-            data_from_file=file_content
+    with _unexpected_errors_as_500():
+        response = await _analyze_data(request, request.context, file_content)
+        return FastJSONResponse(response)
+
+
+def _batch_max_concurrency(requested: Optional[int], item_count: int) -> int:
+    if item_count > batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Too many items in the batch (max: {batch_max_items}).")
+
+    if requested is not None and requested < 1:
+        raise HTTPException(status_code=400, detail="The max concurrency must be greater than 0.")
+
+    return min(requested or batch_max_concurrency, batch_max_concurrency)
+
+
+async def _batch_response(results: AsyncIterator[AiBatchResult], stream: bool):
+    """
+    Either all the results (in order), or a server-sent event per result, as soon as it's ready (out of order).
+    """
+    if not stream:
+        return FastJSONResponse([result async for result in results])
+
+    async def event_stream():
+        async for result in results:
+            yield f"data: {result.model_dump_json()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/ask-question/batch", response_model=List[AiBatchResult])
+async def ask_question_batch(request: AskQuestionBatchRequest):
+    """
+    Ask many independent questions at once. Each item works like /ask-question, and gets its own result (with the
+    response or the error) in the same position. With stream=True, results are sent as server-sent events as soon as
+    each one is ready, so check their index.
+    """
+    max_concurrency = _batch_max_concurrency(request.max_concurrency, len(request.items))
+
+    # Loading the personalities here, so an unknown character fails only its own item.
+    async def ask(item: AskQuestionRequest) -> AiResponse:
+        return await ai_tasker.ask_a_question(
+            question_or_prompt=item.question_or_prompt,
+            system_context=_load_system_context(item),
+            context=item.context,
+            use_cache=item.use_cache
         )
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    results = async_run_batch(
+        [lambda item=item: ask(item) for item in request.items],
+        max_concurrency=max_concurrency,
+        ordered=not request.stream
+    )
+
+    return await _batch_response(results, request.stream)
+
+
+@app.post("/analyze-data/batch", response_model=List[AiBatchResult])
+async def analyze_data_batch(request: AnalyzeDataBatchRequest):
+    """
+    Same as /ask-question/batch, but each item works like /analyze-data.
+    """
+    max_concurrency = _batch_max_concurrency(request.max_concurrency, len(request.items))
+
+    async def analyze(item: AnalyzeDataRequest) -> AiResponse:
+        file_content = await _load_uploaded_file(item.file_id)
+        return await _analyze_data(item, item.context, file_content)
+
+    results = async_run_batch(
+        [lambda item=item: analyze(item) for item in request.items],
+        max_concurrency=max_concurrency,
+        ordered=not request.stream
+    )
+
+    return await _batch_response(results, request.stream)
+
+
+@app.post("/analyze-data/encoding-report", response_model=Dict[str, Dict[str, int]])
+async def analyze_data_encoding_report(request: AnalyzeDataRequest):
+    """
+    How many tokens each dataset would take in the prompt, for every encoding (cheapest first).
+    Use it to choose the dataset_encoding for /analyze-data.
+    """
+    file_content = await _load_uploaded_file(request.file_id)
+
+    try:
+        return await asyncio.to_thread(
+            ai_tasker.dataset_encoding_report,
+            request.data,
+            request.is_csv,
+            file_content
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _load_conversation(conversation_id: str) -> Tuple[List[ChatContextItem], int]:
+    """
+    Get the messages of a conversation (and their version) from the store. Raises a 404 if it doesn't exist.
+    """
+    try:
+        conversation = await asyncio.to_thread(conversation_store.get, conversation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if conversation is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found.")
+
+    return conversation
+
+
+@asynccontextmanager
+async def _conversation_turn(
+        conversation_id: Optional[str],
+        context: Optional[List[ChatContextItem]]
+) -> AsyncIterator[Tuple[str, Optional[List[ChatContextItem]], int]]:
+    """
+    Get the id, context and version of the conversation for a new turn. If no conversation id is informed, a new
+    conversation is started, using the context sent by the client (if any) as its starting point.
+    Turns of the same conversation run one at a time (in this worker), so each one gets the answer of the one before
+    in its context. Between workers, the one that saves last gets a 409 instead. (See _save_conversation_turn)
+    """
+    if conversation_id is None:
+        yield conversation_store.new_conversation_id(), context, 0
+        return
+
+    lock = conversation_locks.get(conversation_id)
+    if lock is None:
+        lock = conversation_locks[conversation_id] = asyncio.Lock()
+
+    async with lock:
+        messages, version = await _load_conversation(conversation_id)
+        yield conversation_id, messages, version
+
+
+async def _save_conversation_turn(conversation_id: str, version: int, response: AiResponse) -> ConversationTurnResponse:
+    """
+    Save the updated context of the conversation, and build the response with only what changed in this turn.
+    Raises a 409 if the conversation was changed (or deleted) since it was loaded.
+    """
+    try:
+        await asyncio.to_thread(conversation_store.save, conversation_id, response.updated_context, version)
+    except ConversationConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return ConversationTurnResponse(
+        conversation_id=conversation_id,
+        response=response.response,
+        # The question and the answer.
+        new_messages=response.updated_context[-2:],
+        config=response.config
+    )
+
+
+async def _stream_with_log_fields(chunks: AsyncIterator[AiStreamChunk], **fields) -> AsyncIterator[AiStreamChunk]:
+    """
+    Same as log_fields, but for a stream. The fields are set only while the stream is running (not while it's waiting
+    for the client), so they don't leak into the code that is reading it.
+    """
+    while True:
+        with log_fields(**fields):
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+
+        yield chunk
+
+
+@app.post("/conversations/ask-question", response_model=ConversationTurnResponse)
+async def conversation_ask_question(request: AskQuestionRequest):
+    """
+    Same as /ask-question, but the context is kept on the server. Send the conversation_id you got in the first turn
+    (or none to start a new conversation), and you'll get back only the new messages.
+    """
+    async with _conversation_turn(request.conversation_id, request.context) as (conversation_id, context, version):
+        with _unexpected_errors_as_500():
+            with log_fields(conversation_id=conversation_id):
+                response = await ai_tasker.ask_a_question(
+                    question_or_prompt=request.question_or_prompt,
+                    system_context=_load_system_context(request),
+                    context=context,
+                    use_cache=request.use_cache
+                )
+            return FastJSONResponse(await _save_conversation_turn(conversation_id, version, response))
+
+
+@app.post("/conversations/ask-question/stream")
+async def conversation_ask_question_stream(request: AskQuestionRequest):
+    """
+    Same as /conversations/ask-question, but the response is sent as server-sent events while it's being generated.
+    Every event carries a ConversationStreamChunk. The last one has done=True and the ConversationTurnResponse.
+    """
+    if request.conversation_id is not None:
+        # Checked here too, so a missing conversation is still a 404. (Once the stream starts, it's too late for that)
+        await _load_conversation(request.conversation_id)
+
+    system_context = _load_system_context(request)
+
+    async def event_stream():
+        conversation = _conversation_turn(request.conversation_id, request.context)
+
+        try:
+            async with conversation as (conversation_id, context, version):
+                async for chunk in _stream_with_log_fields(ai_tasker.ask_a_question_stream(
+                        question_or_prompt=request.question_or_prompt,
+                        system_context=system_context,
+                        context=context
+                ), conversation_id=conversation_id):
+                    if not chunk.done:
+                        yield f"data: {ConversationStreamChunk(delta=chunk.delta).model_dump_json()}\n\n"
+                        continue
+
+                    turn = await _save_conversation_turn(conversation_id, version, chunk.response)
+                    yield f"data: {ConversationStreamChunk(delta='', done=True, response=turn).model_dump_json()}\n\n"
+        except Exception as e:
+            # Headers are already gone at this point, so we can't change the status code anymore.
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/conversations/analyze-data", response_model=ConversationTurnResponse)
+async def conversation_analyze_data(request: AnalyzeDataRequest):
+    """
+    Same as /analyze-data, but the context is kept on the server. Works like /conversations/ask-question.
+    """
+    file_content = await _load_uploaded_file(request.file_id)
+
+    async with _conversation_turn(request.conversation_id, request.context) as (conversation_id, context, version):
+        with _unexpected_errors_as_500():
+            with log_fields(conversation_id=conversation_id):
+                response = await _analyze_data(request, context, file_content)
+            return FastJSONResponse(await _save_conversation_turn(conversation_id, version, response))
+
+
+@app.get("/conversations/{conversation_id}", response_model=Conversation)
+async def get_conversation(conversation_id: str):
+    messages, _ = await _load_conversation(conversation_id)
+    return Conversation(conversation_id=conversation_id, messages=messages)
+
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    if not await asyncio.to_thread(conversation_store.delete, conversation_id):
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found.")
+
+    return {"conversation_id": conversation_id}
+
+
+@app.get("/logs/interactions", response_model=List[InteractionLogEntry])
+async def get_logged_interactions(
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        model: Optional[str] = None,
+        provider: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        limit: int = 100):
+    """
+    Search the logged interactions with the AI (newest first). Naive datetimes are UTC.
+    """
+    return await asyncio.to_thread(
+        interaction_log_index.query, since, until, model, provider, conversation_id, limit
+    )
+
+
+@app.get("/logs/interactions/{entry_id}")
+async def get_logged_interaction(entry_id: int):
+    record = await asyncio.to_thread(interaction_log_index.get_record, entry_id)
+
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Interaction {entry_id} not found.")
+
+    return record
+
+
+@app.get("/logs/stats", response_model=List[InteractionLogStats])
+async def get_logged_interaction_stats(
+        group_by: InteractionLogGroupBy = InteractionLogGroupBy.Model,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        model: Optional[str] = None,
+        provider: Optional[str] = None,
+        conversation_id: Optional[str] = None):
+    """
+    Count, tokens and latency percentiles of the logged interactions, per model/provider/conversation/day.
+    e.g.: p95 latency per model yesterday: /logs/stats?group_by=model&since=2024-05-01&until=2024-05-02
+    """
+    return await asyncio.to_thread(
+        interaction_log_index.stats, group_by, since, until, model, provider, conversation_id
+    )
+
+
+@app.get("/providers/stats", response_model=List[AiProviderStats])
+async def get_provider_stats():
+    if provider_pool is None:
+        raise HTTPException(status_code=404, detail="The provider pool is not enabled.")
+
+    return provider_pool.stats()
+
+
+@app.get("/response-cache/stats", response_model=ResponseCacheStats)
+async def get_response_cache_stats():
+    if response_cache is None:
+        raise HTTPException(status_code=404, detail="The response cache is not enabled.")
+
+    return await asyncio.to_thread(response_cache.stats)
+
+
+@app.delete("/response-cache")
+async def clear_response_cache():
+    if response_cache is None:
+        raise HTTPException(status_code=404, detail="The response cache is not enabled.")
+
+    await asyncio.to_thread(response_cache.clear)
+    return {"cleared": True}
 
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import argparse
+import json
 
 import src.shared.requests_with_retry as requests
 from src.shared.config import ensure_env_is_loaded, API_PORT
@@ -42,17 +43,48 @@ def get_command_line() -> dict:
     }
 
 
-def call_ask_question(question_or_prompt, character_name=None, character_variant=None, context=None):
-    url = f"{API_BASE_URL}/ask-question"
+def call_ask_question(question_or_prompt, character_name=None, character_variant=None, conversation_id=None):
+    """
+    Ask a question, printing the answer as it arrives.
+    The context of the conversation is kept by the server, so we only send the new message.
+    :return: The complete response, once the AI is done answering.
+    """
+    url = f"{API_BASE_URL}/conversations/ask-question/stream"
     payload = {
         "question_or_prompt": question_or_prompt,
         "character_name": character_name,
         "character_variant": character_variant,
-        "context": context
+        "conversation_id": conversation_id
     }
-    response = requests.post(url, json=payload)
+    response = requests.post(url, json=payload, stream=True)
     response.raise_for_status()
-    return response.json()
+
+    # Event streams usually don't inform the charset, and requests would give us bytes in that case.
+    if response.encoding is None:
+        response.encoding = "utf-8"
+
+    with response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                continue
+
+            if not line.startswith("data:"):
+                continue
+
+            data = json.loads(line[len("data:"):])
+
+            if event == "error":
+                raise RuntimeError(f"Failed to get a response from the AI: {data['detail']}")
+
+            if data["done"]:
+                print()
+                return data["response"]
+
+            print(data["delta"], end="", flush=True)
+
+    raise RuntimeError("The stream ended before the AI finished answering.")
 
 
 def main():
@@ -68,28 +100,26 @@ def main():
 
     initial_msg = f"$chat$: {character} entered the chat."   # $chat$ comes from the ruleset
 
+    print(initial_msg)
+    print(f"{character}: ", end="", flush=True)
+
     response = call_ask_question(
         question_or_prompt=initial_msg,
         character_name=character,
         character_variant=character_variant
     )
 
-    print(initial_msg)
-    print(f"{character}: {response['response']}")
-
-    updated_context = response['updated_context']
+    conversation_id = response['conversation_id']
     while True:
         user_message = input(f"{user}: ")
 
-        response = call_ask_question(
+        print(f"{character}: ", end="", flush=True)
+
+        call_ask_question(
             question_or_prompt=f"{user}: {user_message}",
-            context=updated_context
+            conversation_id=conversation_id
         )
 
-        updated_context = response['updated_context']
-
-        print(f"{character}: {response['response']}")
-
 
 if __name__ == "__main__":
     main()
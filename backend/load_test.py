@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+from src.load_testing.mock_llm_server import run_mock_server, GLOBAL_MOCK_HOST, GLOBAL_MOCK_PORT
+from src.load_testing.runner import run_load_test, save_report, load_report, compare_reports
+from src.load_testing.types import MockServerSettings, MockLatencyDistribution, LoadTestScenario, \
+    LoadTestScenarioType
+
+logging.basicConfig(level=logging.INFO)
+# One line per request would bury the results.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def _add_mock_arguments(parser: argparse.ArgumentParser):
+    defaults = MockServerSettings()
+    parser.add_argument(
+        "--latency-distribution",
+        type=str,
+        default=defaults.latency_distribution.value,
+        choices=[distribution.value for distribution in MockLatencyDistribution],
+        help=f"How the latency of the mock AI varies. (default: {defaults.latency_distribution.value})"
+    )
+    parser.add_argument("--latency", type=float, default=defaults.latency_seconds,
+                        help=f"Latency of the mock AI, in seconds (median for lognormal). "
+                             f"(default: {defaults.latency_seconds})")
+    parser.add_argument("--latency-spread", type=float, default=defaults.latency_spread,
+                        help=f"Sigma for lognormal, +/- fraction for uniform. (default: {defaults.latency_spread})")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens,
+                        help=f"Size of the answers. (default: {defaults.completion_tokens})")
+    parser.add_argument("--stream-chunks", type=int, default=defaults.stream_chunks,
+                        help=f"Chunks per streamed answer. (default: {defaults.stream_chunks})")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of the requests answered with a 500. (default: 0)")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate,
+                        help="Fraction of the requests answered with a 429. (default: 0)")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after_seconds,
+                        help=f"Retry-After of the 429s, in seconds. (default: {defaults.retry_after_seconds})")
+    parser.add_argument("--seed", type=int, default=None, help="Seed, for repeatable runs. (Optional)")
+
+
+def _get_mock_settings(args: argparse.Namespace) -> MockServerSettings:
+    return MockServerSettings(
+        latency_distribution=args.latency_distribution,
+        latency_seconds=args.latency,
+        latency_spread=args.latency_spread,
+        completion_tokens=args.completion_tokens,
+        stream_chunks=args.stream_chunks,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_seconds=args.retry_after,
+        seed=args.seed
+    )
+
+
+def get_command_line() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Load test the API against a mock AI server, and compare the results between versions."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser(
+        "run", help="Start the mock AI and the API, run the scenarios and save the results in .benchmarks."
+    )
+    run.add_argument(
+        "-s", "--scenarios",
+        type=str,
+        nargs="+",
+        default=[scenario_type.value for scenario_type in LoadTestScenarioType],
+        choices=[scenario_type.value for scenario_type in LoadTestScenarioType],
+        help="What to run. (default: all)"
+    )
+    run.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 10, 50],
+                     help="Each scenario is run once per concurrency level. (default: 1 10 50)")
+    run.add_argument("-n", "--requests", type=int, default=200, help="Requests per scenario. (default: 200)")
+    run.add_argument("--warmup", type=int, default=10, help="Requests before measuring. (default: 10)")
+    run.add_argument("--same-prompts", action="store_true",
+                     help="Send the same question every time (so the API can coalesce/cache them).")
+    run.add_argument("--api-url", type=str, default=None,
+                     help="Test an API that is already running, instead of starting one. (Optional)")
+    run.add_argument("--api-pid", type=int, default=None,
+                     help="Process of that API, to measure its CPU and memory. (Optional)")
+    run.add_argument("--mock-url", type=str, default=None,
+                     help="Base URL of the mock AI server that API talks to, to count its requests. (Optional)")
+    run.add_argument("-o", "--output", type=str, default=None,
+                     help="Where to save the results. (default: .benchmarks/load-test-<datetime>-<version>.json)")
+    _add_mock_arguments(run)
+
+    mock = commands.add_parser("mock-server", help="Only start the mock AI server (OpenAI-compatible).")
+    mock.add_argument("--host", type=str, default=GLOBAL_MOCK_HOST, help=f"(default: {GLOBAL_MOCK_HOST})")
+    mock.add_argument("--port", type=int, default=GLOBAL_MOCK_PORT, help=f"(default: {GLOBAL_MOCK_PORT})")
+    _add_mock_arguments(mock)
+
+    compare = commands.add_parser("compare", help="Compare two results. Exits with 1 if something got worse.")
+    compare.add_argument("baseline", type=str, help="The old results (JSON).")
+    compare.add_argument("current", type=str, help="The new results (JSON).")
+    compare.add_argument("-t", "--threshold", type=float, default=10,
+                         help="How much worse (in %%) a metric can get before it's a regression. (default: 10)")
+
+    return parser.parse_args()
+
+
+def _format(value) -> str:
+    if value is None:
+        return "-"
+
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def _print_table(header: list, rows: list):
+    rows = [[_format(value) for value in row] for row in rows]
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+
+    for row in [header, *rows]:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def run(args: argparse.Namespace):
+    scenarios = [
+        LoadTestScenario(
+            scenario_type=scenario_type,
+            concurrency=concurrency,
+            requests=args.requests,
+            warmup_requests=args.warmup,
+            unique_prompts=not args.same_prompts
+        )
+        for scenario_type in args.scenarios
+        for concurrency in args.concurrency
+    ]
+
+    report = asyncio.run(run_load_test(
+        scenarios,
+        mock_settings=_get_mock_settings(args),
+        api_url=args.api_url,
+        api_pid=args.api_pid,
+        mock_url=args.mock_url
+    ))
+
+    _print_table(
+        ["scenario", "req/s", "ok", "errors", "p50", "p95", "p99", "api cpu %", "api rss MB", "upstream"],
+        [
+            [r.name, r.requests_per_second, r.successes, sum(r.errors.values()), r.latency.p50, r.latency.p95,
+             r.latency.p99, r.api_process.cpu_percent if r.api_process else None,
+             r.api_process.rss_peak_bytes / 1024 ** 2 if r.api_process else None,
+             r.upstream.requests if r.upstream else None]
+            for r in report.results
+        ]
+    )
+
+    file = save_report(report, Path(args.output) if args.output else None)
+    print(f"Results saved to {file}")
+
+
+def compare(args: argparse.Namespace):
+    comparisons = compare_reports(
+        load_report(Path(args.baseline)), load_report(Path(args.current)), threshold_percent=args.threshold
+    )
+
+    _print_table(
+        ["scenario", "metric", "baseline", "current", "change %", ""],
+        [
+            [c.name, c.metric, c.baseline, c.current, c.change_percent, "REGRESSION" if c.regression else ""]
+            for c in comparisons
+        ]
+    )
+
+    if any(c.regression for c in comparisons):
+        sys.exit(1)
+
+
+def main():
+    args = get_command_line()
+
+    if args.command == "mock-server":
+        run_mock_server(_get_mock_settings(args), args.host, args.port)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import sys
+from pathlib import Path
+
+from src.benchmarks.cases import get_cases
+from src.benchmarks.harness import run_micro_benchmarks, save_report, load_report, compare_reports, GLOBAL_RUNS, \
+    GLOBAL_MIN_RUN_SECONDS
+from src.benchmarks.types import BenchmarkSize, MicroBenchmarkResult
+
+
+def get_command_line() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure the time and memory of the functions that run on every request, and compare the results "
+                    "between versions."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks and save the results in .benchmarks.")
+    run.add_argument(
+        "--sizes",
+        type=str,
+        nargs="+",
+        default=[size.value for size in BenchmarkSize],
+        choices=[size.value for size in BenchmarkSize],
+        help="Sizes of the contexts/datasets. (default: all)"
+    )
+    run.add_argument("-k", "--filter", type=str, default=None,
+                     help="Only the benchmarks with this in the name (group/case/size). (Optional)")
+    run.add_argument("-r", "--runs", type=int, default=GLOBAL_RUNS, help=f"Runs per benchmark. (default: {GLOBAL_RUNS})")
+    run.add_argument("--min-run-time", type=float, default=GLOBAL_MIN_RUN_SECONDS,
+                     help=f"Min duration of each run, in seconds. (default: {GLOBAL_MIN_RUN_SECONDS})")
+    run.add_argument("-o", "--output", type=str, default=None,
+                     help="Where to save the results. (default: .benchmarks/micro-benchmark-<datetime>-<version>.json)")
+
+    compare = commands.add_parser("compare", help="Compare two results. Exits with 1 if something got worse.")
+    compare.add_argument("baseline", type=str, help="The old results (JSON).")
+    compare.add_argument("current", type=str, help="The new results (JSON).")
+    compare.add_argument("-t", "--threshold", type=float, default=10,
+                         help="How much worse (in %%) a metric can get before it's a regression. (default: 10)")
+
+    return parser.parse_args()
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+
+    if seconds >= 0.001:
+        return f"{seconds * 1000:.2f}ms"
+
+    return f"{seconds * 1000000:.2f}us"
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+
+        size /= 1024
+
+    return f"{size:.1f}GB"
+
+
+def _print_result(result: MicroBenchmarkResult):
+    print(f"{result.name:<45} {_format_seconds(result.median_seconds):>10} +- "
+          f"{_format_seconds(result.stdev_seconds):<10} peak {_format_bytes(result.peak_allocated_bytes):>9}  "
+          f"retained {_format_bytes(result.retained_bytes):>9}")
+
+
+def run(args: argparse.Namespace):
+    cases = get_cases([BenchmarkSize(size) for size in args.sizes], args.filter)
+
+    if len(cases) == 0:
+        print("No benchmarks match the filter.")
+        return
+
+    print(f"{'benchmark':<45} {'median':>10}    {'stdev':<10} (memory of a single call)")
+    report = run_micro_benchmarks(cases, runs=args.runs, min_run_seconds=args.min_run_time, on_result=_print_result)
+
+    file = save_report(report, Path(args.output) if args.output else None)
+    print(f"Results saved to {file}")
+
+
+def compare(args: argparse.Namespace):
+    comparisons = compare_reports(
+        load_report(Path(args.baseline)), load_report(Path(args.current)), threshold_percent=args.threshold
+    )
+
+    for c in comparisons:
+        format_value = _format_seconds if c.metric == "median_seconds" else _format_bytes
+        change = "-" if c.change_percent is None else f"{c.change_percent:+.1f}%"
+        print(f"{c.name:<45} {c.metric:<22} {format_value(c.baseline):>10} -> {format_value(c.current):<10} "
+              f"{change:>8} {'REGRESSION' if c.regression else ''}")
+
+    if any(c.regression for c in comparisons):
+        sys.exit(1)
+
+
+def main():
+    args = get_command_line()
+
+    if args.command == "compare":
+        compare(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
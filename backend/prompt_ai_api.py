@@ -4,11 +4,11 @@ from src.shared.config import API_PORT
 API_BASE_URL = f"http://localhost:{API_PORT}"
 
 
-def call_ask_question(question_or_prompt, context=None):
-    url = f"{API_BASE_URL}/ask-question"
+def call_ask_question(question_or_prompt, conversation_id=None):
+    url = f"{API_BASE_URL}/conversations/ask-question"
     payload = {
         "question_or_prompt": question_or_prompt,
-        "context": context
+        "conversation_id": conversation_id
     }
     response = requests.post(url, json=payload)
     response.raise_for_status()
@@ -19,16 +19,16 @@ def main():
     print("YapBox AI Prompt :: No personality, agent, or user context")
     print("-----------------------------------------------------------------------------------")
 
-    updated_context = None
+    conversation_id = None
     while True:
         user_message = input("User: ")
 
         response = call_ask_question(
             question_or_prompt=user_message,
-            context=updated_context
+            conversation_id=conversation_id
         )
 
-        updated_context = response['updated_context']
+        conversation_id = response['conversation_id']
 
         print(f"AI: {response['response']}")
 
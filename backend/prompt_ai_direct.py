@@ -2,7 +2,7 @@ import os
 
 from src.ai_tasks.ai_tasks import AiTasks
 from src.shared.config import ensure_env_is_loaded
-from src.shared.loggers import log_json_to_folder
+from src.shared.log_writer import BufferedJsonlLogger
 
 
 def main():
@@ -15,7 +15,7 @@ def main():
         api_endpoint=os.getenv("AI_API_URL"),
         api_key=os.getenv("AI_API_KEY"),
         default_model=os.getenv("MODEL_NAME"),
-        response_logger=log_json_to_folder
+        response_logger=BufferedJsonlLogger()
     )
 
     updated_context = None
@@ -0,0 +1,93 @@
+import argparse
+import json
+
+from src.shared.log_index import InteractionLogIndex
+from src.shared.types import InteractionLogGroupBy
+
+
+def get_command_line() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Search and aggregate the interactions with the AI logged in .logs."
+    )
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument("--since", type=str, default=None, help="Logged at or after this (ISO 8601, UTC).")
+    filters.add_argument("--until", type=str, default=None, help="Logged before this (ISO 8601, UTC).")
+    filters.add_argument("--model", type=str, default=None, help="Only this model.")
+    filters.add_argument("--provider", type=str, default=None, help="Only this provider.")
+    filters.add_argument("--conversation", type=str, default=None, help="Only this conversation id.")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats = commands.add_parser("stats", parents=[filters], help="Count, tokens and latency percentiles per group.")
+    stats.add_argument(
+        "-g", "--group-by",
+        type=str,
+        default=InteractionLogGroupBy.Model.value,
+        choices=[group_by.value for group_by in InteractionLogGroupBy],
+        help="What to group by. (default: model)"
+    )
+
+    search = commands.add_parser("list", parents=[filters], help="List the interactions, newest first.")
+    search.add_argument("-l", "--limit", type=int, default=20, help="Max number of interactions. (default: 20)")
+
+    show = commands.add_parser("show", help="Print the full record of an interaction.")
+    show.add_argument("id", type=int, help="The id of the interaction (see list).")
+
+    return parser.parse_args()
+
+
+def _format(value) -> str:
+    if value is None:
+        return "-"
+
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def _print_table(header: list, rows: list):
+    rows = [[_format(value) for value in row] for row in rows]
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+
+    for row in [header, *rows]:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+    args = get_command_line()
+    index = InteractionLogIndex()
+
+    if args.command == "show":
+        record = index.get_record(args.id)
+        print(json.dumps(record, indent=2, ensure_ascii=False) if record else f"Interaction {args.id} not found.")
+        return
+
+    filters = {
+        "since": args.since,
+        "until": args.until,
+        "model": args.model,
+        "provider": args.provider,
+        "conversation_id": args.conversation
+    }
+
+    if args.command == "stats":
+        _print_table(
+            [args.group_by, "count", "prompt_tokens", "completion_tokens", "avg", "p50", "p95", "p99"],
+            [
+                [s.group, s.count, s.prompt_tokens, s.completion_tokens, s.latency_avg, s.latency_p50,
+                 s.latency_p95, s.latency_p99]
+                for s in index.stats(group_by=args.group_by, **filters)
+            ]
+        )
+        return
+
+    _print_table(
+        ["id", "logged_at", "model", "provider", "conversation", "tokens", "latency"],
+        [
+            [e.id, e.logged_at, e.model, e.provider, e.conversation_id, e.total_tokens, e.latency_seconds]
+            for e in index.query(limit=args.limit, **filters)
+        ]
+    )
+
+
+if __name__ == '__main__':
+    main()
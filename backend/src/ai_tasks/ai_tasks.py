@@ -1,18 +1,83 @@
+import logging
 import re
-from typing import List, Callable, Union
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from timeit import default_timer as timer
+from typing import List, Callable, Union, Iterator, Dict, Tuple, Iterable, Sequence, Any
 
-from src.ai_tasks.types import ChatContextItem, AiResponse, AiRequest, AiGeneratorConfig
+from src.ai_tasks.batch import run_batch
+from src.ai_tasks.chat_request import ChatRequest
+from src.ai_tasks.provider_pool import ProviderPool, is_provider_failure, get_failure_cooldown
+from src.ai_tasks.request_key import build_request_key
+from src.ai_tasks.response_cache import ResponseCache
+from src.ai_tasks.single_flight import SingleFlight
+from src.ai_tasks.streaming import StreamCollector
+from src.ai_tasks.types import ChatContextItem, AiResponse, AiGeneratorConfig, AiStreamChunk, AiProvider, \
+    AiBatchItem, AiBatchResult
+from src.ai_utils.context_window import ContextWindowManager, DEFAULT_TOKENS_PER_MESSAGE
+from src.ai_utils.system_prompt import context_prefix_hash, context_prompt_label
+from src.ai_utils.token_counter import get_token_counter
+from src.datasets.columnar import ColumnarDataset
+from src.datasets.encoders import records_to_table, encoding_report, encode_table, chunk_table
+from src.datasets.summary import summarize_dataset
+from src.datasets.types import DatasetEncoding
 from src.shared.http import get_headers
+from src.shared.loggers import get_log_fields
+from src.shared.metrics import STAGE_DURATION, AI_REQUESTS, AI_TOKENS, PROMPT_PREFIX_TOKENS
+from src.shared.rate_limiter import RateLimiter, get_rate_limiter, is_rate_limited
+import src.shared.json_codec as json_codec
 import src.shared.requests_with_retry as requests
 from src.shared.serializer import serialize_to_dict, csv_string_to_dict_list, dataset_to_prompt_text
 
+# Used for the chunks of the chunked analysis when there's no context window (and no size was informed).
+DEFAULT_CHUNK_MAX_TOKENS = 3000
+
+# Room left for the instructions we add around each chunk/partial answer.
+CHUNK_PROMPT_OVERHEAD_TOKENS = 150
+
+CHUNKED_ANALYSIS_MAP_PROMPT = (
+    "The dataset is too big to be analyzed at once, so it was split into {count} parts. This is part {index}. "
+    "Answer the question below using only this part. Your answer will be combined with the answers for the other "
+    "parts, so include any numbers (counts, sums, min/max, etc.) needed to combine them.\n\n"
+    "Question: {question}"
+)
+
+CHUNKED_ANALYSIS_REDUCE_PROMPT = (
+    "The dataset was too big to be analyzed at once, so it was split into parts and each part was analyzed separately. "
+    "Combine the answers below into a single answer to the question, as if the whole dataset was analyzed at once.\n\n"
+    "Question: {question}\n\n"
+    "{answers}"
+)
+
 
 class AiTasks:
-    def __init__(self, api_endpoint: str, api_key: str, default_model: str, response_logger: Callable[[dict], None]):
+    def __init__(
+            self,
+            api_endpoint: str,
+            api_key: str,
+            default_model: str,
+            response_logger: Callable[[dict], None],
+            context_window: ContextWindowManager = None,
+            dataset_encoding: DatasetEncoding = DatasetEncoding.Csv,
+            response_cache: ResponseCache = None,
+            coalesce_requests: bool = False,
+            provider_pool: ProviderPool = None):
         self.api_endpoint: str = api_endpoint
         self.api_key: str = api_key
         self.model: str = default_model
         self.response_logger: Callable[[dict], None] = response_logger
+        self.context_window: ContextWindowManager = context_window
+        self.dataset_encoding: DatasetEncoding = DatasetEncoding(dataset_encoding)
+        self.response_cache: ResponseCache = response_cache
+        # When enabled, identical requests sent at the same time share a single call to the AI model.
+        self.single_flight = self._create_single_flight() if coalesce_requests else None
+        # When informed, the requests go to the providers of the pool (and api_endpoint/api_key/model are only used as
+        # the key of the response cache).
+        self.provider_pool: ProviderPool = provider_pool
+        self._hedge_executor: Union[ThreadPoolExecutor, None] = None
+        self._hedge_executor_lock = Lock()
+        self.token_counter: Callable[[str], int] = context_window.token_counter if context_window is not None \
+            else get_token_counter(default_model)
 
     @staticmethod
     def _update_system_context(
@@ -25,7 +90,8 @@ class AiTasks:
         the question.
         :param system_context: How the AI should answer the question/behave.
         :param context: Current context (previous messages).
-        :param append_to_system_context: If True, the system context will be appended to the current system context.
+        :param append_to_system_context: If True, the system context is added after the current messages (as another
+        system message), and the current system context is kept as it is.
         :return: The updated context.
         """
         system_context_item = ChatContextItem(role="system", content=system_context)
@@ -36,14 +102,23 @@ class AiTasks:
 
         current_sys_context = context[0] if context[0].role == "system" else None
 
-        # If the system context is already in the context, and we want to append to it, then do so
-        if append_to_system_context and current_sys_context is not None:
-            current_sys_context["content"] += f" {system_context}"
-            context[0] = current_sys_context
+        # If the context is not empty, but we don't have a system context yet, it goes first.
+        if current_sys_context is None:
+            context.insert(0, system_context_item)
             return context
 
-        # Otherwise, it means that the context is not empty, but we don"t have a system context yet
-        context.insert(0, system_context_item)
+        # The system message must stay exactly the same from one turn to the next: it's the prefix the providers cache.
+        # So, instead of changing it, the extra system context goes at the end (once), where things change anyway.
+        if append_to_system_context:
+            if not any(item.role == "system" and item.content == system_context for item in context):
+                context.append(system_context_item)
+
+            return context
+
+        # A different system context replaces the current one (instead of piling up a new one every turn).
+        if current_sys_context.content != system_context:
+            context[0] = system_context_item
+
         return context
 
     def _update_context(
@@ -60,7 +135,8 @@ class AiTasks:
         or the response received from the AI model.
         :param system_context: How the AI should answer the question/behave.
         :param context: Current context (previous messages).
-        :param append_to_system_context: If True, the system context will be appended to the current system context.
+        :param append_to_system_context: If True, the system context is added after the current messages, and the
+        current system context is kept as it is.
         :return: The updated context.
         """
         if context is None:
@@ -74,36 +150,356 @@ class AiTasks:
 
         return context
 
-    def _build_request_payload(self, context: List[ChatContextItem]) -> AiRequest:
+    def _build_request_payload(self, context: List[ChatContextItem], stream: bool = False) -> ChatRequest:
         """
         Build the payload for the request to the AI model.
         :param context: The context to send to the AI model.
-        :return: The payload for the request.
+        :param stream: If True, the AI model will send the response in chunks, as it's generated.
+        :return: The payload for the request. Encoded only once, however many times it's sent.
         """
-        return AiRequest(messages=context, model=self.model)
+        return ChatRequest.from_context(context, self.model, stream)
+
+    def _create_single_flight(self) -> SingleFlight:
+        return SingleFlight()
 
-    def _send_request_to_ai(self, context: List[ChatContextItem]) -> dict:
+    def _request_key(self, payload: ChatRequest) -> Union[str, None]:
         """
-        Send the context to the AI model and get the response.
-        :param context: The context to send to the AI model.
+        Get the key that identifies the request (for the response cache and to coalesce identical requests).
+        :return: The key, or None if neither is enabled.
+        """
+        if self.response_cache is None and self.single_flight is None:
+            return None
+
+        return build_request_key(self.api_endpoint, payload)
+
+    @staticmethod
+    def _get_rate_limiter(api_endpoint: str) -> Union[RateLimiter, None]:
+        return get_rate_limiter(api_endpoint)
+
+    def _estimate_request_tokens(self, payload: ChatRequest, api_endpoint: str) -> int:
+        """
+        Estimate how many tokens the request will use, for the tokens per minute limit of the rate limiter.
+        :param payload: The request.
+        :param api_endpoint: Where the request will be sent.
+        :return: The estimate (prompt + the room reserved for the answer), or 0 if the AI API is not rate limited.
+        """
+        # Counting tokens is not free, so we only do it when someone is going to use it.
+        if not is_rate_limited(api_endpoint):
+            return 0
+
+        if self.context_window is not None:
+            return self.context_window.count_context(payload.messages) + self.context_window.reserved_for_completion
+
+        return sum(self.token_counter(message.content) + DEFAULT_TOKENS_PER_MESSAGE for message in payload.messages)
+
+    def _record_token_usage(self, api_endpoint: str, estimated_tokens: int, json_response: dict):
+        """
+        Tell the rate limiter how many tokens the request actually used, so its estimate is corrected.
+        """
+        rate_limiter = self._get_rate_limiter(api_endpoint)
+        if rate_limiter is None or not estimated_tokens:
+            return
+
+        used_tokens = (json_response.get("usage") or {}).get("total_tokens")
+        if isinstance(used_tokens, int):
+            rate_limiter.record_usage(estimated_tokens, used_tokens)
+
+    def _default_provider(self) -> AiProvider:
+        return AiProvider(name="default", api_endpoint=self.api_endpoint, api_key=self.api_key, model=self.model)
+
+    def _generator_config(self, provider: AiProvider = None) -> AiGeneratorConfig:
+        """
+        :param provider: The provider that answered. (Optional. Default: the one informed when creating this object)
+        :return: The config reported in the responses.
+        """
+        if provider is None:
+            return AiGeneratorConfig.model_construct(base_url=self.api_endpoint, ai_model_name=self.model)
+
+        return AiGeneratorConfig.model_construct(
+            base_url=provider.api_endpoint,
+            ai_model_name=provider.model,
+            provider=provider.name if self.provider_pool is not None else None
+        )
+
+    @staticmethod
+    def _payload_for_provider(payload: ChatRequest, provider: AiProvider) -> ChatRequest:
+        return payload.with_model(provider.model)
+
+    @staticmethod
+    def _parse_response(response: Any) -> dict:
+        try:
+            return json_codec.loads(response.content)
+        except ValueError:
+            raise ValueError(f"Failed to parse response from the AI model: {response.text}")
+
+    @staticmethod
+    def _record_response_metrics(provider: AiProvider, payload: ChatRequest, json_response: dict):
+        AI_REQUESTS.inc(provider=provider.name, outcome="success")
+
+        # What we're paying for, per model.
+        usage = json_response.get("usage") or {}
+        model = json_response.get("model") or provider.model
+        for token_type in ["prompt_tokens", "completion_tokens"]:
+            if isinstance(usage.get(token_type), int):
+                AI_TOKENS.inc(usage[token_type], model=model, type=token_type.replace("_tokens", ""))
+
+        # And how much of the prompts the provider had cached, per system prompt. (The hash is in the logs)
+        if isinstance(usage.get("prompt_tokens"), int):
+            prompt = context_prompt_label(payload.messages)
+            PROMPT_PREFIX_TOKENS.inc(usage["prompt_tokens"], prompt=prompt, type="prompt")
+
+            # OpenAI (and most of the compatible APIs) / DeepSeek.
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") \
+                or usage.get("prompt_cache_hit_tokens")
+            if isinstance(cached_tokens, int) and cached_tokens > 0:
+                PROMPT_PREFIX_TOKENS.inc(cached_tokens, prompt=prompt, type="cached")
+
+    @STAGE_DURATION.timed(stage="ai_request")
+    def _post_to_provider(self, provider: AiProvider, payload: ChatRequest) -> dict:
+        """
+        Send the request to one provider.
+        :param provider: The provider.
+        :param payload: The request.
         :return: The response from the AI model.
         """
+        payload = self._payload_for_provider(payload, provider)
+
         # Define the header for the request
-        headers = get_headers(token=self.api_key)
+        headers = get_headers(token=provider.api_key)
+        estimated_tokens = self._estimate_request_tokens(payload, provider.api_endpoint)
+
+        try:
+            # Make the API request
+            response = requests.post(
+                provider.api_endpoint, headers=headers, json=payload.encoded(), estimated_tokens=estimated_tokens
+            )
+
+            # If the request was not successful, raise an exception.
+            response.raise_for_status()
+
+            json_response = self._parse_response(response)
+        except Exception:
+            AI_REQUESTS.inc(provider=provider.name, outcome="error")
+            raise
+
+        self._record_token_usage(provider.api_endpoint, estimated_tokens, json_response)
+        self._record_response_metrics(provider, payload, json_response)
+
+        return json_response
+
+    def _post_to_pool_provider(self, provider: AiProvider, payload: ChatRequest) -> dict:
+        """
+        Same as _post_to_provider, but the latency (or the failure) goes into the stats of the provider pool.
+        """
+        started_at = timer()
 
+        try:
+            json_response = self._post_to_provider(provider, payload)
+        except Exception as e:
+            # A bad request (e.g.: a 400) is not the fault of the provider.
+            if is_provider_failure(e):
+                self.provider_pool.record_failure(provider, get_failure_cooldown(e))
+            raise
+
+        self.provider_pool.record_success(provider, timer() - started_at)
+
+        return json_response
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        # Not the same executor as the chunked analysis: that one would be waiting on the requests running here.
+        with self._hedge_executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(thread_name_prefix="ai-hedge")
+
+            return self._hedge_executor
+
+    def _post_with_hedging(
+            self,
+            provider: AiProvider,
+            payload: ChatRequest,
+            tried: List[str]) -> Tuple[dict, AiProvider]:
+        """
+        Send the request to the provider. If it takes longer than usual, send it to another provider as well, and
+        use whichever answers first.
+        :param provider: The provider.
+        :param payload: The request.
+        :param tried: Names of the providers that already got this request. The backup provider is added to it.
+        :return: The response from the AI model, and the provider that sent it.
+        """
+        hedge_after = self.provider_pool.hedge_after(provider)
+        if hedge_after is None:
+            return self._post_to_pool_provider(provider, payload), provider
+
+        executor = self._get_hedge_executor()
+        attempts = {executor.submit(self._post_to_pool_provider, provider, payload): provider}
+
+        done, _ = wait(attempts, timeout=hedge_after)
+        if not done:
+            backup = self.provider_pool.choose(exclude=tried)
+            if backup is not None:
+                logging.debug(f"{provider.name} is taking longer than {hedge_after:.2f}s. Also sending to {backup.name}.")
+                tried.append(backup.name)
+                attempts[executor.submit(self._post_to_pool_provider, backup, payload)] = backup
+
+        # The first answer wins. The other request can't be cancelled mid-way, so it finishes in the background.
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), attempts[future]
+
+                # No point waiting for the other one, it's the same request.
+                if not is_provider_failure(future.exception()):
+                    raise future.exception()
+
+                error = error or future.exception()
+
+        raise error
+
+    def _post_request_to_pool(self, payload: ChatRequest) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the request to the providers of the pool, moving on to the next one when a provider fails.
+        :param payload: The request.
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
+        tried = []
+        last_error = None
+
+        while (provider := self.provider_pool.choose(exclude=tried)) is not None:
+            tried.append(provider.name)
+
+            try:
+                json_response, provider = self._post_with_hedging(provider, payload, tried)
+                return json_response, self._generator_config(provider)
+            except Exception as e:
+                # It would fail the same way on the other providers.
+                if not is_provider_failure(e):
+                    raise
+
+                logging.warning(f"Request to the provider {provider.name} failed. Error: {repr(e)}")
+                last_error = e
+
+        raise last_error
+
+    def _post_request_to_ai(self, payload: ChatRequest) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the request to the AI model (no cache, no coalescing).
+        :param payload: The request.
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
+        if self.provider_pool is not None:
+            return self._post_request_to_pool(payload)
+
+        provider = self._default_provider()
+        return self._post_to_provider(provider, payload), self._generator_config(provider)
+
+    @STAGE_DURATION.timed(stage="send_request")
+    def _send_request_to_ai(
+            self,
+            context: List[ChatContextItem],
+            use_cache: bool = True) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the context to the AI model and get the response.
+        :param context: The context to send to the AI model.
+        :param use_cache: If False, the response cache is skipped. (Default: True)
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
         # Construct the payload for the request
         payload = self._build_request_payload(context)
+        request_key = self._request_key(payload)
 
-        # Make the API request
-        response = requests.post(self.api_endpoint, headers=headers, json=payload)
+        use_cache = use_cache and self.response_cache is not None
+        if use_cache:
+            cached_response = self.response_cache.get(request_key)
+            if cached_response is not None:
+                # We don't keep which provider answered, so cached responses report the default one.
+                return cached_response, self._generator_config()
 
-        # If the request was not successful, raise an exception.
-        response.raise_for_status()
+        # If the same request is already on its way, we wait for it instead of sending another one.
+        if self.single_flight is not None:
+            json_response, config = self.single_flight.do(request_key, lambda: self._post_request_to_ai(payload))
+        else:
+            json_response, config = self._post_request_to_ai(payload)
+
+        if use_cache:
+            self.response_cache.set(request_key, json_response)
+
+        return json_response, config
+
+    def _open_stream(self, provider: AiProvider, payload: ChatRequest) -> Any:
+        """
+        Send the request to one provider, asking for the response to be streamed.
+        :return: The response, as soon as the headers arrive. Must be closed by the caller.
+        """
+        payload = self._payload_for_provider(payload, provider)
+
+        response = requests.post(
+            provider.api_endpoint,
+            headers=get_headers(token=provider.api_key),
+            json=payload.encoded(),
+            stream=True,
+            estimated_tokens=self._estimate_request_tokens(payload, provider.api_endpoint)
+        )
 
         try:
-            return response.json()
-        except ValueError:
-            raise ValueError(f"Failed to parse response from the AI model: {response.text}")
+            response.raise_for_status()
+        except Exception:
+            AI_REQUESTS.inc(provider=provider.name, outcome="error")
+            response.close()
+            raise
+
+        # Streams don't report the usage (unless asked to), so no tokens here.
+        AI_REQUESTS.inc(provider=provider.name, outcome="success")
+
+        return response
+
+    @staticmethod
+    def _iter_stream_lines(response: Any) -> Iterator[str]:
+        with response:
+            # Event streams usually don't inform the charset, and requests would give us bytes in that case.
+            if response.encoding is None:
+                response.encoding = "utf-8"
+
+            yield from response.iter_lines(decode_unicode=True)
+
+    def _stream_request_to_ai(self, context: List[ChatContextItem]) -> Tuple[Iterator[str], AiGeneratorConfig]:
+        """
+        Send the context to the AI model, asking for the response to be streamed.
+        With a provider pool, we move on to the next provider if one fails before the stream starts (but streams are
+        never hedged).
+        :param context: The context to send to the AI model.
+        :return: An iterator with the lines of the stream (as they arrive), and the config of the provider.
+        """
+        payload = self._build_request_payload(context, stream=True)
+
+        if self.provider_pool is None:
+            provider = self._default_provider()
+            return self._iter_stream_lines(self._open_stream(provider, payload)), self._generator_config(provider)
+
+        tried = []
+        last_error = None
+
+        while (provider := self.provider_pool.choose(exclude=tried)) is not None:
+            tried.append(provider.name)
+
+            try:
+                response = self._open_stream(provider, payload)
+            except Exception as e:
+                if not is_provider_failure(e):
+                    raise
+
+                logging.warning(f"Stream from the provider {provider.name} failed. Error: {repr(e)}")
+                self.provider_pool.record_failure(provider, get_failure_cooldown(e))
+                last_error = e
+                continue
+
+            # Streams take as long as the answer, so their latency is not comparable with the other requests.
+            self.provider_pool.record_success(provider)
+            return self._iter_stream_lines(response), self._generator_config(provider)
+
+        raise last_error
 
     @staticmethod
     def _extract_data_from_response(response: dict) -> ChatContextItem:
@@ -122,23 +518,33 @@ class AiTasks:
             # apparent reason.
             concatenated_message = re.sub(r"^\s+|\s+$", " ", concatenated_message).strip()
 
-            return ChatContextItem(role="assistant", content=concatenated_message)
+            return ChatContextItem.model_construct(role="assistant", content=concatenated_message)
         except (IndexError, KeyError) as e:
             raise ValueError("Invalid AI response format") from e
 
-    def _log_ai_interaction(self, response: AiResponse, api_response: dict):
+    def _log_ai_interaction(self, response: AiResponse, api_response: dict, latency_seconds: float = None):
         """
         Log the interaction with the AI model.
         :param response: The response from the AI model with extra information.
         :param api_response: The raw response from the API.
+        :param latency_seconds: How long it took to get the complete response. (Optional)
         """
         if self.response_logger is None:
             return
 
-        self.response_logger(serialize_to_dict({
-            "parsed_response": response,
-            "api_response": api_response,
-        }))
+        with STAGE_DURATION.time(stage="serialize"):
+            record = serialize_to_dict({
+                # Whatever the caller wants to tag the interaction with (e.g.: the conversation id).
+                **get_log_fields(),
+                "latency_seconds": latency_seconds,
+                # Same hash, same system prompt: these requests could be served from the prompt cache of the provider.
+                "prompt_prefix_hash": context_prefix_hash(response.updated_context),
+                "parsed_response": response,
+                "api_response": api_response,
+            })
+
+        with STAGE_DURATION.time(stage="log"):
+            self.response_logger(record)
 
     def _fetch_data_from_query(self, query: str) -> Union[str, List[str], None]:
         """
@@ -149,46 +555,118 @@ class AiTasks:
         # TODO: Implement this... maybe.
         return None
 
+    def _dataset_to_text(
+            self,
+            dataset: Union[List[dict], ColumnarDataset, str, None],
+            encoding: DatasetEncoding,
+            summarize: bool = False) -> str:
+        encoding = encoding or self.dataset_encoding
+
+        is_table = isinstance(dataset, ColumnarDataset) or \
+            (isinstance(dataset, list) and len(dataset) > 0 and all(isinstance(row, dict) for row in dataset))
+        if summarize and is_table:
+            return summarize_dataset(dataset, encoding, self.token_counter)
+
+        if isinstance(dataset, ColumnarDataset):
+            return encode_table(dataset.columns, dataset.iter_rows(), encoding, self.token_counter)
+
+        return dataset_to_prompt_text(dataset, encoding, self.token_counter)
+
+    @staticmethod
+    def _parse_dataset_from_file(dataset_from_file: Union[str, ColumnarDataset]) -> Union[List[dict], ColumnarDataset]:
+        # Uploaded files are parsed only once, when uploaded. Raw CSV text still works, though.
+        if isinstance(dataset_from_file, ColumnarDataset):
+            return dataset_from_file
+
+        return csv_string_to_dict_list(dataset_from_file)
+
+    @STAGE_DURATION.timed(stage="prepare_datasets")
     def _prepare_datasets(
             self,
             is_csv: bool,
             data: Union[str, List[str], dict, List[dict]],
-            dataset_from_file: str,
-            query: str) -> str:
+            dataset_from_file: Union[str, ColumnarDataset],
+            query: str,
+            dataset_encoding: DatasetEncoding = None,
+            summarize_datasets: bool = False) -> str:
         if data is not None:
+            if is_csv or (isinstance(data, list) and len(data) > 0 and all(isinstance(row, dict) for row in data)):
+                records = csv_string_to_dict_list(data) if is_csv else data
+                main_dataset = self._dataset_to_text(records, dataset_encoding, summarize_datasets)
+            else:
+                main_dataset = data if isinstance(data, str) else str(data)
+
             prepared = [
                 "Main dataset:",
-                dataset_to_prompt_text(csv_string_to_dict_list(data)) if is_csv else data,
+                main_dataset,
             ]
         else:
             prepared = []
 
         if dataset_from_file is not None:
             prepared.append("\nDataset from file:")
-            prepared.append(dataset_to_prompt_text(csv_string_to_dict_list(dataset_from_file)))
+            prepared.append(self._dataset_to_text(
+                self._parse_dataset_from_file(dataset_from_file), dataset_encoding, summarize_datasets
+            ))
 
         if query is not None and query.strip() != "":
             query_data = self._fetch_data_from_query(query)
             prepared.append("Dataset from query:")
-            prepared.append(dataset_to_prompt_text(query_data) if query_data is not None else "Query yielded no results.")
+            prepared.append(
+                self._dataset_to_text(query_data, dataset_encoding, summarize_datasets) if query_data is not None
+                else "Query yielded no results."
+            )
 
         return "\n".join(prepared)
 
-    def ask_a_question(
+    def dataset_encoding_report(
+            self,
+            data: Union[str, List[str], List[dict]] = None,
+            is_csv: bool = False,
+            data_from_file: Union[str, ColumnarDataset] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Count how many tokens the datasets would take in the prompt with each encoding, so the cheapest one can be
+        chosen for them.
+
+        :param data: The data that would be analyzed. (Optional)
+        :param is_csv: If the data is in CSV format. (Optional. Default: False)
+        :param data_from_file: Extra data (CSV or an uploaded dataset) that would be used in the prompt. (Optional)
+        :return: For each dataset, the number of tokens per encoding (cheapest first).
+        """
+        datasets = {}
+
+        if data is not None:
+            datasets["main_dataset"] = csv_string_to_dict_list(data) if is_csv else data
+
+        if data_from_file is not None:
+            datasets["dataset_from_file"] = self._parse_dataset_from_file(data_from_file)
+
+        report = {}
+        for name, dataset in datasets.items():
+            if isinstance(dataset, ColumnarDataset):
+                report[name] = encoding_report(dataset.columns, dataset.iter_rows(), self.token_counter)
+                continue
+
+            if not isinstance(dataset, list) or not all(isinstance(row, dict) for row in dataset):
+                raise ValueError(f"The {name} is not tabular, so it can't be encoded.")
+
+            columns, rows = records_to_table(dataset)
+            report[name] = encoding_report(columns, rows, self.token_counter)
+
+        return report
+
+    def _prepare_question_context(
             self,
             question_or_prompt: str,
             system_context: str = None,
             context: List[ChatContextItem] = None
-    ) -> AiResponse:
+    ) -> List[ChatContextItem]:
         """
-        Ask a question to the AI model.
-
+        Build the context that will be sent to the AI model for a new question.
         :param question_or_prompt: The question to ask the AI model.
         :param system_context: A text that will give the AI context while answering the question.
-        (Optional. Default: Nothing. Just let the AI be themselves.)
         :param context: A list of previous messages that the AI should consider while answering the question.
-        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
-        :return: The response from the AI with extra information.
+        :return: The context, ready to be sent to the AI model.
         """
         # Converting the question to a message that will be sent in the context to the AI model
         message = ChatContextItem(role="user", content=question_or_prompt)
@@ -196,8 +674,28 @@ class AiTasks:
         # Updating the context with the latest message and system context (if provided)
         updated_context = self._update_context(latest_message=message, system_context=system_context, context=context)
 
-        # Sending the context to the AI model and getting the response
-        json_response = self._send_request_to_ai(updated_context)
+        # Making sure it fits the context window of the model (if we know it)
+        if self.context_window is not None:
+            updated_context = self.context_window.fit(updated_context)
+
+        return updated_context
+
+    def _build_ai_response(
+            self,
+            updated_context: List[ChatContextItem],
+            json_response: dict,
+            config: AiGeneratorConfig = None,
+            started_at: float = None) -> AiResponse:
+        """
+        Turn the raw response from the AI model into an AiResponse, and log the interaction.
+        :param updated_context: The context that was sent to the AI model.
+        :param json_response: The raw response from the AI model.
+        :param config: The config of the provider that answered. (Optional. Default: the one informed when creating
+        this object)
+        :param started_at: When the request was sent (timeit's default_timer), to log the latency. (Optional)
+        :return: The response from the AI with extra information.
+        """
+        latency_seconds = None if started_at is None else timer() - started_at
 
         # Extracting the message from the AI response
         response = self._extract_data_from_response(json_response)
@@ -205,21 +703,281 @@ class AiTasks:
         # Update the context again, now with the response from the AI model
         updated_context = self._update_context(latest_message=response, context=updated_context)
 
-        # Converts the response to the AiResponse type
-        response = AiResponse(
+        # Converts the response to the AiResponse type. Everything in it was either validated when it came in or built
+        # here, so it's not validated again (that only happens at the edges: the API and the conversation store).
+        response = AiResponse.model_construct(
             response=response.content,
             updated_context=updated_context,
-            config=AiGeneratorConfig(
-                base_url=self.api_endpoint,
-                ai_model_name=self.model
-            )
+            config=config or self._generator_config()
         )
 
         # Log the interaction with the AI model
-        self._log_ai_interaction(response, json_response)
+        self._log_ai_interaction(response, json_response, latency_seconds)
 
         return response
 
+    @staticmethod
+    def _build_analysis_prompt(question_or_prompt: str, serialized_data: str, data_before_prompt: bool) -> str:
+        """
+        Combine the question and the serialized datasets into a single prompt.
+        :param question_or_prompt: The question to ask the AI model.
+        :param serialized_data: The datasets, already converted to text.
+        :param data_before_prompt: If the data should be sent before the prompt.
+        :return: The prompt.
+        """
+        if data_before_prompt:
+            return f"{serialized_data}\n\n{question_or_prompt}"
+
+        return f"{question_or_prompt}\n\n{serialized_data}"
+
+    def _chunk_budget(self, question_or_prompt: str, agent: str = None, chunk_max_tokens: int = None) -> int:
+        """
+        How many tokens each chunk of data (or group of partial answers) can take in the chunked analysis.
+        :param question_or_prompt: The question, which goes with every chunk.
+        :param agent: The system context, which goes with every chunk. (Optional)
+        :param chunk_max_tokens: If informed, this is the budget. (Optional)
+        :return: The number of tokens.
+        """
+        if chunk_max_tokens is not None:
+            return chunk_max_tokens
+
+        if self.context_window is None:
+            return DEFAULT_CHUNK_MAX_TOKENS
+
+        used = self.context_window.count_message(ChatContextItem(role="user", content=question_or_prompt))
+        if agent is not None:
+            used += self.context_window.count_message(ChatContextItem(role="system", content=agent))
+
+        budget = self.context_window.budget - used - CHUNK_PROMPT_OVERHEAD_TOKENS
+
+        if budget < 1:
+            raise ValueError("The question doesn't leave room for any data in the context window of the model.")
+
+        return budget
+
+    def _collect_tables(
+            self,
+            is_csv: bool,
+            data: Union[str, List[str], dict, List[dict]],
+            dataset_from_file: Union[str, ColumnarDataset],
+            query: str
+    ) -> Tuple[List[Tuple[str, List[str], Iterable[Sequence[Any]], int]], List[str]]:
+        """
+        Split the datasets in tables (that can be chunked) and the rest (that goes whole with every chunk).
+        :return: The tables (name, columns, rows, row count) and the texts of the rest.
+        """
+        tables = []
+        extras = []
+
+        if data is not None:
+            records = csv_string_to_dict_list(data) if is_csv else data
+            if isinstance(records, list) and len(records) > 0 and all(isinstance(row, dict) for row in records):
+                columns, rows = records_to_table(records)
+                tables.append(("Main dataset", columns, rows, len(rows)))
+            else:
+                extras.append(f"Main dataset:\n{data if isinstance(data, str) else str(data)}")
+
+        if dataset_from_file is not None:
+            dataset = self._parse_dataset_from_file(dataset_from_file)
+            if isinstance(dataset, ColumnarDataset):
+                tables.append(("Dataset from file", dataset.columns, dataset.iter_rows(), dataset.row_count))
+            else:
+                columns, rows = records_to_table(dataset)
+                tables.append(("Dataset from file", columns, rows, len(rows)))
+
+        if query is not None and query.strip() != "":
+            query_data = self._fetch_data_from_query(query)
+            query_text = str(query_data) if query_data is not None else "Query yielded no results."
+            extras.append(f"Dataset from query:\n{query_text}")
+
+        return tables, extras
+
+    def _prepare_dataset_chunks(
+            self,
+            is_csv: bool,
+            data: Union[str, List[str], dict, List[dict]],
+            dataset_from_file: Union[str, ColumnarDataset],
+            query: str,
+            max_tokens: int,
+            dataset_encoding: DatasetEncoding = None) -> List[str]:
+        """
+        Same as _prepare_datasets, but the tables are split in chunks that fit in max_tokens.
+        :return: The data for each chunk, as text.
+        """
+        encoding = dataset_encoding or self.dataset_encoding
+        tables, extras = self._collect_tables(is_csv, data, dataset_from_file, query)
+
+        # Whatever can't be chunked goes with every chunk, so it takes from the budget of all of them.
+        extra_text = "\n".join(extras)
+        max_tokens -= self.token_counter(extra_text) if extra_text else 0
+        if max_tokens < 1:
+            raise ValueError("The data that can't be split (not tabular) doesn't fit in the context window.")
+
+        chunks = []
+        for name, columns, rows, row_count in tables:
+            for first_row, last_row, text in chunk_table(columns, rows, max_tokens, encoding, self.token_counter):
+                chunks.append(f"{name} (rows {first_row + 1} to {last_row} of {row_count}):\n{text}")
+
+        if len(chunks) == 0:
+            return [extra_text]
+
+        return [f"{extra_text}\n\n{chunk}" if extra_text else chunk for chunk in chunks]
+
+    @staticmethod
+    def _build_map_prompts(question_or_prompt: str, chunks: List[str], data_before_prompt: bool) -> List[str]:
+        """
+        Build the prompt that asks the question for each chunk of the data.
+        """
+        return [
+            AiTasks._build_analysis_prompt(
+                CHUNKED_ANALYSIS_MAP_PROMPT.format(count=len(chunks), index=index, question=question_or_prompt),
+                chunk,
+                data_before_prompt
+            )
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+
+    @staticmethod
+    def _build_reduce_prompt(question_or_prompt: str, answers: List[str]) -> str:
+        """
+        Build the prompt that combines the partial answers into one.
+        """
+        return CHUNKED_ANALYSIS_REDUCE_PROMPT.format(
+            question=question_or_prompt,
+            answers="\n\n".join(f"Answer for part {index}:\n{answer}" for index, answer in enumerate(answers, start=1))
+        )
+
+    def _group_partial_answers(self, answers: List[str], max_tokens: int) -> List[List[str]]:
+        """
+        Group the partial answers, so each group can be combined with a single prompt.
+        :param answers: The partial answers.
+        :param max_tokens: Max number of tokens of each group.
+        :return: The groups. If there's only one, it can be combined with the final prompt.
+        """
+        groups = [[]]
+        group_tokens = 0
+
+        for answer in answers:
+            answer_tokens = self.token_counter(answer)
+
+            # A group always gets at least two answers, otherwise combining them would never end.
+            if len(groups[-1]) >= 2 and group_tokens + answer_tokens > max_tokens:
+                groups.append([])
+                group_tokens = 0
+
+            groups[-1].append(answer)
+            group_tokens += answer_tokens
+
+        return groups
+
+    def _ask_for_partial_answer(self, prompt: str, agent: str = None, use_cache: bool = True) -> str:
+        """
+        Ask a question that is part of a chunked analysis. These are not part of the conversation, so they go without
+        the previous messages.
+        :param prompt: The prompt.
+        :param agent: The system context. (Optional)
+        :param use_cache: If False, the response cache is skipped. (Default: True)
+        :return: The answer.
+        """
+        updated_context = self._prepare_question_context(prompt, agent)
+        started_at = timer()
+        json_response, config = self._send_request_to_ai(updated_context, use_cache)
+        return self._build_ai_response(updated_context, json_response, config, started_at).response
+
+    def ask_a_question(
+            self,
+            question_or_prompt: str,
+            system_context: str = None,
+            context: List[ChatContextItem] = None,
+            use_cache: bool = True
+    ) -> AiResponse:
+        """
+        Ask a question to the AI model.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param system_context: A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question.
+        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
+        :return: The response from the AI with extra information.
+        """
+        updated_context = self._prepare_question_context(question_or_prompt, system_context, context)
+
+        # Sending the context to the AI model and getting the response
+        started_at = timer()
+        json_response, config = self._send_request_to_ai(updated_context, use_cache)
+
+        return self._build_ai_response(updated_context, json_response, config, started_at)
+
+    def ask_a_question_stream(
+            self,
+            question_or_prompt: str,
+            system_context: str = None,
+            context: List[ChatContextItem] = None
+    ) -> Iterator[AiStreamChunk]:
+        """
+        Same as ask_a_question, but yields the response as it is generated by the AI model.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param system_context: A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question.
+        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
+        :return: An iterator of chunks. The last one has done=True and the complete response.
+        """
+        updated_context = self._prepare_question_context(question_or_prompt, system_context, context)
+
+        started_at = timer()
+
+        lines, config = self._stream_request_to_ai(updated_context)
+
+        collector = StreamCollector()
+        for line in lines:
+            delta = collector.feed_line(line)
+
+            if delta:
+                yield AiStreamChunk(delta=delta)
+
+        response = self._build_ai_response(updated_context, collector.to_response(), config, started_at)
+        yield AiStreamChunk(delta="", done=True, response=response)
+
+    @staticmethod
+    def _to_batch_item(item: Union[str, AiBatchItem]) -> AiBatchItem:
+        return AiBatchItem(question_or_prompt=item) if isinstance(item, str) else item
+
+    def ask_many(
+            self,
+            items: Sequence[Union[str, AiBatchItem]],
+            max_concurrency: int = 4,
+            ordered: bool = True
+    ) -> Iterator[AiBatchResult]:
+        """
+        Ask many independent questions, sending up to max_concurrency of them to the AI model at the same time.
+
+        :param items: The questions. Either just the prompt, or an AiBatchItem (with the system context, etc.).
+        :param max_concurrency: How many questions are sent to the AI model at the same time. (Optional. Default: 4)
+        :param ordered: If True, the results come out in the same order as the items. Otherwise, they come out as
+        soon as they are ready (check the index). (Optional. Default: True)
+        :return: An iterator with one result per item. If a question fails, its result has the error instead of the
+        response, and the others carry on.
+        """
+        items = [self._to_batch_item(item) for item in items]
+
+        return run_batch(
+            [
+                lambda item=item: self.ask_a_question(
+                    question_or_prompt=item.question_or_prompt,
+                    system_context=item.system_context,
+                    context=item.context,
+                    use_cache=item.use_cache
+                )
+                for item in items
+            ],
+            max_concurrency=max_concurrency,
+            ordered=ordered
+        )
+
     def analyze_data(
             self,
             question_or_prompt: str,
@@ -229,7 +987,10 @@ class AiTasks:
             agent: str = None,
             context: List[ChatContextItem] = None,
             query: str = None,
-            data_from_file: str = None
+            data_from_file: Union[str, ColumnarDataset] = None,
+            dataset_encoding: DatasetEncoding = None,
+            summarize_datasets: bool = False,
+            use_cache: bool = True
     ) -> AiResponse:
         """
         Analyze data with the AI model.
@@ -243,18 +1004,96 @@ class AiTasks:
         :param context: A list of previous messages that the AI should consider while answering the question.
         (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
         :param query: A query to get data from the Database. (Optional. Default: None)
-        :param data_from_file: Extra data to use in the prompt. (Optional. Default: None)
+        :param data_from_file: Extra data (CSV or an uploaded dataset) to use in the prompt. (Optional. Default: None)
+        :param dataset_encoding: How the datasets are written in the prompt. (Optional. Default: the one informed
+        when creating this object)
+        :param summarize_datasets: If True, the tables are summarized locally (stats, counts, correlations and a sample)
+        and only the summary goes in the prompt, instead of all the rows. (Optional. Default: False)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
         :return: The response from the AI with extra information.
         """
-        serialized_data = self._prepare_datasets(is_csv, data, data_from_file, query)
+        serialized_data = self._prepare_datasets(
+            is_csv, data, data_from_file, query, dataset_encoding, summarize_datasets
+        )
 
-        if data_before_prompt:
-            prompt = f"{serialized_data}\n\n{question_or_prompt}"
-        else:
-            prompt = f"{question_or_prompt}\n\n{serialized_data}"
+        prompt = self._build_analysis_prompt(question_or_prompt, serialized_data, data_before_prompt)
 
         return self.ask_a_question(
             question_or_prompt=prompt,
             system_context=agent,
-            context=context
+            context=context,
+            use_cache=use_cache
+        )
+
+    def analyze_data_chunked(
+            self,
+            question_or_prompt: str,
+            data: Union[str, List[str], dict, List[dict]],
+            is_csv: bool = False,
+            data_before_prompt: bool = False,
+            agent: str = None,
+            context: List[ChatContextItem] = None,
+            query: str = None,
+            data_from_file: Union[str, ColumnarDataset] = None,
+            dataset_encoding: DatasetEncoding = None,
+            chunk_max_tokens: int = None,
+            max_concurrency: int = 4,
+            use_cache: bool = True
+    ) -> AiResponse:
+        """
+        Same as analyze_data, but for datasets that don't fit in the context window of the model.
+        The tables are split in chunks, the question is asked for each chunk (in parallel) and then the partial answers
+        are combined into one. If the data fits in a single chunk, this works exactly like analyze_data.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param data: The data to analyze with the AI model.
+        :param is_csv: If the data is in CSV format. (Optional. Default: False)
+        :param data_before_prompt: If the data should be sent before the prompt. (Optional. Default: False)
+        :param agent:  A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question. Only the
+        final prompt (that combines the partial answers) is added to it. (Optional. Default: Nothing.)
+        :param query: A query to get data from the Database. (Optional. Default: None)
+        :param data_from_file: Extra data (CSV or an uploaded dataset) to use in the prompt. (Optional. Default: None)
+        :param dataset_encoding: How the datasets are written in the prompt. (Optional. Default: the one informed
+        when creating this object)
+        :param chunk_max_tokens: Max number of tokens of each chunk. (Optional. Default: whatever fits in the context
+        window, or DEFAULT_CHUNK_MAX_TOKENS if we don't know its size)
+        :param max_concurrency: How many chunks are sent to the AI model at the same time. (Optional. Default: 4)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
+        :return: The response from the AI with extra information.
+        """
+        if max_concurrency < 1:
+            raise ValueError("The max concurrency must be greater than 0.")
+
+        budget = self._chunk_budget(question_or_prompt, agent, chunk_max_tokens)
+        chunks = self._prepare_dataset_chunks(is_csv, data, data_from_file, query, budget, dataset_encoding)
+
+        if len(chunks) == 1:
+            prompt = self._build_analysis_prompt(question_or_prompt, chunks[0], data_before_prompt)
+            return self.ask_a_question(
+                question_or_prompt=prompt, system_context=agent, context=context, use_cache=use_cache
+            )
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # Map: one partial answer per chunk.
+            answers = list(executor.map(
+                lambda prompt: self._ask_for_partial_answer(prompt, agent, use_cache),
+                self._build_map_prompts(question_or_prompt, chunks, data_before_prompt)
+            ))
+
+            # Reduce: if the partial answers are too many to be combined at once, we combine them in groups first.
+            groups = self._group_partial_answers(answers, budget)
+            while len(groups) > 1:
+                answers = list(executor.map(
+                    lambda prompt: self._ask_for_partial_answer(prompt, agent, use_cache),
+                    [self._build_reduce_prompt(question_or_prompt, group) for group in groups]
+                ))
+                groups = self._group_partial_answers(answers, budget)
+
+        return self.ask_a_question(
+            question_or_prompt=self._build_reduce_prompt(question_or_prompt, groups[0]),
+            system_context=agent,
+            context=context,
+            use_cache=use_cache
         )
@@ -0,0 +1,530 @@
+import asyncio
+import logging
+from timeit import default_timer as timer
+from typing import List, Union, AsyncIterator, Tuple, Sequence
+
+import httpx
+
+from src.ai_tasks.ai_tasks import AiTasks
+from src.ai_tasks.batch import async_run_batch
+from src.ai_tasks.chat_request import ChatRequest
+from src.ai_tasks.streaming import StreamCollector
+from src.ai_tasks.provider_pool import is_provider_failure, get_failure_cooldown
+from src.ai_tasks.single_flight import AsyncSingleFlight
+from src.ai_tasks.types import ChatContextItem, AiResponse, AiStreamChunk, AiProvider, AiGeneratorConfig, \
+    AiBatchItem, AiBatchResult
+from src.datasets.columnar import ColumnarDataset
+from src.datasets.types import DatasetEncoding
+from src.shared.http import get_headers
+from src.shared.metrics import STAGE_DURATION, AI_REQUESTS
+from src.shared.rate_limiter import AsyncRateLimiter, get_async_rate_limiter
+import src.shared.async_requests_with_retry as requests
+
+
+class AsyncAiTasks(AiTasks):
+    """
+    Same as AiTasks, but the calls to the AI model are awaitable, so they don't block the event loop while waiting
+    for the AI to answer. Use this one inside async code (like the FastAPI endpoints).
+    """
+
+    def _create_single_flight(self) -> AsyncSingleFlight:
+        return AsyncSingleFlight()
+
+    @staticmethod
+    def _get_rate_limiter(api_endpoint: str) -> Union[AsyncRateLimiter, None]:
+        return get_async_rate_limiter(api_endpoint)
+
+    @STAGE_DURATION.timed(stage="ai_request")
+    async def _post_to_provider(self, provider: AiProvider, payload: ChatRequest) -> dict:
+        """
+        Send the request to one provider.
+        :param provider: The provider.
+        :param payload: The request.
+        :return: The response from the AI model.
+        """
+        payload = self._payload_for_provider(payload, provider)
+
+        # Define the header for the request
+        headers = get_headers(token=provider.api_key)
+        estimated_tokens = self._estimate_request_tokens(payload, provider.api_endpoint)
+
+        try:
+            # Make the API request
+            response = await requests.post(
+                provider.api_endpoint, headers=headers, json=payload.encoded(), estimated_tokens=estimated_tokens
+            )
+
+            # If the request was not successful, raise an exception.
+            response.raise_for_status()
+
+            json_response = self._parse_response(response)
+        except Exception:
+            AI_REQUESTS.inc(provider=provider.name, outcome="error")
+            raise
+
+        self._record_token_usage(provider.api_endpoint, estimated_tokens, json_response)
+        self._record_response_metrics(provider, payload, json_response)
+
+        return json_response
+
+    async def _post_to_pool_provider(self, provider: AiProvider, payload: ChatRequest) -> dict:
+        """
+        Same as _post_to_provider, but the latency (or the failure) goes into the stats of the provider pool.
+        """
+        started_at = timer()
+
+        try:
+            json_response = await self._post_to_provider(provider, payload)
+        except Exception as e:
+            # A bad request (e.g.: a 400) is not the fault of the provider.
+            if is_provider_failure(e):
+                self.provider_pool.record_failure(provider, get_failure_cooldown(e))
+            raise
+
+        self.provider_pool.record_success(provider, timer() - started_at)
+
+        return json_response
+
+    async def _post_with_hedging(
+            self,
+            provider: AiProvider,
+            payload: ChatRequest,
+            tried: List[str]) -> Tuple[dict, AiProvider]:
+        """
+        Send the request to the provider. If it takes longer than usual, send it to another provider as well, and
+        use whichever answers first (the other one is cancelled).
+        :param provider: The provider.
+        :param payload: The request.
+        :param tried: Names of the providers that already got this request. The backup provider is added to it.
+        :return: The response from the AI model, and the provider that sent it.
+        """
+        hedge_after = self.provider_pool.hedge_after(provider)
+        if hedge_after is None:
+            return await self._post_to_pool_provider(provider, payload), provider
+
+        attempts = {asyncio.ensure_future(self._post_to_pool_provider(provider, payload)): provider}
+        pending = set(attempts)
+
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                backup = self.provider_pool.choose(exclude=tried)
+                if backup is not None:
+                    logging.debug(
+                        f"{provider.name} is taking longer than {hedge_after:.2f}s. Also sending to {backup.name}."
+                    )
+                    tried.append(backup.name)
+                    backup_attempt = asyncio.ensure_future(self._post_to_pool_provider(backup, payload))
+                    attempts[backup_attempt] = backup
+                    pending.add(backup_attempt)
+
+            error = None
+            while True:
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result(), attempts[attempt]
+
+                    # No point waiting for the other one, it's the same request.
+                    if not is_provider_failure(attempt.exception()):
+                        raise attempt.exception()
+
+                    error = error or attempt.exception()
+
+                if not pending:
+                    raise error
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # The first answer wins, the other one is not needed anymore.
+            for attempt in pending:
+                attempt.cancel()
+
+    async def _post_request_to_pool(self, payload: ChatRequest) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the request to the providers of the pool, moving on to the next one when a provider fails.
+        :param payload: The request.
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
+        tried = []
+        last_error = None
+
+        while (provider := self.provider_pool.choose(exclude=tried)) is not None:
+            tried.append(provider.name)
+
+            try:
+                json_response, provider = await self._post_with_hedging(provider, payload, tried)
+                return json_response, self._generator_config(provider)
+            except Exception as e:
+                # It would fail the same way on the other providers.
+                if not is_provider_failure(e):
+                    raise
+
+                logging.warning(f"Request to the provider {provider.name} failed. Error: {repr(e)}")
+                last_error = e
+
+        raise last_error
+
+    async def _post_request_to_ai(self, payload: ChatRequest) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the request to the AI model (no cache, no coalescing).
+        :param payload: The request.
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
+        if self.provider_pool is not None:
+            return await self._post_request_to_pool(payload)
+
+        provider = self._default_provider()
+        return await self._post_to_provider(provider, payload), self._generator_config(provider)
+
+    @STAGE_DURATION.timed(stage="send_request")
+    async def _send_request_to_ai(
+            self,
+            context: List[ChatContextItem],
+            use_cache: bool = True) -> Tuple[dict, AiGeneratorConfig]:
+        """
+        Send the context to the AI model and get the response.
+        :param context: The context to send to the AI model.
+        :param use_cache: If False, the response cache is skipped. (Default: True)
+        :return: The response from the AI model, and the config of the provider that sent it.
+        """
+        # Construct the payload for the request
+        payload = self._build_request_payload(context)
+        request_key = self._request_key(payload)
+
+        use_cache = use_cache and self.response_cache is not None
+        if use_cache:
+            # In a worker thread, like the other stores: the cache can be SQLite, which would block the event loop.
+            cached_response = await asyncio.to_thread(self.response_cache.get, request_key)
+            if cached_response is not None:
+                # We don't keep which provider answered, so cached responses report the default one.
+                return cached_response, self._generator_config()
+
+        # If the same request is already on its way, we wait for it instead of sending another one.
+        if self.single_flight is not None:
+            json_response, config = await self.single_flight.do(
+                request_key, lambda: self._post_request_to_ai(payload)
+            )
+        else:
+            json_response, config = await self._post_request_to_ai(payload)
+
+        if use_cache:
+            await asyncio.to_thread(self.response_cache.set, request_key, json_response)
+
+        return json_response, config
+
+    async def _open_stream(self, provider: AiProvider, payload: ChatRequest) -> httpx.Response:
+        """
+        Send the request to one provider, asking for the response to be streamed.
+        :return: The response, as soon as the headers arrive. Must be closed by the caller.
+        """
+        payload = self._payload_for_provider(payload, provider)
+
+        response = await requests.post_stream(
+            provider.api_endpoint,
+            headers=get_headers(token=provider.api_key),
+            json=payload.encoded(),
+            estimated_tokens=self._estimate_request_tokens(payload, provider.api_endpoint)
+        )
+
+        try:
+            response.raise_for_status()
+        except Exception:
+            AI_REQUESTS.inc(provider=provider.name, outcome="error")
+            await response.aclose()
+            raise
+
+        # Streams don't report the usage (unless asked to), so no tokens here.
+        AI_REQUESTS.inc(provider=provider.name, outcome="success")
+
+        return response
+
+    @staticmethod
+    async def _iter_stream_lines(response: httpx.Response) -> AsyncIterator[str]:
+        try:
+            async for line in response.aiter_lines():
+                yield line
+        finally:
+            await response.aclose()
+
+    async def _stream_request_to_ai(
+            self,
+            context: List[ChatContextItem]) -> Tuple[AsyncIterator[str], AiGeneratorConfig]:
+        """
+        Send the context to the AI model, asking for the response to be streamed.
+        With a provider pool, we move on to the next provider if one fails before the stream starts (but streams are
+        never hedged).
+        :param context: The context to send to the AI model.
+        :return: An async iterator with the lines of the stream (as they arrive), and the config of the provider.
+        """
+        payload = self._build_request_payload(context, stream=True)
+
+        if self.provider_pool is None:
+            provider = self._default_provider()
+            response = await self._open_stream(provider, payload)
+            return self._iter_stream_lines(response), self._generator_config(provider)
+
+        tried = []
+        last_error = None
+
+        while (provider := self.provider_pool.choose(exclude=tried)) is not None:
+            tried.append(provider.name)
+
+            try:
+                response = await self._open_stream(provider, payload)
+            except Exception as e:
+                if not is_provider_failure(e):
+                    raise
+
+                logging.warning(f"Stream from the provider {provider.name} failed. Error: {repr(e)}")
+                self.provider_pool.record_failure(provider, get_failure_cooldown(e))
+                last_error = e
+                continue
+
+            # Streams take as long as the answer, so their latency is not comparable with the other requests.
+            self.provider_pool.record_success(provider)
+            return self._iter_stream_lines(response), self._generator_config(provider)
+
+        raise last_error
+
+    async def _ask_for_partial_answer(self, prompt: str, agent: str = None, use_cache: bool = True) -> str:
+        """
+        Ask a question that is part of a chunked analysis. These are not part of the conversation, so they go without
+        the previous messages.
+        :param prompt: The prompt.
+        :param agent: The system context. (Optional)
+        :param use_cache: If False, the response cache is skipped. (Default: True)
+        :return: The answer.
+        """
+        updated_context = self._prepare_question_context(prompt, agent)
+        started_at = timer()
+        json_response, config = await self._send_request_to_ai(updated_context, use_cache)
+        return self._build_ai_response(updated_context, json_response, config, started_at).response
+
+    async def _ask_for_partial_answers(
+            self,
+            prompts: List[str],
+            agent: str,
+            semaphore: asyncio.Semaphore,
+            use_cache: bool = True) -> List[str]:
+        """
+        Ask all the prompts, but only as many at the same time as the semaphore allows.
+        :return: The answers, in the same order as the prompts.
+        """
+        async def ask(prompt: str) -> str:
+            async with semaphore:
+                return await self._ask_for_partial_answer(prompt, agent, use_cache)
+
+        return list(await asyncio.gather(*(ask(prompt) for prompt in prompts)))
+
+    async def ask_a_question(
+            self,
+            question_or_prompt: str,
+            system_context: str = None,
+            context: List[ChatContextItem] = None,
+            use_cache: bool = True
+    ) -> AiResponse:
+        """
+        Ask a question to the AI model.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param system_context: A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question.
+        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
+        :return: The response from the AI with extra information.
+        """
+        updated_context = self._prepare_question_context(question_or_prompt, system_context, context)
+
+        # Sending the context to the AI model and getting the response
+        started_at = timer()
+        json_response, config = await self._send_request_to_ai(updated_context, use_cache)
+
+        return self._build_ai_response(updated_context, json_response, config, started_at)
+
+    async def ask_a_question_stream(
+            self,
+            question_or_prompt: str,
+            system_context: str = None,
+            context: List[ChatContextItem] = None
+    ) -> AsyncIterator[AiStreamChunk]:
+        """
+        Same as ask_a_question, but yields the response as it is generated by the AI model.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param system_context: A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question.
+        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
+        :return: An async iterator of chunks. The last one has done=True and the complete response.
+        """
+        updated_context = self._prepare_question_context(question_or_prompt, system_context, context)
+
+        started_at = timer()
+
+        lines, config = await self._stream_request_to_ai(updated_context)
+
+        collector = StreamCollector()
+        async for line in lines:
+            delta = collector.feed_line(line)
+
+            if delta:
+                yield AiStreamChunk(delta=delta)
+
+        response = self._build_ai_response(updated_context, collector.to_response(), config, started_at)
+        yield AiStreamChunk(delta="", done=True, response=response)
+
+    async def ask_many(
+            self,
+            items: Sequence[Union[str, AiBatchItem]],
+            max_concurrency: int = 4,
+            ordered: bool = True
+    ) -> AsyncIterator[AiBatchResult]:
+        """
+        Ask many independent questions, sending up to max_concurrency of them to the AI model at the same time.
+
+        :param items: The questions. Either just the prompt, or an AiBatchItem (with the system context, etc.).
+        :param max_concurrency: How many questions are sent to the AI model at the same time. (Optional. Default: 4)
+        :param ordered: If True, the results come out in the same order as the items. Otherwise, they come out as
+        soon as they are ready (check the index). (Optional. Default: True)
+        :return: An async iterator with one result per item. If a question fails, its result has the error instead of
+        the response, and the others carry on.
+        """
+        items = [self._to_batch_item(item) for item in items]
+
+        async for result in async_run_batch(
+            [
+                lambda item=item: self.ask_a_question(
+                    question_or_prompt=item.question_or_prompt,
+                    system_context=item.system_context,
+                    context=item.context,
+                    use_cache=item.use_cache
+                )
+                for item in items
+            ],
+            max_concurrency=max_concurrency,
+            ordered=ordered
+        ):
+            yield result
+
+    async def analyze_data(
+            self,
+            question_or_prompt: str,
+            data: Union[str, List[str], dict, List[dict]],
+            is_csv: bool = False,
+            data_before_prompt: bool = False,
+            agent: str = None,
+            context: List[ChatContextItem] = None,
+            query: str = None,
+            data_from_file: Union[str, ColumnarDataset] = None,
+            dataset_encoding: DatasetEncoding = None,
+            summarize_datasets: bool = False,
+            use_cache: bool = True
+    ) -> AiResponse:
+        """
+        Analyze data with the AI model.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param data: The data to analyze with the AI model.
+        :param is_csv: If the data is in CSV format. (Optional. Default: False)
+        :param data_before_prompt: If the data should be sent before the prompt. (Optional. Default: False)
+        :param agent:  A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question.
+        (Optional. Default: Nothing. Will be created automatically when the AI answers the question.)
+        :param query: A query to get data from the Database. (Optional. Default: None)
+        :param data_from_file: Extra data (CSV or an uploaded dataset) to use in the prompt. (Optional. Default: None)
+        :param dataset_encoding: How the datasets are written in the prompt. (Optional. Default: the one informed
+        when creating this object)
+        :param summarize_datasets: If True, the tables are summarized locally (stats, counts, correlations and a sample)
+        and only the summary goes in the prompt, instead of all the rows. (Optional. Default: False)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
+        :return: The response from the AI with extra information.
+        """
+        # Parsing big datasets is CPU bound, so we do it in a worker thread to keep the event loop responsive.
+        serialized_data = await asyncio.to_thread(
+            self._prepare_datasets, is_csv, data, data_from_file, query, dataset_encoding, summarize_datasets
+        )
+
+        prompt = self._build_analysis_prompt(question_or_prompt, serialized_data, data_before_prompt)
+
+        return await self.ask_a_question(
+            question_or_prompt=prompt,
+            system_context=agent,
+            context=context,
+            use_cache=use_cache
+        )
+
+    async def analyze_data_chunked(
+            self,
+            question_or_prompt: str,
+            data: Union[str, List[str], dict, List[dict]],
+            is_csv: bool = False,
+            data_before_prompt: bool = False,
+            agent: str = None,
+            context: List[ChatContextItem] = None,
+            query: str = None,
+            data_from_file: Union[str, ColumnarDataset] = None,
+            dataset_encoding: DatasetEncoding = None,
+            chunk_max_tokens: int = None,
+            max_concurrency: int = 4,
+            use_cache: bool = True
+    ) -> AiResponse:
+        """
+        Same as analyze_data, but for datasets that don't fit in the context window of the model.
+        The tables are split in chunks, the question is asked for each chunk (in parallel) and then the partial answers
+        are combined into one. If the data fits in a single chunk, this works exactly like analyze_data.
+
+        :param question_or_prompt: The question to ask the AI model.
+        :param data: The data to analyze with the AI model.
+        :param is_csv: If the data is in CSV format. (Optional. Default: False)
+        :param data_before_prompt: If the data should be sent before the prompt. (Optional. Default: False)
+        :param agent:  A text that will give the AI context while answering the question.
+        (Optional. Default: Nothing. Just let the AI be themselves.)
+        :param context: A list of previous messages that the AI should consider while answering the question. Only the
+        final prompt (that combines the partial answers) is added to it. (Optional. Default: Nothing.)
+        :param query: A query to get data from the Database. (Optional. Default: None)
+        :param data_from_file: Extra data (CSV or an uploaded dataset) to use in the prompt. (Optional. Default: None)
+        :param dataset_encoding: How the datasets are written in the prompt. (Optional. Default: the one informed
+        when creating this object)
+        :param chunk_max_tokens: Max number of tokens of each chunk. (Optional. Default: whatever fits in the context
+        window, or DEFAULT_CHUNK_MAX_TOKENS if we don't know its size)
+        :param max_concurrency: How many chunks are sent to the AI model at the same time. (Optional. Default: 4)
+        :param use_cache: If False, the response cache is skipped for this call. (Optional. Default: True)
+        :return: The response from the AI with extra information.
+        """
+        if max_concurrency < 1:
+            raise ValueError("The max concurrency must be greater than 0.")
+
+        budget = self._chunk_budget(question_or_prompt, agent, chunk_max_tokens)
+        chunks = await asyncio.to_thread(
+            self._prepare_dataset_chunks, is_csv, data, data_from_file, query, budget, dataset_encoding
+        )
+
+        if len(chunks) == 1:
+            prompt = self._build_analysis_prompt(question_or_prompt, chunks[0], data_before_prompt)
+            return await self.ask_a_question(
+                question_or_prompt=prompt, system_context=agent, context=context, use_cache=use_cache
+            )
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Map: one partial answer per chunk.
+        answers = await self._ask_for_partial_answers(
+            self._build_map_prompts(question_or_prompt, chunks, data_before_prompt), agent, semaphore, use_cache
+        )
+
+        # Reduce: if the partial answers are too many to be combined at once, we combine them in groups first.
+        groups = self._group_partial_answers(answers, budget)
+        while len(groups) > 1:
+            answers = await self._ask_for_partial_answers(
+                [self._build_reduce_prompt(question_or_prompt, group) for group in groups], agent, semaphore, use_cache
+            )
+            groups = self._group_partial_answers(answers, budget)
+
+        return await self.ask_a_question(
+            question_or_prompt=self._build_reduce_prompt(question_or_prompt, groups[0]),
+            system_context=agent,
+            context=context,
+            use_cache=use_cache
+        )
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List
+
+from src.ai_tasks.types import AiBatchResult, AiResponse
+
+
+def _validate_max_concurrency(max_concurrency: int):
+    if max_concurrency < 1:
+        raise ValueError("The max concurrency must be greater than 0.")
+
+
+def _error_result(index: int, error: Exception) -> AiBatchResult:
+    logging.warning(f"Item {index} of the batch failed: {error}")
+    return AiBatchResult(index=index, error=str(error) or type(error).__name__)
+
+
+def run_batch(
+        tasks: List[Callable[[], AiResponse]],
+        max_concurrency: int = 4,
+        ordered: bool = True) -> Iterator[AiBatchResult]:
+    """
+    Run the tasks in a pool of threads, and yield their results.
+    :param tasks: What to run. Each one is a function that takes no arguments and returns an AiResponse.
+    :param max_concurrency: How many tasks run at the same time. (Default: 4)
+    :param ordered: If True, the results come out in the same order as the tasks. Otherwise, they come out as soon as
+    they are done. (Default: True)
+    :return: An iterator of results, one per task. A task that fails gets a result with the error, and doesn't stop
+    the others.
+    """
+    _validate_max_concurrency(max_concurrency)
+
+    def run(index: int, task: Callable[[], AiResponse]) -> AiBatchResult:
+        try:
+            return AiBatchResult(index=index, response=task())
+        except Exception as e:
+            return _error_result(index, e)
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ai-batch")
+    try:
+        futures = [executor.submit(run, index, task) for index, task in enumerate(tasks)]
+
+        for future in (futures if ordered else as_completed(futures)):
+            yield future.result()
+    finally:
+        # If whoever is reading the results gives up, the tasks that haven't started yet are dropped.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def async_run_batch(
+        tasks: List[Callable[[], Awaitable[AiResponse]]],
+        max_concurrency: int = 4,
+        ordered: bool = True) -> AsyncIterator[AiBatchResult]:
+    """
+    Same as run_batch, but for coroutines. Each task is a function that takes no arguments and returns an awaitable.
+    """
+    _validate_max_concurrency(max_concurrency)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(index: int, task: Callable[[], Awaitable[AiResponse]]) -> AiBatchResult:
+        async with semaphore:
+            try:
+                return AiBatchResult(index=index, response=await task())
+            except Exception as e:
+                return _error_result(index, e)
+
+    pending = [asyncio.ensure_future(run(index, task)) for index, task in enumerate(tasks)]
+    try:
+        for future in (pending if ordered else asyncio.as_completed(pending)):
+            yield await future
+    finally:
+        # If whoever is reading the results gives up (e.g.: the client disconnected), the rest is cancelled.
+        for future in pending:
+            future.cancel()
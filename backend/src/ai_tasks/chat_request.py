@@ -0,0 +1,61 @@
+from typing import List, Optional, Sequence
+
+from src.ai_tasks.types import ChatContextItem
+from src.shared.json_codec import EncodedJson, encode
+
+
+class ChatMessage:
+    """
+    A message of a request to the AI model. Same as ChatContextItem, but without pydantic: the context was already
+    validated when it came in (or built by us), so this is just what gets encoded.
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role: str = role
+        self.content: str = content
+
+    def to_dict(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ChatMessage) and self.role == other.role and self.content == other.content
+
+    def __repr__(self) -> str:
+        return f"ChatMessage(role={self.role!r}, content={self.content!r})"
+
+
+class ChatRequest:
+    """
+    A request to the AI model (the body of /chat/completions). The body is encoded the first time it's needed and
+    reused after that (retries, other providers with the same model, hedged requests).
+    Never changed after it's created: use with_model to get a copy for another model.
+    """
+    __slots__ = ("messages", "model", "stream", "_encoded")
+
+    def __init__(self, messages: List[ChatMessage], model: str, stream: bool = False):
+        self.messages: List[ChatMessage] = messages
+        self.model: str = model
+        self.stream: bool = stream
+        self._encoded: Optional[EncodedJson] = None
+
+    @classmethod
+    def from_context(cls, context: Sequence[ChatContextItem], model: str, stream: bool = False) -> "ChatRequest":
+        return cls([ChatMessage(item.role, item.content) for item in context], model, stream)
+
+    def with_model(self, model: str) -> "ChatRequest":
+        return self if model == self.model else ChatRequest(self.messages, model, self.stream)
+
+    def to_dict(self) -> dict:
+        return {
+            "messages": [{"role": message.role, "content": message.content} for message in self.messages],
+            "model": self.model,
+            "stream": self.stream
+        }
+
+    def encoded(self) -> EncodedJson:
+        # Two threads may encode it at the same time. They get the same bytes, so whichever wins is fine.
+        if self._encoded is None:
+            self._encoded = encode(self.to_dict())
+
+        return self._encoded
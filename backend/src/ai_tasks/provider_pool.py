@@ -0,0 +1,254 @@
+import json
+import math
+import random
+import time
+from collections import deque
+from pathlib import Path
+from threading import Lock
+from typing import Deque, Dict, Iterable, List, Optional, Union
+
+import httpx
+import requests
+
+from src.ai_tasks.types import AiProvider, AiProviderStats
+from src.decorators.retry import CircuitOpenError
+from src.shared.http import get_retry_after
+
+# Errors that mean the provider can't answer right now (no response, or it took too long), for requests and httpx.
+_UNAVAILABLE_ERRORS = (
+    CircuitOpenError,
+    requests.Timeout,
+    requests.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    httpx.RemoteProtocolError,
+)
+
+# 4xx that are about the provider, not the request: each provider has its own key and quota, so the others may still
+# take it. (Bad/revoked key, no access to the model, rate limited or out of quota)
+_PROVIDER_STATUS_CODES = frozenset([401, 403, 429])
+
+
+def _error_response(error: BaseException) -> Union[requests.Response, httpx.Response, None]:
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        return error.response
+
+    return None
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    Check if an error means the provider can't take the request (5xx, 401, 403, 429, timeout or connection error), so
+    it should be left out for a while and the request should go to another provider. Any other error (e.g.: a 400) is a
+    problem with the request itself, and would fail the same way on every provider.
+    :param error: The error raised by the request.
+    :return: True if it's a failure of the provider.
+    """
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        response = _error_response(error)
+        return response is not None and (response.status_code >= 500 or response.status_code in _PROVIDER_STATUS_CODES)
+
+    return isinstance(error, _UNAVAILABLE_ERRORS)
+
+
+def get_failure_cooldown(error: BaseException) -> Union[float, None]:
+    """
+    How long the provider asked to be left alone (Retry-After of a 429 or 503), if it did.
+    :param error: The error raised by the request.
+    :return: The seconds, or None if the provider didn't say.
+    """
+    response = _error_response(error)
+
+    if response is None or response.status_code not in (429, 503):
+        return None
+
+    return get_retry_after(response.headers)
+
+
+class _ProviderState:
+    def __init__(self, max_latency_samples: int):
+        self.requests: int = 0
+        self.failures: int = 0
+        self.consecutive_failures: int = 0
+        self.latency_ewma: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=max_latency_samples)
+        self.unavailable_until: float = 0
+
+
+class ProviderPool:
+    """
+    A group of AI providers (endpoint + key + model) that can answer the same requests.
+
+    Each request goes to one of them, picked at random, but favoring the ones with higher weights and lower latency
+    (a moving average of the latency of their last responses). A provider that fails is left out for a while, and the
+    request goes to the next one. Requests slower than usual (a percentile of the latency of the provider) can be
+    hedged: a copy is sent to another provider, and the first answer wins.
+
+    This class only keeps the stats and picks the providers. Sending the requests is up to AiTasks.
+    """
+
+    def __init__(
+            self,
+            providers: List[AiProvider],
+            ewma_alpha: float = 0.3,
+            hedge_percentile: Optional[float] = 0.95,
+            hedge_min_samples: int = 20,
+            failure_cooldown_seconds: float = 30,
+            max_latency_samples: int = 200):
+        """
+        :param providers: The providers. Names must be unique.
+        :param ewma_alpha: How much the latest latency weighs in the moving average (0 to 1). (Default: 0.3)
+        :param hedge_percentile: Requests taking longer than this percentile of the latency of the provider are also
+        sent to another provider. (Default: 0.95. None to disable hedging)
+        :param hedge_min_samples: Only hedge after this many responses from the provider. (Default: 20)
+        :param failure_cooldown_seconds: How long a provider is left out after a failure. Doubles on each failure in a
+        row, up to 8x. (Default: 30)
+        :param max_latency_samples: How many latencies we keep per provider, to calculate the percentile. (Default: 200)
+        """
+        if len(providers) == 0:
+            raise ValueError("The provider pool needs at least one provider.")
+
+        if len({provider.name for provider in providers}) != len(providers):
+            raise ValueError("The names of the providers must be unique.")
+
+        if any(provider.weight <= 0 for provider in providers):
+            raise ValueError("The weight of the providers must be greater than 0.")
+
+        if not 0 < ewma_alpha <= 1:
+            raise ValueError("The EWMA alpha must be between 0 (exclusive) and 1.")
+
+        if hedge_percentile is not None and not 0 < hedge_percentile < 1:
+            raise ValueError("The hedge percentile must be between 0 and 1 (exclusive).")
+
+        self.providers: List[AiProvider] = list(providers)
+        self.ewma_alpha: float = ewma_alpha
+        self.hedge_percentile: Optional[float] = hedge_percentile
+        self.hedge_min_samples: int = hedge_min_samples
+        self.failure_cooldown_seconds: float = failure_cooldown_seconds
+
+        self._states: Dict[str, _ProviderState] = {
+            provider.name: _ProviderState(max_latency_samples) for provider in providers
+        }
+        self._lock = Lock()
+
+    @classmethod
+    def from_json_file(cls, json_file: Union[str, Path], **kwargs) -> "ProviderPool":
+        """
+        Create a pool from a JSON file with a list of providers (name, api_endpoint, api_key, model and weight).
+        :param json_file: The file.
+        :param kwargs: Anything else the constructor takes.
+        :return: The pool.
+        """
+        providers = json.loads(Path(json_file).read_text(encoding="utf-8"))
+        return cls([AiProvider(**provider) for provider in providers], **kwargs)
+
+    def _score(self, provider: AiProvider, default_latency: float) -> float:
+        latency = self._states[provider.name].latency_ewma
+        return provider.weight / max(latency if latency is not None else default_latency, 0.001)
+
+    def choose(self, exclude: Iterable[str] = ()) -> Union[AiProvider, None]:
+        """
+        Pick the provider for a request.
+        :param exclude: Names of the providers that must not be picked (e.g.: the ones that already failed this
+        request).
+        :return: The provider, or None if all of them were excluded.
+        """
+        exclude = set(exclude)
+        now = time.monotonic()
+
+        with self._lock:
+            candidates = [provider for provider in self.providers if provider.name not in exclude]
+            if len(candidates) == 0:
+                return None
+
+            available = [p for p in candidates if self._states[p.name].unavailable_until <= now]
+            if len(available) == 0:
+                # Everyone is cooling down. Better to try the one that will be back first than to fail right away.
+                return min(candidates, key=lambda p: self._states[p.name].unavailable_until)
+
+            # Providers we haven't heard from yet get the best latency, so they get tried.
+            known_latencies = [self._states[p.name].latency_ewma for p in available]
+            known_latencies = [latency for latency in known_latencies if latency is not None]
+            default_latency = min(known_latencies) if known_latencies else 1
+
+            scores = [self._score(provider, default_latency) for provider in available]
+
+        return random.choices(available, weights=scores)[0]
+
+    def record_success(self, provider: AiProvider, latency_seconds: Optional[float] = None):
+        """
+        The provider answered.
+        :param provider: The provider.
+        :param latency_seconds: How long it took. (Optional. e.g.: streams, where it's not comparable)
+        """
+        with self._lock:
+            state = self._states[provider.name]
+            state.requests += 1
+            state.consecutive_failures = 0
+            state.unavailable_until = 0
+
+            if latency_seconds is None:
+                return
+
+            state.latencies.append(latency_seconds)
+            state.latency_ewma = latency_seconds if state.latency_ewma is None \
+                else self.ewma_alpha * latency_seconds + (1 - self.ewma_alpha) * state.latency_ewma
+
+    def record_failure(self, provider: AiProvider, cooldown_seconds: Optional[float] = None):
+        """
+        The provider failed. It will be left out for a while.
+        :param provider: The provider.
+        :param cooldown_seconds: How long to leave it out, when the provider told us (Retry-After). (Optional. Default:
+        failure_cooldown_seconds, doubling on each failure in a row)
+        """
+        with self._lock:
+            state = self._states[provider.name]
+            state.requests += 1
+            state.failures += 1
+            state.consecutive_failures += 1
+
+            if cooldown_seconds is None:
+                cooldown_seconds = self.failure_cooldown_seconds * min(2 ** (state.consecutive_failures - 1), 8)
+
+            state.unavailable_until = time.monotonic() + cooldown_seconds
+
+    def _hedge_after(self, provider_name: str) -> Union[float, None]:
+        # Must be called holding the lock.
+        if self.hedge_percentile is None or len(self.providers) < 2:
+            return None
+
+        latencies = self._states[provider_name].latencies
+        if len(latencies) < max(self.hedge_min_samples, 1):
+            return None
+
+        ordered = sorted(latencies)
+        return ordered[min(math.ceil(self.hedge_percentile * len(ordered)) - 1, len(ordered) - 1)]
+
+    def hedge_after(self, provider: AiProvider) -> Union[float, None]:
+        """
+        :param provider: The provider the request was sent to.
+        :return: After how many seconds without an answer the request should also be sent to another provider, or
+        None if it shouldn't be hedged.
+        """
+        with self._lock:
+            return self._hedge_after(provider.name)
+
+    def stats(self) -> List[AiProviderStats]:
+        now = time.monotonic()
+
+        with self._lock:
+            return [
+                AiProviderStats(
+                    name=provider.name,
+                    base_url=provider.api_endpoint,
+                    ai_model_name=provider.model,
+                    weight=provider.weight,
+                    requests=self._states[provider.name].requests,
+                    failures=self._states[provider.name].failures,
+                    latency_ewma=self._states[provider.name].latency_ewma,
+                    hedge_after=self._hedge_after(provider.name),
+                    available=self._states[provider.name].unavailable_until <= now
+                )
+                for provider in self.providers
+            ]
@@ -0,0 +1,21 @@
+import hashlib
+import json
+
+from src.ai_tasks.chat_request import ChatRequest
+
+
+def build_request_key(api_endpoint: str, payload: ChatRequest) -> str:
+    """
+    Build a key that identifies a request to the AI model. Requests that would get the same response (same endpoint,
+    model, messages and parameters) get the same key.
+    :param api_endpoint: Where the request is sent.
+    :param payload: The request.
+    :return: The key (a SHA-256 hash).
+    """
+    # Streamed or not, the response is the same.
+    request = payload.to_dict()
+    del request["stream"]
+
+    # Always the standard library (sorted, so it's stable): a different JSON backend must not change the keys.
+    canonical = json.dumps([api_endpoint, request], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
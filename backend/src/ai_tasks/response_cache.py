@@ -0,0 +1,248 @@
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, Optional, Tuple, Union
+
+from src.ai_tasks.chat_request import ChatRequest
+from src.ai_tasks.request_key import build_request_key
+from src.ai_tasks.types import ResponseCacheType, ResponseCacheStats
+import src.shared.json_codec as json_codec
+from src.shared.config import RESPONSE_CACHE_FOLDER
+from src.shared.metrics import RESPONSE_CACHE_LOOKUPS
+
+
+class ResponseCache(ABC):
+    """
+    Keeps the responses of the AI model, so the same request (same endpoint, model, messages and parameters) doesn't
+    need to be sent again. Only makes sense for prompts where the same answer is fine every time, like analyzing the
+    same dataset over and over.
+    """
+
+    def __init__(self, ttl_seconds: Optional[int] = 60 * 60):
+        """
+        :param ttl_seconds: How long a response is kept. (None to keep it until evicted)
+        """
+        self.ttl_seconds: Optional[int] = ttl_seconds
+        self._hits: int = 0
+        self._misses: int = 0
+        self._stats_lock = Lock()
+
+    @staticmethod
+    def build_key(api_endpoint: str, payload: ChatRequest) -> str:
+        """
+        Build the key of a request. Requests that would get the same response get the same key.
+        """
+        return build_request_key(api_endpoint, payload)
+
+    def _expires_at(self) -> Optional[float]:
+        return None if self.ttl_seconds is None else time.time() + self.ttl_seconds
+
+    def get(self, key: str) -> Union[dict, None]:
+        """
+        Get a response from the cache.
+        :param key: The key of the request. (See build_request_key)
+        :return: A copy of the response (the raw JSON of the AI model), or None if it's not cached (or expired).
+        """
+        response = self._get(key)
+
+        with self._stats_lock:
+            if response is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+
+        RESPONSE_CACHE_LOOKUPS.inc(result="miss" if response is None else "hit")
+
+        return None if response is None else json_codec.loads(response)
+
+    def set(self, key: str, response: dict) -> None:
+        """
+        Add a response to the cache.
+        :param key: The key of the request. (See build_request_key)
+        :param response: The response (the raw JSON of the AI model).
+        """
+        self._set(key, json_codec.dumps(response).decode("utf-8"), self._expires_at())
+
+    def stats(self) -> ResponseCacheStats:
+        with self._stats_lock:
+            return ResponseCacheStats(hits=self._hits, misses=self._misses, entries=self._count())
+
+    @abstractmethod
+    def _get(self, key: str) -> Union[str, None]:
+        """
+        :return: The response (as JSON), or None if it's not cached (or expired).
+        """
+
+    @abstractmethod
+    def _set(self, key: str, response: str, expires_at: Optional[float]) -> None:
+        pass
+
+    @abstractmethod
+    def _count(self) -> int:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Remove all the responses from the cache.
+        """
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    Keeps the responses in memory. When the cache is full, the least recently used response is evicted.
+    Not shared between workers.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[int] = 60 * 60):
+        super().__init__(ttl_seconds)
+
+        if max_entries < 1:
+            raise ValueError("The max number of entries must be greater than 0.")
+
+        self._max_entries: int = max_entries
+        self._entries: OrderedDict[str, Tuple[str, Optional[float]]] = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key: str) -> Union[str, None]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            response, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return response
+
+    def _set(self, key: str, response: str, expires_at: Optional[float]) -> None:
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteResponseCache(ResponseCache):
+    """
+    Keeps the responses in a SQLite database. Survives restarts and can be shared between workers/processes.
+    When the cache is full, the least recently used responses are evicted.
+    """
+
+    def __init__(
+            self,
+            db_file: Path = RESPONSE_CACHE_FOLDER.joinpath("responses.sqlite"),
+            max_entries: int = 10000,
+            ttl_seconds: Optional[int] = 60 * 60):
+        super().__init__(ttl_seconds)
+
+        if max_entries < 1:
+            raise ValueError("The max number of entries must be greater than 0.")
+
+        self._max_entries: int = max_entries
+        self._db_file: Path = db_file
+        self._db_file.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "response TEXT NOT NULL, "
+                "expires_at REAL, "
+                "last_accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_last_accessed_at ON responses (last_accessed_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self._db_file, timeout=30)
+        try:
+            # It's a cache: losing the last writes if the machine crashes is fine, and it makes writing a lot cheaper.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get(self, key: str) -> Union[str, None]:
+        now = time.time()
+
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            response, expires_at = row
+            if expires_at is not None and expires_at < now:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            connection.execute("UPDATE responses SET last_accessed_at = ? WHERE key = ?", (now, key))
+            return response
+
+    def _set(self, key: str, response: str, expires_at: Optional[float]) -> None:
+        now = time.time()
+
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO responses (key, response, expires_at, last_accessed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET response = excluded.response, expires_at = excluded.expires_at, "
+                "last_accessed_at = excluded.last_accessed_at",
+                (key, response, expires_at, now)
+            )
+
+            # Cleaning up: the expired ones first, then the least recently used ones (if it's still too big).
+            connection.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+            connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,)
+            )
+
+    def _count(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+
+
+def get_response_cache(
+        cache_type: Union[ResponseCacheType, str] = ResponseCacheType.Memory,
+        max_entries: int = 1000,
+        ttl_seconds: Optional[int] = 60 * 60) -> ResponseCache:
+    """
+    Create a response cache.
+    :param cache_type: Which kind of cache to create. (Default: Memory)
+    :param max_entries: Max number of responses kept. (Default: 1000)
+    :param ttl_seconds: How long a response is kept. (Default: 1 hour. None to keep it until evicted)
+    :return: The response cache.
+    """
+    cache_type = ResponseCacheType(cache_type)
+
+    if cache_type == ResponseCacheType.Sqlite:
+        return SqliteResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    return MemoryResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
@@ -0,0 +1,104 @@
+import asyncio
+import copy
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.shared.metrics import COALESCED_REQUESTS
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Makes identical calls that happen at the same time share a single execution: the first one runs, and the others
+    wait for it and get (a copy of) the same result. Once it's done, the next call runs again.
+    Use it from threads. For async code, use AsyncSingleFlight.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = Lock()
+        self.coalesced: int = 0
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        """
+        Run the function, unless a call with the same key is already running. In that case, wait for it instead.
+        :param key: Identifies the call. Calls with the same key must be interchangeable.
+        :param function: What to run.
+        :return: The result of the function. (The ones who waited get a copy, so they can't affect each other)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+                COALESCED_REQUESTS.inc()
+
+        if not is_leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Same as SingleFlight, but for coroutines (all the calls must come from the same event loop).
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.coalesced: int = 0
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+        # Marking the error as seen, in case everyone waiting for it was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, function: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run the coroutine function, unless a call with the same key is already running. In that case, wait for it.
+        :param key: Identifies the call. Calls with the same key must be interchangeable.
+        :param function: What to run.
+        :return: The result of the function. (The ones who waited get a copy, so they can't affect each other)
+        """
+        task = self._tasks.get(key)
+
+        if task is not None:
+            self.coalesced += 1
+            COALESCED_REQUESTS.inc()
+            return copy.deepcopy(await asyncio.shield(task))
+
+        # It runs in its own task, so if the caller that started it is cancelled (e.g.: the client disconnected),
+        # the others still get the result.
+        task = asyncio.ensure_future(function())
+        self._tasks[key] = task
+        task.add_done_callback(lambda finished: self._forget(key, finished))
+
+        return await asyncio.shield(task)
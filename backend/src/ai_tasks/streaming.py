@@ -0,0 +1,88 @@
+from typing import List, Union
+
+import src.shared.json_codec as json_codec
+
+
+class StreamCollector:
+    """
+    Collects the server-sent events streamed by the AI model (when the request is made with stream=True).
+    Feed it the lines as they arrive, and it will give back the new text of each one. When the stream ends, it can
+    rebuild a regular (non-streamed) response, so the rest of the flow doesn't need to care about streaming.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._usage: Union[dict, None] = None
+        self._last_event: dict = {}
+
+    @staticmethod
+    def _parse_line(line: str) -> Union[dict, None]:
+        """
+        Parse one line of the stream.
+        :param line: The line, as received.
+        :return: The parsed event, or None if the line doesn't carry any data (keep-alives, comments, [DONE], etc).
+        """
+        if not line or not line.startswith("data:"):
+            return None
+
+        data = line[len("data:"):].strip()
+
+        if data == "[DONE]":
+            return None
+
+        try:
+            return json_codec.loads(data)
+        except ValueError:
+            raise ValueError(f"Failed to parse streamed response from the AI model: {data}")
+
+    def feed_line(self, line: Union[str, bytes]) -> str:
+        """
+        Process one line of the stream.
+        :param line: The line, as received.
+        :return: The text generated since the last line. (Empty if the line didn't have any)
+        """
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+
+        event = self._parse_line(line)
+
+        if event is None:
+            return ""
+
+        if "error" in event:
+            raise ValueError(f"The AI model returned an error while streaming: {event['error']}")
+
+        self._last_event = event
+
+        if event.get("usage"):
+            self._usage = event["usage"]
+
+        try:
+            delta = "".join((choice.get("delta") or {}).get("content") or "" for choice in event["choices"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError("Invalid AI response format") from e
+
+        if delta:
+            self._parts.append(delta)
+
+        return delta
+
+    def to_response(self) -> dict:
+        """
+        Rebuild the response as if it was requested without streaming.
+        :return: The response, in the same format as the non-streamed one.
+        """
+        return {
+            "id": self._last_event.get("id"),
+            "model": self._last_event.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": "".join(self._parts)
+                    }
+                }
+            ],
+            "usage": self._usage
+        }
@@ -1,4 +1,5 @@
-from typing import List
+from enum import Enum
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -10,6 +11,8 @@ class ChatContextItem(BaseModel):
 class AiGeneratorConfig(BaseModel):
     base_url: str
     ai_model_name: str
+    # Name of the provider that answered, when using a provider pool.
+    provider: Optional[str] = None
 
 
 class AiResponse(BaseModel):
@@ -21,3 +24,65 @@ class AiResponse(BaseModel):
 class AiRequest(BaseModel):
     messages: List[ChatContextItem]
     model: str
+    stream: bool = False
+
+
+class AiStreamChunk(BaseModel):
+    # Piece of the response generated since the last chunk.
+    delta: str
+    # True for the last chunk. This one carries the complete response (with the updated context).
+    done: bool = False
+    response: Optional[AiResponse] = None
+
+
+class ResponseCacheType(Enum):
+    Memory = "memory"
+    Sqlite = "sqlite"
+
+
+class ResponseCacheStats(BaseModel):
+    hits: int
+    misses: int
+    # Entries currently in the cache (including expired ones not cleaned up yet)
+    entries: int
+
+
+class AiProvider(BaseModel):
+    # Unique name, used in the logs and stats.
+    name: str
+    api_endpoint: str
+    api_key: str
+    model: str
+    # How much of the traffic it should get, compared to the others (before considering the latency).
+    weight: float = 1
+
+
+class AiProviderStats(BaseModel):
+    name: str
+    base_url: str
+    ai_model_name: str
+    weight: float
+    requests: int
+    failures: int
+    # Moving average of the latency, in seconds. None until the first response.
+    latency_ewma: Optional[float]
+    # Slow requests to this provider are also sent to another one after this many seconds. None if not hedging (yet).
+    hedge_after: Optional[float]
+    # False while it's cooling down after a failure.
+    available: bool
+
+
+class AiBatchItem(BaseModel):
+    # One question of a batch. Same as the arguments of ask_a_question.
+    question_or_prompt: str
+    system_context: Optional[str] = None
+    context: Optional[List[ChatContextItem]] = None
+    use_cache: bool = True
+
+
+class AiBatchResult(BaseModel):
+    # Position of the item in the batch (results can come out of order).
+    index: int
+    # Either the response or the error. One item failing doesn't affect the others.
+    response: Optional[AiResponse] = None
+    error: Optional[str] = None
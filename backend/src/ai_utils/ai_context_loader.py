@@ -1,6 +1,8 @@
 import json
-from typing import List, Dict, Union
+from pathlib import Path
+from typing import List, Dict, Tuple, Union
 
+from src.ai_utils.system_prompt import normalize_prompt_text, assemble_system_prompt, register_prompt
 from src.ai_utils.types import CustomPersonality
 from src.shared.config import AI_VIDEO_GAME_PERSONALITIES_FOLDER, AI_CUSTOM_PERSONALITIES_FOLDER, \
     AI_RULESETS_FOLDER, AI_AGENTS_FOLDER
@@ -14,19 +16,27 @@ class ContextBuilder:
         self._available_custom_personalities: Dict[str, CustomPersonality] = {}
         self._rulesets: Dict[str, str] = {}
         self._agents: Dict[str, str] = {}
+        # The custom personalities already put together, by (name, variant, ruleset). This way, the same personality is
+        # always the same string.
+        self._custom_personality_prompts: Dict[Tuple[str, Union[str, None], Union[str, None]], str] = {}
 
         self._load_rulesets()
         self._load_video_game_personalities()
         self._load_custom_personalities()
         self._load_agents()
 
+    @staticmethod
+    def _read_prompt_file(file: Path) -> str:
+        # Always UTF-8 and normalized, so the prompt is byte for byte the same in any OS (and the provider can cache it).
+        return normalize_prompt_text(file.read_text(encoding="utf-8"))
+
     def _load_rulesets(self) -> None:
         for ruleset in AI_RULESETS_FOLDER.rglob("*.txt"):
             if not ruleset.is_file():
                 continue
 
             ruleset_name = ruleset.stem
-            ruleset_text = ruleset.read_text()
+            ruleset_text = self._read_prompt_file(ruleset)
 
             self._rulesets[ruleset_name.lower()] = ruleset_text
 
@@ -45,9 +55,10 @@ class ContextBuilder:
 
             self._game_personalities_map[game_name].append(character_name)
 
-            personality = personality_file.read_text()
+            personality = self._read_prompt_file(personality_file)
 
             self._available_video_game_personalities[character_name.lower()] = personality
+            register_prompt(f"personality:{character_name.lower()}", personality)
 
     def _load_custom_personalities(self) -> None:
         custom_personalities_folders = [p for p in AI_CUSTOM_PERSONALITIES_FOLDER.iterdir() if p.is_dir()]
@@ -59,12 +70,15 @@ class ContextBuilder:
             if not base_personality_file.exists():
                 continue
 
-            base_personality = base_personality_file.read_text()
+            base_personality = self._read_prompt_file(base_personality_file)
 
             personality_variants_file = custom_personality_folder.joinpath("variants.json")
 
             if personality_variants_file.exists():
-                personality_variants = json.loads(personality_variants_file.read_text())
+                personality_variants = {
+                    name: normalize_prompt_text(text)
+                    for name, text in json.loads(personality_variants_file.read_text(encoding="utf-8")).items()
+                }
                 variant_intro = personality_variants.get(
                     "_variant_intro",
                     "Consider the following change in personality. You are free to create a role play explanation as to"
@@ -86,9 +100,10 @@ class ContextBuilder:
                 continue
 
             agent_name = agent_file.stem
-            agent_text = agent_file.read_text()
+            agent_text = self._read_prompt_file(agent_file)
 
             self._agents[agent_name.lower()] = agent_text
+            register_prompt(f"agent:{agent_name.lower()}", agent_text)
 
     def _load_video_game_personality(self, character_name: str) -> Union[str, None]:
         if character_name is None:
@@ -96,7 +111,7 @@ class ContextBuilder:
 
         return self._available_video_game_personalities.get(character_name.lower())
 
-    def _load_custom_personality(self, character_name: str, variant: str) -> Union[str, None]:
+    def _load_custom_personality(self, character_name: str, variant: str, ruleset: str) -> Union[str, None]:
         if character_name is None:
             return None
 
@@ -105,41 +120,50 @@ class ContextBuilder:
         if custom_personality is None:
             return None
 
-        personality = custom_personality.base
-
-        if variant is None:
-            return personality
+        # Only the ones that exist are part of the key, so the cache can't grow with whatever is sent to us.
+        variant = variant.lower() if variant is not None and variant.lower() in custom_personality.variants else None
+        ruleset = ruleset.lower() if ruleset is not None and ruleset.lower() in self._rulesets else None
+        key = (character_name.lower(), variant, ruleset)
 
-        personality_variant = custom_personality.variants.get(variant.lower())
+        personality = self._custom_personality_prompts.get(key)
 
-        if personality_variant is None:
+        if personality is not None:
             return personality
 
-        variant_intro = custom_personality.variant_intro
-        personality = f"{personality}\n{variant_intro}\n{personality_variant}"
-
+        # From the part that changes the least to the one that changes the most, so they share the longest prefix.
+        personality = assemble_system_prompt(
+            assemble_system_prompt(
+                custom_personality.base,
+                custom_personality.variant_intro if variant is not None else None,
+                custom_personality.variants.get(variant) if variant is not None else None,
+                separator="\n"
+            ),
+            self._rulesets.get(ruleset) if ruleset is not None else None
+        )
+
+        self._custom_personality_prompts[key] = personality
+        register_prompt(
+            f"personality:{key[0]}" + (f"/{variant}" if variant else "") + (f"+{ruleset}" if ruleset else ""),
+            personality
+        )
         return personality
 
-    def _load_ruleset(self, ruleset):
-        return self._rulesets.get(ruleset.lower())
-
     def load_personality(self, character_name: str, variant: str = None, ruleset: str = None) -> Union[str, None]:
+        """
+        Get the system prompt of a personality: the personality, then the variant, then the ruleset. The same
+        personality/variant/ruleset always gives the exact same text, so providers that cache prompts can reuse it.
+        Video game personalities have no variants or rulesets.
+        :param character_name: The personality.
+        :param variant: A variant of the personality. Ignored if it doesn't exist. (Optional)
+        :param ruleset: A ruleset to add to the personality. Ignored if it doesn't exist. (Optional)
+        :return: The system prompt, or None if there's no personality with that name.
+        """
         personality = self._load_video_game_personality(character_name)
 
         if personality is not None:
             return personality
 
-        personality = self._load_custom_personality(character_name, variant)
-
-        if personality is None or ruleset is None:
-            return personality
-
-        ruleset = self._load_ruleset(ruleset)
-
-        if ruleset is None:
-            return personality
-
-        return f"{personality}\n\n{ruleset}"
+        return self._load_custom_personality(character_name, variant, ruleset)
 
     def load_agent(self, agent_name: str) -> str:
         return self._agents.get(agent_name.lower())
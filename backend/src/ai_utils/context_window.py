@@ -0,0 +1,152 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, List, Optional
+
+from src.ai_tasks.types import ChatContextItem
+from src.ai_utils.token_counter import get_token_counter
+
+# Every message costs a few tokens on top of its content (role, separators, etc). This is what OpenAI models use.
+DEFAULT_TOKENS_PER_MESSAGE = 4
+
+
+class ContextWindowManager:
+    """
+    Keeps the context within a token budget, so long conversations don't overflow the context window of the model
+    (and we don't pay for every old message on every call).
+
+    The system message (the first one, if it's a system message) and the latest message are always kept. When the
+    context is over budget, the oldest messages are dropped. If a summarizer is informed, the dropped messages are
+    replaced by their summary.
+
+    Token counts are cached per message, so each message is tokenized only once, no matter how many turns it stays
+    in the context.
+    """
+
+    def __init__(
+            self,
+            max_tokens: int,
+            reserved_for_completion: int = 0,
+            token_counter: Callable[[str], int] = None,
+            tokens_per_message: int = DEFAULT_TOKENS_PER_MESSAGE,
+            summarizer: Callable[[List[ChatContextItem]], Optional[str]] = None,
+            max_cached_messages: int = 10000):
+        """
+        :param max_tokens: Size of the context window of the model.
+        :param reserved_for_completion: How many tokens should be left free for the answer. (Default: 0)
+        :param token_counter: A function that counts the tokens of a text. (Default: get_token_counter())
+        :param tokens_per_message: Extra tokens each message costs. (Default: 4)
+        :param summarizer: An optional function that receives the messages that will be dropped, and returns a summary
+        of them. It should be fast, since it runs before every request that goes over budget. (Optional)
+        :param max_cached_messages: How many token counts to keep in cache. (Default: 10000)
+        """
+        if max_tokens <= reserved_for_completion:
+            raise ValueError("The max tokens must be greater than the tokens reserved for the completion.")
+
+        self.max_tokens: int = max_tokens
+        self.reserved_for_completion: int = reserved_for_completion
+        self.token_counter: Callable[[str], int] = token_counter or get_token_counter()
+        self.tokens_per_message: int = tokens_per_message
+        self.summarizer: Callable[[List[ChatContextItem]], Optional[str]] = summarizer
+
+        self._max_cached_messages: int = max_cached_messages
+        self._cache: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def budget(self) -> int:
+        """
+        How many tokens the context can use.
+        """
+        return self.max_tokens - self.reserved_for_completion
+
+    def count_message(self, message: ChatContextItem) -> int:
+        """
+        Count the tokens of a message. The count is cached, so the same message is never tokenized twice.
+        :param message: The message.
+        :return: The number of tokens (including the per-message overhead).
+        """
+        # A digest, instead of the content itself: contents can be big (e.g.: datasets), and we keep thousands of them.
+        key = hashlib.blake2b(message.content.encode("utf-8"), digest_size=16).digest()
+
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                return count
+
+        count = self.token_counter(message.content) + self.tokens_per_message
+
+        with self._lock:
+            self._cache[key] = count
+            while len(self._cache) > self._max_cached_messages:
+                self._cache.popitem(last=False)
+
+        return count
+
+    def count_context(self, context: List[ChatContextItem]) -> int:
+        """
+        Count the tokens of the whole context.
+        :param context: The context.
+        :return: The number of tokens.
+        """
+        return sum(self.count_message(message) for message in context)
+
+    def _summarize(self, dropped: List[ChatContextItem]) -> Optional[ChatContextItem]:
+        if self.summarizer is None or len(dropped) == 0:
+            return None
+
+        summary = self.summarizer(dropped)
+
+        if not summary:
+            return None
+
+        return ChatContextItem(role="system", content=f"Summary of the earlier conversation: {summary}")
+
+    def fit(self, context: List[ChatContextItem]) -> List[ChatContextItem]:
+        """
+        Make the context fit the budget, dropping (or summarizing) the oldest messages.
+        The system message and the latest message are always kept, even if they alone are over budget.
+
+        :param context: The context.
+        :return: A new list with the messages that fit. The original list is not changed.
+        """
+        if len(context) == 0:
+            return context
+
+        counts = [self.count_message(message) for message in context]
+        total = sum(counts)
+
+        if total <= self.budget:
+            return context
+
+        pinned_head = 1 if context[0].role == "system" else 0
+        first_kept = pinned_head
+
+        # Drop the oldest messages (after the system message) until we're within budget, but never the latest one.
+        while total > self.budget and first_kept < len(context) - 1:
+            total -= counts[first_kept]
+            first_kept += 1
+
+        dropped_until = first_kept
+        summary = self._summarize(context[pinned_head:first_kept])
+
+        if summary is not None:
+            summary_tokens = self.count_message(summary)
+
+            # Making room for the summary. It's still worth it if we end up dropping one more message for it.
+            while total + summary_tokens > self.budget and first_kept < len(context) - 1:
+                total -= counts[first_kept]
+                first_kept += 1
+
+            if first_kept != dropped_until:
+                # The extra messages we dropped need to be in the summary too.
+                summary = self._summarize(context[pinned_head:first_kept])
+                summary_tokens = self.count_message(summary) if summary is not None else 0
+
+            if summary is not None and total + summary_tokens <= self.budget:
+                return [*context[:pinned_head], summary, *context[first_kept:]]
+
+        # No summary (or no room for it), so only the messages that didn't fit are dropped. Not the ones we dropped to
+        # make room for the summary.
+        return [*context[:pinned_head], *context[dropped_until:]]
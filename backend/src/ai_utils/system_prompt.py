@@ -0,0 +1,83 @@
+import hashlib
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence
+
+# Between the parts of a system prompt (personality, variant, ruleset...).
+GLOBAL_SECTION_SEPARATOR = "\n\n"
+
+# Enough to tell the prompts apart in the logs.
+GLOBAL_PREFIX_HASH_LENGTH = 16
+
+# Names of the system prompts we know (personalities and agents), by prefix hash. The metrics use these names instead
+# of the hashes, so the number of series stays bounded: any other prompt (e.g.: sent by the client) is "other".
+_known_prompts: Dict[str, str] = {}
+
+
+def normalize_prompt_text(text: str) -> str:
+    """
+    Make sure the same text always ends up as the same bytes, no matter where it came from (e.g.: a file saved on
+    Windows): Unicode NFC, \\n as line ending, no trailing whitespace on the lines, and nothing around the text.
+    Providers only reuse their cache of a prompt (prompt/KV caching) when it starts with the exact same bytes.
+    :param text: The text.
+    :return: The normalized text.
+    """
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n").replace("\r", "\n"))
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def assemble_system_prompt(*sections: Optional[str], separator: str = GLOBAL_SECTION_SEPARATOR) -> str:
+    """
+    Put the sections of a system prompt together. The ones that change the least should come first (the provider
+    caches the longest prefix it has seen before), and the ones that change the most (per request) should come last.
+    :param sections: The sections, already normalized. The empty ones (or None) are skipped.
+    :param separator: What goes between them. (Default: a blank line)
+    :return: The system prompt.
+    """
+    return separator.join(section for section in sections if section)
+
+
+@lru_cache(maxsize=1024)
+def prefix_hash(text: str) -> str:
+    """
+    A short hash that identifies a prompt prefix. Same text, same hash (across processes and restarts).
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:GLOBAL_PREFIX_HASH_LENGTH]
+
+
+def context_prefix_hash(context: Sequence[Any]) -> Optional[str]:
+    """
+    Hash of the part of the context that stays the same between the turns of a conversation: the system message (the
+    first message, if it's a system message). Requests with the same hash can be served from the cache of the provider.
+    :param context: The messages (anything with role and content).
+    :return: The hash, or None if there's no system message.
+    """
+    if len(context) == 0 or context[0].role != "system":
+        return None
+
+    return prefix_hash(context[0].content)
+
+
+def register_prompt(name: str, text: str):
+    """
+    Give a name to a system prompt, to be used in the metrics. Only for prompts from a bounded set (e.g.: the ones
+    loaded from files), since each name becomes a series.
+    :param name: The name. (e.g.: agent:data-analyst)
+    :param text: The system prompt, exactly as it's sent.
+    """
+    _known_prompts[prefix_hash(text)] = name
+
+
+def context_prompt_label(context: Sequence[Any]) -> str:
+    """
+    Label of the system prompt of the context, for the metrics.
+    :param context: The messages (anything with role and content).
+    :return: The name given by register_prompt, "other" if it's not a known prompt, or "none" if there's no system
+    message.
+    """
+    hash_value = context_prefix_hash(context)
+
+    if hash_value is None:
+        return "none"
+
+    return _known_prompts.get(hash_value, "other")
@@ -0,0 +1,46 @@
+import importlib.util
+import math
+from typing import Callable
+
+# Rough average for English text with GPT-like tokenizers. Only used when tiktoken is not installed.
+APPROXIMATE_CHARS_PER_TOKEN = 4
+
+_TIKTOKEN_AVAILABLE = importlib.util.find_spec("tiktoken") is not None
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimate how many tokens a text has, without a tokenizer.
+    :param text: The text.
+    :return: The (estimated) number of tokens.
+    """
+    if not text:
+        return 0
+
+    return math.ceil(len(text) / APPROXIMATE_CHARS_PER_TOKEN)
+
+
+def get_token_counter(model: str = None) -> Callable[[str], int]:
+    """
+    Get a function that counts the tokens of a text.
+    If tiktoken is installed, it will be used (with the encoding of the model, if known). Otherwise, the count will
+    be estimated based on the length of the text.
+
+    :param model: Name of the model. (Optional)
+    :return: A function that receives a text and returns the number of tokens.
+    """
+    if not _TIKTOKEN_AVAILABLE:
+        return approximate_token_count
+
+    import tiktoken
+
+    try:
+        encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except KeyError:
+        # Not an OpenAI model (or a new one). cl100k_base is close enough for budgeting purposes.
+        encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(encoding.encode(text, disallowed_special=())) if text else 0
+
+    return count_tokens
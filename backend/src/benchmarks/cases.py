@@ -0,0 +1,325 @@
+import csv
+import json
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from io import StringIO
+from typing import Any, Callable, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+from src.ai_tasks.ai_tasks import AiTasks
+from src.ai_tasks.chat_request import ChatRequest
+from src.ai_tasks.types import ChatContextItem, AiRequest, AiResponse, AiGeneratorConfig
+from src.benchmarks.harness import MicroBenchmarkCase
+from src.benchmarks.types import BenchmarkSize
+from src.datasets.types import DatasetEncoding
+import src.shared.json_codec as json_codec
+from src.shared.serializer import serialize_to_dict, csv_string_to_dict_list, dataset_to_prompt_text
+
+# Number of messages, and characters per message.
+_CONTEXT_SIZES: Dict[BenchmarkSize, Tuple[int, int]] = {
+    BenchmarkSize.Small: (4, 200),
+    BenchmarkSize.Medium: (50, 1000),
+    BenchmarkSize.Huge: (1000, 4000),
+}
+
+# Number of rows.
+_DATASET_SIZES: Dict[BenchmarkSize, int] = {
+    BenchmarkSize.Small: 10,
+    BenchmarkSize.Medium: 1000,
+    BenchmarkSize.Huge: 50000,
+}
+
+_MODEL = "benchmark-model"
+_SYSTEM_CONTEXT = "You are a helpful assistant. Answer in a single paragraph, and never make up data."
+
+_WORDS = ["the", "ad", "user", "clicked", "salary", "age", "purchase", "profile", "likely", "and", "of", "data",
+          "analysis", "top", "three", "most", "estimated", "gender", "because", "their"]
+
+
+def _make_text(rng: random.Random, chars: int) -> str:
+    words = []
+    length = 0
+
+    while length < chars:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+
+    return " ".join(words)[:chars]
+
+
+def _make_context(size: BenchmarkSize) -> List[ChatContextItem]:
+    """
+    A conversation (without the system message), alternating between the user and the assistant.
+    """
+    rng = random.Random(0)
+    message_count, message_chars = _CONTEXT_SIZES[size]
+
+    return [
+        ChatContextItem(role="user" if i % 2 == 0 else "assistant", content=_make_text(rng, message_chars))
+        for i in range(message_count)
+    ]
+
+
+def _make_records(size: BenchmarkSize) -> List[dict]:
+    """
+    Rows like the ones in the sample dataset (Social_Network_Ads.csv), as they come out of the CSV parser.
+    """
+    rng = random.Random(0)
+
+    return [
+        {
+            "User ID": str(15600000 + i),
+            "Gender": rng.choice(["Male", "Female"]),
+            "Age": str(rng.randint(18, 60)),
+            "EstimatedSalary": str(rng.randrange(15000, 150000, 1000)),
+            "Purchased": str(rng.randint(0, 1)),
+        }
+        for i in range(_DATASET_SIZES[size])
+    ]
+
+
+def _records_to_csv(records: List[dict]) -> str:
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(records[0].keys()), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(records)
+    return output.getvalue()
+
+
+def _make_api_response(content: str) -> dict:
+    return {
+        "id": "chatcmpl-benchmark",
+        "object": "chat.completion",
+        "created": 1700000000,
+        "model": _MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 100, "total_tokens": 1100}
+    }
+
+
+def _make_ai_tasks() -> AiTasks:
+    # Nothing is sent anywhere: only the methods that build the context are used.
+    return AiTasks(
+        api_endpoint="http://localhost/v1/chat/completions",
+        api_key="benchmark",
+        default_model=_MODEL,
+        response_logger=None
+    )
+
+
+def _make_config() -> AiGeneratorConfig:
+    return AiGeneratorConfig(base_url="http://localhost", ai_model_name=_MODEL)
+
+
+def _legacy_obj_to_dict(obj) -> dict:
+    if issubclass(type(obj), BaseModel):
+        obj = obj.dict()
+    elif hasattr(obj, '__dict__'):
+        obj = obj.__dict__
+
+    return obj
+
+
+def _legacy_serialize_to_dict(obj):
+    """
+    serialize_to_dict, the way it was before it walked through everything (list items were only converted one level
+    deep). Kept here so the new one can be compared against it.
+    """
+    if obj is None:
+        return None
+
+    if isinstance(obj, list):
+        serialized = [_legacy_obj_to_dict(item) for item in obj]
+    elif isinstance(obj, dict):
+        serialized = {}
+        for key, value in obj.items():
+            serialized[key] = _legacy_serialize_to_dict(value)
+    else:
+        serialized = _legacy_obj_to_dict(obj)
+
+    return serialized
+
+
+@dataclass
+class _NestedRecord:
+    # Something that's not a pydantic model: a dataclass, with a datetime and an enum, and more of them inside.
+    created_at: datetime
+    encoding: DatasetEncoding
+    values: List[Any]
+    children: List["_NestedRecord"]
+
+
+def _make_nested_records(size: BenchmarkSize) -> List[_NestedRecord]:
+    message_count, _ = _CONTEXT_SIZES[size]
+    start = datetime(2024, 1, 1)
+
+    def make(i: int, depth: int) -> _NestedRecord:
+        children = [] if depth == 0 else [make(i, depth - 1) for _ in range(2)]
+        return _NestedRecord(start + timedelta(minutes=i), DatasetEncoding.Csv, [i, str(i), i / 2], children)
+
+    return [make(i, 3) for i in range(message_count)]
+
+
+# Each one gets the size, prepares the input, and returns the function to measure.
+def _serialize_request(serializer: Callable[[Any], Any]) -> Callable[[BenchmarkSize], Callable[[], Any]]:
+    def setup(size: BenchmarkSize) -> Callable[[], Any]:
+        payload = AiRequest(messages=[ChatContextItem(role="system", content=_SYSTEM_CONTEXT), *_make_context(size)],
+                            model=_MODEL)
+        return lambda: serializer(payload)
+
+    return setup
+
+
+def _serialize_log_record(serializer: Callable[[Any], Any]) -> Callable[[BenchmarkSize], Callable[[], Any]]:
+    def setup(size: BenchmarkSize) -> Callable[[], Any]:
+        context = _make_context(size)
+        response = AiResponse(response=context[-1].content, updated_context=context, config=_make_config())
+        api_response = _make_api_response(context[-1].content)
+
+        return lambda: serializer({
+            "latency_seconds": 1.5,
+            "parsed_response": response,
+            "api_response": api_response,
+        })
+
+    return setup
+
+
+def _serialize_nested(serializer: Callable[[Any], Any]) -> Callable[[BenchmarkSize], Callable[[], Any]]:
+    def setup(size: BenchmarkSize) -> Callable[[], Any]:
+        records = {"records": _make_nested_records(size)}
+        return lambda: serializer(records)
+
+    return setup
+
+
+def _request_body_from_model(size: BenchmarkSize) -> Callable[[], Any]:
+    context = [ChatContextItem(role="system", content=_SYSTEM_CONTEXT), *_make_context(size)]
+
+    # The way it used to be: a pydantic AiRequest, turned into dicts, and encoded by requests.
+    return lambda: json.dumps(_legacy_serialize_to_dict(AiRequest(messages=context, model=_MODEL))).encode("utf-8")
+
+
+def _request_body_from_chat_request(size: BenchmarkSize) -> Callable[[], Any]:
+    context = [ChatContextItem(role="system", content=_SYSTEM_CONTEXT), *_make_context(size)]
+
+    # What AiTasks does now (encoded with the default JSON backend).
+    return lambda: ChatRequest.from_context(context, _MODEL).encoded()
+
+
+def _parse_response_body(size: BenchmarkSize) -> Callable[[], Any]:
+    context = _make_context(size)
+    body = json.dumps(_make_api_response(context[-1].content)).encode("utf-8")
+    return lambda: json_codec.loads(body)
+
+
+def _parse_csv(size: BenchmarkSize) -> Callable[[], Any]:
+    data = _records_to_csv(_make_records(size))
+    return lambda: csv_string_to_dict_list(data)
+
+
+def _dataset_to_prompt_text(encoding: DatasetEncoding) -> Callable[[BenchmarkSize], Callable[[], Any]]:
+    def setup(size: BenchmarkSize) -> Callable[[], Any]:
+        records = _make_records(size)
+        return lambda: dataset_to_prompt_text(records, encoding)
+
+    return setup
+
+
+def _update_context_with_message(size: BenchmarkSize) -> Callable[[], Any]:
+    ai_tasks = _make_ai_tasks()
+    context = _make_context(size)
+    message = ChatContextItem(role="user", content="And what about the next one?")
+
+    # _update_context changes the list it gets, so each call gets a (shallow) copy, like a new request would.
+    return lambda: ai_tasks._update_context(latest_message=message, context=list(context))
+
+
+def _update_context_with_system_context(size: BenchmarkSize) -> Callable[[], Any]:
+    ai_tasks = _make_ai_tasks()
+    context = _make_context(size)
+    message = ChatContextItem(role="user", content="And what about the next one?")
+
+    return lambda: ai_tasks._update_context(
+        latest_message=message, system_context=_SYSTEM_CONTEXT, context=list(context)
+    )
+
+
+def _ai_response_from_models(size: BenchmarkSize) -> Callable[[], Any]:
+    context = _make_context(size)
+    config = _make_config()
+
+    # What _build_ai_response used to do.
+    return lambda: AiResponse(response=context[-1].content, updated_context=context, config=config)
+
+
+def _ai_response_constructed(size: BenchmarkSize) -> Callable[[], Any]:
+    context = _make_context(size)
+    config = _make_config()
+
+    # What _build_ai_response does now: no validation.
+    return lambda: AiResponse.model_construct(response=context[-1].content, updated_context=context, config=config)
+
+
+def _ai_response_to_json(size: BenchmarkSize) -> Callable[[], Any]:
+    context = _make_context(size)
+    response = AiResponse(response=context[-1].content, updated_context=context, config=_make_config())
+
+    # What the API sends back.
+    return lambda: json_codec.dumps(response)
+
+
+def _ai_response_from_dict(size: BenchmarkSize) -> Callable[[], Any]:
+    context = _make_context(size)
+    data = AiResponse(response=context[-1].content, updated_context=context, config=_make_config()).model_dump()
+
+    # What happens to the responses read from the cache/conversation store, and to the contexts sent to the API.
+    return lambda: AiResponse.model_validate(data)
+
+
+_CASES: List[Tuple[str, str, Callable[[BenchmarkSize], Callable[[], Any]]]] = [
+    ("serialize_to_dict", "request", _serialize_request(serialize_to_dict)),
+    ("serialize_to_dict", "request_legacy", _serialize_request(_legacy_serialize_to_dict)),
+    ("serialize_to_dict", "log_record", _serialize_log_record(serialize_to_dict)),
+    ("serialize_to_dict", "log_record_legacy", _serialize_log_record(_legacy_serialize_to_dict)),
+    ("serialize_to_dict", "nested", _serialize_nested(serialize_to_dict)),
+    ("serialize_to_dict", "nested_legacy", _serialize_nested(_legacy_serialize_to_dict)),
+    ("request_body", "ai_request", _request_body_from_model),
+    ("request_body", "chat_request", _request_body_from_chat_request),
+    ("response_body", "parse", _parse_response_body),
+    ("csv_string_to_dict_list", "csv", _parse_csv),
+    ("dataset_to_prompt_text", "python", _dataset_to_prompt_text(DatasetEncoding.Python)),
+    ("dataset_to_prompt_text", "csv", _dataset_to_prompt_text(DatasetEncoding.Csv)),
+    ("update_context", "message", _update_context_with_message),
+    ("update_context", "system_context", _update_context_with_system_context),
+    ("ai_response", "from_models", _ai_response_from_models),
+    ("ai_response", "constructed", _ai_response_constructed),
+    ("ai_response", "to_json", _ai_response_to_json),
+    ("ai_response", "from_dict", _ai_response_from_dict),
+]
+
+
+def get_cases(sizes: List[BenchmarkSize] = None, name_filter: str = None) -> List[MicroBenchmarkCase]:
+    """
+    Get the benchmarks of the hot path of a request: serializing, parsing/encoding the datasets, building the context
+    and the AiResponse.
+    :param sizes: Only these sizes. (Default: all)
+    :param name_filter: Only the cases with this in the name (group/case/size). (Optional)
+    :return: The cases.
+    """
+    sizes = sizes or list(BenchmarkSize)
+    cases = []
+
+    for group, case, setup in _CASES:
+        for size in sizes:
+            benchmark_case = MicroBenchmarkCase(group, case, size, lambda s=setup, z=size: s(z))
+
+            if name_filter and name_filter not in benchmark_case.name:
+                continue
+
+            cases.append(benchmark_case)
+
+    return cases
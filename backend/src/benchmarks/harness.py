@@ -0,0 +1,227 @@
+import gc
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Any, Callable, List, Optional, Tuple
+
+from src.benchmarks.types import BenchmarkSize, MicroBenchmarkResult, MicroBenchmarkReport, MicroBenchmarkComparison
+from src.shared.config import ROOT_FOLDER, BENCHMARKS_FOLDER
+from src.shared.loggers import get_filename_for_new_file
+
+# Each run calls the function as many times as needed to take at least this long, so the timer's resolution and the
+# loop don't matter.
+GLOBAL_MIN_RUN_SECONDS = 0.05
+
+# Runs per case. The first one (warmup) is not counted.
+GLOBAL_RUNS = 10
+
+
+class MicroBenchmarkCase:
+    """
+    Something to measure. setup is called once (not measured) and returns the function that is measured, which should
+    do a single call of whatever is being benchmarked.
+    """
+
+    def __init__(self, group: str, case: str, size: BenchmarkSize, setup: Callable[[], Callable[[], Any]]):
+        """
+        :param group: What is being benchmarked. (e.g.: serialize_to_dict)
+        :param case: The variant. (e.g.: request, log_record)
+        :param size: How big the input is.
+        :param setup: Prepares the input and returns the function to measure.
+        """
+        self.group: str = group
+        self.case: str = case
+        self.size: BenchmarkSize = size
+        self.setup: Callable[[], Callable[[], Any]] = setup
+
+    @property
+    def name(self) -> str:
+        return f"{self.group}/{self.case}/{self.size.value}"
+
+
+def get_code_version() -> Optional[str]:
+    """
+    :return: The commit being tested (with a + if there are uncommitted changes), or None if not in a git repository.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty=+"], cwd=ROOT_FOLDER, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def _time_loops(func: Callable[[], Any], loops: int) -> float:
+    # Like timeit: the garbage collector would add noise that depends on whatever ran before.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        started_at = timer()
+        for _ in range(loops):
+            func()
+        return timer() - started_at
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _calibrate(func: Callable[[], Any], min_run_seconds: float) -> int:
+    loops = 1
+
+    while True:
+        elapsed = _time_loops(func, loops)
+        if elapsed >= min_run_seconds:
+            return loops
+
+        # Jumping close to the target, instead of doubling all the way there.
+        loops = max(loops * 2, int(loops * min_run_seconds / max(elapsed, 1e-9) * 1.2))
+
+
+def _measure_memory(func: Callable[[], Any]) -> Tuple[int, int]:
+    """
+    :return: The peak allocated during a single call, and how much was still allocated after it.
+    """
+    tracemalloc.start()
+
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        # Kept alive until we read the memory, so it counts as retained.
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+
+        return peak - before, current - before
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(
+        case: MicroBenchmarkCase,
+        runs: int = GLOBAL_RUNS,
+        min_run_seconds: float = GLOBAL_MIN_RUN_SECONDS) -> MicroBenchmarkResult:
+    """
+    Measure a single case: the time per call (over many runs) and the memory allocated by one call.
+    :param case: What to measure.
+    :param runs: How many runs. (Default: 10)
+    :param min_run_seconds: Min duration of each run. (Default: 0.05)
+    :return: The result.
+    """
+    func = case.setup()
+
+    # The first call also warms up whatever is cached (imports, regexes, pydantic validators...).
+    loops = _calibrate(func, min_run_seconds)
+    times = [_time_loops(func, loops) / loops for _ in range(max(runs, 1))]
+    peak_allocated_bytes, retained_bytes = _measure_memory(func)
+
+    return MicroBenchmarkResult(
+        name=case.name,
+        group=case.group,
+        case=case.case,
+        size=case.size,
+        loops=loops,
+        runs=times,
+        mean_seconds=statistics.fmean(times),
+        median_seconds=statistics.median(times),
+        stdev_seconds=statistics.stdev(times) if len(times) > 1 else 0,
+        min_seconds=min(times),
+        peak_allocated_bytes=peak_allocated_bytes,
+        retained_bytes=retained_bytes
+    )
+
+
+def run_micro_benchmarks(
+        cases: List[MicroBenchmarkCase],
+        runs: int = GLOBAL_RUNS,
+        min_run_seconds: float = GLOBAL_MIN_RUN_SECONDS,
+        on_result: Callable[[MicroBenchmarkResult], None] = None) -> MicroBenchmarkReport:
+    """
+    Run the cases, one after the other.
+    :param cases: What to measure.
+    :param runs: Runs per case. (Default: 10)
+    :param min_run_seconds: Min duration of each run. (Default: 0.05)
+    :param on_result: Called with each result, as soon as it's ready. (Optional)
+    :return: The results.
+    """
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = []
+
+    for case in cases:
+        result = run_case(case, runs, min_run_seconds)
+        results.append(result)
+
+        if on_result is not None:
+            on_result(result)
+
+    return MicroBenchmarkReport(
+        started_at=started_at,
+        version=get_code_version(),
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        results=results
+    )
+
+
+def save_report(report: MicroBenchmarkReport, file: Optional[Path] = None) -> Path:
+    """
+    Save the results as JSON.
+    :param report: The results.
+    :param file: Where to save it. (Default: .benchmarks/micro-benchmark-<datetime>-<version>.json)
+    :return: The file.
+    """
+    if file is None:
+        file = BENCHMARKS_FOLDER.joinpath(get_filename_for_new_file(
+            ".json", prefix="micro-benchmark", unique_identifier=report.version or False
+        ))
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(report.model_dump_json(indent=2), encoding="utf-8")
+    return file
+
+
+def load_report(file: Path) -> MicroBenchmarkReport:
+    return MicroBenchmarkReport.model_validate_json(file.read_text(encoding="utf-8"))
+
+
+def compare_reports(
+        baseline: MicroBenchmarkReport,
+        current: MicroBenchmarkReport,
+        threshold_percent: float = 10) -> List[MicroBenchmarkComparison]:
+    """
+    Compare the median time and the peak memory of the cases that are in both reports.
+    :param baseline: The old results.
+    :param current: The new results.
+    :param threshold_percent: How much worse a metric can get before it's a regression. (Default: 10%)
+    :return: One comparison per case and metric.
+    """
+    baseline_results = {result.name: result for result in baseline.results}
+    comparisons = []
+
+    for result in current.results:
+        old = baseline_results.get(result.name)
+        if old is None:
+            continue
+
+        for metric, old_value, new_value in (
+                ("median_seconds", old.median_seconds, result.median_seconds),
+                ("peak_allocated_bytes", old.peak_allocated_bytes, result.peak_allocated_bytes)):
+            change_percent = (new_value - old_value) / old_value * 100 if old_value else None
+
+            comparisons.append(MicroBenchmarkComparison(
+                name=result.name,
+                metric=metric,
+                baseline=old_value,
+                current=new_value,
+                change_percent=change_percent,
+                regression=change_percent is not None and change_percent > threshold_percent
+            ))
+
+    return comparisons
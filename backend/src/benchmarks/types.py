@@ -0,0 +1,54 @@
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class BenchmarkSize(Enum):
+    # A couple of messages, a handful of rows.
+    Small = "small"
+    # A long conversation, a typical uploaded file.
+    Medium = "medium"
+    # Way more than fits in a context window. Shows how things scale.
+    Huge = "huge"
+
+
+class MicroBenchmarkResult(BaseModel):
+    # group/case/size
+    name: str
+    group: str
+    case: str
+    size: BenchmarkSize
+    # Calls per run.
+    loops: int
+    # Seconds per call, for each run.
+    runs: List[float]
+    mean_seconds: float
+    median_seconds: float
+    stdev_seconds: float
+    min_seconds: float
+    # Most memory allocated at once during a single call (tracemalloc), and how much was still allocated after it
+    # (usually, the result).
+    peak_allocated_bytes: int
+    retained_bytes: int
+
+
+class MicroBenchmarkReport(BaseModel):
+    # UTC, ISO 8601.
+    started_at: str
+    # The commit being tested (with a + if there were uncommitted changes). None if not in a git repository.
+    version: Optional[str]
+    python_version: str
+    platform: str
+    results: List[MicroBenchmarkResult]
+
+
+class MicroBenchmarkComparison(BaseModel):
+    name: str
+    metric: str
+    baseline: float
+    current: float
+    # (current - baseline) / baseline, in %. None if there's nothing to compare.
+    change_percent: Optional[float]
+    # True if it got worse by more than the threshold.
+    regression: bool
@@ -0,0 +1,333 @@
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import List, Union, Iterator, Tuple
+from uuid import uuid4
+
+from src.ai_tasks.types import ChatContextItem
+from src.conversations.types import ConversationStoreType
+import src.shared.json_codec as json_codec
+from src.shared.config import CONVERSATIONS_FOLDER
+
+
+class ConversationConflictError(Exception):
+    """
+    The conversation got a new turn (or was deleted) after it was loaded, so saving would lose that turn.
+    """
+
+    def __init__(self, conversation_id: str):
+        super().__init__(f"Conversation {conversation_id} was changed by another request. Try again.")
+        self.conversation_id: str = conversation_id
+
+
+class ConversationStore(ABC):
+    """
+    Keeps the context (messages) of the conversations on the server, so the clients only need to send the conversation
+    id and the new message on every turn.
+    """
+
+    @staticmethod
+    def new_conversation_id() -> str:
+        return str(uuid4())
+
+    @abstractmethod
+    def get(self, conversation_id: str) -> Union[Tuple[List[ChatContextItem], int], None]:
+        """
+        Get the messages of a conversation.
+        :param conversation_id: The id of the conversation.
+        :return: The messages and their version (pass it to save), or None if the conversation doesn't exist (or was
+        evicted).
+        """
+
+    @abstractmethod
+    def save(self, conversation_id: str, messages: List[ChatContextItem], version: int) -> None:
+        """
+        Save (create or replace) the messages of a conversation, if nobody else saved it since it was loaded.
+        Raises a ConversationConflictError if someone did.
+        :param conversation_id: The id of the conversation.
+        :param messages: All the messages of the conversation.
+        :param version: The version that was loaded (from get), or 0 for a new conversation.
+        """
+
+    @abstractmethod
+    def delete(self, conversation_id: str) -> bool:
+        """
+        Delete a conversation.
+        :param conversation_id: The id of the conversation.
+        :return: True if the conversation existed.
+        """
+
+    @staticmethod
+    def _to_json(messages: List[ChatContextItem]) -> str:
+        return json_codec.dumps(messages).decode("utf-8")
+
+    @staticmethod
+    def _from_json(data: str) -> List[ChatContextItem]:
+        # It's coming from outside (a file or a database), so it's validated.
+        return [ChatContextItem(**message) for message in json_codec.loads(data)]
+
+
+class MemoryConversationStore(ConversationStore):
+    """
+    Keeps the conversations in memory. When the store is full, the least recently used conversation is evicted.
+    Conversations are lost when the process dies, and are not shared between workers.
+    """
+
+    def __init__(self, max_conversations: int = 1000):
+        if max_conversations < 1:
+            raise ValueError("The max number of conversations must be greater than 0.")
+
+        self._max_conversations: int = max_conversations
+        # The messages and their version.
+        self._conversations: OrderedDict[str, Tuple[List[ChatContextItem], int]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, conversation_id: str) -> Union[Tuple[List[ChatContextItem], int], None]:
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+
+            if conversation is None:
+                return None
+
+            self._conversations.move_to_end(conversation_id)
+
+            # Callers will append to it, so we hand out a copy.
+            messages, version = conversation
+            return list(messages), version
+
+    def save(self, conversation_id: str, messages: List[ChatContextItem], version: int) -> None:
+        with self._lock:
+            current = self._conversations.get(conversation_id)
+            if (current[1] if current is not None else 0) != version:
+                raise ConversationConflictError(conversation_id)
+
+            self._conversations[conversation_id] = (list(messages), version + 1)
+            self._conversations.move_to_end(conversation_id)
+
+            while len(self._conversations) > self._max_conversations:
+                self._conversations.popitem(last=False)
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            return self._conversations.pop(conversation_id, None) is not None
+
+
+class SqliteConversationStore(ConversationStore):
+    """
+    Keeps the conversations in a SQLite database. Can be shared between workers/processes.
+    When the store is full, the conversation that went the longest without a new turn is evicted.
+    """
+
+    def __init__(
+            self,
+            db_file: Path = CONVERSATIONS_FOLDER.joinpath("conversations.sqlite"),
+            max_conversations: int = 1000):
+        if max_conversations < 1:
+            raise ValueError("The max number of conversations must be greater than 0.")
+
+        self._db_file: Path = db_file
+        self._db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._max_conversations: int = max_conversations
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # saved_order goes up on every save (of any conversation), so the lowest one is the least recently used.
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "conversation_id TEXT PRIMARY KEY, "
+                "messages TEXT NOT NULL, "
+                "version INTEGER NOT NULL, "
+                "saved_order INTEGER NOT NULL, "
+                "updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_saved_order ON conversations (saved_order)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Connecting is cheap, and a connection per call keeps us safe when used from multiple threads.
+        connection = sqlite3.connect(self._db_file, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, conversation_id: str) -> Union[Tuple[List[ChatContextItem], int], None]:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT messages, version FROM conversations WHERE conversation_id = ?",
+                (conversation_id,)
+            ).fetchone()
+
+        return None if row is None else (self._from_json(row[0]), row[1])
+
+    def save(self, conversation_id: str, messages: List[ChatContextItem], version: int) -> None:
+        next_saved_order = "(SELECT COALESCE(MAX(saved_order), 0) + 1 FROM conversations)"
+
+        with self._connect() as connection:
+            # Only one of the turns based on the same version gets to save. For the others, nothing matches.
+            if version == 0:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO conversations (conversation_id, messages, version, saved_order) "
+                    f"VALUES (?, ?, 1, {next_saved_order})",
+                    (conversation_id, self._to_json(messages))
+                )
+            else:
+                cursor = connection.execute(
+                    f"UPDATE conversations SET messages = ?, version = version + 1, saved_order = {next_saved_order}, "
+                    "updated_at = CURRENT_TIMESTAMP WHERE conversation_id = ? AND version = ?",
+                    (self._to_json(messages), conversation_id, version)
+                )
+
+            if cursor.rowcount == 0:
+                raise ConversationConflictError(conversation_id)
+
+            # Only new conversations make the store grow.
+            if version == 0:
+                connection.execute(
+                    "DELETE FROM conversations WHERE saved_order <= "
+                    "(SELECT saved_order FROM conversations ORDER BY saved_order DESC LIMIT 1 OFFSET ?)",
+                    (self._max_conversations,)
+                )
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._connect() as connection:
+            cursor = connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+            return cursor.rowcount > 0
+
+
+class FileConversationStore(ConversationStore):
+    """
+    Keeps each conversation in its own JSON file. Can be shared between workers/processes, as long as they can see
+    the same folder. When the store is full, the conversation that went the longest without a new turn is removed.
+    """
+
+    # A save takes a few milliseconds. A lock older than this was left behind by a worker that died while saving.
+    _STALE_LOCK_SECONDS = 30
+
+    def __init__(self, folder: Path = CONVERSATIONS_FOLDER, max_conversations: int = 1000):
+        if max_conversations < 1:
+            raise ValueError("The max number of conversations must be greater than 0.")
+
+        self._folder: Path = folder
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._max_conversations: int = max_conversations
+
+    def _get_file(self, conversation_id: str) -> Path:
+        # The id comes from the client, so we make sure it can't be used to escape the folder.
+        if not conversation_id or Path(conversation_id).name != conversation_id:
+            raise ValueError(f"Invalid conversation id: {conversation_id}")
+
+        return self._folder.joinpath(f"{conversation_id}.json")
+
+    @staticmethod
+    def _read(file: Path) -> Union[Tuple[List[ChatContextItem], int], None]:
+        try:
+            data = json_codec.loads(file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+        # It's coming from a file, so it's validated.
+        return [ChatContextItem(**message) for message in data["messages"]], data["version"]
+
+    def get(self, conversation_id: str) -> Union[Tuple[List[ChatContextItem], int], None]:
+        return self._read(self._get_file(conversation_id))
+
+    def _is_stale(self, lock_file: Path) -> bool:
+        try:
+            return time.time() - lock_file.stat().st_mtime > self._STALE_LOCK_SECONDS
+        except FileNotFoundError:
+            return True
+
+    @contextmanager
+    def _lock(self, conversation_id: str, file: Path) -> Iterator[None]:
+        lock_file = file.with_name(f"{file.name}.lock")
+
+        try:
+            # Creating a file that must not exist is atomic, even between processes. Whoever creates it holds the lock.
+            os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # Someone else is saving this conversation right now, so one of the two turns has to lose.
+            if not self._is_stale(lock_file):
+                raise ConversationConflictError(conversation_id)
+
+            lock_file.unlink(missing_ok=True)
+            try:
+                os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                raise ConversationConflictError(conversation_id)
+
+        try:
+            yield
+        finally:
+            lock_file.unlink(missing_ok=True)
+
+    def save(self, conversation_id: str, messages: List[ChatContextItem], version: int) -> None:
+        file = self._get_file(conversation_id)
+
+        with self._lock(conversation_id, file):
+            current = self._read(file)
+            if (current[1] if current is not None else 0) != version:
+                raise ConversationConflictError(conversation_id)
+
+            # Write to a temp file and swap it, so readers never see a half-written conversation.
+            temp_file = file.with_name(f"{file.name}.{uuid4()}.tmp")
+            temp_file.write_text(
+                json_codec.dumps({"version": version + 1, "messages": messages}).decode("utf-8"),
+                encoding="utf-8"
+            )
+            os.replace(temp_file, file)
+
+        # Only new conversations make the store grow.
+        if version == 0:
+            self._evict()
+
+    def _evict(self):
+        conversations = []
+        for file in self._folder.glob("*.json"):
+            try:
+                conversations.append((file.stat().st_mtime, file))
+            except FileNotFoundError:
+                pass
+
+        if len(conversations) <= self._max_conversations:
+            return
+
+        conversations.sort()
+        for _, file in conversations[:len(conversations) - self._max_conversations]:
+            file.unlink(missing_ok=True)
+
+    def delete(self, conversation_id: str) -> bool:
+        try:
+            self._get_file(conversation_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def get_conversation_store(
+        store_type: Union[ConversationStoreType, str] = ConversationStoreType.Memory,
+        max_conversations: int = 1000) -> ConversationStore:
+    """
+    Create a conversation store.
+    :param store_type: Which kind of store to create. (Default: Memory)
+    :param max_conversations: Max number of conversations kept. When it's reached, the least recently used ones are
+    removed. (Default: 1000)
+    :return: The conversation store.
+    """
+    store_type = ConversationStoreType(store_type)
+
+    if store_type == ConversationStoreType.Sqlite:
+        return SqliteConversationStore(max_conversations=max_conversations)
+
+    if store_type == ConversationStoreType.File:
+        return FileConversationStore(max_conversations=max_conversations)
+
+    return MemoryConversationStore(max_conversations=max_conversations)
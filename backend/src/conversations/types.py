@@ -0,0 +1,31 @@
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from src.ai_tasks.types import ChatContextItem, AiGeneratorConfig
+
+
+class ConversationStoreType(Enum):
+    Memory = "memory"
+    Sqlite = "sqlite"
+    File = "file"
+
+
+class Conversation(BaseModel):
+    conversation_id: str
+    messages: List[ChatContextItem]
+
+
+class ConversationTurnResponse(BaseModel):
+    conversation_id: str
+    response: str
+    # Only the messages added in this turn (the question and the answer). The full context stays on the server.
+    new_messages: List[ChatContextItem]
+    config: AiGeneratorConfig
+
+
+class ConversationStreamChunk(BaseModel):
+    delta: str
+    done: bool = False
+    response: Optional[ConversationTurnResponse] = None
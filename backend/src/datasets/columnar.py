@@ -0,0 +1,459 @@
+import csv
+import json
+import math
+import mmap
+import re
+import shutil
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from src.datasets.types import ColumnType, ColumnMetadata, DatasetMetadata
+
+# Typecodes used to store each column type. (int64, float64 and uint32 codes for the dictionary of strings)
+_TYPECODES: Dict[ColumnType, str] = {
+    ColumnType.Integer: "q",
+    ColumnType.Float: "d",
+    ColumnType.String: "I",
+}
+
+# Typecode of the missing value masks of the integer columns. (One byte per row, 1 when the value is missing)
+_MASK_TYPECODE = "B"
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# Only plain decimal numbers are numbers. int() and float() also take "1_000", "nan", "inf", "007" and non-ASCII
+# digits, and storing those as numbers would change them. (Leading zeros are usually codes, like zip codes.)
+_INTEGER_PATTERN = re.compile(r"[+-]?(0|[1-9][0-9]*)")
+_FLOAT_PATTERN = re.compile(r"[+-]?(0|[1-9][0-9]*)?(\.[0-9]+)?([eE][+-]?[0-9]+)?")
+
+# How many rows are buffered (per column) before being written to disk while ingesting a CSV file.
+INGEST_CHUNK_ROWS = 65536
+
+METADATA_FILE_NAME = "metadata.json"
+
+
+def _infer_type(value: str, current: Optional[ColumnType]) -> ColumnType:
+    """
+    Find the narrowest type that can hold the value and everything seen before it (int -> float -> string).
+    Empty values are missing values, so they don't change the type of the column.
+    """
+    if current == ColumnType.String:
+        return current
+
+    value = value.strip()
+    if value == "":
+        return current
+
+    if (current is None or current == ColumnType.Integer) and _INTEGER_PATTERN.fullmatch(value):
+        if _INT64_MIN <= int(value) <= _INT64_MAX:
+            return ColumnType.Integer
+        # Too big to be a number we can store. Most likely an identifier, so we keep it exactly as it is.
+        return ColumnType.String
+
+    # The pattern also matches "", "+" and "." (everything is optional), hence the digit check.
+    if _FLOAT_PATTERN.fullmatch(value) and any(c.isdigit() for c in value) and math.isfinite(float(value)):
+        return ColumnType.Float
+
+    return ColumnType.String
+
+
+def _resolve_type(column_type: Optional[ColumnType]) -> ColumnType:
+    # Only empty values.
+    return ColumnType.String if column_type is None else column_type
+
+
+class _ColumnWriter:
+    """
+    Converts the values of a column and writes them to disk, in chunks.
+    """
+
+    def __init__(self, file: Path, column_type: ColumnType, mask_file: Path = None):
+        """
+        :param file: Where the values go.
+        :param column_type: The type of the column.
+        :param mask_file: Where the missing value mask goes. Only for integer columns with missing values. (Optional)
+        """
+        self.column_type: ColumnType = column_type
+        self.dictionary: Dict[str, int] = {}
+        self._file = file.open("wb")
+        self._buffer = array(_TYPECODES[column_type])
+        self._mask_file = mask_file.open("wb") if mask_file is not None else None
+        self._mask_buffer = array(_MASK_TYPECODE)
+
+    def add(self, value: str):
+        if self.column_type == ColumnType.String:
+            code = self.dictionary.get(value)
+            if code is None:
+                code = len(self.dictionary)
+                self.dictionary[value] = code
+            self._buffer.append(code)
+        elif self.column_type == ColumnType.Integer:
+            value = value.strip()
+            if self._mask_file is not None:
+                self._mask_buffer.append(value == "")
+            self._buffer.append(int(value) if value != "" else 0)
+        else:
+            value = value.strip()
+            self._buffer.append(float(value) if value != "" else math.nan)
+
+        if len(self._buffer) >= INGEST_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        self._buffer.tofile(self._file)
+        self._buffer = array(_TYPECODES[self.column_type])
+
+        if self._mask_file is not None:
+            self._mask_buffer.tofile(self._mask_file)
+            self._mask_buffer = array(_MASK_TYPECODE)
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+        if self._mask_file is not None:
+            self._mask_file.close()
+
+
+class ColumnarDataset:
+    """
+    A table stored column by column, with typed columns.
+
+    Numbers are stored as int64/float64 and strings are dictionary encoded, so a dataset takes a fraction of the
+    memory of a list of dicts. When loaded from disk, the columns are memory-mapped: nothing is read until used,
+    and the OS can drop the pages whenever it needs the memory back.
+
+    Missing values are NaN in float columns, and in integer columns they have a mask (one byte per row, 1 when
+    missing), so the column stays integer.
+    """
+
+    def __init__(
+            self,
+            metadata: DatasetMetadata,
+            columns: List[Sequence],
+            dictionaries: List[Optional[List[str]]],
+            folder: Path = None,
+            mapped_files: List[mmap.mmap] = None,
+            missing_masks: List[Optional[Sequence[int]]] = None):
+        self.metadata: DatasetMetadata = metadata
+        self.folder: Optional[Path] = folder
+        self._columns: List[Sequence] = columns
+        self._dictionaries: List[Optional[List[str]]] = dictionaries
+        self._missing_masks: List[Optional[Sequence[int]]] = missing_masks or [None] * len(columns)
+        self._mapped_files: List[mmap.mmap] = mapped_files or []
+
+    @property
+    def columns(self) -> List[str]:
+        return [column.name for column in self.metadata.columns]
+
+    @property
+    def row_count(self) -> int:
+        return self.metadata.row_count
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        Approximate size of the data (columns + dictionaries).
+        """
+        size = sum(len(column) * array(_TYPECODES[meta.column_type]).itemsize
+                   for column, meta in zip(self._columns, self.metadata.columns))
+        size += sum(len(value) for dictionary in self._dictionaries if dictionary for value in dictionary)
+        size += sum(len(mask) for mask in self._missing_masks if mask is not None)
+        return size
+
+    def column_type(self, column: Union[str, int]) -> ColumnType:
+        return self.metadata.columns[self._column_index(column)].column_type
+
+    def _column_index(self, column: Union[str, int]) -> int:
+        if isinstance(column, int):
+            return column
+
+        return self.columns.index(column)
+
+    def column_values(self, column: Union[str, int]) -> List[Any]:
+        """
+        Get all the values of a column. Missing values are None.
+        :param column: The name (or index) of the column.
+        :return: The values.
+        """
+        index = self._column_index(column)
+        values = self._columns[index]
+        dictionary = self._dictionaries[index]
+        mask = self._missing_masks[index]
+
+        if dictionary is not None:
+            return [dictionary[code] for code in values]
+
+        if self.metadata.columns[index].column_type == ColumnType.Float:
+            return [None if math.isnan(value) else value for value in values]
+
+        if mask is not None:
+            return [None if missing else value for value, missing in zip(values, mask)]
+
+        return list(values)
+
+    def raw_column(self, column: Union[str, int]) -> Sequence:
+        """
+        Get the stored values of a column, without decoding them. (Dictionary codes for string columns)
+        Useful for fast computations over numeric columns. Missing integers are stored as 0: check missing_mask, or use
+        numeric_values instead.
+        """
+        return self._columns[self._column_index(column)]
+
+    def missing_mask(self, column: Union[str, int]) -> Optional[Sequence[int]]:
+        """
+        Get the missing value mask of an integer column (1 when the value is missing), or None if the column has no
+        mask (not an integer column, or no missing values). The raw column has a 0 where the value is missing.
+        """
+        return self._missing_masks[self._column_index(column)]
+
+    def numeric_values(self, column: Union[str, int]) -> Sequence:
+        """
+        Get the values of a numeric column, with NaN where they're missing. For computations (e.g.: stats).
+        No copy, unless it's an integer column with missing values.
+        """
+        index = self._column_index(column)
+        values = self._columns[index]
+        mask = self._missing_masks[index]
+
+        if mask is None:
+            return values
+
+        return array("d", (math.nan if missing else value for value, missing in zip(values, mask)))
+
+    def dictionary(self, column: Union[str, int]) -> Optional[List[str]]:
+        """
+        Get the distinct values of a string column (indexed by their code), or None for numeric columns.
+        """
+        return self._dictionaries[self._column_index(column)]
+
+    def iter_rows(self, start: int = 0, stop: int = None) -> Iterator[List[Any]]:
+        """
+        Iterate over the rows. Missing values are None.
+        :param start: Index of the first row. (Default: 0)
+        :param stop: Index after the last row. (Default: all the rows)
+        :return: An iterator of rows (one value per column).
+        """
+        stop = self.row_count if stop is None else min(stop, self.row_count)
+
+        decoders = []
+        for values, dictionary, mask, meta in zip(
+                self._columns, self._dictionaries, self._missing_masks, self.metadata.columns):
+            if dictionary is not None:
+                decoders.append(lambda i, v=values, d=dictionary: d[v[i]])
+            elif meta.column_type == ColumnType.Float:
+                decoders.append(lambda i, v=values: None if math.isnan(v[i]) else v[i])
+            elif mask is not None:
+                decoders.append(lambda i, v=values, m=mask: None if m[i] else v[i])
+            else:
+                decoders.append(values.__getitem__)
+
+        for i in range(start, stop):
+            yield [decode(i) for decode in decoders]
+
+    def to_records(self) -> List[dict]:
+        """
+        Convert the dataset to a list of dicts. Avoid it for big datasets, since that's what this class is for.
+        """
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.iter_rows()]
+
+    def close(self):
+        """
+        Release the memory-mapped files (if any).
+        """
+        for column in [*self._columns, *self._missing_masks]:
+            if isinstance(column, memoryview):
+                column.release()
+
+        self._columns = []
+        self._missing_masks = []
+        for mapped_file in self._mapped_files:
+            mapped_file.close()
+        self._mapped_files = []
+
+    @classmethod
+    def from_records(cls, records: List[dict]) -> "ColumnarDataset":
+        """
+        Build an in-memory dataset from a list of dicts (like the ones returned by csv_string_to_dict_list).
+        Values are converted to the narrowest type that fits the whole column.
+        """
+        names: Dict[str, None] = {}
+        for record in records:
+            for key in record.keys():
+                names.setdefault(key, None)
+
+        column_names = list(names.keys())
+        return cls.from_rows(column_names, ([record.get(name) for name in column_names] for record in records))
+
+    @classmethod
+    def from_rows(cls, column_names: List[str], rows: Iterable[Sequence[Any]]) -> "ColumnarDataset":
+        """
+        Build an in-memory dataset from a table (column names + rows).
+        """
+        rows = [["" if value is None else str(value) for value in row] for row in rows]
+
+        metadata_columns = []
+        columns = []
+        dictionaries = []
+        missing_masks = []
+        for index, name in enumerate(column_names):
+            values = [row[index] if index < len(row) else "" for row in rows]
+
+            column_type = None
+            for value in values:
+                column_type = _infer_type(value, column_type)
+            column_type = _resolve_type(column_type)
+            has_missing_values = column_type == ColumnType.Integer and any(value.strip() == "" for value in values)
+
+            metadata_columns.append(ColumnMetadata(
+                name=str(name), column_type=column_type, has_missing_values=has_missing_values
+            ))
+
+            mask = None
+            if column_type == ColumnType.String:
+                dictionary: Dict[str, int] = {}
+                columns.append(array("I", (dictionary.setdefault(value, len(dictionary)) for value in values)))
+                dictionaries.append(list(dictionary.keys()))
+            elif column_type == ColumnType.Integer:
+                values = [value.strip() for value in values]
+                columns.append(array("q", (int(value) if value != "" else 0 for value in values)))
+                dictionaries.append(None)
+                if has_missing_values:
+                    mask = array(_MASK_TYPECODE, (value == "" for value in values))
+            else:
+                columns.append(array("d", (float(value) if value.strip() != "" else math.nan for value in values)))
+                dictionaries.append(None)
+
+            missing_masks.append(mask)
+
+        metadata = DatasetMetadata(row_count=len(rows), columns=metadata_columns)
+        return cls(metadata, columns, dictionaries, missing_masks=missing_masks)
+
+    @classmethod
+    def load(cls, folder: Path) -> "ColumnarDataset":
+        """
+        Load a dataset saved by ingest_csv_file. The columns are memory-mapped, not read.
+        :param folder: The folder of the dataset.
+        :return: The dataset.
+        """
+        metadata = DatasetMetadata.model_validate_json(folder.joinpath(METADATA_FILE_NAME).read_text())
+
+        columns = []
+        dictionaries = []
+        mapped_files = []
+        missing_masks = []
+
+        def map_file(file_name: str, typecode: str) -> Sequence:
+            with folder.joinpath(file_name).open("rb") as file:
+                if metadata.row_count == 0:
+                    return array(typecode)
+
+                mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                mapped_files.append(mapped_file)
+                return memoryview(mapped_file).cast(typecode)
+
+        for index, column in enumerate(metadata.columns):
+            columns.append(map_file(f"{index}.bin", _TYPECODES[column.column_type]))
+            missing_masks.append(
+                map_file(f"{index}.missing.bin", _MASK_TYPECODE) if column.has_missing_values else None
+            )
+
+            if column.column_type == ColumnType.String:
+                dictionaries.append(json.loads(folder.joinpath(f"{index}.dictionary.json").read_text(encoding="utf-8")))
+            else:
+                dictionaries.append(None)
+
+        return cls(
+            metadata, columns, dictionaries, folder=folder, mapped_files=mapped_files, missing_masks=missing_masks
+        )
+
+
+def ingest_csv_file(csv_file: Path, folder: Path, encoding: str = "utf-8") -> ColumnarDataset:
+    """
+    Parse a CSV file (first row is the header) into a columnar dataset saved in a folder.
+    The file is streamed twice (once to find the types of the columns, once to write them), so memory usage doesn't
+    depend on the size of the file.
+
+    :param csv_file: The CSV file.
+    :param folder: Where the dataset will be saved. Will be created if it doesn't exist.
+    :param encoding: Encoding of the CSV file. (Default: utf-8)
+    :return: The dataset, loaded from the folder.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+
+    # First pass: find the type of each column.
+    with csv_file.open("r", encoding=encoding, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        column_types: List[Optional[ColumnType]] = [None] * len(header)
+        has_missing_values = [False] * len(header)
+        row_count = 0
+
+        for row in reader:
+            if len(row) == 0:
+                continue
+
+            row_count += 1
+            for index in range(len(header)):
+                value = row[index] if index < len(row) else ""
+                column_types[index] = _infer_type(value, column_types[index])
+                if value.strip() == "":
+                    has_missing_values[index] = True
+
+    resolved_types = [_resolve_type(column_type) for column_type in column_types]
+    # Only integer columns need a mask. (Floats have NaN, and strings keep the empty value as it is)
+    has_missing_values = [missing and column_type == ColumnType.Integer
+                          for missing, column_type in zip(has_missing_values, resolved_types)]
+
+    # Second pass: write the columns.
+    writers = [
+        _ColumnWriter(
+            folder.joinpath(f"{index}.bin"),
+            column_type,
+            folder.joinpath(f"{index}.missing.bin") if missing else None
+        )
+        for index, (column_type, missing) in enumerate(zip(resolved_types, has_missing_values))
+    ]
+    try:
+        with csv_file.open("r", encoding=encoding, newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+
+            for row in reader:
+                if len(row) == 0:
+                    continue
+
+                for index, writer in enumerate(writers):
+                    writer.add(row[index] if index < len(row) else "")
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for index, writer in enumerate(writers):
+        if writer.column_type == ColumnType.String:
+            folder.joinpath(f"{index}.dictionary.json").write_text(
+                json.dumps(list(writer.dictionary.keys()), ensure_ascii=False),
+                encoding="utf-8"
+            )
+
+    metadata = DatasetMetadata(
+        row_count=row_count,
+        columns=[ColumnMetadata(name=name, column_type=column_type, has_missing_values=missing)
+                 for name, column_type, missing in zip(header, resolved_types, has_missing_values)]
+    )
+    folder.joinpath(METADATA_FILE_NAME).write_text(metadata.model_dump_json(), encoding="utf-8")
+
+    return ColumnarDataset.load(folder)
+
+
+def delete_dataset(dataset: ColumnarDataset):
+    """
+    Close the dataset and delete its folder (if it was saved to disk).
+    """
+    dataset.close()
+
+    if dataset.folder is not None:
+        shutil.rmtree(dataset.folder, ignore_errors=True)
@@ -0,0 +1,256 @@
+import csv
+import json
+from datetime import datetime
+from io import StringIO
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from src.ai_utils.token_counter import get_token_counter
+from src.datasets.types import DatasetEncoding
+
+# A column is dictionary encoded (in the columnar encoding) when it has at most this many distinct values...
+COLUMNAR_MAX_DICTIONARY_SIZE = 64
+# ...and at most this fraction of the rows are distinct values.
+COLUMNAR_MAX_DICTIONARY_RATIO = 0.5
+
+
+def records_to_table(records: List[dict]) -> Tuple[List[str], List[List[Any]]]:
+    """
+    Convert a list of dicts to a table (column names + rows). Missing values become None.
+    :param records: The list of dicts.
+    :return: The column names (in the order they were first seen) and the rows.
+    """
+    columns: Dict[str, None] = {}
+    for record in records:
+        for key in record.keys():
+            columns.setdefault(key, None)
+
+    column_names = list(columns.keys())
+    rows = [[record.get(column) for column in column_names] for record in records]
+
+    return column_names, rows
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return ""
+
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    return str(value)
+
+
+def _encode_python(columns: List[str], rows: Iterable[Sequence[Any]]) -> str:
+    data = []
+    for row in rows:
+        data.append({
+            column: value.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(value, datetime) else value
+            for column, value in zip(columns, row)
+        })
+
+    return str(data)
+
+
+def _encode_delimited(columns: List[str], rows: Iterable[Sequence[Any]], delimiter: str) -> str:
+    output = StringIO()
+    writer = csv.writer(output, delimiter=delimiter, lineterminator="\n")
+
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_format_value(value) for value in row])
+
+    return output.getvalue().rstrip("\n")
+
+
+def _encode_csv(columns: List[str], rows: Iterable[Sequence[Any]]) -> str:
+    return _encode_delimited(columns, rows, ",")
+
+
+def _encode_tsv(columns: List[str], rows: Iterable[Sequence[Any]]) -> str:
+    return _encode_delimited(columns, rows, "\t")
+
+
+def _escape_markdown(value: Any) -> str:
+    return _format_value(value).replace("|", "\\|").replace("\n", " ")
+
+
+def _encode_markdown(columns: List[str], rows: Iterable[Sequence[Any]]) -> str:
+    lines = [
+        f"| {' | '.join(_escape_markdown(column) for column in columns)} |",
+        f"|{'|'.join('---' for _ in columns)}|"
+    ]
+
+    for row in rows:
+        lines.append(f"| {' | '.join(_escape_markdown(value) for value in row)} |")
+
+    return "\n".join(lines)
+
+
+def _quote_columnar(value: str) -> str:
+    # Values are separated by commas, so anything that could be confused with the separators gets quoted.
+    if "," in value or "\n" in value or "\"" in value or value != value.strip():
+        return json.dumps(value, ensure_ascii=False)
+
+    return value
+
+
+def _looks_numeric(value: Any) -> bool:
+    if isinstance(value, bool):
+        return False
+
+    if isinstance(value, (int, float)):
+        return True
+
+    # Values parsed from CSV are always strings, so we check if they would make sense as numbers.
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _encode_column(column: str, values: List[Any]) -> str:
+    formatted = [_quote_columnar(_format_value(value)) for value in values]
+    distinct = list(dict.fromkeys(formatted))
+
+    is_numeric = all(value is None or value == "" or _looks_numeric(value) for value in values)
+    use_dictionary = not is_numeric \
+        and len(distinct) <= COLUMNAR_MAX_DICTIONARY_SIZE \
+        and len(distinct) <= len(values) * COLUMNAR_MAX_DICTIONARY_RATIO
+
+    if not use_dictionary:
+        return f"{column}: {','.join(formatted)}"
+
+    codes = {value: str(code) for code, value in enumerate(distinct)}
+    dictionary = ",".join(f"{code}={value}" for value, code in codes.items())
+
+    return f"{column} {{{dictionary}}}: {','.join(codes[value] for value in formatted)}"
+
+
+def _encode_columnar(columns: List[str], rows: Iterable[Sequence[Any]]) -> str:
+    rows = list(rows)
+    lines = [f"rows: {len(rows)}"]
+
+    for index, column in enumerate(columns):
+        lines.append(_encode_column(column, [row[index] for row in rows]))
+
+    return "\n".join(lines)
+
+
+_ENCODERS: Dict[DatasetEncoding, Callable[[List[str], Iterable[Sequence[Any]]], str]] = {
+    DatasetEncoding.Python: _encode_python,
+    DatasetEncoding.Csv: _encode_csv,
+    DatasetEncoding.Tsv: _encode_tsv,
+    DatasetEncoding.Markdown: _encode_markdown,
+    DatasetEncoding.Columnar: _encode_columnar,
+}
+
+
+def encode_table(
+        columns: List[str],
+        rows: Iterable[Sequence[Any]],
+        encoding: DatasetEncoding = DatasetEncoding.Csv,
+        token_counter: Callable[[str], int] = None) -> str:
+    """
+    Convert a table to text, to be used in a prompt.
+    :param columns: The column names.
+    :param rows: The rows. Each row must have one value per column.
+    :param encoding: The format of the text. (Default: Csv)
+    :param token_counter: Used to pick the cheapest encoding when encoding is Auto. (Default: get_token_counter())
+    :return: The table as text.
+    """
+    encoding = DatasetEncoding(encoding)
+
+    if encoding == DatasetEncoding.Auto:
+        rows = list(rows)
+        encoded = [encoder(columns, rows) for encoder in _ENCODERS.values()]
+        token_counter = token_counter or get_token_counter()
+        return min(encoded, key=token_counter)
+
+    return _ENCODERS[encoding](columns, rows)
+
+
+def encoding_report(
+        columns: List[str],
+        rows: Iterable[Sequence[Any]],
+        token_counter: Callable[[str], int] = None) -> Dict[str, int]:
+    """
+    Count how many tokens the table would take in each encoding, so we can choose the cheapest one.
+    :param columns: The column names.
+    :param rows: The rows. Each row must have one value per column.
+    :param token_counter: A function that counts the tokens of a text. (Default: get_token_counter())
+    :return: The number of tokens per encoding, cheapest first.
+    """
+    rows = list(rows)
+    token_counter = token_counter or get_token_counter()
+
+    report = {
+        encoding.value: token_counter(encoder(columns, rows))
+        for encoding, encoder in _ENCODERS.items()
+    }
+
+    return dict(sorted(report.items(), key=lambda item: item[1]))
+
+
+def _encode_chunk(
+        columns: List[str],
+        rows: List[Sequence[Any]],
+        first_row: int,
+        encoding: DatasetEncoding,
+        max_tokens: int,
+        token_counter: Callable[[str], int]) -> Iterator[Tuple[int, int, str]]:
+    text = encode_table(columns, rows, encoding, token_counter)
+
+    # The rows were picked using an estimate, so we check the real thing. If it doesn't fit, we split it in two.
+    # (A single row that doesn't fit is sent anyway, there's nothing else we can do with it)
+    if len(rows) == 1 or token_counter(text) <= max_tokens:
+        yield first_row, first_row + len(rows), text
+        return
+
+    middle = len(rows) // 2
+    yield from _encode_chunk(columns, rows[:middle], first_row, encoding, max_tokens, token_counter)
+    yield from _encode_chunk(columns, rows[middle:], first_row + middle, encoding, max_tokens, token_counter)
+
+
+def chunk_table(
+        columns: List[str],
+        rows: Iterable[Sequence[Any]],
+        max_tokens: int,
+        encoding: DatasetEncoding = DatasetEncoding.Csv,
+        token_counter: Callable[[str], int] = None) -> Iterator[Tuple[int, int, str]]:
+    """
+    Split a table in chunks that fit in a number of tokens. Each chunk has the column names, so it can be understood on
+    its own. The rows are read as needed, so big tables are never converted to text all at once.
+    :param columns: The column names.
+    :param rows: The rows. Each row must have one value per column.
+    :param max_tokens: Max number of tokens of each chunk.
+    :param encoding: The format of the text. (Default: Csv)
+    :param token_counter: A function that counts the tokens of a text. (Default: get_token_counter())
+    :return: For each chunk: the index of the first row, the index after the last row, and the chunk as text.
+    """
+    if max_tokens < 1:
+        raise ValueError("The max number of tokens of a chunk must be greater than 0.")
+
+    encoding = DatasetEncoding(encoding)
+    token_counter = token_counter or get_token_counter()
+
+    # Estimating the size of each row as a CSV line. It's close enough to pick the rows for a chunk.
+    header_tokens = token_counter(",".join(columns))
+    pending: List[Sequence[Any]] = []
+    pending_tokens = header_tokens
+    first_row = 0
+
+    for row in rows:
+        row_tokens = token_counter(",".join(_format_value(value) for value in row)) + 1
+
+        if pending and pending_tokens + row_tokens > max_tokens:
+            yield from _encode_chunk(columns, pending, first_row, encoding, max_tokens, token_counter)
+            first_row += len(pending)
+            pending = []
+            pending_tokens = header_tokens
+
+        pending.append(row)
+        pending_tokens += row_tokens
+
+    if pending:
+        yield from _encode_chunk(columns, pending, first_row, encoding, max_tokens, token_counter)
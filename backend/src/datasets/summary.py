@@ -0,0 +1,372 @@
+import importlib.util
+import math
+import random
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from src.datasets.columnar import ColumnarDataset
+from src.datasets.encoders import encode_table
+from src.datasets.types import ColumnType, DatasetEncoding
+
+# NumPy makes the summaries a lot faster on big datasets, but it's optional. Without it, we use plain Python.
+_NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+
+# Columns with up to this many distinct values are treated as categories (value counts and group-by).
+SUMMARY_MAX_CATEGORIES = 20
+
+# How many rows go in the (stratified) sample.
+SUMMARY_SAMPLE_ROWS = 20
+
+# Correlations are only computed between this many numeric columns (the first ones), to keep the matrix readable.
+SUMMARY_MAX_CORRELATION_COLUMNS = 12
+
+
+def _format_number(value: Optional[float]) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+
+    if abs(value) >= 1:
+        return f"{value:.2f}"
+
+    return f"{value:.4g}"
+
+
+def _numeric_column(dataset: ColumnarDataset, index: int):
+    """
+    Get the values of a numeric column, without the missing ones.
+    :return: A NumPy array (float64) if NumPy is available, or a list of numbers otherwise.
+    """
+    raw = dataset.numeric_values(index)
+
+    if _NUMPY_AVAILABLE:
+        import numpy as np
+
+        # No copy for memory-mapped columns. (Until we convert it to float)
+        values = np.asarray(raw, dtype=np.float64)
+        return values[~np.isnan(values)]
+
+    if dataset.column_type(index) == ColumnType.Float or dataset.missing_mask(index) is not None:
+        return [value for value in raw if not math.isnan(value)]
+
+    return list(raw)
+
+
+def _describe(values) -> Dict[str, Optional[float]]:
+    """
+    Describe-style stats (count, mean, std, min, quartiles and max) of the values of a numeric column.
+    """
+    count = len(values)
+    if count == 0:
+        return {"count": 0, "mean": None, "std": None, "min": None, "p25": None, "median": None, "p75": None,
+                "max": None}
+
+    if _NUMPY_AVAILABLE:
+        import numpy as np
+
+        p25, median, p75 = np.percentile(values, [25, 50, 75])
+        return {
+            "count": count,
+            "mean": float(values.mean()),
+            "std": float(values.std(ddof=1)) if count > 1 else None,
+            "min": float(values.min()),
+            "p25": float(p25),
+            "median": float(median),
+            "p75": float(p75),
+            "max": float(values.max()),
+        }
+
+    ordered = sorted(values)
+
+    def percentile(fraction: float) -> float:
+        # Linear interpolation, same as NumPy's default.
+        position = (count - 1) * fraction
+        lower = math.floor(position)
+        upper = min(lower + 1, count - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    mean = math.fsum(ordered) / count
+    std = math.sqrt(math.fsum((value - mean) ** 2 for value in ordered) / (count - 1)) if count > 1 else None
+
+    return {
+        "count": count,
+        "mean": mean,
+        "std": std,
+        "min": ordered[0],
+        "p25": percentile(0.25),
+        "median": percentile(0.5),
+        "p75": percentile(0.75),
+        "max": ordered[-1],
+    }
+
+
+def _category_codes(dataset: ColumnarDataset, index: int) -> Optional[Tuple[List[Any], Sequence[int]]]:
+    """
+    If the column has few distinct values, get them (sorted by how common they are) and the code of each row.
+    :return: The distinct values and the codes (index in the distinct values), or None if the column is not a category.
+    """
+    raw = dataset.raw_column(index)
+    dictionary = dataset.dictionary(index)
+
+    if dictionary is not None:
+        if len(dictionary) > SUMMARY_MAX_CATEGORIES:
+            return None
+        labels = dictionary
+    else:
+        # Missing values don't have a code. (The missing ones would count as 0)
+        if dataset.column_type(index) != ColumnType.Integer or dataset.missing_mask(index) is not None:
+            return None
+
+        labels = []
+        seen = set()
+        for value in raw:
+            if value not in seen:
+                seen.add(value)
+                labels.append(value)
+                if len(labels) > SUMMARY_MAX_CATEGORIES:
+                    return None
+
+    if _NUMPY_AVAILABLE:
+        import numpy as np
+
+        values = np.asarray(raw)
+        if dictionary is None:
+            # Mapping the values to their position in labels.
+            order = np.array(labels)
+            sorter = np.argsort(order)
+            values = sorter[np.searchsorted(order, values, sorter=sorter)]
+        counts = np.bincount(values, minlength=len(labels))
+        ranking = np.argsort(-counts, kind="stable")
+        remap = np.empty_like(ranking)
+        remap[ranking] = np.arange(len(ranking))
+        return [labels[i] for i in ranking], remap[values]
+
+    positions = {label: position for position, label in enumerate(labels)}
+    codes = list(raw) if dictionary is not None else [positions[value] for value in raw]
+    counts = Counter(codes)
+    ranking = sorted(range(len(labels)), key=lambda code: -counts[code])
+    remap = {code: position for position, code in enumerate(ranking)}
+    return [labels[i] for i in ranking], [remap[code] for code in codes]
+
+
+def _group_stats(codes: Sequence[int], group_count: int, values: Sequence[float]) -> Tuple[List[int], List[float]]:
+    """
+    Count the rows and average a numeric column for each group.
+    :param codes: The group of each row.
+    :param group_count: Number of groups.
+    :param values: The values of the numeric column (one per row, NaN when missing).
+    :return: The number of rows and the mean of the values, per group.
+    """
+    if _NUMPY_AVAILABLE:
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        counts = np.bincount(codes, minlength=group_count)
+        sums = np.bincount(codes[present], weights=values[present], minlength=group_count)
+        present_counts = np.bincount(codes[present], minlength=group_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / present_counts
+        return counts.tolist(), means.tolist()
+
+    counts = [0] * group_count
+    present_counts = [0] * group_count
+    sums = [0.0] * group_count
+    for code, value in zip(codes, values):
+        counts[code] += 1
+        if not math.isnan(value):
+            present_counts[code] += 1
+            sums[code] += value
+
+    return counts, [total / present if present else math.nan for total, present in zip(sums, present_counts)]
+
+
+def _correlation(xs: Sequence[float], ys: Sequence[float]) -> Optional[float]:
+    """
+    Pearson correlation between two numeric columns, using only the rows where both have values.
+    """
+    if _NUMPY_AVAILABLE:
+        import numpy as np
+
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        present = ~(np.isnan(xs) | np.isnan(ys))
+        xs, ys = xs[present], ys[present]
+        if len(xs) < 2 or xs.std() == 0 or ys.std() == 0:
+            return None
+        return float(np.corrcoef(xs, ys)[0, 1])
+
+    pairs = [(x, y) for x, y in zip(xs, ys) if not math.isnan(x) and not math.isnan(y)]
+    if len(pairs) < 2:
+        return None
+
+    mean_x = math.fsum(x for x, _ in pairs) / len(pairs)
+    mean_y = math.fsum(y for _, y in pairs) / len(pairs)
+    covariance = math.fsum((x - mean_x) * (y - mean_y) for x, y in pairs)
+    variance_x = math.fsum((x - mean_x) ** 2 for x, _ in pairs)
+    variance_y = math.fsum((y - mean_y) ** 2 for _, y in pairs)
+
+    if variance_x == 0 or variance_y == 0:
+        return None
+
+    return covariance / math.sqrt(variance_x * variance_y)
+
+
+def _stratified_sample(
+        codes: Optional[Sequence[int]],
+        group_count: int,
+        row_count: int,
+        sample_rows: int) -> List[int]:
+    """
+    Pick rows so every group is represented (proportionally, but with at least one row each).
+    :return: The indexes of the rows, sorted.
+    """
+    # Always the same sample for the same data, so the prompt (and the answer) don't change between calls.
+    rng = random.Random(0)
+
+    if row_count <= sample_rows:
+        return list(range(row_count))
+
+    if codes is None:
+        return sorted(rng.sample(range(row_count), sample_rows))
+
+    rows_per_group: List[List[int]] = [[] for _ in range(group_count)]
+    for row, code in enumerate(codes):
+        rows_per_group[int(code)].append(row)
+
+    picked = []
+    for rows in rows_per_group:
+        if not rows:
+            continue
+        share = max(1, round(sample_rows * len(rows) / row_count))
+        picked.extend(rng.sample(rows, min(share, len(rows))))
+
+    return sorted(picked)
+
+
+def summarize_dataset(
+        dataset: Union[List[dict], ColumnarDataset],
+        encoding: DatasetEncoding = DatasetEncoding.Csv,
+        token_counter: Callable[[str], int] = None,
+        sample_rows: int = SUMMARY_SAMPLE_ROWS,
+        stratify_by: str = None) -> str:
+    """
+    Summarize a dataset locally, so the summary can go in the prompt instead of all the rows.
+    The summary has: the type and describe-style stats of each column, the counts of the values of the columns with few
+    distinct values (and the mean of the numeric columns for each of them), the correlations between the numeric
+    columns and a sample of the rows (stratified by a column with few distinct values).
+
+    :param dataset: The dataset (a list of dicts or an uploaded dataset).
+    :param encoding: The format of the tables in the summary. (Default: Csv)
+    :param token_counter: Used to pick the cheapest encoding when encoding is Auto. (Optional)
+    :param sample_rows: How many rows go in the sample. (Default: SUMMARY_SAMPLE_ROWS)
+    :param stratify_by: The column used to stratify the sample. (Optional. Default: the one with the fewest distinct
+    values. Ties go to the rightmost one, since that's usually where the target of the dataset is)
+    :return: The summary, as text.
+    """
+    if not isinstance(dataset, ColumnarDataset):
+        dataset = ColumnarDataset.from_records(dataset)
+
+    columns = dataset.columns
+    row_count = dataset.row_count
+
+    def table(header: List[str], rows: List[List[Any]]) -> str:
+        return encode_table(header, rows, encoding, token_counter)
+
+    numeric_indexes = [index for index in range(len(columns)) if dataset.column_type(index) != ColumnType.String]
+    categories = {index: _category_codes(dataset, index) for index in range(len(columns))}
+    categories = {index: category for index, category in categories.items() if category is not None}
+
+    sections = [
+        f"Summary of the dataset ({row_count} rows, {len(columns)} columns), computed locally from all the rows."
+    ]
+
+    # Columns
+    column_rows = []
+    for index, name in enumerate(columns):
+        column_type = dataset.column_type(index)
+
+        if column_type == ColumnType.String:
+            values = dataset.raw_column(index)
+            distinct = len(dataset.dictionary(index))
+            column_rows.append([name, column_type.value, len(values), "", distinct, "", "", "", "", "", "", ""])
+            continue
+
+        stats = _describe(_numeric_column(dataset, index))
+        distinct = len(categories[index][0]) if index in categories else ""
+        column_rows.append([
+            name, column_type.value, stats["count"], row_count - stats["count"], distinct,
+            *(_format_number(stats[key]) for key in ["mean", "std", "min", "p25", "median", "p75", "max"])
+        ])
+
+    sections.append("Columns:")
+    sections.append(table(
+        ["column", "type", "count", "missing", "distinct", "mean", "std", "min", "p25", "median", "p75", "max"],
+        column_rows
+    ))
+
+    # Value counts and group-by
+    for index, (labels, codes) in categories.items():
+        group_columns = [i for i in numeric_indexes if i != index]
+        means_per_column = []
+        counts = None
+        for numeric_index in group_columns:
+            counts, means = _group_stats(codes, len(labels), dataset.numeric_values(numeric_index))
+            means_per_column.append(means)
+
+        if counts is None:
+            counts, _ = _group_stats(codes, len(labels), [math.nan] * row_count)
+
+        sections.append(f"\nRows per {columns[index]} (with the mean of the numeric columns):")
+        sections.append(table(
+            [columns[index], "rows", *(f"mean {columns[i]}" for i in group_columns)],
+            [
+                [label, counts[position], *(_format_number(means[position]) for means in means_per_column)]
+                for position, label in enumerate(labels)
+            ]
+        ))
+
+    # Correlations
+    correlation_indexes = [
+        index for index in numeric_indexes
+        if index not in categories or len(categories[index][0]) > 1
+    ][:SUMMARY_MAX_CORRELATION_COLUMNS]
+
+    if len(correlation_indexes) > 1:
+        correlation_rows = []
+        for row_index in correlation_indexes:
+            row = [columns[row_index]]
+            for column_index in correlation_indexes:
+                if column_index == row_index:
+                    row.append("1")
+                    continue
+                row.append(_format_number(_correlation(
+                    dataset.numeric_values(row_index), dataset.numeric_values(column_index)
+                )))
+            correlation_rows.append(row)
+
+        sections.append("\nCorrelations between the numeric columns:")
+        sections.append(table(["column", *(columns[i] for i in correlation_indexes)], correlation_rows))
+
+    # Sample
+    if stratify_by is not None:
+        strata_index = dataset.columns.index(stratify_by)
+        if strata_index not in categories:
+            raise ValueError(f"The column {stratify_by} has too many distinct values to stratify the sample by.")
+    else:
+        candidates = [index for index, (labels, _) in categories.items() if len(labels) > 1]
+        strata_index = min(reversed(candidates), key=lambda i: len(categories[i][0])) if candidates else None
+
+    if strata_index is not None:
+        labels, codes = categories[strata_index]
+        sample = _stratified_sample(codes, len(labels), row_count, sample_rows)
+        sections.append(f"\nSample of {len(sample)} rows (stratified by {columns[strata_index]}):")
+    else:
+        sample = _stratified_sample(None, 0, row_count, sample_rows)
+        sections.append(f"\nSample of {len(sample)} rows:")
+
+    sections.append(table(columns, [next(dataset.iter_rows(row, row + 1)) for row in sample]))
+
+    return "\n".join(sections)
@@ -0,0 +1,36 @@
+from enum import Enum
+from typing import List
+
+from pydantic import BaseModel
+
+
+class DatasetEncoding(Enum):
+    # Python's repr of a list of dicts. Repeats every column name on every row. (The original format)
+    Python = "python"
+    # Header once, then one line per row.
+    Csv = "csv"
+    Tsv = "tsv"
+    Markdown = "markdown"
+    # One line per column. Columns with few distinct values are dictionary encoded.
+    Columnar = "columnar"
+    # Whichever of the above uses the fewest tokens.
+    Auto = "auto"
+
+
+class ColumnType(Enum):
+    Integer = "int"
+    Float = "float"
+    # Strings are dictionary encoded: each distinct value is stored once, and the rows keep only its code.
+    String = "string"
+
+
+class ColumnMetadata(BaseModel):
+    name: str
+    column_type: ColumnType
+    # Only integer columns: if True, the column has a missing value mask. (Floats use NaN)
+    has_missing_values: bool = False
+
+
+class DatasetMetadata(BaseModel):
+    row_count: int
+    columns: List[ColumnMetadata]
@@ -0,0 +1,295 @@
+import shutil
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, List, Optional, Union
+from uuid import UUID, uuid4
+
+from src.datasets.columnar import ColumnarDataset, ingest_csv_file
+from src.shared.config import UPLOADS_FOLDER
+
+INDEX_FILE_NAME = "uploads.sqlite"
+
+# Suffix of the files the uploads are streamed to, before being ingested.
+TEMPORARY_UPLOAD_SUFFIX = ".upload.csv"
+
+# Folders without an entry in the index are uploads still being ingested (or left behind by a crash), and so are the
+# temporary upload files. We only clean them up after this long, so we don't delete an upload that another worker is
+# receiving or ingesting right now.
+ORPHAN_GRACE_PERIOD_SECONDS = 60 * 60
+
+
+class UploadStore:
+    """
+    Keeps the uploaded datasets on disk (in the columnar format), with an index in SQLite, so it can be shared by
+    every worker/process using the same folder.
+
+    The store is bounded: uploads that are not used for longer than the TTL are removed and, when the total size goes
+    over the limit, the least recently used uploads are removed until it fits again.
+
+    Each process keeps only a few datasets open (they are memory-mapped, so the OS decides what stays in memory).
+    """
+
+    def __init__(
+            self,
+            folder: Path = UPLOADS_FOLDER,
+            max_total_bytes: int = 2 * 1024 ** 3,
+            ttl_seconds: Optional[int] = 24 * 60 * 60,
+            max_open_datasets: int = 16):
+        """
+        :param folder: Where the uploads (and the index) are stored. Every worker must use the same one.
+        :param max_total_bytes: Max size of all the uploads combined, in bytes.
+        :param ttl_seconds: Uploads not used for this long are removed. (None to keep them until evicted by size)
+        :param max_open_datasets: How many datasets each process keeps open.
+        """
+        if max_total_bytes < 1:
+            raise ValueError("The max size of the upload store must be greater than 0.")
+
+        if max_open_datasets < 1:
+            raise ValueError("The max number of open datasets must be greater than 0.")
+
+        self.folder: Path = folder
+        self.max_total_bytes: int = max_total_bytes
+        self.ttl_seconds: Optional[int] = ttl_seconds
+        self.max_open_datasets: int = max_open_datasets
+
+        self._db_file: Path = folder.joinpath(INDEX_FILE_NAME)
+        self._open_datasets: OrderedDict[str, ColumnarDataset] = OrderedDict()
+        self._lock = Lock()
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "file_id TEXT PRIMARY KEY, "
+                "size_bytes INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "last_accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS uploads_last_accessed_at ON uploads (last_accessed_at)")
+
+        self._remove_orphans()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Same as the conversation store: a connection per call, so it's safe to use from multiple threads.
+        connection = sqlite3.connect(self._db_file, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _dataset_folder(self, file_id: str) -> Path:
+        return self.folder.joinpath(file_id)
+
+    @staticmethod
+    def _is_valid_file_id(file_id: str) -> bool:
+        # The id becomes a folder name, so we only accept the ones we generate.
+        try:
+            return str(UUID(file_id)) == file_id
+        except (ValueError, TypeError, AttributeError):
+            return False
+
+    def _is_expired(self, last_accessed_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - last_accessed_at > self.ttl_seconds
+
+    def _forget(self, file_ids: List[str]):
+        """
+        Drop the datasets from the open datasets of this process and delete their folders.
+        The entries must already be gone from the index.
+        """
+        with self._lock:
+            for file_id in file_ids:
+                # Not closing it: another request may still be reading it. It will be closed when garbage collected.
+                # (Deleting the files of a memory-mapped dataset is fine, the data is kept until it's unmapped)
+                self._open_datasets.pop(file_id, None)
+
+        for file_id in file_ids:
+            shutil.rmtree(self._dataset_folder(file_id), ignore_errors=True)
+
+    def _remove_orphans(self):
+        with self._connect() as connection:
+            known_ids = {row[0] for row in connection.execute("SELECT file_id FROM uploads")}
+
+        now = time.time()
+        for path in self.folder.iterdir():
+            is_orphan_folder = path.is_dir() and path.name not in known_ids
+            # Left behind by a crash. (The API deletes them itself otherwise)
+            is_temporary_upload = path.is_file() and path.name.endswith(TEMPORARY_UPLOAD_SUFFIX)
+            if not is_orphan_folder and not is_temporary_upload:
+                continue
+
+            try:
+                if now - path.stat().st_mtime <= ORPHAN_GRACE_PERIOD_SECONDS:
+                    continue
+
+                if is_orphan_folder:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+
+    def add_csv_file(self, csv_file: Path, encoding: str = "utf-8") -> str:
+        """
+        Ingest a CSV file into the store. The CSV file itself is not kept (nor deleted).
+        :param csv_file: The CSV file.
+        :param encoding: The encoding of the file. (Default: utf-8)
+        :return: The id of the upload.
+        """
+        file_id = str(uuid4())
+        dataset_folder = self._dataset_folder(file_id)
+
+        try:
+            dataset = ingest_csv_file(csv_file, dataset_folder, encoding)
+        except Exception:
+            shutil.rmtree(dataset_folder, ignore_errors=True)
+            raise
+
+        size_bytes = dataset.size_bytes
+        if size_bytes > self.max_total_bytes:
+            dataset.close()
+            shutil.rmtree(dataset_folder, ignore_errors=True)
+            raise ValueError(
+                f"The dataset takes {size_bytes} bytes, but the upload store can only hold {self.max_total_bytes}."
+            )
+
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO uploads (file_id, size_bytes, created_at, last_accessed_at) VALUES (?, ?, ?, ?)",
+                (file_id, size_bytes, now, now)
+            )
+
+        with self._lock:
+            self._open_datasets[file_id] = dataset
+            self._trim_open_datasets()
+
+        self.evict(keep=file_id)
+
+        return file_id
+
+    def get(self, file_id: str) -> Union[ColumnarDataset, None]:
+        """
+        Get an upload.
+        :param file_id: The id of the upload.
+        :return: The dataset, or None if it doesn't exist (or was evicted).
+        """
+        if not self._is_valid_file_id(file_id):
+            return None
+
+        now = time.time()
+
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT last_accessed_at FROM uploads WHERE file_id = ?", (file_id,)
+            ).fetchone()
+
+            if row is not None and not self._is_expired(row[0], now):
+                connection.execute("UPDATE uploads SET last_accessed_at = ? WHERE file_id = ?", (now, file_id))
+
+        if row is None:
+            # Maybe another worker evicted it. The folder is already gone, but we may still have it open.
+            with self._lock:
+                self._open_datasets.pop(file_id, None)
+            return None
+
+        if self._is_expired(row[0], now):
+            self.delete(file_id)
+            return None
+
+        with self._lock:
+            dataset = self._open_datasets.get(file_id)
+
+            if dataset is not None:
+                self._open_datasets.move_to_end(file_id)
+                return dataset
+
+        try:
+            dataset = ColumnarDataset.load(self._dataset_folder(file_id))
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            dataset = self._open_datasets.setdefault(file_id, dataset)
+            self._open_datasets.move_to_end(file_id)
+            self._trim_open_datasets()
+
+        return dataset
+
+    def _trim_open_datasets(self):
+        # Must be called holding the lock.
+        while len(self._open_datasets) > self.max_open_datasets:
+            self._open_datasets.popitem(last=False)
+
+    def delete(self, file_id: str) -> bool:
+        """
+        Delete an upload.
+        :param file_id: The id of the upload.
+        :return: True if the upload existed.
+        """
+        if not self._is_valid_file_id(file_id):
+            return False
+
+        with self._connect() as connection:
+            deleted = connection.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,)).rowcount > 0
+
+        self._forget([file_id])
+
+        return deleted
+
+    def total_bytes(self) -> int:
+        """
+        :return: The size of all the uploads combined, in bytes.
+        """
+        with self._connect() as connection:
+            return connection.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM uploads").fetchone()[0]
+
+    def evict(self, keep: str = None) -> List[str]:
+        """
+        Remove the expired uploads and, if the store is still over the size limit, the least recently used ones.
+        :param keep: An upload that must not be evicted (like the one that was just added). (Optional)
+        :return: The ids of the removed uploads.
+        """
+        now = time.time()
+        evicted = []
+
+        with self._connect() as connection:
+            # Taking the write lock before reading, so two workers don't pick (and count) the same victims.
+            connection.execute("BEGIN IMMEDIATE")
+
+            rows = connection.execute(
+                "SELECT file_id, size_bytes, last_accessed_at FROM uploads ORDER BY last_accessed_at"
+            ).fetchall()
+
+            remaining = []
+            for file_id, size_bytes, last_accessed_at in rows:
+                if file_id != keep and self._is_expired(last_accessed_at, now):
+                    evicted.append(file_id)
+                else:
+                    remaining.append((file_id, size_bytes))
+
+            # Least recently used first.
+            total_bytes = sum(size_bytes for _, size_bytes in remaining)
+            for file_id, size_bytes in remaining:
+                if total_bytes <= self.max_total_bytes:
+                    break
+
+                if file_id == keep:
+                    continue
+
+                evicted.append(file_id)
+                total_bytes -= size_bytes
+
+            connection.executemany("DELETE FROM uploads WHERE file_id = ?", [(file_id,) for file_id in evicted])
+
+        self._forget(evicted)
+
+        return evicted
+
@@ -1,10 +1,23 @@
+import asyncio
 import logging
+import math
+import time
+import weakref
 from functools import wraps
-from typing import Callable, Any, Union
+from threading import Lock, local
+from typing import Callable, Any, Union, List, Optional, Tuple, Set
 from datetime import datetime, timedelta
 from timeit import default_timer as timer
 from typing_extensions import TypedDict
 
+# Each power of 2 is split in this many buckets, so percentiles are off by less than 1% (half a bucket).
+GLOBAL_HISTOGRAM_SUB_BUCKETS = 64
+
+# Durations are kept between 2^-30 seconds (~1 nanosecond) and 2^12 seconds (~68 minutes). Anything outside goes in
+# the first/last bucket (min and max are still exact).
+GLOBAL_HISTOGRAM_MIN_EXPONENT = -30
+GLOBAL_HISTOGRAM_MAX_EXPONENT = 12
+
 
 class TimerInfo(TypedDict):
     started_at: Union[datetime, None]
@@ -14,54 +27,290 @@ class TimerInfo(TypedDict):
     elapsed_time: Union[timedelta, None]
 
 
-def benchmark(func: Callable) -> Callable:
-    """
-    A decorator that benchmarks the execution time of a function.
+class BenchmarkStats(TypedDict):
+    count: int
+    # Calls that raised. They are counted in the rest of the stats too.
+    errors: int
+    total_seconds: float
+    mean_seconds: Union[float, None]
+    min_seconds: Union[float, None]
+    max_seconds: Union[float, None]
+    p50_seconds: Union[float, None]
+    p95_seconds: Union[float, None]
+    p99_seconds: Union[float, None]
 
-    The results will be logged using the logging module - INFO level.
 
-    If you want to access the timer information, you can call the decorated function with the
-    method get_benchmark_info().
+def _bucket_index(seconds: float) -> int:
+    if seconds <= 0:
+        return 0
 
-    :param func: The function to benchmark
-    :return: The decorated function
+    # seconds = mantissa * 2^exponent, with the mantissa in [0.5, 1).
+    mantissa, exponent = math.frexp(seconds)
+
+    if exponent < GLOBAL_HISTOGRAM_MIN_EXPONENT:
+        return 0
+
+    if exponent > GLOBAL_HISTOGRAM_MAX_EXPONENT:
+        return _BUCKET_COUNT - 1
+
+    sub_bucket = int((mantissa - 0.5) * 2 * GLOBAL_HISTOGRAM_SUB_BUCKETS)
+    return (exponent - GLOBAL_HISTOGRAM_MIN_EXPONENT) * GLOBAL_HISTOGRAM_SUB_BUCKETS + sub_bucket
+
+
+def _bucket_middle(index: int) -> float:
+    exponent, sub_bucket = divmod(index, GLOBAL_HISTOGRAM_SUB_BUCKETS)
+    mantissa = 0.5 + (sub_bucket + 0.5) / (2 * GLOBAL_HISTOGRAM_SUB_BUCKETS)
+    return math.ldexp(mantissa, exponent + GLOBAL_HISTOGRAM_MIN_EXPONENT)
+
+
+_BUCKET_COUNT = (GLOBAL_HISTOGRAM_MAX_EXPONENT - GLOBAL_HISTOGRAM_MIN_EXPONENT + 1) * GLOBAL_HISTOGRAM_SUB_BUCKETS
+
+
+class _ThreadHistogram:
+    """
+    The durations recorded by one thread. Only that thread writes to it, so no lock is needed to record.
+    Readers may see it a call or two behind, which is fine for stats.
+    Also holds the total of the threads that are gone (see merged).
     """
-    started_at: Union[datetime, None] = None
-    stopped_at: Union[datetime, None] = None
-    start_timer: Union[float, None] = None
-    end_timer: Union[float, None] = None
-    elapsed_time: Union[timedelta, None] = None
 
-    @wraps(func)
-    def wrapper(*args, **kwargs) -> Any:
-        nonlocal started_at
-        nonlocal stopped_at
-        nonlocal start_timer
-        nonlocal end_timer
-        nonlocal elapsed_time
+    def __init__(self):
+        self.counts: List[int] = [0] * _BUCKET_COUNT
+        self.count: int = 0
+        self.errors: int = 0
+        self.total: float = 0
+        self.min: float = math.inf
+        self.max: float = 0
 
-        started_at = datetime.utcnow()
-        start_timer = timer()
+    def record(self, seconds: float, failed: bool):
+        self.counts[_bucket_index(seconds)] += 1
+        self.count += 1
+        self.total += seconds
 
-        result: Any = func(*args, **kwargs)
+        if failed:
+            self.errors += 1
 
-        stopped_at = datetime.utcnow()
-        end_timer = timer()
+        if seconds < self.min:
+            self.min = seconds
 
-        elapsed_time = timedelta(seconds=end_timer - start_timer)
-        logging.info(f"{func.__name__} took {elapsed_time} to execute.")
+        if seconds > self.max:
+            self.max = seconds
 
+    def merged(self, other: "_ThreadHistogram") -> "_ThreadHistogram":
+        """
+        :return: A new histogram, with the durations of both.
+        """
+        result = _ThreadHistogram()
+        result.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        result.count = self.count + other.count
+        result.errors = self.errors + other.errors
+        result.total = self.total + other.total
+        result.min = min(self.min, other.min)
+        result.max = max(self.max, other.max)
         return result
 
-    def get_benchmark_info() -> TimerInfo:
+
+class _ThreadOwner:
+    """
+    Lives in the thread-local storage, so it's collected when its thread ends. (The histogram of the thread is not,
+    since the aggregator keeps a reference to it)
+    """
+    __slots__ = ("__weakref__",)
+
+
+class _Aggregator:
+    """
+    Aggregates the durations of every call, from every thread, into a log-linear histogram (like an HDR histogram).
+    Recording takes constant time and memory, whatever the number of calls.
+    """
+
+    def __init__(self):
+        self._local = local()
+        # Histograms of the threads that are still alive.
+        self._histograms: Set[_ThreadHistogram] = set()
+        # Everything recorded by the threads that are gone. (Replaced, never changed, so readers can use it unlocked)
+        self._retired: _ThreadHistogram = _ThreadHistogram()
+        # Only taken the first time each thread records, when a thread ends, and to read/reset.
+        self._lock = Lock()
+
+    def _get_histogram(self) -> _ThreadHistogram:
+        histogram = getattr(self._local, "histogram", None)
+
+        if histogram is None:
+            histogram = self._local.histogram = _ThreadHistogram()
+            owner = self._local.owner = _ThreadOwner()
+            with self._lock:
+                self._histograms.add(histogram)
+
+            # When the thread ends, its histogram goes into the total. Otherwise, with threads coming and going (e.g.:
+            # a pool that replaces its workers), we would keep a histogram for every thread that ever ran.
+            weakref.finalize(owner, self._retire, histogram).atexit = False
+
+        return histogram
+
+    def _retire(self, histogram: _ThreadHistogram):
+        with self._lock:
+            # Not there if the stats were reset after the thread recorded.
+            if histogram in self._histograms:
+                self._histograms.remove(histogram)
+                self._retired = self._retired.merged(histogram)
+
+    def record(self, seconds: float, failed: bool):
+        self._get_histogram().record(seconds, failed)
+
+    def reset(self):
+        previous_local = self._local
+
+        with self._lock:
+            # Threads will create new ones the next time they record.
+            self._histograms = set()
+            self._retired = _ThreadHistogram()
+            self._local = local()
+
+        # Dropping the old thread-local storage runs the finalizers of its threads (which take the lock), so it has to
+        # happen outside of the lock.
+        del previous_local
+
+    def stats(self) -> BenchmarkStats:
+        with self._lock:
+            histograms = [self._retired, *self._histograms]
+
+        counts = [0] * _BUCKET_COUNT
+        count = errors = 0
+        total = 0
+        minimum = math.inf
+        maximum = 0
+
+        for histogram in histograms:
+            for i, bucket in enumerate(histogram.counts):
+                if bucket:
+                    counts[i] += bucket
+
+            count += histogram.count
+            errors += histogram.errors
+            total += histogram.total
+            minimum = min(minimum, histogram.min)
+            maximum = max(maximum, histogram.max)
+
+        def percentile(p: float) -> Union[float, None]:
+            # The total of the buckets, not count: a thread may have been halfway through recording.
+            recorded = sum(counts)
+            if recorded == 0:
+                return None
+
+            rank = max(math.ceil(p * recorded), 1)
+            seen = 0
+            for i, bucket in enumerate(counts):
+                seen += bucket
+                if seen >= rank:
+                    # Never outside of what was actually seen.
+                    return min(max(_bucket_middle(i), minimum), maximum)
+
         return {
-            "started_at": started_at,
-            "stopped_at": stopped_at,
-            "start_timer": start_timer,
-            "end_timer": end_timer,
-            "elapsed_time": elapsed_time
+            "count": count,
+            "errors": errors,
+            "total_seconds": total,
+            "mean_seconds": total / count if count else None,
+            "min_seconds": minimum if count else None,
+            "max_seconds": maximum if count else None,
+            "p50_seconds": percentile(0.5),
+            "p95_seconds": percentile(0.95),
+            "p99_seconds": percentile(0.99),
         }
 
-    wrapper.get_benchmark_info = get_benchmark_info
 
-    return wrapper
+def benchmark(func: Callable = None, log_calls: bool = True, aggregate: bool = True) -> Callable:
+    """
+    A decorator that benchmarks the execution time of a function. Works with regular and async functions, and with
+    concurrent calls (threads or tasks).
+
+    By default, the results will be logged using the logging module - INFO level.
+
+    If you want to access the timer information of the last call, you can call the decorated function with the
+    method get_benchmark_info(). For the stats of all the calls so far (count, mean, p50/p95/p99, max...), call
+    get_benchmark_stats(), and reset_benchmark_stats() to start over.
+
+    Can be used as @benchmark or @benchmark(...). To leave it on in production, use @benchmark(log_calls=False).
+
+    :param func: The function to benchmark
+    :param log_calls: If True, every call is logged. (Default: True)
+    :param aggregate: If True, every call is recorded in the stats. (Default: True)
+    :return: The decorated function
+    """
+    def decorator(inner_func: Callable) -> Callable:
+        aggregator = _Aggregator()
+        # Only the last call (wall clock start, start timer, end timer). It's replaced as a whole, so it's never a mix
+        # of two concurrent calls. Turned into a TimerInfo only when someone asks for it.
+        last_call: Optional[Tuple[float, float, float]] = None
+
+        def start() -> Tuple[float, float]:
+            return time.time(), timer()
+
+        def stop(started: Tuple[float, float], failed: bool):
+            nonlocal last_call
+
+            end_timer = timer()
+            started_at, start_timer = started
+            elapsed_seconds = end_timer - start_timer
+            last_call = (started_at, start_timer, end_timer)
+
+            if aggregate:
+                aggregator.record(elapsed_seconds, failed)
+
+            if log_calls:
+                logging.info(f"{inner_func.__name__} took {timedelta(seconds=elapsed_seconds)} to execute.")
+
+        if asyncio.iscoroutinefunction(inner_func):
+            @wraps(inner_func)
+            async def wrapper(*args, **kwargs) -> Any:
+                started = start()
+                failed = True
+                try:
+                    result: Any = await inner_func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    stop(started, failed)
+        else:
+            @wraps(inner_func)
+            def wrapper(*args, **kwargs) -> Any:
+                started = start()
+                failed = True
+                try:
+                    result: Any = inner_func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    stop(started, failed)
+
+        def get_benchmark_info() -> TimerInfo:
+            if last_call is None:
+                return {
+                    "started_at": None,
+                    "stopped_at": None,
+                    "start_timer": None,
+                    "end_timer": None,
+                    "elapsed_time": None
+                }
+
+            started_at, start_timer, end_timer = last_call
+            elapsed_time = timedelta(seconds=end_timer - start_timer)
+            started_at = datetime.utcfromtimestamp(started_at)
+
+            return {
+                "started_at": started_at,
+                "stopped_at": started_at + elapsed_time,
+                "start_timer": start_timer,
+                "end_timer": end_timer,
+                "elapsed_time": elapsed_time
+            }
+
+        wrapper.get_benchmark_info = get_benchmark_info
+        wrapper.get_benchmark_stats = aggregator.stats
+        wrapper.reset_benchmark_stats = aggregator.reset
+
+        return wrapper
+
+    if func is None:
+        return decorator
+    else:
+        return decorator(func)
@@ -1,10 +1,315 @@
+import asyncio
 import logging
+import random
+import time
+from collections import deque
 from functools import wraps
+from threading import Lock
 from time import sleep
-from typing import Callable, Any, List, Type, Optional, Union
+from typing import Callable, Any, List, Type, Optional, Union, Deque
 
 import requests
 
+from src.decorators.types import RetryJitter, CircuitState
+from src.shared.http import get_retry_after
+from src.shared.metrics import RETRIES, RETRY_GIVE_UPS, CIRCUIT_REJECTIONS
+
+# If the server asks us to wait longer than this (Retry-After), we give up instead of holding the caller.
+MAX_RETRY_AFTER_SECONDS = 60
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is refused by a circuit breaker, because the upstream is failing.
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        self.name: str = name
+        self.retry_in: float = retry_in
+        super().__init__(f"{name} is failing. Not calling it again for {retry_in:.1f} seconds.")
+
+
+class RetryBudget:
+    """
+    Limits the retries to a percentage of the calls, so an upstream that is down doesn't get all our traffic multiplied
+    by the number of retries. Share the same instance between everything that calls the same upstream(s).
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries_per_second: float = 1, window_seconds: float = 10):
+        """
+        :param ratio: Max retries, as a fraction of the calls made in the window. (Default: 0.2, so 20%)
+        :param min_retries_per_second: Retries that are always allowed, so a low traffic can still retry. (Default: 1)
+        :param window_seconds: How far back we look when counting calls and retries. (Default: 10)
+        """
+        if ratio < 0:
+            raise ValueError("The ratio of retries must be greater than or equal to 0.")
+
+        if min_retries_per_second < 0:
+            raise ValueError("The min retries per second must be greater than or equal to 0.")
+
+        if window_seconds <= 0:
+            raise ValueError("The window must be greater than 0.")
+
+        self.ratio: float = ratio
+        self.min_retries_per_second: float = min_retries_per_second
+        self.window_seconds: float = window_seconds
+
+        self._calls: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+        self._lock = Lock()
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_seconds
+
+        while self._calls and self._calls[0] < cutoff:
+            self._calls.popleft()
+
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def record_call(self):
+        """
+        Count a call (only the first attempt, retries are counted by try_retry).
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            self._trim(now)
+            self._calls.append(now)
+
+    def try_retry(self) -> bool:
+        """
+        Take a retry from the budget.
+        :return: True if we can retry, False if the budget is exhausted.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            self._trim(now)
+
+            allowed = self.min_retries_per_second * self.window_seconds + self.ratio * len(self._calls)
+            if len(self._retries) >= allowed:
+                return False
+
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing. After `failure_threshold` failures in a row the circuit opens, and
+    every call fails right away (CircuitOpenError) for `recovery_timeout` seconds. Then it goes half-open: a few calls
+    go through, and if they work the circuit closes again. If they fail, it opens for another `recovery_timeout`.
+    """
+
+    def __init__(
+            self,
+            name: str = "upstream",
+            failure_threshold: int = 5,
+            recovery_timeout: float = 30,
+            half_open_max_calls: int = 1):
+        """
+        :param name: Name of the upstream, used in the logs and errors. (Default: upstream)
+        :param failure_threshold: How many failures in a row open the circuit. (Default: 5)
+        :param recovery_timeout: How many seconds the circuit stays open before trying again. (Default: 30)
+        :param half_open_max_calls: How many calls can check the upstream at the same time while half-open. (Default: 1)
+        """
+        if failure_threshold < 1:
+            raise ValueError("The failure threshold must be greater than 0.")
+
+        if recovery_timeout < 0:
+            raise ValueError("The recovery timeout must be greater than or equal to 0.")
+
+        if half_open_max_calls < 1:
+            raise ValueError("The max calls while half-open must be greater than 0.")
+
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.recovery_timeout: float = recovery_timeout
+        self.half_open_max_calls: int = half_open_max_calls
+
+        self._failures: int = 0
+        self._opened_at: Optional[float] = None
+        self._probes: int = 0
+        self._lock = Lock()
+
+    def _get_state(self, now: float) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.Closed
+
+        if now - self._opened_at < self.recovery_timeout:
+            return CircuitState.Open
+
+        return CircuitState.HalfOpen
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._get_state(time.monotonic())
+
+    def _open(self, now: float):
+        self._opened_at = now
+        self._probes = 0
+
+    def before_call(self):
+        """
+        Must be called before each call to the upstream. Raises CircuitOpenError if the call is not allowed.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            state = self._get_state(now)
+
+            if state == CircuitState.Closed:
+                return
+
+            if state == CircuitState.HalfOpen and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+
+            retry_in = max(self._opened_at + self.recovery_timeout - now, 0)
+
+        CIRCUIT_REJECTIONS.inc(circuit=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        """
+        The call worked (the upstream is up).
+        """
+        with self._lock:
+            self._failures = 0
+
+            if self._get_state(time.monotonic()) == CircuitState.HalfOpen:
+                logging.info(f"{self.name} is back. Closing the circuit.")
+                self._opened_at = None
+                self._probes = 0
+
+    def record_failure(self):
+        """
+        The call failed (the upstream is down, or in trouble).
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            self._failures += 1
+            state = self._get_state(now)
+
+            if state == CircuitState.HalfOpen:
+                logging.warning(f"{self.name} is still failing. Opening the circuit again.")
+                self._open(now)
+            elif state == CircuitState.Closed and self._failures >= self.failure_threshold:
+                logging.warning(f"{self.name} failed {self._failures} times in a row. Opening the circuit for "
+                                f"{self.recovery_timeout} seconds.")
+                self._open(now)
+
+    def release(self):
+        """
+        The call ended without telling us anything about the upstream (e.g.: it was cancelled).
+        """
+        with self._lock:
+            if self._probes > 0:
+                self._probes -= 1
+
+
+class _Backoff:
+    """
+    Calculates how long to wait before each retry.
+    """
+
+    def __init__(self, delay: float, delay_is_exponential: bool, jitter: RetryJitter, max_delay: Optional[float]):
+        self._delay: float = delay
+        self._delay_is_exponential: bool = delay_is_exponential
+        self._jitter: RetryJitter = jitter
+        self._max_delay: Optional[float] = max_delay
+        self._current_delay: float = delay
+        self._last_wait: float = delay
+
+    def _cap(self, wait: float) -> float:
+        return wait if self._max_delay is None else min(wait, self._max_delay)
+
+    def next_wait(self) -> float:
+        if self._jitter == RetryJitter.Decorrelated:
+            self._last_wait = self._cap(random.uniform(self._delay, max(self._delay, self._last_wait * 3)))
+            return self._last_wait
+
+        wait = self._current_delay if self._jitter == RetryJitter.Off else random.uniform(0, self._current_delay)
+
+        if self._delay_is_exponential:
+            self._current_delay = self._cap(self._current_delay * 2)
+
+        return self._cap(wait)
+
+
+def _validate_retry_config(retries: int, delay: float, max_delay: Optional[float]):
+    if retries < 1:
+        raise ValueError("The number of retries must be greater than 0.")
+
+    if delay < 0:
+        raise ValueError("The delay between retries must be greater than or equal to 0.")
+
+    if max_delay is not None and max_delay < delay:
+        raise ValueError("The max delay must be greater than or equal to the delay.")
+
+
+def _get_retry_after(response: Any) -> Union[float, None]:
+    return get_retry_after(getattr(response, "headers", None))
+
+
+def _get_url(args: tuple, kwargs: dict) -> Union[str, None]:
+    return kwargs.get("url", args[0] if args else None)
+
+
+def _record_response(circuit_breaker: Optional[CircuitBreaker], status_code: int):
+    if circuit_breaker is None:
+        return
+
+    # Anything else means the upstream is up, even if it didn't like our request.
+    if status_code >= 500:
+        circuit_breaker.record_failure()
+    else:
+        circuit_breaker.record_success()
+
+
+def _get_request_retry_wait(
+        response: Any,
+        attempt: int,
+        retries: int,
+        backoff: _Backoff,
+        retry_budget: Optional[RetryBudget],
+        circuit_breaker: Optional[CircuitBreaker],
+        func_name: str) -> Union[float, None]:
+    """
+    :return: How long to wait before the next attempt, or None if we should give up and return the response.
+    """
+    if attempt >= retries:
+        logging.error(f"Failed execution of {func_name} after {retries} attempts.")
+        RETRY_GIVE_UPS.inc(function=func_name, reason="attempts")
+        return None
+
+    if circuit_breaker is not None and circuit_breaker.state == CircuitState.Open:
+        logging.error(f"Circuit for {circuit_breaker.name} is open. Giving up on {func_name}.")
+        RETRY_GIVE_UPS.inc(function=func_name, reason="circuit_open")
+        return None
+
+    # If the server told us how long to wait (usually with a 429 or 503), we wait at least that long.
+    wait = backoff.next_wait()
+    retry_after = _get_retry_after(response)
+    if retry_after is not None:
+        if retry_after > MAX_RETRY_AFTER_SECONDS:
+            logging.error(f"Server asked to wait {retry_after} seconds before retrying {func_name}. Giving up.")
+            RETRY_GIVE_UPS.inc(function=func_name, reason="retry_after")
+            return None
+
+        wait = max(wait, retry_after)
+
+    if retry_budget is not None and not retry_budget.try_retry():
+        logging.error(f"Retry budget exhausted. Giving up on {func_name} after {attempt} attempts.")
+        RETRY_GIVE_UPS.inc(function=func_name, reason="budget")
+        return None
+
+    RETRIES.inc(function=func_name)
+    return wait
+
 
 def retry(
         func: Optional[Callable] = None,
@@ -12,7 +317,11 @@ def retry(
         retries: int = 3,
         delay: float = 1,
         delay_is_exponential: bool = False,
-        only_exceptions_of_type: List[Type[BaseException]] = None
+        only_exceptions_of_type: List[Type[BaseException]] = None,
+        jitter: Union[RetryJitter, str] = RetryJitter.Off,
+        max_delay: Optional[float] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None
 ) -> Union[Callable, Any]:
     """
     A decorator that retries a function call a number of times before giving up.
@@ -26,39 +335,64 @@ def retry(
     :param delay: Delay in seconds between each retry
     :param delay_is_exponential: If True, the delay between retries will increase exponentially
     :param only_exceptions_of_type: A list of exception types to catch and retry on. If None, all exceptions are caught.
+    :param jitter: Randomizes the delays, so callers that failed together don't retry together. (Default: none)
+    :param max_delay: The delay between retries never goes over this. (Optional)
+    :param retry_budget: A budget shared with other callers. When it's exhausted, we stop retrying. (Optional)
+    :param circuit_breaker: If the circuit is open, the call fails right away with CircuitOpenError. (Optional)
     :return: The decorated function
     """
-    if retries < 1:
-        raise ValueError("The number of retries must be greater than 0.")
-
-    if delay < 0:
-        raise ValueError("The delay between retries must be greater than or equal to 0.")
+    _validate_retry_config(retries, delay, max_delay)
+    jitter = RetryJitter(jitter)
 
     def decorator(inner_func: Callable) -> Callable:
         @wraps(inner_func)
         def wrapper(*args, **kwargs) -> Any:
-            current_delay = delay
+            backoff = _Backoff(delay, delay_is_exponential, jitter, max_delay)
+
+            if retry_budget is not None:
+                retry_budget.record_call()
 
             for i in range(1, retries + 1):
+                if circuit_breaker is not None:
+                    circuit_breaker.before_call()
+
                 try:
                     logging.debug(f"Attempt {i} of {retries} for {inner_func.__name__}.")
-                    return inner_func(*args, **kwargs)
+                    result = inner_func(*args, **kwargs)
                 except Exception as e:
                     if (only_exceptions_of_type and
                             not any(isinstance(e, exception_type) for exception_type in only_exceptions_of_type)):
                         logging.debug(f"Not allowed to retry on exception type {type(e)}.")
+                        if circuit_breaker is not None:
+                            circuit_breaker.release()
                         raise e
 
+                    if circuit_breaker is not None:
+                        circuit_breaker.record_failure()
+
                     if i >= retries:
                         logging.error(f"Failed execution of {inner_func.__name__} after {retries} attempts.")
+                        RETRY_GIVE_UPS.inc(function=inner_func.__name__, reason="attempts")
                         break
 
-                    logging.debug(f"Retrying {inner_func.__name__} in {current_delay} seconds. Last error: {repr(e)}")
+                    if retry_budget is not None and not retry_budget.try_retry():
+                        logging.error(f"Retry budget exhausted. Giving up on {inner_func.__name__} after {i} attempts.")
+                        RETRY_GIVE_UPS.inc(function=inner_func.__name__, reason="budget")
+                        break
 
-                    sleep(current_delay)
+                    wait = backoff.next_wait()
+                    logging.debug(f"Retrying {inner_func.__name__} in {wait} seconds. Last error: {repr(e)}")
+                    RETRIES.inc(function=inner_func.__name__)
 
-                    if delay_is_exponential:
-                        current_delay *= 2
+                    sleep(wait)
+                except BaseException:
+                    if circuit_breaker is not None:
+                        circuit_breaker.release()
+                    raise
+                else:
+                    if circuit_breaker is not None:
+                        circuit_breaker.record_success()
+                    return result
 
         return wrapper
 
@@ -68,6 +402,135 @@ def retry(
         return decorator(func)
 
 
+def _can_update_token(kwargs: dict) -> bool:
+    return "headers" in kwargs \
+        and "Authorization" in kwargs["headers"] \
+        and kwargs["headers"]["Authorization"].startswith("Bearer ")
+
+
+class _RequestRetryPolicy:
+    """
+    The settings of retry_request/async_retry_request. Everything they decide is here, so the sync and async versions
+    only differ in how they send the request and wait.
+    """
+
+    def __init__(
+            self,
+            retries: int,
+            delay: float,
+            delay_is_exponential: bool,
+            skip_retry_on_404: bool,
+            retry_only_on_status_codes: Optional[List[int]],
+            get_new_token_on_401: Optional[Callable[[], str]],
+            get_new_token_on_403: Optional[Callable[[], str]],
+            jitter: Union[RetryJitter, str],
+            max_delay: Optional[float],
+            retry_budget: Optional[RetryBudget],
+            get_circuit_breaker: Optional[Callable[[str], Optional[CircuitBreaker]]]):
+        _validate_retry_config(retries, delay, max_delay)
+
+        self.retries: int = retries
+        self.delay: float = delay
+        self.delay_is_exponential: bool = delay_is_exponential
+        self.skip_retry_on_404: bool = skip_retry_on_404
+        self.retry_only_on_status_codes: List[int] = retry_only_on_status_codes or []
+        self.get_new_token_on_401: Optional[Callable[[], str]] = get_new_token_on_401
+        self.get_new_token_on_403: Optional[Callable[[], str]] = get_new_token_on_403
+        self.jitter: RetryJitter = RetryJitter(jitter)
+        self.max_delay: Optional[float] = max_delay
+        self.retry_budget: Optional[RetryBudget] = retry_budget
+        self.get_circuit_breaker: Optional[Callable[[str], Optional[CircuitBreaker]]] = get_circuit_breaker
+
+    def can_retry(self, status_code: int) -> bool:
+        return (len(self.retry_only_on_status_codes) == 0 or status_code in self.retry_only_on_status_codes) \
+            and status_code >= 400
+
+    def start_call(self, func_name: str, args: tuple, kwargs: dict) -> "_RequestCall":
+        return _RequestCall(self, func_name, args, kwargs)
+
+
+class _RequestCall:
+    """
+    The state of one call to a function decorated with retry_request/async_retry_request (through all its attempts).
+    """
+
+    def __init__(self, policy: _RequestRetryPolicy, func_name: str, args: tuple, kwargs: dict):
+        self._policy: _RequestRetryPolicy = policy
+        self._func_name: str = func_name
+        # Same dict the function gets, so a new token is sent in the next attempt.
+        self._kwargs: dict = kwargs
+        self._backoff = _Backoff(policy.delay, policy.delay_is_exponential, policy.jitter, policy.max_delay)
+        self._circuit_breaker: Optional[CircuitBreaker] = \
+            policy.get_circuit_breaker(_get_url(args, kwargs)) if policy.get_circuit_breaker else None
+        self._new_token: Optional[str] = None
+
+        if policy.retry_budget is not None:
+            policy.retry_budget.record_call()
+
+    def before_attempt(self):
+        """
+        Must be called before each attempt. Raises CircuitOpenError if the circuit is open.
+        """
+        if self._new_token and _can_update_token(self._kwargs):
+            self._kwargs["headers"]["Authorization"] = f"Bearer {self._new_token}"
+            self._new_token = None
+
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.before_call()
+
+    def record_error(self):
+        """
+        The attempt raised an exception (it's not retried).
+        """
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.record_failure()
+
+    def record_cancelled(self):
+        """
+        The attempt was interrupted (e.g.: cancelled). Doesn't tell us anything about the upstream.
+        """
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.release()
+
+    def get_retry_wait(self, response: Any, attempt: int) -> Union[float, None]:
+        """
+        Decide what to do with the response of an attempt.
+        :param response: The response.
+        :param attempt: Which attempt it was (starting from 1).
+        :return: How long to wait before the next attempt, or None if the response should be returned.
+        """
+        policy = self._policy
+        status_code = response.status_code
+        _record_response(self._circuit_breaker, status_code)
+
+        if not policy.can_retry(status_code):
+            # We either cannot retry or the request was successful
+            return None
+
+        if status_code == 404 and policy.skip_retry_on_404:
+            logging.debug(f"404 (Not Found) detected and set to skip. Will not retry.")
+            return None
+
+        if status_code == 401 and policy.get_new_token_on_401:
+            logging.debug(f"401 Unauthorized detected. Executing on_401 callable.")
+            self._new_token = policy.get_new_token_on_401()
+
+        if status_code == 403 and policy.get_new_token_on_403:
+            logging.debug(f"403 Forbidden detected. Executing on_403 callable.")
+            self._new_token = policy.get_new_token_on_403()
+
+        wait = _get_request_retry_wait(
+            response, attempt, policy.retries, self._backoff, policy.retry_budget, self._circuit_breaker,
+            self._func_name
+        )
+
+        if wait is not None:
+            logging.debug(f"Attempt {attempt} of {policy.retries} for {self._func_name}. "
+                          f"Retrying in {wait} seconds. Status code: {status_code}")
+
+        return wait
+
+
 def retry_request(
         func: Optional[Callable] = None,
         *,
@@ -77,7 +540,11 @@ def retry_request(
         skip_retry_on_404: bool = False,
         retry_only_on_status_codes: List[int] = None,
         get_new_token_on_401: Optional[Callable[[], str]] = None,
-        get_new_token_on_403: Optional[Callable[[], str]] = None
+        get_new_token_on_403: Optional[Callable[[], str]] = None,
+        jitter: Union[RetryJitter, str] = RetryJitter.Off,
+        max_delay: Optional[float] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        get_circuit_breaker: Optional[Callable[[str], Optional[CircuitBreaker]]] = None
 ) -> Union[Callable, Any]:
     """
     A decorator that retries a http request a number of times before giving up.
@@ -94,68 +561,125 @@ def retry_request(
     :param retry_only_on_status_codes: A list of HTTP status codes to retry on. If None, no retries will be made.
     :param get_new_token_on_401: An optional callable to execute and get a new token when a 401 response is received.
     :param get_new_token_on_403: An optional callable to execute and get a new token when a 403 response is received.
+    :param jitter: Randomizes the delays, so callers that failed together don't retry together. (Default: none)
+    :param max_delay: The delay between retries never goes over this (unless the server asks for more). (Optional)
+    :param retry_budget: A budget shared with other requests. When it's exhausted, we stop retrying. (Optional)
+    :param get_circuit_breaker: An optional callable that receives the url and returns its circuit breaker. While the
+    circuit is open, requests fail right away with CircuitOpenError. Server errors (5xx) and exceptions count as
+    failures.
     :return: The decorated function
     """
-    if retries < 1:
-        raise ValueError("The number of retries must be greater than 0.")
-
-    if delay < 0:
-        raise ValueError("The delay between retries must be greater than or equal to 0.")
-
-    if retry_only_on_status_codes is None:
-        retry_only_on_status_codes = []
-
-    is_restricting_retry_status_code = len(retry_only_on_status_codes) > 0
-
-    def _can_retry(status_code: int) -> bool:
-        return (not is_restricting_retry_status_code or status_code in retry_only_on_status_codes) \
-            and status_code >= 400
 
-    def _can_update_token(**kwargs) -> bool:
-        return "headers" in kwargs \
-            and "Authorization" in kwargs["headers"] \
-            and kwargs["headers"]["Authorization"].startswith("Bearer ")
+    policy = _RequestRetryPolicy(
+        retries, delay, delay_is_exponential, skip_retry_on_404, retry_only_on_status_codes, get_new_token_on_401,
+        get_new_token_on_403, jitter, max_delay, retry_budget, get_circuit_breaker
+    )
 
     def decorator(inner_func: Callable) -> Callable:
         @wraps(inner_func)
         def wrapper(*args, **kwargs) -> requests.Response:
-            current_delay = delay
-            new_token = None
-            for i in range(1, retries + 1):
-                if new_token and _can_update_token(**kwargs):
-                    kwargs["headers"]["Authorization"] = f"Bearer {new_token}"
-                    new_token = None
+            call = policy.start_call(inner_func.__name__, args, kwargs)
 
-                response = inner_func(*args, **kwargs)
-                status_code = response.status_code
+            for i in range(1, retries + 1):
+                call.before_attempt()
 
-                if not _can_retry(status_code):
-                    # We either cannot retry or the request was successful
+                try:
+                    response = inner_func(*args, **kwargs)
+                except Exception:
+                    call.record_error()
+                    raise
+                except BaseException:
+                    call.record_cancelled()
+                    raise
+
+                wait = call.get_retry_wait(response, i)
+                if wait is None:
                     return response
 
-                if status_code == 404 and skip_retry_on_404:
-                    logging.debug(f"404 (Not Found) detected and set to skip. Will not retry.")
-                    return response
+                # We're discarding this response, so release its connection (matters for streamed responses).
+                response.close()
 
-                if status_code == 401 and get_new_token_on_401:
-                    logging.debug(f"401 Unauthorized detected. Executing on_401 callable.")
-                    new_token = get_new_token_on_401()
+                sleep(wait)
 
-                if status_code == 403 and get_new_token_on_403:
-                    logging.debug(f"403 Forbidden detected. Executing on_403 callable.")
-                    new_token = get_new_token_on_403()
+        return wrapper
 
-                if i >= retries:
-                    logging.error(f"Failed execution of {inner_func.__name__} after {retries} attempts.")
-                    return response
+    if func is None:
+        return decorator
+    else:
+        return decorator(func)
+
+
+def async_retry_request(
+        func: Optional[Callable] = None,
+        *,
+        retries: int = 3,
+        delay: float = 1,
+        delay_is_exponential: bool = False,
+        skip_retry_on_404: bool = False,
+        retry_only_on_status_codes: List[int] = None,
+        get_new_token_on_401: Optional[Callable[[], str]] = None,
+        get_new_token_on_403: Optional[Callable[[], str]] = None,
+        jitter: Union[RetryJitter, str] = RetryJitter.Off,
+        max_delay: Optional[float] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        get_circuit_breaker: Optional[Callable[[str], Optional[CircuitBreaker]]] = None
+) -> Union[Callable, Any]:
+    """
+    Async version of retry_request. Works the same way, but decorates coroutine functions and waits between retries
+    using asyncio.sleep, so the event loop is free to do other things while we wait.
+
+    The results will be logged using the logging module - DEBUG level.
+    Except for the last attempt, where it will log an ERROR level message.
 
-                logging.debug(f"Attempt {i} of {retries} for {inner_func.__name__}. "
-                              f"Retrying in {current_delay} seconds. Status code: {status_code}")
+    :param func: The coroutine function to retry. This should not be set manually. Python sets it when using the
+    decorator without parentheses.
+    :param retries: Maximum number of retries before giving up
+    :param delay: Delay in seconds between each retry
+    :param delay_is_exponential: If True, the delay between retries will increase exponentially
+    :param skip_retry_on_404: If True, the decorator will not retry on 404 responses
+    :param retry_only_on_status_codes: A list of HTTP status codes to retry on. If None, no retries will be made.
+    :param get_new_token_on_401: An optional callable to execute and get a new token when a 401 response is received.
+    :param get_new_token_on_403: An optional callable to execute and get a new token when a 403 response is received.
+    :param jitter: Randomizes the delays, so callers that failed together don't retry together. (Default: none)
+    :param max_delay: The delay between retries never goes over this (unless the server asks for more). (Optional)
+    :param retry_budget: A budget shared with other requests. When it's exhausted, we stop retrying. (Optional)
+    :param get_circuit_breaker: An optional callable that receives the url and returns its circuit breaker. While the
+    circuit is open, requests fail right away with CircuitOpenError. Server errors (5xx) and exceptions count as
+    failures.
+    :return: The decorated coroutine function
+    """
+
+    policy = _RequestRetryPolicy(
+        retries, delay, delay_is_exponential, skip_retry_on_404, retry_only_on_status_codes, get_new_token_on_401,
+        get_new_token_on_403, jitter, max_delay, retry_budget, get_circuit_breaker
+    )
+
+    def decorator(inner_func: Callable) -> Callable:
+        @wraps(inner_func)
+        async def wrapper(*args, **kwargs) -> Any:
+            call = policy.start_call(inner_func.__name__, args, kwargs)
+
+            for i in range(1, retries + 1):
+                call.before_attempt()
+
+                try:
+                    response = await inner_func(*args, **kwargs)
+                except Exception:
+                    call.record_error()
+                    raise
+                except BaseException:
+                    # Cancelled: doesn't tell us anything about the upstream.
+                    call.record_cancelled()
+                    raise
+
+                wait = call.get_retry_wait(response, i)
+                if wait is None:
+                    return response
 
-                sleep(current_delay)
+                # We're discarding this response, so release its connection (matters for streamed responses).
+                await response.aclose()
 
-                if delay_is_exponential:
-                    current_delay *= 2
+                await asyncio.sleep(wait)
 
         return wrapper
 
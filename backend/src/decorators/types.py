@@ -0,0 +1,19 @@
+from enum import Enum
+
+
+class RetryJitter(Enum):
+    # Everyone waits exactly the delay (doubling it, if exponential). The original behavior.
+    Off = "none"
+    # Waits a random time between 0 and the delay (doubling it, if exponential).
+    Full = "full"
+    # Waits a random time between the delay and 3x the last wait. Grows by itself, so delay_is_exponential is ignored.
+    Decorrelated = "decorrelated"
+
+
+class CircuitState(Enum):
+    # Everything goes through.
+    Closed = "closed"
+    # Too many failures in a row: everything fails right away, without calling the upstream.
+    Open = "open"
+    # The recovery timeout passed: a few calls go through to check if the upstream is back.
+    HalfOpen = "half_open"
@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Set
+from uuid import uuid4
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.ai_utils.token_counter import approximate_token_count
+from src.load_testing.types import MockServerSettings, MockLatencyDistribution, MockServerStats
+
+GLOBAL_MOCK_HOST = "127.0.0.1"
+GLOBAL_MOCK_PORT = 42999
+
+
+def _get_latency(settings: MockServerSettings, rng: random.Random) -> float:
+    if settings.latency_distribution == MockLatencyDistribution.Fixed:
+        return settings.latency_seconds
+
+    if settings.latency_distribution == MockLatencyDistribution.Uniform:
+        spread = settings.latency_seconds * settings.latency_spread
+        return max(rng.uniform(settings.latency_seconds - spread, settings.latency_seconds + spread), 0)
+
+    # The median of a log-normal is e^mu.
+    return rng.lognormvariate(0, settings.latency_spread) * settings.latency_seconds
+
+
+def _get_usage(messages: list, completion_tokens: int, cached_prefixes: Set[str]) -> dict:
+    prompt_tokens = sum(approximate_token_count(str(message.get("content") or "")) for message in messages)
+    cached_tokens = 0
+
+    # Like the prompt caching of the real providers, but simpler: a system message seen before is "cached" (no
+    # matter its size, and it never expires).
+    if len(messages) > 0 and messages[0].get("role") == "system":
+        prefix = str(messages[0].get("content") or "")
+
+        if prefix in cached_prefixes:
+            cached_tokens = approximate_token_count(prefix)
+        else:
+            cached_prefixes.add(prefix)
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens}
+    }
+
+
+def create_mock_app(settings: MockServerSettings) -> FastAPI:
+    """
+    Create a fake OpenAI-compatible API (POST /v1/chat/completions), to load test without paying a real provider.
+    Answers with made up text, after a random delay, and fails as often as the settings say.
+    The counters are in GET /mock/stats (and are zeroed by DELETE /mock/stats).
+    :param settings: How it should behave.
+    :return: The app, ready to be served by uvicorn.
+    """
+    app = FastAPI()
+    rng = random.Random(settings.seed)
+    stats = MockServerStats()
+    cached_prefixes: Set[str] = set()
+
+    # Always the same text, so the only thing changing between requests is the latency.
+    completion = " ".join(f"word{i}" for i in range(settings.completion_tokens))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats.requests += 1
+
+        # Deciding everything up front, so the sequence is the same for the same seed.
+        draw = rng.random()
+        latency = _get_latency(settings, rng)
+
+        if draw < settings.rate_limit_rate:
+            stats.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (mock).", "type": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": str(settings.retry_after_seconds)}
+            )
+
+        if draw < settings.rate_limit_rate + settings.error_rate:
+            # Failing takes time too.
+            await asyncio.sleep(latency / 2)
+            stats.errors += 1
+            return JSONResponse({"error": {"message": "Internal error (mock).", "type": "server_error"}}, 500)
+
+        response_id = f"chatcmpl-mock-{uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "mock-model")
+        usage = _get_usage(body.get("messages", []), settings.completion_tokens, cached_prefixes)
+        stats.prompt_tokens += usage["prompt_tokens"]
+        stats.cached_prompt_tokens += usage["prompt_tokens_details"]["cached_tokens"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return {
+                "id": response_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": completion},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            }
+
+        stats.streams += 1
+        words = completion.split(" ")
+        chunk_count = max(min(settings.stream_chunks, len(words)), 1)
+        chunk_size = -(-len(words) // chunk_count)
+
+        def event(choices: list, **extra) -> str:
+            chunk = {
+                "id": response_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+                **extra
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        async def stream():
+            for i in range(0, len(words), chunk_size):
+                await asyncio.sleep(latency / chunk_count)
+                content = " ".join(words[i:i + chunk_size]) + ("" if i + chunk_size >= len(words) else " ")
+                yield event([{"index": 0, "delta": {"content": content}, "finish_reason": None}])
+
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield event([], usage=usage)
+
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/mock/stats", response_model=MockServerStats)
+    async def get_stats():
+        return stats
+
+    @app.delete("/mock/stats", response_model=MockServerStats)
+    async def reset_stats():
+        nonlocal stats
+        previous, stats = stats, MockServerStats()
+        return previous
+
+    return app
+
+
+def run_mock_server(settings: MockServerSettings, host: str = GLOBAL_MOCK_HOST, port: int = GLOBAL_MOCK_PORT):
+    """
+    Serve the mock API until the process is stopped.
+    """
+    uvicorn.run(create_mock_app(settings), host=host, port=port, log_level="warning")
+
+
+if __name__ == '__main__':
+    # Used by the load test runner, to start it in another process.
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible API, for load testing.")
+    parser.add_argument("--host", type=str, default=GLOBAL_MOCK_HOST)
+    parser.add_argument("--port", type=int, default=GLOBAL_MOCK_PORT)
+    parser.add_argument("--settings", type=str, default="{}", help="MockServerSettings, as JSON.")
+    args = parser.parse_args()
+
+    run_mock_server(MockServerSettings.model_validate_json(args.settings), args.host, args.port)
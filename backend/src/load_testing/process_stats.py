@@ -0,0 +1,105 @@
+import asyncio
+import importlib.util
+import os
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Optional, Tuple
+
+from src.load_testing.types import ProcessStats
+
+_PSUTIL_AVAILABLE = importlib.util.find_spec("psutil") is not None
+
+
+def _read_process(pid: int) -> Optional[Tuple[float, int]]:
+    """
+    Read the CPU time and resident memory of a process.
+    Uses psutil if it's installed. Otherwise, only works on Linux (/proc).
+    :param pid: The process.
+    :return: CPU seconds (user + system) and RSS bytes, or None if it can't be read.
+    """
+    if _PSUTIL_AVAILABLE:
+        import psutil
+
+        try:
+            process = psutil.Process(pid)
+            cpu_times = process.cpu_times()
+            return cpu_times.user + cpu_times.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+
+    proc = Path("/proc").joinpath(str(pid))
+
+    try:
+        # The command name (2nd field) may have spaces, so splitting after it. utime and stime are the 14th and 15th.
+        stat = proc.joinpath("stat").read_text().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(stat[11]) + int(stat[12])) / os.sysconf("SC_CLK_TCK")
+        rss_bytes = int(stat[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu_seconds, rss_bytes
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ProcessMonitor:
+    """
+    Watches the CPU and memory of a process (e.g.: the API) while a scenario runs.
+    Memory is sampled every interval, so the peak is approximate.
+
+    Usage:
+        async with ProcessMonitor(pid) as monitor:
+            ...
+        stats = monitor.stats
+    """
+
+    def __init__(self, pid: Optional[int], interval_seconds: float = 0.1):
+        """
+        :param pid: The process. If None (or it can't be read), stats will be None.
+        :param interval_seconds: How often the memory is sampled. (Default: 0.1)
+        """
+        self.pid: Optional[int] = pid
+        self.interval_seconds: float = interval_seconds
+        self.stats: Optional[ProcessStats] = None
+
+        self._start: Optional[Tuple[float, int]] = None
+        self._started_at: float = 0
+        self._peak_rss: int = 0
+        self._sampler: Optional[asyncio.Task] = None
+
+    async def _sample(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            sample = await asyncio.to_thread(_read_process, self.pid)
+            if sample is not None:
+                self._peak_rss = max(self._peak_rss, sample[1])
+
+    async def __aenter__(self) -> "ProcessMonitor":
+        if self.pid is None:
+            return self
+
+        self._start = await asyncio.to_thread(_read_process, self.pid)
+        self._started_at = timer()
+
+        if self._start is not None:
+            self._peak_rss = self._start[1]
+            self._sampler = asyncio.create_task(self._sample())
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._sampler is None:
+            return
+
+        self._sampler.cancel()
+        end = await asyncio.to_thread(_read_process, self.pid)
+        duration = timer() - self._started_at
+
+        if end is None:
+            return
+
+        cpu_seconds = end[0] - self._start[0]
+        self.stats = ProcessStats(
+            cpu_seconds=cpu_seconds,
+            cpu_percent=cpu_seconds / duration * 100 if duration > 0 else 0,
+            rss_start_bytes=self._start[1],
+            rss_end_bytes=end[1],
+            rss_peak_bytes=max(self._peak_rss, end[1])
+        )
@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from src.benchmarks.harness import get_code_version
+from src.load_testing.process_stats import ProcessMonitor
+from src.load_testing.types import LoadTestScenario, LoadTestScenarioType, LoadTestScenarioResult, LatencyStats, \
+    LoadTestReport, MockServerSettings, MockServerStats, LoadTestComparison
+from src.shared.config import ROOT_FOLDER, SAMPLE_DATASETS_FOLDER, BENCHMARKS_FOLDER
+from src.shared.loggers import get_filename_for_new_file
+
+GLOBAL_SAMPLE_DATASET = SAMPLE_DATASETS_FOLDER.joinpath("ad_click_prediction").joinpath("Social_Network_Ads.csv")
+
+GLOBAL_QUESTION = "What is the meaning of life, the universe, and everything?"
+GLOBAL_ANALYSIS_PROMPT = "Give me the top 3 profiles that will most likely make a purchase by clicking an ad."
+
+# How long to wait for the mock/API processes to start.
+GLOBAL_STARTUP_TIMEOUT_SECONDS = 30
+
+
+class _ScenarioState:
+    def __init__(self, client: httpx.AsyncClient, scenario: LoadTestScenario):
+        self.client: httpx.AsyncClient = client
+        self.scenario: LoadTestScenario = scenario
+        self.dataset: bytes = b""
+        # The file analyzed by the analyze_data scenario.
+        self.file_id: Optional[str] = None
+        # Everything we uploaded, to delete when done.
+        self.uploaded_file_ids: List[str] = []
+
+    def prompt(self, text: str, index: int) -> str:
+        return f"{text} (#{index})" if self.scenario.unique_prompts else text
+
+
+async def _upload(state: _ScenarioState) -> str:
+    response = await state.client.post(
+        "/upload-data-file", files={"file": (GLOBAL_SAMPLE_DATASET.name, state.dataset, "text/csv")}
+    )
+    response.raise_for_status()
+
+    file_id = response.json()["file_id"]
+    state.uploaded_file_ids.append(file_id)
+    return file_id
+
+
+# Each one sends a single request (raising if it fails) and returns the time to the first byte, for streams.
+async def _send_ask_question(state: _ScenarioState, index: int) -> Optional[float]:
+    response = await state.client.post(
+        "/ask-question", json={"question_or_prompt": state.prompt(GLOBAL_QUESTION, index)}
+    )
+    response.raise_for_status()
+    return None
+
+
+async def _send_ask_question_stream(state: _ScenarioState, index: int) -> Optional[float]:
+    started_at = timer()
+    time_to_first_byte = None
+
+    payload = {"question_or_prompt": state.prompt(GLOBAL_QUESTION, index)}
+    async with state.client.stream("POST", "/ask-question/stream", json=payload) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            if time_to_first_byte is None:
+                time_to_first_byte = timer() - started_at
+
+    return time_to_first_byte
+
+
+async def _send_analyze_data(state: _ScenarioState, index: int) -> Optional[float]:
+    response = await state.client.post(
+        "/analyze-data",
+        json={"question_or_prompt": state.prompt(GLOBAL_ANALYSIS_PROMPT, index), "file_id": state.file_id}
+    )
+    response.raise_for_status()
+    return None
+
+
+async def _send_upload_data_file(state: _ScenarioState, index: int) -> Optional[float]:
+    await _upload(state)
+    return None
+
+
+_SENDERS: Dict[LoadTestScenarioType, Callable[[_ScenarioState, int], Awaitable[Optional[float]]]] = {
+    LoadTestScenarioType.AskQuestion: _send_ask_question,
+    LoadTestScenarioType.AskQuestionStream: _send_ask_question_stream,
+    LoadTestScenarioType.AnalyzeData: _send_analyze_data,
+    LoadTestScenarioType.UploadDataFile: _send_upload_data_file,
+}
+
+
+class _Measurements:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.times_to_first_byte: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+
+async def _send_requests(
+        state: _ScenarioState,
+        count: int,
+        concurrency: int,
+        measurements: Optional[_Measurements] = None):
+    """
+    Send count requests, concurrency at a time (closed loop: each worker sends the next one when it gets an answer).
+    """
+    send = _SENDERS[state.scenario.scenario_type]
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+
+        while sent < count:
+            index = sent
+            sent += 1
+
+            started_at = timer()
+            try:
+                time_to_first_byte = await send(state, index)
+            except httpx.HTTPStatusError as e:
+                error = str(e.response.status_code)
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            else:
+                error = None
+
+            if measurements is None:
+                continue
+
+            if error is not None:
+                measurements.errors[error] = measurements.errors.get(error, 0) + 1
+                continue
+
+            measurements.latencies.append(timer() - started_at)
+            if time_to_first_byte is not None:
+                measurements.times_to_first_byte.append(time_to_first_byte)
+
+    await asyncio.gather(*(worker() for _ in range(max(min(concurrency, count), 1))))
+
+
+def get_latency_stats(values: List[float]) -> LatencyStats:
+    """
+    Summarize latencies (nearest rank percentiles).
+    :param values: The latencies, in seconds.
+    :return: The stats. All None if there are no values.
+    """
+    if len(values) == 0:
+        return LatencyStats(mean=None, min=None, p50=None, p90=None, p95=None, p99=None, max=None)
+
+    values = sorted(values)
+
+    def percentile(p: float) -> float:
+        return values[max(math.ceil(p * len(values)), 1) - 1]
+
+    return LatencyStats(
+        mean=sum(values) / len(values),
+        min=values[0],
+        p50=percentile(0.5),
+        p90=percentile(0.9),
+        p95=percentile(0.95),
+        p99=percentile(0.99),
+        max=values[-1]
+    )
+
+
+async def _get_mock_stats(mock_url: Optional[str], reset: bool = False) -> Optional[MockServerStats]:
+    if not mock_url:
+        return None
+
+    async with httpx.AsyncClient(base_url=mock_url) as client:
+        response = await (client.delete("/mock/stats") if reset else client.get("/mock/stats"))
+        response.raise_for_status()
+        return MockServerStats.model_validate(response.json())
+
+
+async def run_scenario(
+        api_url: str,
+        scenario: LoadTestScenario,
+        api_pid: Optional[int] = None,
+        mock_url: Optional[str] = None) -> LoadTestScenarioResult:
+    """
+    Run a single scenario against a running API.
+    :param api_url: Base URL of the API. (e.g.: http://127.0.0.1:42000)
+    :param scenario: What to run.
+    :param api_pid: The process of the API, to measure its CPU and memory. (Optional)
+    :param mock_url: Base URL of the mock AI server, to count the requests that reached it. (Optional)
+    :return: The result.
+    """
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=120) as client:
+        state = _ScenarioState(client, scenario)
+        state.dataset = await asyncio.to_thread(GLOBAL_SAMPLE_DATASET.read_bytes)
+
+        try:
+            if scenario.scenario_type == LoadTestScenarioType.AnalyzeData:
+                state.file_id = await _upload(state)
+
+            await _send_requests(state, scenario.warmup_requests, scenario.concurrency)
+
+            measurements = _Measurements()
+            await _get_mock_stats(mock_url, reset=True)
+            client_cpu_started_at = time.process_time()
+            started_at = timer()
+
+            async with ProcessMonitor(api_pid) as monitor:
+                await _send_requests(state, scenario.requests, scenario.concurrency, measurements)
+
+            duration = timer() - started_at
+            client_cpu_seconds = time.process_time() - client_cpu_started_at
+            upstream = await _get_mock_stats(mock_url)
+        finally:
+            for file_id in state.uploaded_file_ids:
+                try:
+                    await client.delete(f"/upload-data-file/{file_id}")
+                except httpx.HTTPError:
+                    pass
+
+    return LoadTestScenarioResult(
+        name=scenario.name,
+        scenario=scenario,
+        duration_seconds=duration,
+        requests=scenario.requests,
+        successes=len(measurements.latencies),
+        errors=measurements.errors,
+        requests_per_second=len(measurements.latencies) / duration if duration > 0 else 0,
+        latency=get_latency_stats(measurements.latencies),
+        time_to_first_byte=get_latency_stats(measurements.times_to_first_byte)
+        if scenario.scenario_type == LoadTestScenarioType.AskQuestionStream else None,
+        api_process=monitor.stats,
+        client_cpu_seconds=client_cpu_seconds,
+        upstream=upstream
+    )
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(process: subprocess.Popen, url: str, name: str):
+    deadline = time.monotonic() + GLOBAL_STARTUP_TIMEOUT_SECONDS
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {name} exited with code {process.returncode} before it was ready.")
+
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+
+        time.sleep(0.2)
+
+    raise TimeoutError(f"The {name} was not ready after {GLOBAL_STARTUP_TIMEOUT_SECONDS} seconds.")
+
+
+def _stop(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_load_test(
+        scenarios: List[LoadTestScenario],
+        mock_settings: Optional[MockServerSettings] = None,
+        api_url: Optional[str] = None,
+        api_pid: Optional[int] = None,
+        mock_url: Optional[str] = None) -> LoadTestReport:
+    """
+    Run the scenarios, one after the other.
+
+    If no api_url is informed, the mock AI server and the API are started (each in its own process, with the API
+    pointing to the mock) and stopped when done. Any other setting of the API (cache, rate limits...) comes from the
+    environment/.env, same as usual.
+
+    :param scenarios: What to run.
+    :param mock_settings: How the mock AI server behaves. Only used when the processes are started here.
+    (Default: MockServerSettings())
+    :param api_url: Base URL of an API that is already running. (Optional)
+    :param api_pid: The process of that API, to measure its CPU and memory. (Optional)
+    :param mock_url: Base URL of the mock AI server that API talks to, if any. (Optional)
+    :return: The results.
+    """
+    started_at = datetime.now(timezone.utc).isoformat()
+    mock_process = api_process = None
+
+    try:
+        if api_url is None:
+            mock_settings = mock_settings or MockServerSettings()
+            mock_port = _get_free_port()
+            mock_url = f"http://127.0.0.1:{mock_port}"
+            mock_process = subprocess.Popen(
+                [sys.executable, "-m", "src.load_testing.mock_llm_server", "--port", str(mock_port),
+                 "--settings", mock_settings.model_dump_json()],
+                cwd=ROOT_FOLDER
+            )
+            _wait_until_ready(mock_process, f"{mock_url}/mock/stats", "mock AI server")
+
+            api_port = _get_free_port()
+            api_url = f"http://127.0.0.1:{api_port}"
+            api_process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(api_port),
+                 "--log-level", "warning", "--no-access-log"],
+                cwd=ROOT_FOLDER,
+                env={
+                    **os.environ,
+                    # Set here, so the values in .env (the real provider) are not used.
+                    "AI_API_URL": f"{mock_url}/v1/chat/completions",
+                    "AI_API_KEY": "load-test",
+                    "MODEL_NAME": "mock-model",
+                    "AI_PROVIDERS_FILE": ""
+                }
+            )
+            api_pid = api_process.pid
+            _wait_until_ready(api_process, f"{api_url}/ping", "API")
+        else:
+            mock_settings = None
+
+        results = []
+        for scenario in scenarios:
+            logging.info(f"Running {scenario.name} ({scenario.requests} requests)...")
+            result = await run_scenario(api_url, scenario, api_pid, mock_url)
+            logging.info(f"{scenario.name}: {result.requests_per_second:.1f} req/s, p50 {result.latency.p50}s, "
+                         f"p99 {result.latency.p99}s, {sum(result.errors.values())} errors.")
+            results.append(result)
+    finally:
+        _stop(api_process)
+        _stop(mock_process)
+
+    return LoadTestReport(
+        started_at=started_at,
+        version=get_code_version(),
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        api_url=api_url,
+        mock_server=mock_settings,
+        results=results
+    )
+
+
+def save_report(report: LoadTestReport, file: Optional[Path] = None) -> Path:
+    """
+    Save the results as JSON.
+    :param report: The results.
+    :param file: Where to save it. (Default: .benchmarks/load-test-<datetime>.json)
+    :return: The file.
+    """
+    if file is None:
+        file = BENCHMARKS_FOLDER.joinpath(get_filename_for_new_file(
+            ".json", prefix="load-test", unique_identifier=report.version or False
+        ))
+
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(report.model_dump_json(indent=2), encoding="utf-8")
+    return file
+
+
+def load_report(file: Path) -> LoadTestReport:
+    return LoadTestReport.model_validate_json(file.read_text(encoding="utf-8"))
+
+
+# Metric name, how to get it from a result, and whether higher is better.
+_COMPARED_METRICS = [
+    ("requests_per_second", lambda r: r.requests_per_second, True),
+    ("latency_p50", lambda r: r.latency.p50, False),
+    ("latency_p95", lambda r: r.latency.p95, False),
+    ("latency_p99", lambda r: r.latency.p99, False),
+    ("error_rate", lambda r: 1 - r.successes / r.requests if r.requests else None, False),
+    ("api_cpu_ms_per_request",
+     lambda r: r.api_process.cpu_seconds * 1000 / r.successes if r.api_process and r.successes else None, False),
+    ("api_rss_peak_mb", lambda r: r.api_process.rss_peak_bytes / 1024 ** 2 if r.api_process else None, False),
+]
+
+
+def compare_reports(
+        baseline: LoadTestReport,
+        current: LoadTestReport,
+        threshold_percent: float = 10) -> List[LoadTestComparison]:
+    """
+    Compare the scenarios that are in both reports.
+    :param baseline: The old results.
+    :param current: The new results.
+    :param threshold_percent: How much worse a metric can get before it's a regression. (Default: 10%)
+    :return: One comparison per scenario and metric.
+    """
+    baseline_results = {result.name: result for result in baseline.results}
+    comparisons = []
+
+    for result in current.results:
+        old = baseline_results.get(result.name)
+        if old is None:
+            continue
+
+        for metric, get_value, higher_is_better in _COMPARED_METRICS:
+            old_value, new_value = get_value(old), get_value(result)
+
+            if old_value is None or new_value is None:
+                change_percent = None
+                regression = False
+            elif old_value == 0:
+                change_percent = None
+                # Going from no errors to some errors is a regression, however few.
+                regression = new_value > 0 and not higher_is_better
+            else:
+                change_percent = (new_value - old_value) / old_value * 100
+                regression = (-change_percent if higher_is_better else change_percent) > threshold_percent
+
+            comparisons.append(LoadTestComparison(
+                name=result.name,
+                metric=metric,
+                baseline=old_value,
+                current=new_value,
+                change_percent=change_percent,
+                regression=regression
+            ))
+
+    return comparisons
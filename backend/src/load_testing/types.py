@@ -0,0 +1,133 @@
+from enum import Enum
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class MockLatencyDistribution(Enum):
+    # Every answer takes exactly latency_seconds.
+    Fixed = "fixed"
+    # Between latency_seconds * (1 - latency_spread) and latency_seconds * (1 + latency_spread).
+    Uniform = "uniform"
+    # Log-normal, with median latency_seconds and sigma latency_spread. Has a long tail, like the real thing.
+    LogNormal = "lognormal"
+
+
+class MockServerSettings(BaseModel):
+    latency_distribution: MockLatencyDistribution = MockLatencyDistribution.LogNormal
+    # Time to the complete answer (fixed, average or median, depending on the distribution).
+    latency_seconds: float = 0.5
+    latency_spread: float = 0.5
+    # Size of the answers. Streams send them in stream_chunks chunks, spread over the latency.
+    completion_tokens: int = 50
+    stream_chunks: int = 10
+    # Fraction (0 to 1) of the requests answered with a 500.
+    error_rate: float = 0
+    # Fraction (0 to 1) of the requests answered with a 429 (with Retry-After).
+    rate_limit_rate: float = 0
+    retry_after_seconds: float = 1
+    # To get the same latencies/errors on every run. (Optional)
+    seed: Optional[int] = None
+
+
+class MockServerStats(BaseModel):
+    requests: int = 0
+    streams: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    prompt_tokens: int = 0
+    # Prompt tokens that would be served from the cache of a real provider (same system message seen before).
+    cached_prompt_tokens: int = 0
+
+
+class LoadTestScenarioType(Enum):
+    # POST /ask-question
+    AskQuestion = "ask_question"
+    # POST /ask-question/stream, reading the whole stream.
+    AskQuestionStream = "ask_question_stream"
+    # POST /analyze-data, with the sample dataset uploaded once before the scenario starts.
+    AnalyzeData = "analyze_data"
+    # POST /upload-data-file, with the sample dataset. The files are deleted after the scenario.
+    UploadDataFile = "upload_data_file"
+
+
+class LoadTestScenario(BaseModel):
+    scenario_type: LoadTestScenarioType
+    # Requests sent at the same time.
+    concurrency: int = 10
+    # Requests measured (after the warmup).
+    requests: int = 200
+    # Requests sent (and ignored) before measuring, so connections/caches are warm.
+    warmup_requests: int = 10
+    # Add a number to each question. If False, they are all the same (and may be coalesced/cached by the API).
+    unique_prompts: bool = True
+
+    @property
+    def name(self) -> str:
+        return f"{self.scenario_type.value}@{self.concurrency}"
+
+
+class LatencyStats(BaseModel):
+    mean: Optional[float]
+    min: Optional[float]
+    p50: Optional[float]
+    p90: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+    max: Optional[float]
+
+
+class ProcessStats(BaseModel):
+    # CPU time (user + system) used by the process during the scenario.
+    cpu_seconds: float
+    # cpu_seconds / duration. Can go over 100 with more than one thread running at the same time.
+    cpu_percent: float
+    # Resident memory.
+    rss_start_bytes: int
+    rss_end_bytes: int
+    rss_peak_bytes: int
+
+
+class LoadTestScenarioResult(BaseModel):
+    name: str
+    scenario: LoadTestScenario
+    duration_seconds: float
+    requests: int
+    successes: int
+    # Failed requests, per status code (or exception name, if there was no response).
+    errors: Dict[str, int]
+    requests_per_second: float
+    # In seconds. Only the successful requests.
+    latency: LatencyStats
+    # Streams only: time to the first chunk.
+    time_to_first_byte: Optional[LatencyStats] = None
+    # The API, if we know its process. None if it's not running on this machine (or we can't read it).
+    api_process: Optional[ProcessStats] = None
+    # CPU time used by the load generator itself. If it's close to the duration, it's the bottleneck, not the API.
+    client_cpu_seconds: float
+    # Requests that reached the mock AI (retries included, coalesced/cached ones not). None if not using the mock.
+    upstream: Optional[MockServerStats] = None
+
+
+class LoadTestReport(BaseModel):
+    # UTC, ISO 8601.
+    started_at: str
+    # The commit being tested (with a + if there were uncommitted changes). None if not in a git repository.
+    version: Optional[str]
+    python_version: str
+    platform: str
+    api_url: str
+    # None when testing an API that talks to a real provider.
+    mock_server: Optional[MockServerSettings]
+    results: List[LoadTestScenarioResult]
+
+
+class LoadTestComparison(BaseModel):
+    name: str
+    metric: str
+    baseline: Optional[float]
+    current: Optional[float]
+    # (current - baseline) / baseline, in %. None if there's nothing to compare.
+    change_percent: Optional[float]
+    # True if it got worse by more than the threshold.
+    regression: bool
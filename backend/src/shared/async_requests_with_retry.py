@@ -0,0 +1,161 @@
+from typing import Awaitable, Callable
+
+import httpx
+
+from src.decorators.retry import async_retry_request
+from src.shared.http_sessions import get_async_client
+from src.shared.rate_limiter import get_async_rate_limiter
+from src.shared.requests_with_retry import _get_decorator_config, encode_json_body
+
+
+async def _send(url: str, estimated_tokens: int, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+    """
+    If the host has a rate limiter (see configure_rate_limit), wait for our turn before sending the request.
+    """
+    rate_limiter = get_async_rate_limiter(url)
+    if rate_limiter is None:
+        return await send()
+
+    # Each attempt (retries included) waits in line, so a 429 holds everyone instead of making them retry sooner.
+    async with rate_limiter.limit(estimated_tokens):
+        response = await send()
+
+    rate_limiter.update_from_response(response.status_code, response.headers, estimated_tokens)
+    return response
+
+
+async def _request(method: str, url: str, estimated_tokens: int = 0, **kwargs) -> httpx.Response:
+    """
+    Sends a request using the pooled async client of the host, so connections are reused between calls (and retries).
+    :param estimated_tokens: How many tokens the request will use, for the tokens per minute limit. (Default: 0)
+    """
+    return await _send(url, estimated_tokens, lambda: get_async_client(url).request(method, url, **kwargs))
+
+
+@async_retry_request(**_get_decorator_config())
+async def get(url, params=None, **kwargs) -> httpx.Response:
+    r"""Sends a GET request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param params: (optional) Dictionary, list of tuples or bytes to send
+        in the query string for the :class:`Request`.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    return await _request("GET", url, params=params, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def options(url, **kwargs) -> httpx.Response:
+    r"""Sends an OPTIONS request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    return await _request("OPTIONS", url, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def head(url, **kwargs) -> httpx.Response:
+    r"""Sends a HEAD request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    return await _request("HEAD", url, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def post(url, data=None, json=None, **kwargs) -> httpx.Response:
+    r"""Sends a POST request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param data: (optional) Dictionary to send in the body of the :class:`Request`.
+    :param json: (optional) A JSON serializable Python object to send in the body of the :class:`Request`.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+    if json is not None:
+        kwargs["content"], kwargs["headers"] = encode_json_body(json, kwargs.get("headers"))
+
+    return await _request("POST", url, data=data, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def post_stream(url, data=None, json=None, estimated_tokens: int = 0, **kwargs) -> httpx.Response:
+    r"""Sends a POST request, but returns as soon as the headers arrive, so the body can be read while it's still
+    being generated (e.g.: using ``aiter_lines``). Remember to ``aclose`` the response when done.
+
+    :param url: URL for the new :class:`Request` object.
+    :param data: (optional) Dictionary to send in the body of the :class:`Request`.
+    :param json: (optional) A JSON serializable Python object to send in the body of the :class:`Request`.
+    :param estimated_tokens: (optional) How many tokens the request will use, for the rate limiter. Only counts
+        as in flight until the headers arrive.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.build_request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+    if json is not None:
+        kwargs["content"], kwargs["headers"] = encode_json_body(json, kwargs.get("headers"))
+
+    client = get_async_client(url)
+    request = client.build_request("POST", url, data=data, **kwargs)
+    return await _send(url, estimated_tokens, lambda: client.send(request, stream=True))
+
+
+@async_retry_request(**_get_decorator_config())
+async def put(url, data=None, **kwargs) -> httpx.Response:
+    r"""Sends a PUT request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param data: (optional) Dictionary to send in the body of the :class:`Request`.
+    :param json: (optional) A JSON serializable Python object to send in the body of the :class:`Request`.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    if kwargs.get("json") is not None:
+        kwargs["content"], kwargs["headers"] = encode_json_body(kwargs.pop("json"), kwargs.get("headers"))
+
+    return await _request("PUT", url, data=data, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def patch(url, data=None, **kwargs) -> httpx.Response:
+    r"""Sends a PATCH request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param data: (optional) Dictionary to send in the body of the :class:`Request`.
+    :param json: (optional) A JSON serializable Python object to send in the body of the :class:`Request`.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    if kwargs.get("json") is not None:
+        kwargs["content"], kwargs["headers"] = encode_json_body(kwargs.pop("json"), kwargs.get("headers"))
+
+    return await _request("PATCH", url, data=data, **kwargs)
+
+
+@async_retry_request(**_get_decorator_config())
+async def delete(url, **kwargs) -> httpx.Response:
+    r"""Sends a DELETE request.
+
+    :param url: URL for the new :class:`Request` object.
+    :param \*\*kwargs: Optional arguments that ``httpx.AsyncClient.request`` takes.
+    :return: :class:`Response <Response>` object
+    :rtype: httpx.Response
+    """
+
+    return await _request("DELETE", url, **kwargs)
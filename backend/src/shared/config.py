@@ -36,6 +36,21 @@ SAMPLE_DATASETS_FOLDER = DATA_FOLDER.joinpath("sample_datasets")
 # backend/.logs
 LOG_FOLDER = ROOT_FOLDER.joinpath(".logs")
 
+# backend/.storage
+STORAGE_FOLDER = ROOT_FOLDER.joinpath(".storage")
+
+# backend/.storage/conversations
+CONVERSATIONS_FOLDER = STORAGE_FOLDER.joinpath("conversations")
+
+# backend/.storage/uploads
+UPLOADS_FOLDER = STORAGE_FOLDER.joinpath("uploads")
+
+# backend/.storage/response_cache
+RESPONSE_CACHE_FOLDER = STORAGE_FOLDER.joinpath("response_cache")
+
+# backend/.benchmarks
+BENCHMARKS_FOLDER = ROOT_FOLDER.joinpath(".benchmarks")
+
 ENV_FILE = ROOT_FOLDER.joinpath(".env")
 
 if not ENV_FILE.exists():
@@ -46,7 +61,8 @@ load_dotenv(ENV_FILE)
 # Create the required folders if they don't exist.
 for required_folder in [DATA_FOLDER, LOG_FOLDER, AI_SYS_CONTEXTS_FOLDER, AI_PERSONALITIES_BASE_FOLDER,
                         AI_VIDEO_GAME_PERSONALITIES_FOLDER, AI_CUSTOM_PERSONALITIES_FOLDER,
-                        AI_RULESETS_FOLDER, AI_AGENTS_FOLDER]:
+                        AI_RULESETS_FOLDER, AI_AGENTS_FOLDER, STORAGE_FOLDER, CONVERSATIONS_FOLDER,
+                        UPLOADS_FOLDER, RESPONSE_CACHE_FOLDER]:
     if required_folder.exists():
         continue
 
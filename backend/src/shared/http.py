@@ -1,4 +1,7 @@
-from typing import Dict
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Union
 
 # Now, why would you want to do something like this?
 DEFAULT_FAKE_BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0"
@@ -48,3 +51,64 @@ def get_headers(
     }
 
     return headers
+
+
+_DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 60 * 60}
+
+
+def parse_duration(value: Union[str, None]) -> Union[float, None]:
+    """
+    Parse a duration sent by a server, like the rate limit resets of OpenAI ("1s", "6m0s", "20ms") or just a number
+    of seconds ("1.5").
+    :param value: The duration.
+    :return: The duration in seconds, or None if it's missing or in a format we don't know.
+    """
+    if not value:
+        return None
+
+    value = value.strip().lower()
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART_PATTERN.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def get_retry_after(headers: Optional[Mapping[str, str]]) -> Union[float, None]:
+    """
+    Get how long the server asked us to wait before trying again (Retry-After, or the retry-after-ms some AI
+    providers send).
+    :param headers: The headers of the response. (Must be case-insensitive, like the ones from requests and httpx)
+    :return: How many seconds to wait, or None if the server didn't say.
+    """
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+
+    # It can also be a date (e.g.: "Wed, 21 Oct 2015 07:28:00 GMT").
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError):
+        return None
@@ -0,0 +1,226 @@
+import asyncio
+import importlib.util
+import logging
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.shared.types import HostPoolConfig
+
+# Default pool settings, used for every host that was not configured with configure_host.
+GLOBAL_POOL_MAXSIZE = 500
+GLOBAL_MAX_KEEPALIVE_CONNECTIONS = 100
+GLOBAL_POOL_BLOCK = False
+GLOBAL_HTTP2 = False
+
+# LLM responses can take a while to be generated, so we're more generous than httpx's default (5 seconds).
+GLOBAL_TIMEOUT = 120
+GLOBAL_CONNECT_TIMEOUT = 10
+
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_host_configs: Dict[str, HostPoolConfig] = {}
+_sessions: Dict[str, requests.Session] = {}
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+# Clients replaced by configure_host outside the event loop. Closed by close_async_clients.
+_retired_async_clients: List[httpx.AsyncClient] = []
+# So the tasks closing the replaced clients are not garbage collected before they're done.
+_closing_tasks: Set[asyncio.Task] = set()
+_lock = Lock()
+
+
+def _get_host_key(url: str) -> str:
+    """
+    Get the key used to pool connections for a url. Connections can only be reused for the same scheme+host+port.
+    :param url: The url (or just scheme://host[:port]).
+    :return: The key for the host.
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _get_default_config() -> HostPoolConfig:
+    return HostPoolConfig(
+        pool_maxsize=GLOBAL_POOL_MAXSIZE,
+        max_keepalive_connections=GLOBAL_MAX_KEEPALIVE_CONNECTIONS,
+        pool_block=GLOBAL_POOL_BLOCK,
+        http2=GLOBAL_HTTP2,
+        timeout=GLOBAL_TIMEOUT
+    )
+
+
+def get_host_config(url: str) -> HostPoolConfig:
+    """
+    Get the pool configuration for the host of the url.
+    :param url: The url (or just scheme://host[:port]).
+    :return: The configuration of the host, or the default one if the host was not configured.
+    """
+    return _host_configs.get(_get_host_key(url)) or _get_default_config()
+
+
+def configure_host(
+        url: str,
+        pool_maxsize: int = None,
+        max_keepalive_connections: int = None,
+        pool_block: bool = None,
+        http2: bool = None,
+        timeout: Optional[float] = GLOBAL_TIMEOUT) -> HostPoolConfig:
+    """
+    Set the pool configuration for a host. Anything not informed will use the global default.
+    If there's already a session/client for this host, it will be closed, so the next request uses the new settings.
+    (Async clients are closed right away when called from the event loop, or by close_async_clients otherwise.)
+
+    :param url: The url (or just scheme://host[:port]) of the host.
+    :param pool_maxsize: Max number of connections kept open to the host. (Optional)
+    :param max_keepalive_connections: Max number of idle connections kept alive. (Optional)
+    :param pool_block: If True, wait for a free connection instead of opening a throwaway one. (Optional)
+    :param http2: Use HTTP/2 for the async client. (Optional)
+    :param timeout: Timeout in seconds. None means wait forever. (Default: GLOBAL_TIMEOUT)
+    :return: The configuration that will be used for the host.
+    """
+    default_config = _get_default_config()
+    config = HostPoolConfig(
+        pool_maxsize=pool_maxsize if pool_maxsize is not None else default_config.pool_maxsize,
+        max_keepalive_connections=max_keepalive_connections if max_keepalive_connections is not None
+        else default_config.max_keepalive_connections,
+        pool_block=pool_block if pool_block is not None else default_config.pool_block,
+        http2=http2 if http2 is not None else default_config.http2,
+        timeout=timeout
+    )
+
+    host_key = _get_host_key(url)
+
+    with _lock:
+        _host_configs[host_key] = config
+        session = _sessions.pop(host_key, None)
+
+    if session is not None:
+        session.close()
+
+    client = _async_clients.pop(host_key, None)
+
+    if client is not None:
+        _retire_async_client(client)
+
+    return config
+
+
+def _retire_async_client(client: httpx.AsyncClient):
+    # Async clients can only be closed from inside the event loop. If we're not in it, close_async_clients does it.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _retired_async_clients.append(client)
+        return
+
+    task = loop.create_task(client.aclose())
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+
+def get_request_timeout(url: str) -> Union[Tuple[float, float], None]:
+    """
+    Get the timeout (connect, read) to be used by requests for the host of the url.
+    :param url: The url that will be requested.
+    :return: The timeout, or None to wait forever.
+    """
+    timeout = get_host_config(url).timeout
+    return None if timeout is None else (GLOBAL_CONNECT_TIMEOUT, timeout)
+
+
+def _create_session(config: HostPoolConfig) -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.pool_maxsize, pool_block=config.pool_block)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Get the shared requests.Session for the host of the url. It will be created on the first call.
+    Reusing the session means we reuse its (keep-alive) connections, so we don't pay for a new TCP+TLS handshake
+    on every request.
+
+    :param url: The url that will be requested.
+    :return: The session for the host.
+    """
+    host_key = _get_host_key(url)
+    session = _sessions.get(host_key)
+
+    if session is not None:
+        return session
+
+    with _lock:
+        # Another thread might have created it while we were waiting for the lock.
+        session = _sessions.get(host_key)
+        if session is None:
+            session = _create_session(get_host_config(url))
+            _sessions[host_key] = session
+
+    return session
+
+
+def _create_async_client(config: HostPoolConfig) -> httpx.AsyncClient:
+    http2 = config.http2
+    if http2 and not _HTTP2_AVAILABLE:
+        logging.warning("HTTP/2 was requested, but the h2 package is not installed. Falling back to HTTP/1.1.")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(config.timeout, connect=GLOBAL_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=config.pool_maxsize,
+            max_keepalive_connections=config.max_keepalive_connections
+        )
+    )
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """
+    Get the shared httpx.AsyncClient for the host of the url. It will be created on the first call.
+    Same idea as get_session, but for async code.
+
+    :param url: The url that will be requested.
+    :return: The async client for the host.
+    """
+    host_key = _get_host_key(url)
+    client = _async_clients.get(host_key)
+
+    if client is None or client.is_closed:
+        client = _create_async_client(get_host_config(url))
+        _async_clients[host_key] = client
+
+    return client
+
+
+def close_sessions():
+    """
+    Close all the shared sessions (and their connections).
+    """
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+
+    for session in sessions:
+        session.close()
+
+
+async def close_async_clients():
+    """
+    Close all the shared async clients (and their connections).
+    Should be called when the application is shutting down.
+    """
+    clients = [*_async_clients.values(), *_retired_async_clients]
+    _async_clients.clear()
+    _retired_async_clients.clear()
+
+    for client in clients:
+        await client.aclose()
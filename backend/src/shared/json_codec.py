@@ -0,0 +1,117 @@
+import importlib.util
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Union
+
+from pydantic import BaseModel
+
+from src.shared.types import JsonBackend
+
+_ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+
+if _ORJSON_AVAILABLE:
+    import orjson
+
+_json_backend: JsonBackend = JsonBackend.Orjson if _ORJSON_AVAILABLE else JsonBackend.Json
+
+
+class EncodedJson:
+    """
+    A JSON body that was already encoded. Sent as is by requests_with_retry/async_requests_with_retry, so retries (and
+    the other providers of a pool) don't encode it again.
+    """
+    __slots__ = ("body",)
+
+    def __init__(self, body: bytes):
+        self.body: bytes = body
+
+
+def configure_json_backend(backend: Union[JsonBackend, str] = JsonBackend.Auto) -> JsonBackend:
+    """
+    Choose the library used to encode/decode JSON (requests to the AI, its responses, our responses and the logs).
+    :param backend: Which one. (Default: Auto - orjson if it's installed)
+    :return: The one that will be used.
+    """
+    global _json_backend
+
+    backend = JsonBackend(backend)
+
+    if backend == JsonBackend.Orjson and not _ORJSON_AVAILABLE:
+        raise ValueError("The orjson backend was requested, but the orjson package is not installed.")
+
+    if backend == JsonBackend.Auto:
+        backend = JsonBackend.Orjson if _ORJSON_AVAILABLE else JsonBackend.Json
+
+    _json_backend = backend
+    return backend
+
+
+def get_json_backend() -> JsonBackend:
+    return _json_backend
+
+
+def _default(obj: Any) -> Any:
+    # Whatever the JSON library doesn't know how to encode.
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+
+    # orjson handles these on its own.
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+
+    if isinstance(obj, Enum):
+        return obj.value
+
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any, default: Callable[[Any], Any] = None) -> bytes:
+    """
+    Encode obj as compact JSON (UTF-8, no escaping of non-ASCII characters).
+    Pydantic models, and objects with to_dict() or __dict__, are encoded as their fields.
+    :param obj: What to encode.
+    :param default: Called with whatever can't be encoded otherwise (e.g.: str, for logs). (Optional)
+    :return: The JSON.
+    """
+    if isinstance(obj, BaseModel):
+        # Pydantic's own encoder is as fast as orjson, and a lot faster than json.
+        return obj.model_dump_json().encode("utf-8")
+
+    fallback = _default
+
+    if default is not None:
+        def fallback(value: Any) -> Any:
+            try:
+                return _default(value)
+            except TypeError:
+                return default(value)
+
+    if _json_backend == JsonBackend.Orjson:
+        # Like json, accept keys that are not strings (e.g.: ints).
+        return orjson.dumps(obj, default=fallback, option=orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(obj, default=fallback, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Decode JSON. Raises a ValueError if it's invalid.
+    """
+    if _json_backend == JsonBackend.Orjson:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def encode(obj: Any) -> EncodedJson:
+    """
+    Encode obj once, to be sent as the body of a request (as many times as needed).
+    """
+    return EncodedJson(dumps(obj))
@@ -0,0 +1,418 @@
+import gzip
+import json
+import logging
+import math
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+from src.shared.config import LOG_FOLDER
+from src.shared.log_writer import GLOBAL_SEGMENT_PREFIX
+from src.shared.types import InteractionLogEntry, InteractionLogGroupBy, InteractionLogStats
+
+# The .json files written (one per interaction) by log_json_to_folder start with the datetime (UTC).
+_LEGACY_FILENAME_DATETIME = re.compile(r"^(\d{20})-")
+
+GLOBAL_PERCENTILES = (0.5, 0.95, 0.99)
+
+_GROUP_BY_COLUMNS = {
+    InteractionLogGroupBy.Model: "model",
+    InteractionLogGroupBy.Provider: "provider",
+    InteractionLogGroupBy.Conversation: "conversation_id",
+    InteractionLogGroupBy.Day: "date(logged_at, 'unixepoch')",
+}
+
+
+def _to_timestamp(value: Union[datetime, str, None]) -> Optional[float]:
+    if value is None:
+        return None
+
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+
+    # No timezone means UTC, same as the logs.
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+
+    return value.timestamp()
+
+
+def _percentile_rank(count: int, percentile: float) -> int:
+    # Nearest rank (1-based).
+    return min(max(math.ceil(percentile * count), 1), count)
+
+
+def _extract_row(record: dict, default_logged_at: float) -> tuple:
+    """
+    Pull the indexed fields out of a record logged by AiTasks.
+    :return: (logged_at, model, provider, conversation_id, prompt_tokens, completion_tokens, total_tokens, latency)
+    """
+    api_response = record.get("api_response") or {}
+    config = (record.get("parsed_response") or {}).get("config") or {}
+    usage = api_response.get("usage") or {}
+
+    logged_at = _to_timestamp(record["logged_at"]) if record.get("logged_at") else default_logged_at
+
+    return (
+        logged_at,
+        api_response.get("model") or config.get("ai_model_name"),
+        config.get("provider"),
+        record.get("conversation_id"),
+        usage.get("prompt_tokens"),
+        usage.get("completion_tokens"),
+        usage.get("total_tokens"),
+        record.get("latency_seconds"),
+    )
+
+
+class InteractionLogIndex:
+    """
+    A SQLite index of the interactions logged to the log folder, so they can be searched and aggregated (e.g.: p95
+    latency per model yesterday) without reading every file.
+
+    The index sits next to the logs (.logs/index.sqlite) and is updated incrementally: only the lines added since the
+    last refresh are read. It covers the JSONL segments written by BufferedJsonlLogger (plain or gzipped), and the old
+    .json files written by log_json_to_folder. The records themselves stay in the logs. Use get_record to read one.
+    """
+
+    def __init__(
+            self,
+            log_folder: Path = LOG_FOLDER,
+            db_file: Path = None,
+            min_refresh_interval_seconds: float = 5):
+        """
+        :param log_folder: The folder with the logs. (Default: .logs)
+        :param db_file: The index. (Default: index.sqlite in the log folder)
+        :param min_refresh_interval_seconds: Queries refresh the index first, but not more often than this.
+        (Default: 5)
+        """
+        self.log_folder: Path = log_folder
+        self.min_refresh_interval_seconds: float = min_refresh_interval_seconds
+        self._db_file: Path = db_file or log_folder.joinpath("index.sqlite")
+        self._db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._refreshed_at: Optional[float] = None
+        self._refresh_lock = Lock()
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "read_offset INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS interactions ("
+                "id INTEGER PRIMARY KEY, "
+                "logged_at REAL NOT NULL, "
+                "model TEXT, "
+                "provider TEXT, "
+                "conversation_id TEXT, "
+                "prompt_tokens INTEGER, "
+                "completion_tokens INTEGER, "
+                "total_tokens INTEGER, "
+                "latency_seconds REAL, "
+                "segment TEXT NOT NULL, "
+                "line_offset INTEGER NOT NULL, "
+                # More than one process may index the same lines at the same time.
+                "UNIQUE (segment, line_offset))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS interactions_logged_at ON interactions (logged_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS interactions_model ON interactions (model, logged_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS interactions_provider ON interactions (provider, logged_at)")
+            # For the latency percentiles, per model/provider.
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS interactions_model_latency ON interactions (model, latency_seconds)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS interactions_provider_latency ON interactions (provider, latency_seconds)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS interactions_conversation ON interactions (conversation_id, logged_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self._db_file, timeout=30)
+        try:
+            # It can always be rebuilt from the logs, so we don't need to wait for the disk on every write.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _find_segments(self) -> List[Path]:
+        return sorted(
+            list(self.log_folder.glob(f"*/{GLOBAL_SEGMENT_PREFIX}-*.jsonl"))
+            + list(self.log_folder.glob(f"*/{GLOBAL_SEGMENT_PREFIX}-*.jsonl.gz"))
+            + list(self.log_folder.glob("*/*.json"))
+        )
+
+    @staticmethod
+    def _open(file: Path) -> IO[bytes]:
+        return gzip.open(file, "rb") if file.suffix == ".gz" else open(file, "rb")
+
+    @staticmethod
+    def _read_legacy_file(file: Path) -> Tuple[List[Tuple[int, dict]], int, float]:
+        match = _LEGACY_FILENAME_DATETIME.match(file.name)
+        logged_at = datetime.strptime(match.group(1), "%Y%m%d%H%M%S%f").replace(tzinfo=timezone.utc).timestamp() \
+            if match else file.stat().st_mtime
+
+        return [(0, json.loads(file.read_text(encoding="utf-8")))], file.stat().st_size, logged_at
+
+    def _read_segment(self, file: Path, read_offset: int) -> Tuple[List[Tuple[int, dict]], int, float]:
+        """
+        Read the complete lines added to a segment since the last time.
+        :return: The records (with their offset), the new offset and the default logged_at (for records without it).
+        """
+        if file.suffix == ".json":
+            return self._read_legacy_file(file)
+
+        records = []
+        offset = read_offset
+
+        with self._open(file) as stream:
+            stream.seek(read_offset)
+
+            try:
+                for line in stream:
+                    # The writer may be halfway through this one. We'll get it next time.
+                    if not line.endswith(b"\n"):
+                        break
+
+                    if line.strip():
+                        try:
+                            records.append((offset, json.loads(line)))
+                        except json.JSONDecodeError:
+                            logging.warning(f"Skipping a broken line in {file} (offset {offset}).")
+
+                    offset += len(line)
+            except EOFError:
+                # A gzipped segment that is still being written.
+                pass
+
+        return records, offset, file.stat().st_mtime
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Index whatever was logged since the last refresh.
+        :param force: If False, does nothing if the last refresh was less than min_refresh_interval_seconds ago.
+        :return: How many records were added.
+        """
+        with self._refresh_lock:
+            if not force and self._refreshed_at is not None \
+                    and time.monotonic() - self._refreshed_at < self.min_refresh_interval_seconds:
+                return 0
+
+            added = 0
+
+            with self._connect() as connection:
+                known = {
+                    path: (size, read_offset)
+                    for path, size, read_offset in connection.execute("SELECT path, size, read_offset FROM segments")
+                }
+
+            for file in self._find_segments():
+                path = file.relative_to(self.log_folder).as_posix()
+
+                try:
+                    size = file.stat().st_size
+                    if known.get(path, (None,))[0] == size:
+                        continue
+
+                    records, read_offset, default_logged_at = self._read_segment(file, known.get(path, (0, 0))[1])
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Failed to index {file}: {e}")
+                    continue
+
+                rows = [(*_extract_row(record, default_logged_at), path, offset) for offset, record in records]
+
+                with self._connect() as connection:
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO interactions (logged_at, model, provider, conversation_id, "
+                        "prompt_tokens, completion_tokens, total_tokens, latency_seconds, segment, line_offset) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                    connection.execute(
+                        "INSERT INTO segments (path, size, read_offset) VALUES (?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, read_offset = excluded.read_offset",
+                        (path, size, read_offset)
+                    )
+
+                added += len(rows)
+
+            self._refreshed_at = time.monotonic()
+            return added
+
+    @staticmethod
+    def _build_filters(
+            since: Union[datetime, str, None],
+            until: Union[datetime, str, None],
+            model: Optional[str],
+            provider: Optional[str],
+            conversation_id: Optional[str]) -> Tuple[str, list]:
+        conditions = []
+        params = []
+
+        for condition, value in [
+            ("logged_at >= ?", _to_timestamp(since)),
+            ("logged_at < ?", _to_timestamp(until)),
+            ("model = ?", model),
+            ("provider = ?", provider),
+            ("conversation_id = ?", conversation_id),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+    def query(
+            self,
+            since: Union[datetime, str] = None,
+            until: Union[datetime, str] = None,
+            model: str = None,
+            provider: str = None,
+            conversation_id: str = None,
+            limit: int = 100) -> List[InteractionLogEntry]:
+        """
+        Find interactions. Newest first.
+        :param since: Only the ones logged at or after this. (Optional. Naive datetimes are UTC)
+        :param until: Only the ones logged before this. (Optional. Naive datetimes are UTC)
+        :param model: Only the ones answered by this model. (Optional)
+        :param provider: Only the ones answered by this provider (see ProviderPool). (Optional)
+        :param conversation_id: Only the ones from this conversation. (Optional)
+        :param limit: Max number of interactions returned. (Default: 100)
+        :return: The interactions.
+        """
+        self.refresh()
+        where, params = self._build_filters(since, until, model, provider, conversation_id)
+
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, logged_at, model, provider, conversation_id, prompt_tokens, completion_tokens, "
+                f"total_tokens, latency_seconds, segment FROM interactions {where} "
+                "ORDER BY logged_at DESC LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+
+        return [
+            InteractionLogEntry(
+                id=row[0],
+                logged_at=datetime.fromtimestamp(row[1], timezone.utc).isoformat(),
+                model=row[2],
+                provider=row[3],
+                conversation_id=row[4],
+                prompt_tokens=row[5],
+                completion_tokens=row[6],
+                total_tokens=row[7],
+                latency_seconds=row[8],
+                segment=row[9]
+            )
+            for row in rows
+        ]
+
+    @staticmethod
+    def _group_condition(group_by: InteractionLogGroupBy, key: Optional[str]) -> Tuple[str, list]:
+        if group_by == InteractionLogGroupBy.Day:
+            # A range, so the index on logged_at can be used.
+            day_start = _to_timestamp(key)
+            return "logged_at >= ? AND logged_at < ?", [day_start, day_start + 24 * 60 * 60]
+
+        return f"{_GROUP_BY_COLUMNS[group_by]} IS ?", [key]
+
+    def stats(
+            self,
+            group_by: Union[InteractionLogGroupBy, str] = InteractionLogGroupBy.Model,
+            since: Union[datetime, str] = None,
+            until: Union[datetime, str] = None,
+            model: str = None,
+            provider: str = None,
+            conversation_id: str = None) -> List[InteractionLogStats]:
+        """
+        Count the interactions, sum their tokens and get the latency percentiles, per group.
+        Takes the same filters as query.
+        :param group_by: What to group by. (Default: model)
+        :return: One entry per group, busiest first.
+        """
+        self.refresh()
+        group_by = InteractionLogGroupBy(group_by)
+        group = _GROUP_BY_COLUMNS[group_by]
+        where, params = self._build_filters(since, until, model, provider, conversation_id)
+
+        with self._connect() as connection:
+            totals = connection.execute(
+                f"SELECT {group}, COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), "
+                "COALESCE(SUM(total_tokens), 0), AVG(latency_seconds), COUNT(latency_seconds) "
+                f"FROM interactions {where} GROUP BY {group} ORDER BY COUNT(*) DESC",
+                params
+            ).fetchall()
+
+            # SQLite has no percentile function. For each group, the latencies are numbered in order (using the index
+            # when possible), and only the ones at the rank of each percentile (nearest rank) leave the database.
+            percentiles = {}
+            for key, *_, latency_count in totals:
+                if latency_count == 0:
+                    continue
+
+                group_condition, group_params = self._group_condition(group_by, key)
+                # Small groups can have more than one percentile at the same rank.
+                ranks = {}
+                for percentile in GLOBAL_PERCENTILES:
+                    ranks.setdefault(_percentile_rank(latency_count, percentile), []).append(percentile)
+
+                for rank, latency in connection.execute(
+                        "SELECT rank, latency_seconds FROM ("
+                        "SELECT latency_seconds, ROW_NUMBER() OVER (ORDER BY latency_seconds) AS rank "
+                        f"FROM interactions {where} {'AND' if where else 'WHERE'} {group_condition} "
+                        f"AND latency_seconds IS NOT NULL) WHERE rank IN ({', '.join('?' * len(ranks))})",
+                        (*params, *group_params, *ranks)):
+                    for percentile in ranks[rank]:
+                        percentiles[(key, percentile)] = latency
+
+        return [
+            InteractionLogStats(
+                group=key,
+                count=count,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=total_tokens,
+                latency_avg=latency_avg,
+                latency_p50=percentiles.get((key, 0.5)),
+                latency_p95=percentiles.get((key, 0.95)),
+                latency_p99=percentiles.get((key, 0.99))
+            )
+            for key, count, prompt_tokens, completion_tokens, total_tokens, latency_avg, _ in totals
+        ]
+
+    def get_record(self, entry_id: int) -> Union[dict, None]:
+        """
+        Read the full record of an interaction from the logs.
+        :param entry_id: The id of the interaction (see query).
+        :return: The record, or None if it's not in the index (or its segment was deleted).
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT segment, line_offset FROM interactions WHERE id = ?", (entry_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        file = self.log_folder.joinpath(row[0])
+        if not file.exists():
+            return None
+
+        if file.suffix == ".json":
+            return json.loads(file.read_text(encoding="utf-8"))
+
+        with self._open(file) as stream:
+            stream.seek(row[1])
+            return json.loads(stream.readline())
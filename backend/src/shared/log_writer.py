@@ -0,0 +1,281 @@
+import atexit
+import gzip
+import itertools
+import logging
+import os
+import queue
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import IO, List, Optional, Tuple, Union
+
+import src.shared.json_codec as json_codec
+from src.shared.config import LOG_FOLDER
+from src.shared.loggers import get_filename_for_new_file
+from src.shared.metrics import LOG_RECORDS, STAGE_DURATION
+from src.shared.types import LogOverflowPolicy
+
+GLOBAL_SEGMENT_PREFIX = "interactions"
+
+# Marks the end of the queue. Once the writer gets it, everything before it was written.
+_STOP = object()
+
+
+class _Segment:
+    def __init__(self, file: Path, stream: IO[bytes], day: str):
+        self.file: Path = file
+        self.stream: IO[bytes] = stream
+        self.day: str = day
+        self.opened_at: float = time.monotonic()
+        self.size: int = 0
+
+
+class BufferedJsonlLogger:
+    """
+    Logs JSON objects (like the interactions with the AI model) without touching the disk in the caller's thread.
+    Records go to a queue, and a background thread writes them in batches, one JSON per line, to segment files:
+    .logs/YYYY-MM-DD/interactions-<datetime>-<pid>.jsonl (or .jsonl.gz), with the day and time in UTC. A new segment
+    is started when the current one gets too big, too old, or the day changes.
+
+    An instance can be used as the response_logger of AiTasks. Call close() when done (it's also called at exit), so
+    the records still in the queue are written.
+    """
+
+    def __init__(
+            self,
+            folder: Path = LOG_FOLDER,
+            max_queue_size: int = 10000,
+            overflow_policy: Union[LogOverflowPolicy, str] = LogOverflowPolicy.DropNewest,
+            block_timeout_seconds: float = 1,
+            max_batch_size: int = 500,
+            flush_interval_seconds: float = 1,
+            max_segment_bytes: int = 64 * 1024 * 1024,
+            max_segment_seconds: Optional[float] = 60 * 60,
+            compress: bool = False):
+        """
+        :param folder: Where the segments are written. (Default: .logs)
+        :param max_queue_size: Max number of records waiting to be written. (Default: 10000)
+        :param overflow_policy: What to do when the queue is full. (Default: drop the new record)
+        :param block_timeout_seconds: With the Block policy, how long to wait for room before dropping the record.
+        (Default: 1)
+        :param max_batch_size: Max number of records written at once. (Default: 500)
+        :param flush_interval_seconds: How long a record may wait in the queue/buffers before it's on disk. (Default: 1)
+        :param max_segment_bytes: A new segment is started after this many bytes (before compression). (Default: 64MB)
+        :param max_segment_seconds: A new segment is started after this many seconds. (Default: 1 hour. None to only
+        rotate by size/day)
+        :param compress: If True, segments are gzipped. (Default: False)
+        """
+        if max_queue_size < 1:
+            raise ValueError("The max queue size must be greater than 0.")
+
+        if max_batch_size < 1:
+            raise ValueError("The max batch size must be greater than 0.")
+
+        self.folder: Path = folder
+        self.overflow_policy: LogOverflowPolicy = LogOverflowPolicy(overflow_policy)
+        self.block_timeout_seconds: float = block_timeout_seconds
+        self.max_batch_size: int = max_batch_size
+        self.flush_interval_seconds: float = flush_interval_seconds
+        self.max_segment_bytes: int = max_segment_bytes
+        self.max_segment_seconds: Optional[float] = max_segment_seconds
+        self.compress: bool = compress
+
+        self.written: int = 0
+        self.dropped: int = 0
+        self._stats_lock = Lock()
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._segment: Optional[_Segment] = None
+        self._closed = Event()
+        self._thread = Thread(target=self._run, name="jsonl-log-writer", daemon=True)
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def __call__(self, obj: dict):
+        self.log(obj)
+
+    def log(self, obj: dict):
+        """
+        Queue a record to be written. Never raises: if the queue is full (and the policy says so), the record is
+        dropped and counted in self.dropped.
+        :param obj: The record. Must be JSON serializable. If it has no "logged_at", one is added (UTC, ISO 8601).
+        """
+        if self._closed.is_set():
+            self._count_drop()
+            return
+
+        # The time is taken now, not when the record is written.
+        item = (time.time(), obj)
+
+        if self.overflow_policy == LogOverflowPolicy.Block:
+            try:
+                self._queue.put(item, timeout=self.block_timeout_seconds)
+            except queue.Full:
+                self._count_drop()
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self.overflow_policy == LogOverflowPolicy.DropNewest:
+                    self._count_drop()
+                    return
+
+            # DropOldest: make room and try again.
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            if oldest is _STOP:
+                # close() was called in the meantime. The marker must stay in the queue (or the writer would never
+                # stop), so it goes back, and this record is the one dropped, since it came after close() anyway.
+                self._queue.put(_STOP)
+                self._count_drop()
+                return
+
+            self._count_drop()
+
+    def _count_drop(self):
+        with self._stats_lock:
+            self.dropped += 1
+            dropped = self.dropped
+
+        LOG_RECORDS.inc(result="dropped")
+
+        # Not logging every single one: if we're dropping, there will be a lot of them.
+        if dropped == 1 or dropped % 1000 == 0:
+            logging.warning(f"The log writer is falling behind. {dropped} records were dropped so far.")
+
+    def _next_batch(self) -> Tuple[List[Tuple[float, dict]], bool]:
+        """
+        Wait for records (up to the flush interval) and take as many as are ready, up to the max batch size.
+        :return: The records, and whether the end of the queue was reached.
+        """
+        batch = []
+
+        try:
+            item = self._queue.get(timeout=self.flush_interval_seconds)
+        except queue.Empty:
+            return batch, False
+
+        while True:
+            if item is _STOP:
+                return batch, True
+
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                return batch, False
+
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+    def _open_segment(self, day: str) -> _Segment:
+        folder = self.folder.joinpath(day)
+        folder.mkdir(parents=True, exist_ok=True)
+
+        file = folder.joinpath(get_filename_for_new_file(
+            ".jsonl.gz" if self.compress else ".jsonl",
+            prefix=GLOBAL_SEGMENT_PREFIX,
+            unique_identifier=str(os.getpid())
+        ))
+
+        stream = gzip.open(file, "ab") if self.compress else open(file, "ab")
+        return _Segment(file, stream, day)
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+
+        self._segment.stream.close()
+        self._segment = None
+
+    def _get_segment(self, day: str) -> _Segment:
+        segment = self._segment
+
+        if segment is not None and (
+                segment.day != day
+                or segment.size >= self.max_segment_bytes
+                or (self.max_segment_seconds is not None
+                    and time.monotonic() - segment.opened_at >= self.max_segment_seconds)):
+            self._close_segment()
+
+        if self._segment is None:
+            self._segment = self._open_segment(day)
+
+        return self._segment
+
+    def _write_batch(self, batch: List[Tuple[float, dict]]):
+        # Each record goes to the folder of the day it was logged, in UTC (like logged_at), even if the batch crosses
+        # midnight.
+        def day(item: Tuple[float, dict]) -> str:
+            return datetime.fromtimestamp(item[0], timezone.utc).strftime("%Y-%m-%d")
+
+        for records_day, records in itertools.groupby(batch, key=day):
+            self._write_records(records_day, list(records))
+
+    def _write_records(self, day: str, records: List[Tuple[float, dict]]):
+        lines = []
+        for logged_at, obj in records:
+            record = obj if "logged_at" in obj else {
+                "logged_at": datetime.fromtimestamp(logged_at, timezone.utc).isoformat(), **obj
+            }
+            lines.append(json_codec.dumps(record, default=str))
+
+        data = b"\n".join(lines) + b"\n"
+
+        segment = self._get_segment(day)
+        segment.stream.write(data)
+        # For gzip, this also flushes the compressor, so what was written so far can be read.
+        segment.stream.flush()
+        segment.size += len(data)
+
+        with self._stats_lock:
+            self.written += len(records)
+
+        LOG_RECORDS.inc(len(records), result="written")
+
+    def _run(self):
+        stopped = False
+
+        while not stopped:
+            batch, stopped = self._next_batch()
+
+            if len(batch) == 0:
+                continue
+
+            try:
+                with STAGE_DURATION.time(stage="log_write"):
+                    self._write_batch(batch)
+            except Exception as e:
+                # Losing some logs is better than killing the writer (and then losing all of them).
+                logging.error(f"Failed to write {len(batch)} log records: {e}")
+                self._close_segment()
+
+        self._close_segment()
+
+    def close(self, timeout_seconds: float = 10):
+        """
+        Stop accepting records, write the ones still in the queue and close the segment.
+        :param timeout_seconds: Max time to wait for the queue to be written. (Default: 10)
+        """
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        atexit.unregister(self.close)
+
+        # Blocking on purpose: the stop marker must go after everything that's already in the queue.
+        try:
+            self._queue.put(_STOP, timeout=timeout_seconds)
+        except queue.Full:
+            logging.warning("The log writer didn't catch up in time. Some records were not written.")
+            return
+
+        self._thread.join(timeout_seconds)
@@ -1,11 +1,34 @@
 import json
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Tuple
 from uuid import uuid4
 
 from src.shared.config import LOG_FOLDER
 
+# Extra fields added to the interactions logged by AiTasks. Set with log_fields(), so it's per request/task.
+_log_fields: ContextVar[dict] = ContextVar("log_fields", default={})
+
+
+@contextmanager
+def log_fields(**fields) -> Iterator[None]:
+    """
+    Add fields (e.g.: the conversation id) to everything logged by AiTasks inside this block.
+    Works across awaits, since each asyncio task has its own copy.
+    :param fields: The fields. Those with None are left out.
+    """
+    token = _log_fields.set({**_log_fields.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _log_fields.reset(token)
+
+
+def get_log_fields() -> dict:
+    return _log_fields.get()
+
 
 def get_filename_for_new_file(
         file_extension: str,
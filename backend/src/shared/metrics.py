@@ -0,0 +1,282 @@
+import asyncio
+import math
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from timeit import default_timer as timer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Upper bounds (in seconds) of the buckets of the latency histograms. From a cache hit to a long answer.
+GLOBAL_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+GLOBAL_METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    metric_type: str = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+        self._lock = Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {self.label_names}, got {tuple(labels)}.")
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def _render_samples(self) -> List[str]:
+        """
+        :return: The lines with the samples of the metric, in the Prometheus text format.
+        """
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+            *self._render_samples()
+        ]
+
+
+class Counter(_Metric):
+    """
+    A number that only goes up (requests, tokens, errors...).
+    """
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        :param amount: How much to add. (Default: 1)
+        :param labels: The value of each label of the counter.
+        """
+        key = self._label_values(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+
+class _HistogramValues:
+    def __init__(self, bucket_count: int):
+        self.buckets: List[int] = [0] * bucket_count
+        self.sum: float = 0
+        self.count: int = 0
+
+
+class Histogram(_Metric):
+    """
+    Counts observations (usually durations) in buckets, so percentiles can be estimated (e.g.: histogram_quantile).
+    """
+    metric_type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = GLOBAL_LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], _HistogramValues] = {}
+
+    def observe(self, value: float, **labels):
+        """
+        :param value: The observation (e.g.: how many seconds something took).
+        :param labels: The value of each label of the histogram.
+        """
+        key = self._label_values(labels)
+
+        # Only the first bucket that fits is counted. They are made cumulative when rendered.
+        index = len(self.buckets)
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                index = i
+                break
+
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = _HistogramValues(len(self.buckets) + 1)
+
+            values.buckets[index] += 1
+            values.sum += value
+            values.count += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observe how long the block took (even if it raises).
+        """
+        started_at = timer()
+        try:
+            yield
+        finally:
+            self.observe(timer() - started_at, **labels)
+
+    def timed(self, **labels) -> Callable[[Callable], Callable]:
+        """
+        Decorator version of time. Works with regular and async functions.
+        """
+        def decorator(func: Callable) -> Callable:
+            if asyncio.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.time(**labels):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (key, list(value.buckets), value.sum, value.count) for key, value in self._values.items()
+            )
+
+        lines = []
+        for key, buckets, total, count in values:
+            cumulative = 0
+            for upper_bound, bucket in zip([*self.buckets, math.inf], buckets):
+                cumulative += bucket
+                labels = _format_labels([*self.label_names, "le"], [*key, _format_value(upper_bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Keeps the metrics of the process and renders them in the Prometheus text format.
+    Each process (e.g.: each uvicorn worker) has its own.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} is already registered with a different type/labels.")
+
+                return existing
+
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        """
+        Create a counter (or get it, if it already exists).
+        """
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = GLOBAL_LATENCY_BUCKETS) -> Histogram:
+        """
+        Create a histogram (or get it, if it already exists).
+        """
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+GLOBAL_METRICS = MetricsRegistry()
+
+# The metrics of the hot path. Exposed by the API on /metrics.
+STAGE_DURATION = GLOBAL_METRICS.histogram(
+    "yapbox_stage_duration_seconds",
+    "Time spent in each stage of handling a request to the AI (send_request includes the cache, coalescing and "
+    "waiting for the rate limiter; ai_request is a single request to a provider).",
+    ["stage"]
+)
+AI_REQUESTS = GLOBAL_METRICS.counter(
+    "yapbox_ai_requests_total", "Requests sent to the AI providers.", ["provider", "outcome"]
+)
+AI_TOKENS = GLOBAL_METRICS.counter(
+    "yapbox_ai_tokens_total", "Tokens used, as reported by the AI providers (usage).", ["model", "type"]
+)
+PROMPT_PREFIX_TOKENS = GLOBAL_METRICS.counter(
+    "yapbox_prompt_prefix_tokens_total",
+    "Prompt tokens per system prompt (prompt: the personality or agent, \"other\" for any other system prompt and "
+    "\"none\" without one): all of them (type=prompt) and the ones the provider read from its prompt cache "
+    "(type=cached).",
+    ["prompt", "type"]
+)
+RETRIES = GLOBAL_METRICS.counter("yapbox_retries_total", "Retries of failed calls.", ["function"])
+RETRY_GIVE_UPS = GLOBAL_METRICS.counter(
+    "yapbox_retry_give_ups_total", "Failed calls that were not retried anymore, and why.", ["function", "reason"]
+)
+CIRCUIT_REJECTIONS = GLOBAL_METRICS.counter(
+    "yapbox_circuit_breaker_rejections_total", "Calls not made because the circuit was open.", ["circuit"]
+)
+RESPONSE_CACHE_LOOKUPS = GLOBAL_METRICS.counter(
+    "yapbox_response_cache_lookups_total", "Lookups in the response cache.", ["result"]
+)
+COALESCED_REQUESTS = GLOBAL_METRICS.counter(
+    "yapbox_coalesced_requests_total", "Requests that waited for an identical one instead of being sent."
+)
+LOG_RECORDS = GLOBAL_METRICS.counter(
+    "yapbox_log_records_total", "Records handled by the log writer.", ["result"]
+)
+HTTP_REQUEST_DURATION = GLOBAL_METRICS.histogram(
+    "yapbox_http_request_duration_seconds",
+    "Time to answer the requests to our API (for streams, until the response starts).",
+    ["method", "route", "status"]
+)
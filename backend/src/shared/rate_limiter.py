@@ -0,0 +1,442 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from threading import Condition, Lock
+from typing import AsyncIterator, Deque, Dict, Iterator, Mapping, Optional, Set, Union
+
+from src.shared.http import get_retry_after, parse_duration
+from src.shared.http_sessions import _get_host_key
+from src.shared.types import RateLimitConfig
+
+# How long everyone waits after a 429 when the server doesn't tell us how long to wait.
+GLOBAL_DEFAULT_PAUSE_SECONDS = 1
+
+# We never pause for longer than this, no matter what the server says. (Callers would just time out instead)
+GLOBAL_MAX_PAUSE_SECONDS = 60
+
+_rate_limit_configs: Dict[str, RateLimitConfig] = {}
+_rate_limiters: Dict[str, "RateLimiter"] = {}
+_async_rate_limiters: Dict[str, "AsyncRateLimiter"] = {}
+_lock = Lock()
+
+
+class _TokenBucket:
+    """
+    A bucket that holds up to `capacity` tokens and is refilled continuously, so the full capacity is refilled each
+    minute. Every request takes tokens from it (1 for the requests per minute, the estimated tokens for the tokens per
+    minute) and has to wait when there's not enough.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self._updated_at: float = time.monotonic()
+
+    @property
+    def refill_rate(self) -> float:
+        # Tokens per second.
+        return self.capacity / 60
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+    def time_until_available(self, amount: float, now: float) -> float:
+        """
+        :return: How many seconds until the bucket has `amount` tokens (0 if it already has).
+        """
+        self._refill(now)
+
+        # A request bigger than the whole bucket would wait forever, so it only waits for the bucket to be full.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+
+        return (amount - self.tokens) / self.refill_rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        # Can be negative (we used more than we took), which means the next requests will have to wait a bit longer.
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def update(self, now: float, limit: Optional[int], remaining: Optional[int]):
+        """
+        Adjust the bucket to what the server says. The server knows better than us (e.g.: other processes using the
+        same API key), but we never trust it to give us more than we think we have.
+        """
+        self._refill(now)
+
+        if limit is not None and limit > 0 and limit != self.capacity:
+            self.tokens = self.tokens * limit / self.capacity
+            self.capacity = limit
+
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+
+
+def _parse_int_header(headers: Mapping[str, str], name: str) -> Union[int, None]:
+    value = headers.get(name)
+    if not value:
+        return None
+
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+class _RateLimiterState:
+    """
+    Keeps track of the budgets of a host: requests per minute, tokens per minute and requests in flight.
+    Not thread-safe by itself, RateLimiter and AsyncRateLimiter take care of that.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            max_concurrency: Optional[int] = None):
+        """
+        :param requests_per_minute: Max number of requests per minute. (Optional. Default: learned from the headers)
+        :param tokens_per_minute: Max number of tokens per minute. (Optional. Default: learned from the headers)
+        :param max_concurrency: Max number of requests in flight at the same time. (Optional. Default: no limit)
+        """
+        if requests_per_minute is not None and requests_per_minute < 1:
+            raise ValueError("The requests per minute must be greater than 0.")
+
+        if tokens_per_minute is not None and tokens_per_minute < 1:
+            raise ValueError("The tokens per minute must be greater than 0.")
+
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("The max concurrency must be greater than 0.")
+
+        self.max_concurrency: Optional[int] = max_concurrency
+        self.in_flight: int = 0
+        self._requests: Optional[_TokenBucket] = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens: Optional[_TokenBucket] = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until: float = 0
+
+    def _wait_time(self, tokens: int) -> Union[float, None]:
+        """
+        :return: How many seconds until a request with `tokens` can be sent (0 if it can go now), or None if we need
+        to wait for a request in flight to finish.
+        """
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return None
+
+        now = time.monotonic()
+        wait = max(self._paused_until - now, 0)
+
+        if self._requests is not None:
+            wait = max(wait, self._requests.time_until_available(1, now))
+
+        if self._tokens is not None and tokens > 0:
+            wait = max(wait, self._tokens.time_until_available(tokens, now))
+
+        return wait
+
+    def _take(self, tokens: int):
+        self.in_flight += 1
+
+        if self._requests is not None:
+            self._requests.take(1)
+
+        if self._tokens is not None and tokens > 0:
+            self._tokens.take(tokens)
+
+    def _pause(self, seconds: float):
+        now = time.monotonic()
+        seconds = min(seconds, GLOBAL_MAX_PAUSE_SECONDS)
+
+        # Requests that were already in flight will probably get 429s too, so we only log the first one.
+        if self._paused_until <= now:
+            logging.warning(f"Rate limit reached. Holding the requests for {seconds:.2f} seconds.")
+
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    def _record_usage(self, estimated_tokens: int, used_tokens: int):
+        if self._tokens is not None:
+            self._tokens.give_back(estimated_tokens - used_tokens)
+
+    def _update_from_response(self, status_code: int, headers: Mapping[str, str], estimated_tokens: int = 0):
+        now = time.monotonic()
+
+        # The names used by OpenAI (and most of the providers that copy its API).
+        request_limit = _parse_int_header(headers, "x-ratelimit-limit-requests")
+        token_limit = _parse_int_header(headers, "x-ratelimit-limit-tokens")
+        remaining_requests = _parse_int_header(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _parse_int_header(headers, "x-ratelimit-remaining-tokens")
+
+        # If we didn't know the limits, now we do.
+        if self._requests is None and request_limit:
+            self._requests = _TokenBucket(request_limit)
+
+        if self._tokens is None and token_limit:
+            self._tokens = _TokenBucket(token_limit)
+
+        if self._requests is not None:
+            self._requests.update(now, request_limit, remaining_requests)
+
+        if self._tokens is not None:
+            self._tokens.update(now, token_limit, remaining_tokens)
+
+        # Out of budget: nobody goes until the server resets it.
+        for remaining, reset_header in ((remaining_requests, "x-ratelimit-reset-requests"),
+                                        (remaining_tokens, "x-ratelimit-reset-tokens")):
+            reset = parse_duration(headers.get(reset_header))
+            if remaining == 0 and reset:
+                self._pause(reset)
+
+        retry_after = get_retry_after(headers)
+
+        if status_code == 429:
+            # The request was refused, so it didn't use any tokens.
+            self._record_usage(estimated_tokens, 0)
+            self._pause(retry_after if retry_after is not None else GLOBAL_DEFAULT_PAUSE_SECONDS)
+        elif status_code == 503 and retry_after is not None:
+            self._pause(retry_after)
+
+
+class RateLimiter(_RateLimiterState):
+    """
+    Keeps the requests to a host within its rate limits (requests and tokens per minute) and limits how many requests
+    are in flight at the same time. Requests that can't go yet wait in line, and are sent in the order they arrived,
+    so nobody waits forever. When the server says we're over the limit (429, or the rate limit headers), everyone waits
+    instead of retrying right away.
+
+    For threads. For coroutines, use AsyncRateLimiter.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            max_concurrency: Optional[int] = None):
+        super().__init__(requests_per_minute, tokens_per_minute, max_concurrency)
+        self._condition = Condition()
+        self._queue: Deque[object] = deque()
+
+    @contextmanager
+    def limit(self, tokens: int = 0) -> Iterator[None]:
+        """
+        Wait for our turn (and the budget) to send a request. The request counts as in flight until the block ends.
+        :param tokens: Estimated tokens of the request. (Default: 0, only counts the request)
+        """
+        ticket = object()
+
+        with self._condition:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    # Only the first in line can take from the budget, so a big request isn't passed by smaller ones.
+                    wait = self._wait_time(tokens) if self._queue[0] is ticket else None
+                    if wait == 0:
+                        self._take(tokens)
+                        break
+
+                    self._condition.wait(timeout=wait)
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int):
+        """
+        Correct the estimate of a request, once we know how many tokens it used.
+        :param estimated_tokens: The tokens informed when the request was sent.
+        :param used_tokens: The tokens it actually used.
+        """
+        with self._condition:
+            self._record_usage(estimated_tokens, used_tokens)
+            self._condition.notify_all()
+
+    def update_from_response(self, status_code: int, headers: Mapping[str, str], estimated_tokens: int = 0):
+        """
+        Adjust the budgets to what the server says (rate limit headers, Retry-After and 429s).
+        :param status_code: The status code of the response.
+        :param headers: The headers of the response. (Must be case-insensitive, like the ones from requests and httpx)
+        :param estimated_tokens: The tokens informed when the request was sent. (Default: 0)
+        """
+        with self._condition:
+            self._update_from_response(status_code, headers, estimated_tokens)
+            self._condition.notify_all()
+
+
+class AsyncRateLimiter(_RateLimiterState):
+    """
+    Same as RateLimiter, but for coroutines. Must be used from a single event loop.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[int] = None,
+            tokens_per_minute: Optional[int] = None,
+            max_concurrency: Optional[int] = None):
+        super().__init__(requests_per_minute, tokens_per_minute, max_concurrency)
+        self._condition = asyncio.Condition()
+        self._queue: Deque[object] = deque()
+        # The event loop only keeps weak references to the tasks, so we keep them until they're done.
+        self._notifications: Set[asyncio.Task] = set()
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0) -> AsyncIterator[None]:
+        """
+        Wait for our turn (and the budget) to send a request. The request counts as in flight until the block ends.
+        :param tokens: Estimated tokens of the request. (Default: 0, only counts the request)
+        """
+        ticket = object()
+
+        async with self._condition:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    wait = self._wait_time(tokens) if self._queue[0] is ticket else None
+                    if wait == 0:
+                        self._take(tokens)
+                        break
+
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+
+        try:
+            yield
+        finally:
+            # Can't wait for the lock here if we're being cancelled, so the others are woken up by their timeouts.
+            self.in_flight -= 1
+            self._notify_soon()
+
+    def _notify_soon(self):
+        async def notify():
+            async with self._condition:
+                self._condition.notify_all()
+
+        task = asyncio.get_running_loop().create_task(notify())
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    # These don't wait for anything, so they're sync (safe, since everything runs in the same event loop).
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int):
+        """
+        Correct the estimate of a request, once we know how many tokens it used.
+        :param estimated_tokens: The tokens informed when the request was sent.
+        :param used_tokens: The tokens it actually used.
+        """
+        self._record_usage(estimated_tokens, used_tokens)
+        self._notify_soon()
+
+    def update_from_response(self, status_code: int, headers: Mapping[str, str], estimated_tokens: int = 0):
+        """
+        Adjust the budgets to what the server says (rate limit headers, Retry-After and 429s).
+        :param status_code: The status code of the response.
+        :param headers: The headers of the response. (Must be case-insensitive, like the ones from requests and httpx)
+        :param estimated_tokens: The tokens informed when the request was sent. (Default: 0)
+        """
+        self._update_from_response(status_code, headers, estimated_tokens)
+        self._notify_soon()
+
+
+def configure_rate_limit(
+        url: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrency: Optional[int] = None) -> RateLimitConfig:
+    """
+    Turn on the rate limiter for a host. Requests to hosts that were not configured are never held.
+    Even without any limits, the limiter learns them from the rate limit headers of the server and holds the requests
+    after a 429.
+
+    :param url: The url (or just scheme://host[:port]) of the host.
+    :param requests_per_minute: Max number of requests per minute. (Optional)
+    :param tokens_per_minute: Max number of tokens per minute. (Optional)
+    :param max_concurrency: Max number of requests in flight at the same time. (Optional)
+    :return: The configuration that will be used for the host.
+    """
+    config = RateLimitConfig(
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        max_concurrency=max_concurrency
+    )
+
+    # Validating now, instead of on the first request.
+    _RateLimiterState(**config.model_dump())
+
+    host_key = _get_host_key(url)
+
+    with _lock:
+        _rate_limit_configs[host_key] = config
+        # The next request creates new ones, with the new settings.
+        _rate_limiters.pop(host_key, None)
+        _async_rate_limiters.pop(host_key, None)
+
+    return config
+
+
+def is_rate_limited(url: str) -> bool:
+    """
+    :param url: The url that will be requested.
+    :return: True if the host of the url has a rate limiter.
+    """
+    return _get_host_key(url) in _rate_limit_configs
+
+
+def get_rate_limiter(url: str) -> Union[RateLimiter, None]:
+    """
+    Get the rate limiter of the host of the url. It's shared by all the threads.
+    :param url: The url that will be requested.
+    :return: The rate limiter, or None if the host was not configured with configure_rate_limit.
+    """
+    host_key = _get_host_key(url)
+    rate_limiter = _rate_limiters.get(host_key)
+
+    if rate_limiter is not None:
+        return rate_limiter
+
+    with _lock:
+        config = _rate_limit_configs.get(host_key)
+        if config is None:
+            return None
+
+        rate_limiter = _rate_limiters.get(host_key)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(**config.model_dump())
+            _rate_limiters[host_key] = rate_limiter
+
+    return rate_limiter
+
+
+def get_async_rate_limiter(url: str) -> Union[AsyncRateLimiter, None]:
+    """
+    Get the async rate limiter of the host of the url. It's shared by all the coroutines.
+    :param url: The url that will be requested.
+    :return: The rate limiter, or None if the host was not configured with configure_rate_limit.
+    """
+    host_key = _get_host_key(url)
+    rate_limiter = _async_rate_limiters.get(host_key)
+
+    if rate_limiter is not None:
+        return rate_limiter
+
+    config = _rate_limit_configs.get(host_key)
+    if config is None:
+        return None
+
+    rate_limiter = AsyncRateLimiter(**config.model_dump())
+    _async_rate_limiters[host_key] = rate_limiter
+
+    return rate_limiter
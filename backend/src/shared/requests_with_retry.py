@@ -1,7 +1,13 @@
+from threading import Lock
+from typing import Any, Dict, Tuple
+
 import requests
 
-from src.decorators.retry import retry_request
-from src.shared.serializer import serialize_to_dict
+from src.decorators.retry import retry_request, RetryBudget, CircuitBreaker
+from src.decorators.types import RetryJitter
+import src.shared.json_codec as json_codec
+from src.shared.http_sessions import get_session, get_request_timeout, _get_host_key
+from src.shared.rate_limiter import get_rate_limiter
 
 GLOBAL_RETRIES = 3
 GLOBAL_DELAY = 1
@@ -11,6 +17,47 @@ GLOBAL_RETRY_ONLY_ON_STATUS_CODES = None
 GLOBAL_GET_NEW_TOKEN_ON_401 = None
 GLOBAL_GET_NEW_TOKEN_ON_403 = None
 
+# Random delays, so the requests that failed together don't all retry together.
+GLOBAL_JITTER = RetryJitter.Full
+GLOBAL_MAX_DELAY = 30
+
+# Shared by every request (sync and async): retries can't be more than 20% of the requests (plus 1 per second), so
+# when an upstream is down we don't hit it with 3x the traffic.
+GLOBAL_RETRY_BUDGET = RetryBudget(ratio=0.2, min_retries_per_second=1, window_seconds=10)
+
+# One circuit breaker per host. After this many failures (5xx or no response) in a row, requests to the host fail
+# right away, until one request gets through after the recovery timeout.
+GLOBAL_CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+GLOBAL_CIRCUIT_BREAKER_RECOVERY_TIMEOUT = 30
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of the host of the url. It will be created on the first call.
+    :param url: The url that will be requested.
+    :return: The circuit breaker of the host.
+    """
+    host_key = _get_host_key(url)
+    circuit_breaker = _circuit_breakers.get(host_key)
+
+    if circuit_breaker is not None:
+        return circuit_breaker
+
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(host_key)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker(
+                name=host_key,
+                failure_threshold=GLOBAL_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                recovery_timeout=GLOBAL_CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+            )
+            _circuit_breakers[host_key] = circuit_breaker
+
+    return circuit_breaker
+
 
 def _get_decorator_config() -> dict:
     return {
@@ -20,10 +67,45 @@ def _get_decorator_config() -> dict:
         "skip_retry_on_404": GLOBAL_SKIP_RETRY_ON_404,
         "retry_only_on_status_codes": GLOBAL_RETRY_ONLY_ON_STATUS_CODES,
         "get_new_token_on_401": GLOBAL_GET_NEW_TOKEN_ON_401,
-        "get_new_token_on_403": GLOBAL_GET_NEW_TOKEN_ON_403
+        "get_new_token_on_403": GLOBAL_GET_NEW_TOKEN_ON_403,
+        "jitter": GLOBAL_JITTER,
+        "max_delay": GLOBAL_MAX_DELAY,
+        "retry_budget": GLOBAL_RETRY_BUDGET,
+        "get_circuit_breaker": get_circuit_breaker
     }
 
 
+def encode_json_body(json: Any, headers: Dict[str, str] = None) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Encode a JSON body with the JSON backend (see json_codec), instead of letting requests/httpx do it.
+    :param json: The body. If it's an EncodedJson, it's sent as is.
+    :param headers: The headers of the request. (Optional)
+    :return: The body, and the headers with the content type (unless they already had one).
+    """
+    body = json.body if isinstance(json, json_codec.EncodedJson) else json_codec.dumps(json)
+    return body, {"Content-Type": "application/json", **(headers or {})}
+
+
+def _request(method: str, url: str, estimated_tokens: int = 0, **kwargs) -> requests.Response:
+    """
+    Sends a request using the pooled session of the host, so connections are reused between calls (and retries).
+    If the host has a rate limiter (see configure_rate_limit), the request waits for its turn first.
+    :param estimated_tokens: How many tokens the request will use, for the tokens per minute limit. (Default: 0)
+    """
+    kwargs.setdefault("timeout", get_request_timeout(url))
+
+    rate_limiter = get_rate_limiter(url)
+    if rate_limiter is None:
+        return get_session(url).request(method, url, **kwargs)
+
+    # Each attempt (retries included) waits in line, so a 429 holds everyone instead of making them retry sooner.
+    with rate_limiter.limit(estimated_tokens):
+        response = get_session(url).request(method, url, **kwargs)
+
+    rate_limiter.update_from_response(response.status_code, response.headers, estimated_tokens)
+    return response
+
+
 @retry_request(**_get_decorator_config())
 def get(url, params=None, **kwargs) -> requests.Response:
     r"""Sends a GET request.
@@ -36,7 +118,7 @@ def get(url, params=None, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    return requests.get(url, params=params, **kwargs)
+    return _request("GET", url, params=params, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -49,7 +131,7 @@ def options(url, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    return requests.options(url, **kwargs)
+    return _request("OPTIONS", url, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -64,7 +146,8 @@ def head(url, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    return requests.head(url, **kwargs)
+    kwargs.setdefault("allow_redirects", False)
+    return _request("HEAD", url, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -79,8 +162,10 @@ def post(url, data=None, json=None, **kwargs) -> requests.Response:
     :return: :class:`Response <Response>` object
     :rtype: requests.Response
     """
-    serialized_json = serialize_to_dict(json)
-    return requests.post(url, data=data, json=serialized_json, **kwargs)
+    if json is not None:
+        data, kwargs["headers"] = encode_json_body(json, kwargs.get("headers"))
+
+    return _request("POST", url, data=data, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -96,10 +181,10 @@ def put(url, data=None, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    if "json" in kwargs:
-        kwargs["json"] = serialize_to_dict(kwargs["json"])
+    if kwargs.get("json") is not None:
+        data, kwargs["headers"] = encode_json_body(kwargs.pop("json"), kwargs.get("headers"))
 
-    return requests.put(url, data=data, **kwargs)
+    return _request("PUT", url, data=data, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -115,10 +200,10 @@ def patch(url, data=None, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    if "json" in kwargs:
-        kwargs["json"] = serialize_to_dict(kwargs["json"])
+    if kwargs.get("json") is not None:
+        data, kwargs["headers"] = encode_json_body(kwargs.pop("json"), kwargs.get("headers"))
 
-    return requests.patch(url, data=data, **kwargs)
+    return _request("PATCH", url, data=data, **kwargs)
 
 
 @retry_request(**_get_decorator_config())
@@ -131,4 +216,4 @@ def delete(url, **kwargs) -> requests.Response:
     :rtype: requests.Response
     """
 
-    return requests.delete(url, **kwargs)
+    return _request("DELETE", url, **kwargs)
@@ -1,9 +1,20 @@
-from datetime import datetime
+from collections.abc import Mapping, Sequence
+from dataclasses import fields, is_dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from functools import lru_cache, singledispatch
 from io import StringIO
-from typing import Union, List
+from pathlib import PurePath
+from typing import Any, Callable, List, Optional, Tuple, Union
+from uuid import UUID
 from pydantic import BaseModel
+from pydantic_core import PydanticSerializationError
 import csv
 
+from src.datasets.encoders import records_to_table, encode_table
+from src.datasets.types import DatasetEncoding
+
 
 _JSON_DUMPS_PARAMS = {
     "indent": 2,
@@ -11,43 +22,231 @@ _JSON_DUMPS_PARAMS = {
 }
 
 
-def obj_to_dict(obj) -> dict:
-    if issubclass(type(obj), BaseModel):
-        # If it's a BaseModel, convert it to a dict using that fancy helper.
-        obj = obj.dict()
+class _Serialized:
+    """
+    Returned by a handler when what it made is already made of dicts, lists and primitives only (nothing to look into).
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
 
-    elif hasattr(obj, '__dict__'):
-        # If it's an object, convert it to a dict using the __dict__ attribute.
-        obj = obj.__dict__
+# These are returned as they are.
+_PRIMITIVES = frozenset([str, int, float, bool, type(None)])
 
-    # Else: No idea how to convert it to a dict, so just return it as is.
+# Sequences that are values, not containers.
+_NOT_CONTAINERS = (str, bytes, bytearray, memoryview)
 
-    # Return the (hopefully) converted object.
+# Deeper than this, serialize_to_dict stops recursing and uses a stack (so it never hits the recursion limit).
+_MAX_RECURSION_DEPTH = 100
+
+
+@singledispatch
+def _to_serializable(obj):
+    # No handler for this type (and it's not a dataclass or an object with a __dict__): return it as is.
     return obj
 
 
+@_to_serializable.register(set)
+@_to_serializable.register(frozenset)
+def _set(obj):
+    return list(obj)
+
+
+@_to_serializable.register(BaseModel)
+def _pydantic_model(obj: BaseModel):
+    try:
+        # Pydantic converts everything it knows (datetimes, enums, nested models...) a lot faster than we can.
+        return _Serialized(obj.model_dump(mode="json"))
+    except PydanticSerializationError:
+        # Some field it doesn't know how to convert: let us handle them.
+        return obj.model_dump()
+
+
+@_to_serializable.register(datetime)
+@_to_serializable.register(date)
+@_to_serializable.register(time)
+def _datetime(obj):
+    return obj.isoformat()
+
+
+@_to_serializable.register(Enum)
+def _enum(obj: Enum):
+    return obj.value
+
+
+@_to_serializable.register(UUID)
+@_to_serializable.register(Decimal)
+@_to_serializable.register(PurePath)
+def _as_string(obj):
+    return str(obj)
+
+
+@lru_cache(maxsize=None)
+def _handler_for_type(obj_type: type) -> Callable:
+    """
+    The handler of a type. Picked once per type, since going through singledispatch on every value is slow.
+    Remarks: Register the handlers (on _to_serializable) before serializing anything of that type.
+    """
+    handler = _to_serializable.dispatch(obj_type)
+
+    if handler is not _to_serializable.registry[object]:
+        return handler
+
+    # Subclasses of the primitives and of dict/list/tuple (OrderedDict, Counter, defaultdict...) are used as they are:
+    # the containers are walked by serialize_to_dict. They must come before the __dict__ check below, since most of
+    # them have one (and it's empty).
+    if issubclass(obj_type, (*_PRIMITIVES, dict, list, tuple)):
+        return _to_serializable.registry[object]
+
+    # Not checked with singledispatch, because str is a Sequence too, and a (str, Enum) would be ambiguous.
+    if issubclass(obj_type, Mapping):
+        return dict
+
+    if issubclass(obj_type, Sequence) and not issubclass(obj_type, _NOT_CONTAINERS):
+        return list
+
+    if is_dataclass(obj_type):
+        # Only the first level: the values are walked by serialize_to_dict (unlike dataclasses.asdict, that recurses).
+        names = tuple(field.name for field in fields(obj_type))
+        return lambda obj: {name: getattr(obj, name) for name in names}
+
+    if getattr(obj_type, "__dictoffset__", 0) != 0:
+        # Its instances have a __dict__.
+        return vars
+
+    return handler
+
+
+def _walkable(value) -> Tuple[Any, Optional[type]]:
+    """
+    Convert value with the handler of its type.
+    :return: What it was converted to, and dict or list if it's a container that still has to be walked through
+    (None if it's done).
+    """
+    value_type = value.__class__
+
+    if value_type is dict or value_type is list:
+        return value, value_type
+
+    value = _handler_for_type(value_type)(value)
+    value_type = value.__class__
+
+    if value_type is _Serialized:
+        return value.value, None
+
+    if isinstance(value, dict):
+        return value, dict
+
+    if isinstance(value, (list, tuple)):
+        return value, list
+
+    return value, None
+
+
+def _enter(value, in_progress: dict):
+    value_id = id(value)
+
+    if value_id in in_progress:
+        raise ValueError(f"Circular reference found while serializing {type(value).__name__}.")
+
+    # Kept here so it's not collected (and its id reused) before it's done.
+    in_progress[value_id] = value
+    return value_id
+
+
+def _serialize_recursively(value, depth: int, in_progress: dict):
+    container_type = value.__class__
+
+    if container_type is not dict and container_type is not list:
+        value, container_type = _walkable(value)
+
+        if container_type is None:
+            return value
+
+    if depth >= _MAX_RECURSION_DEPTH:
+        return _serialize_iteratively(value, container_type, in_progress)
+
+    # Same as _enter (inlined: this runs for every container).
+    value_id = id(value)
+
+    if value_id in in_progress:
+        raise ValueError(f"Circular reference found while serializing {type(value).__name__}.")
+
+    in_progress[value_id] = value
+    depth += 1
+
+    if container_type is dict:
+        converted = {
+            key: child if child.__class__ in _PRIMITIVES else _serialize_recursively(child, depth, in_progress)
+            for key, child in value.items()
+        }
+    else:
+        converted = [
+            child if child.__class__ in _PRIMITIVES else _serialize_recursively(child, depth, in_progress)
+            for child in value
+        ]
+
+    del in_progress[value_id]
+    return converted
+
+
+def _serialize_iteratively(value, container_type: type, in_progress: dict):
+    root = [None]
+    # What's left to convert: (where to put it, key/index, value, dict/list), or the id of a container that is done.
+    stack = [(root, 0, value, container_type)]
+
+    while stack:
+        item = stack.pop()
+
+        if item.__class__ is int:
+            del in_progress[item]
+            continue
+
+        target, key, value, container_type = item
+
+        if container_type is dict:
+            converted = dict.fromkeys(value)  # So the keys stay in order.
+            children = value.items()
+        else:
+            converted = [None] * len(value)
+            children = enumerate(value)
+
+        target[key] = converted
+        stack.append(_enter(value, in_progress))
+
+        for child_key, child in children:
+            if child.__class__ in _PRIMITIVES:
+                converted[child_key] = child
+                continue
+
+            child, child_container_type = _walkable(child)
+
+            if child_container_type is None:
+                converted[child_key] = child
+            else:
+                stack.append((converted, child_key, child, child_container_type))
+
+    return root[0]
+
+
 def serialize_to_dict(obj) -> Union[dict, List[dict], None]:
     """
-    Serialize obj to a dict or a list of dicts. Useful when sending complex objects in http requests.
-    If the obj passed is a dict, will iterate over all the properties and convert them to dicts.
-    Remarks: This scans the object recursively.
+    Serialize obj to dicts, lists and primitives. Useful when sending complex objects in http requests.
+    Goes through everything in it (mappings, sequences and sets, pydantic models, dataclasses and objects), converting
+    datetimes to ISO 8601, enums to their values, and UUIDs, Decimals and paths to strings.
+    Remarks: There's no limit on how deep obj can be (past a point, a stack is used instead of recursion). Raises a
+    ValueError if obj contains itself.
 
     :param obj: The object to be serialized
     :return: The serialized JSON object or None if the object is None.
     """
-    if obj is None:
-        return None
-
-    if isinstance(obj, list):
-        serialized = [obj_to_dict(item) for item in obj]
-    elif isinstance(obj, dict):
-        serialized = {}
-        for key, value in obj.items():
-            serialized[key] = serialize_to_dict(value)
-    else:
-        serialized = obj_to_dict(obj)
+    if obj.__class__ in _PRIMITIVES:
+        return obj
 
-    return serialized
+    # Containers being converted (the ones above the current value), by id. Seeing one again means obj contains itself.
+    return _serialize_recursively(obj, 0, {})
 
 
 def parse_csv(csv_data: str) -> List[dict]:
@@ -80,25 +279,20 @@ def csv_string_to_dict_list(
     return no_data_return
 
 
-def dataset_to_prompt_text(dataset: List[dict]) -> str:
+def dataset_to_prompt_text(
+        dataset: List[dict],
+        encoding: DatasetEncoding = DatasetEncoding.Python,
+        token_counter: Callable[[str], int] = None) -> str:
     """
     Converts a dataset to a prompt text.
     :param dataset: The dataset.
+    :param encoding: The format of the text. Python repeats the column names on every row, so for anything but tiny
+    datasets, the other encodings are a lot cheaper (in tokens). (Default: Python)
+    :param token_counter: Used to pick the cheapest encoding when encoding is Auto. (Optional)
     :return: The prompt text.
     """
     if dataset is None or not isinstance(dataset, list):
         return str(dataset)
 
-    data = []
-    for row in dataset:
-        item ={}
-        for key, value in row.items():
-            if isinstance(value, datetime):
-                item[key] = value.strftime("%Y-%m-%d %H:%M:%S.%f")
-                continue
-
-            item[key] = value
-
-        data.append(item)
-
-    return str(data)
+    columns, rows = records_to_table(dataset)
+    return encode_table(columns, rows, encoding, token_counter)
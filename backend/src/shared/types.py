@@ -0,0 +1,82 @@
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class HostPoolConfig(BaseModel):
+    # Max number of connections kept open to the host. (requests: pool_maxsize / httpx: max_connections)
+    pool_maxsize: int
+    # Max number of idle connections kept alive, waiting to be reused. Only used by the async clients.
+    max_keepalive_connections: int
+    # If True, requests will wait for a free connection instead of opening a throwaway one. Only used by requests.
+    pool_block: bool
+    # Use HTTP/2 when the server supports it. Only used by the async clients, and only if h2 is installed.
+    http2: bool
+    # How long (in seconds) to wait for the server. None means wait forever.
+    timeout: Optional[float]
+
+
+class RateLimitConfig(BaseModel):
+    # Max number of requests per minute. None means we only learn it from the rate limit headers of the server.
+    requests_per_minute: Optional[int]
+    # Max number of tokens (prompt + completion) per minute. None means we only learn it from the headers.
+    tokens_per_minute: Optional[int]
+    # Max number of requests waiting for the server at the same time. None means no limit.
+    max_concurrency: Optional[int]
+
+
+class LogOverflowPolicy(Enum):
+    # What to do with a new record when the queue of the log writer is full.
+    # Wait for room (up to a timeout, then drop it).
+    Block = "block"
+    # Drop the new record.
+    DropNewest = "drop_newest"
+    # Drop the oldest record in the queue to make room for the new one.
+    DropOldest = "drop_oldest"
+
+
+class InteractionLogEntry(BaseModel):
+    id: int
+    # UTC, ISO 8601.
+    logged_at: str
+    model: Optional[str]
+    provider: Optional[str]
+    conversation_id: Optional[str]
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    total_tokens: Optional[int]
+    # Time to get the complete response. None for records logged before it was tracked.
+    latency_seconds: Optional[float]
+    # Where the full record is. (See InteractionLogIndex.get_record)
+    segment: str
+
+
+class InteractionLogGroupBy(Enum):
+    Model = "model"
+    Provider = "provider"
+    Conversation = "conversation_id"
+    # UTC day.
+    Day = "day"
+
+
+class InteractionLogStats(BaseModel):
+    # The value of whatever the stats are grouped by (None for records without it).
+    group: Optional[str]
+    count: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    # Latency percentiles and average, in seconds. None if no record of the group has it.
+    latency_avg: Optional[float]
+    latency_p50: Optional[float]
+    latency_p95: Optional[float]
+    latency_p99: Optional[float]
+
+
+class JsonBackend(Enum):
+    # orjson if it's installed, json otherwise.
+    Auto = "auto"
+    Orjson = "orjson"
+    # The standard library.
+    Json = "json"
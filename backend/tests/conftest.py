@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The tests import the code the same way the scripts do (from src...), so the backend folder has to be on the path.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeClock:
+    """
+    Stands in for the time module of the code being tested: monotonic() and time() only move when the test calls
+    advance().
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(request, monkeypatch) -> FakeClock:
+    """
+    A FakeClock in place of the time module of the module given as the param:
+    @pytest.mark.parametrize("clock", [module], indirect=True)
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(request.param, "time", clock)
+    return clock
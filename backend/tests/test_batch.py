@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.ai_tasks.async_ai_tasks import AsyncAiTasks
+from src.ai_tasks.batch import async_run_batch, run_batch
+from src.ai_tasks.types import AiBatchItem, AiGeneratorConfig, AiResponse
+
+
+def _response(text: str) -> AiResponse:
+    config = AiGeneratorConfig(base_url="url", ai_model_name="model")
+    return AiResponse(response=text, updated_context=[], config=config)
+
+
+class _Tracker:
+    """
+    Keeps track of how many tasks are running at the same time, and which ones ran.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+
+    def enter(self, index: int):
+        with self.lock:
+            self.started.append(index)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def leave(self):
+        with self.lock:
+            self.running -= 1
+
+
+def _sync_tasks(tracker: _Tracker, delays, fail=()):
+    def task(index: int, delay: float) -> AiResponse:
+        tracker.enter(index)
+        try:
+            time.sleep(delay)
+            if index in fail:
+                raise RuntimeError(f"item {index} failed")
+            return _response(f"answer {index}")
+        finally:
+            tracker.leave()
+
+    return [lambda index=index, delay=delay: task(index, delay) for index, delay in enumerate(delays)]
+
+
+def _async_tasks(tracker: _Tracker, delays, fail=()):
+    async def task(index: int, delay: float) -> AiResponse:
+        tracker.enter(index)
+        try:
+            await asyncio.sleep(delay)
+            if index in fail:
+                raise RuntimeError(f"item {index} failed")
+            return _response(f"answer {index}")
+        finally:
+            tracker.leave()
+
+    return [lambda index=index, delay=delay: task(index, delay) for index, delay in enumerate(delays)]
+
+
+def _run_async(tasks, **kwargs):
+    async def collect():
+        return [result async for result in async_run_batch(tasks, **kwargs)]
+
+    return asyncio.run(collect())
+
+
+@pytest.fixture(params=["threads", "async"])
+def run(request):
+    """
+    Runs a batch with run_batch or async_run_batch (same behavior, separate code).
+    """
+    def _run(delays, fail=(), **kwargs):
+        tracker = _Tracker()
+        if request.param == "threads":
+            results = list(run_batch(_sync_tasks(tracker, delays, fail), **kwargs))
+        else:
+            results = _run_async(_async_tasks(tracker, delays, fail), **kwargs)
+        return results, tracker
+
+    return _run
+
+
+def test_results_come_in_the_order_of_the_items(run):
+    results, _ = run([0.05, 0.01, 0.03], max_concurrency=3)
+
+    assert [result.index for result in results] == [0, 1, 2]
+    assert [result.response.response for result in results] == ["answer 0", "answer 1", "answer 2"]
+
+
+def test_unordered_results_come_as_soon_as_they_are_ready(run):
+    results, _ = run([0.1, 0.01, 0.05], max_concurrency=3, ordered=False)
+
+    assert [result.index for result in results] == [1, 2, 0]
+
+
+def test_a_failed_item_does_not_stop_the_others(run):
+    results, _ = run([0.01, 0.01, 0.01], fail={1}, max_concurrency=2)
+
+    assert [result.error for result in results] == [None, "item 1 failed", None]
+    assert results[1].response is None
+    assert results[2].response.response == "answer 2"
+
+
+def test_no_more_than_max_concurrency_items_run_at_the_same_time(run):
+    results, tracker = run([0.02] * 8, max_concurrency=3)
+
+    assert len(results) == 8
+    assert tracker.max_running == 3
+
+
+def test_max_concurrency_must_be_positive(run):
+    with pytest.raises(ValueError):
+        run([0.01], max_concurrency=0)
+
+
+def test_items_that_have_not_started_are_dropped_when_the_reader_gives_up():
+    tracker = _Tracker()
+    results = run_batch(_sync_tasks(tracker, [0.02] * 5), max_concurrency=1)
+
+    assert next(results).index == 0
+    results.close()
+    time.sleep(0.1)
+
+    # The next one may have started before the reader gave up, but the others never do.
+    assert tracker.started in ([0], [0, 1])
+
+
+def test_async_items_are_cancelled_when_the_reader_gives_up():
+    tracker = _Tracker()
+
+    async def read_one():
+        results = async_run_batch(_async_tasks(tracker, [0.02] * 5), max_concurrency=1)
+        first = await results.__anext__()
+        await results.aclose()
+        await asyncio.sleep(0.1)
+        return first
+
+    assert asyncio.run(read_one()).index == 0
+    assert tracker.started in ([0], [0, 1])
+    assert tracker.running == 0
+
+
+def test_ask_many():
+    tasks = AsyncAiTasks(api_endpoint="http://provider.test", api_key="key", default_model="model",
+                         response_logger=lambda _: None)
+
+    async def post(provider, payload):
+        question = payload.messages[-1].content
+        if question == "fail":
+            raise ValueError("bad question")
+        return {"choices": [{"message": {"role": "assistant", "content": f"answer to {question}"}}]}
+
+    tasks._post_to_provider = post
+
+    async def collect():
+        items = ["one", AiBatchItem(question_or_prompt="fail"), AiBatchItem(question_or_prompt="two", use_cache=False)]
+        return [result async for result in tasks.ask_many(items, max_concurrency=2)]
+
+    results = asyncio.run(collect())
+
+    assert [result.response.response if result.response else result.error for result in results] == [
+        "answer to one", "bad question", "answer to two"
+    ]
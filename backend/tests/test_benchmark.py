@@ -0,0 +1,94 @@
+import gc
+import threading
+
+from src.decorators.benchmark import _Aggregator, benchmark
+
+
+def _record_in_threads(aggregator: _Aggregator, thread_count: int, calls_per_thread: int):
+    def record():
+        for i in range(calls_per_thread):
+            aggregator.record(0.001 * (i + 1), failed=i == 0)
+
+    threads = [threading.Thread(target=record) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    gc.collect()
+
+
+def test_finished_threads_are_folded_into_the_total():
+    aggregator = _Aggregator()
+
+    _record_in_threads(aggregator, thread_count=50, calls_per_thread=10)
+
+    assert len(aggregator._histograms) == 0
+    stats = aggregator.stats()
+    assert stats["count"] == 500
+    assert stats["errors"] == 50
+    assert stats["min_seconds"] == 0.001
+    assert stats["max_seconds"] == 0.01
+    assert abs(stats["p50_seconds"] - 0.005) < 0.0001
+
+
+def test_live_and_finished_threads_are_both_counted():
+    aggregator = _Aggregator()
+    aggregator.record(1, failed=False)
+
+    _record_in_threads(aggregator, thread_count=3, calls_per_thread=2)
+
+    assert len(aggregator._histograms) == 1
+    assert aggregator.stats()["count"] == 7
+    assert aggregator.stats()["max_seconds"] == 1
+
+
+def test_reset_forgets_live_and_finished_threads():
+    aggregator = _Aggregator()
+    aggregator.record(1, failed=False)
+    _record_in_threads(aggregator, thread_count=3, calls_per_thread=2)
+
+    aggregator.reset()
+    gc.collect()
+
+    assert aggregator.stats()["count"] == 0
+    aggregator.record(2, failed=True)
+    assert aggregator.stats()["count"] == 1
+    assert aggregator.stats()["errors"] == 1
+
+
+def test_threads_that_end_after_a_reset_are_not_counted():
+    aggregator = _Aggregator()
+    recorded = threading.Event()
+    finish = threading.Event()
+
+    def record():
+        aggregator.record(1, failed=False)
+        recorded.set()
+        finish.wait(5)
+
+    thread = threading.Thread(target=record)
+    thread.start()
+    recorded.wait(5)
+
+    aggregator.reset()
+    finish.set()
+    thread.join()
+    gc.collect()
+
+    assert aggregator.stats()["count"] == 0
+
+
+def test_benchmark_stats_from_threads():
+    @benchmark(log_calls=False)
+    def work():
+        return 1
+
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+
+    assert work.get_benchmark_stats()["count"] == 10
@@ -0,0 +1,136 @@
+import asyncio
+import re
+
+from src.ai_tasks.ai_tasks import AiTasks
+from src.ai_tasks.async_ai_tasks import AsyncAiTasks
+from src.ai_tasks.types import ChatContextItem
+
+_URL = "http://provider.test/v1/chat/completions"
+_QUESTION = "How many names?"
+_DATA = [{"id": index, "name": f"name {index}"} for index in range(30)]
+
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+
+class _FakeAi:
+    """
+    Answers the prompts of the chunked analysis: each part with its rows, and each combination with the answers it got.
+    """
+
+    def __init__(self, partial_answer_padding: int = 0):
+        self.prompts = []
+        self.partial_answer_padding = partial_answer_padding
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def answer(self, payload) -> dict:
+        prompt = payload.messages[-1].content
+        self.prompts.append(prompt)
+
+        if prompt.startswith("The dataset is too big"):
+            first_row, last_row = re.search(r"rows (\d+) to (\d+) of", prompt).groups()
+            content = f"rows {first_row}-{last_row}" + " pad" * self.partial_answer_padding
+        elif prompt.startswith("The dataset was too big"):
+            content = "[" + " + ".join(re.findall(r"Answer for part \d+:\n(.+)", prompt)) + "]"
+        else:
+            content = "whole"
+
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    async def async_answer(self, payload) -> dict:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            return self.answer(payload)
+        finally:
+            self.in_flight -= 1
+
+
+def _tasks(cls, fake_ai: _FakeAi):
+    tasks = cls(api_endpoint=_URL, api_key="key", default_model="model", response_logger=lambda _: None)
+    tasks.token_counter = _words
+
+    if cls is AsyncAiTasks:
+        tasks._post_to_provider = lambda provider, payload: fake_ai.async_answer(payload)
+    else:
+        tasks._post_to_provider = lambda provider, payload: fake_ai.answer(payload)
+
+    return tasks
+
+
+def _part_answers(response: str):
+    return re.findall(r"rows \d+-\d+", response)
+
+
+def test_data_that_fits_in_one_chunk_is_analyzed_at_once():
+    fake_ai = _FakeAi()
+
+    response = _tasks(AiTasks, fake_ai).analyze_data_chunked(_QUESTION, _DATA[:3], chunk_max_tokens=1000)
+
+    assert response.response == "whole"
+    assert len(fake_ai.prompts) == 1
+    assert fake_ai.prompts[0].startswith(_QUESTION)
+    assert "rows 1 to 3 of 3" in fake_ai.prompts[0]
+
+
+def test_each_chunk_is_asked_and_the_answers_are_combined():
+    fake_ai = _FakeAi()
+    context = [
+        ChatContextItem(role="user", content="Earlier question"),
+        ChatContextItem(role="assistant", content="Ok")
+    ]
+
+    response = _tasks(AiTasks, fake_ai).analyze_data_chunked(
+        _QUESTION, _DATA, chunk_max_tokens=20, context=context, max_concurrency=2
+    )
+
+    map_prompts, final_prompt = fake_ai.prompts[:-1], fake_ai.prompts[-1]
+    assert len(map_prompts) > 1
+    assert all(f"split into {len(map_prompts)} parts" in prompt for prompt in map_prompts)
+    assert all(_QUESTION in prompt for prompt in fake_ai.prompts)
+
+    # Every row is in exactly one part, in order, and the final answer has all of them.
+    parts = _part_answers(response.response)
+    assert parts[0].startswith("rows 1-") and parts[-1].endswith(f"-{len(_DATA)}")
+    ranges = [[int(row) for row in part[len("rows "):].split("-")] for part in parts]
+    assert [first for first, _ in ranges[1:]] == [last + 1 for _, last in ranges[:-1]]
+
+    # Only the final prompt goes in the conversation.
+    assert [item.content for item in response.updated_context] == [
+        "Earlier question", "Ok", final_prompt, response.response
+    ]
+
+
+def test_answers_that_do_not_fit_together_are_combined_in_groups_first():
+    fake_ai = _FakeAi(partial_answer_padding=15)
+
+    response = _tasks(AiTasks, fake_ai).analyze_data_chunked(_QUESTION, _DATA, chunk_max_tokens=20)
+
+    reduce_prompts = [prompt for prompt in fake_ai.prompts if prompt.startswith("The dataset was too big")]
+    assert len(reduce_prompts) > 1
+    # Combinations of combinations, but still every part once.
+    assert response.response.startswith("[[")
+    assert len(_part_answers(response.response)) == len(fake_ai.prompts) - len(reduce_prompts)
+
+
+def test_groups_get_at_least_two_answers():
+    tasks = _tasks(AiTasks, _FakeAi())
+
+    assert tasks._group_partial_answers(["a b c", "d e f", "g h i"], max_tokens=1) == [["a b c", "d e f"], ["g h i"]]
+    assert tasks._group_partial_answers(["a", "b", "c"], max_tokens=10) == [["a", "b", "c"]]
+
+
+def test_async_chunks_are_sent_up_to_the_max_concurrency():
+    fake_ai = _FakeAi()
+
+    response = asyncio.run(_tasks(AsyncAiTasks, fake_ai).analyze_data_chunked(
+        _QUESTION, _DATA, chunk_max_tokens=10, max_concurrency=2
+    ))
+
+    map_prompts = [prompt for prompt in fake_ai.prompts if prompt.startswith("The dataset is too big")]
+    assert len(map_prompts) > 2
+    assert fake_ai.max_in_flight == 2
+    assert len(_part_answers(response.response)) == len(map_prompts)
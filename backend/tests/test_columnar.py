@@ -0,0 +1,74 @@
+import pytest
+
+from src.datasets.columnar import ColumnarDataset, ingest_csv_file
+from src.datasets.types import ColumnType
+
+
+@pytest.fixture(params=["from_rows", "ingest_csv_file"])
+def build(request, tmp_path):
+    """
+    Build a dataset both ways (in memory and from a CSV file, memory-mapped), since they have separate code paths.
+    """
+    datasets = []
+
+    def _build(header, rows):
+        if request.param == "from_rows":
+            dataset = ColumnarDataset.from_rows(header, rows)
+        else:
+            csv_file = tmp_path.joinpath("data.csv")
+            csv_file.write_text("\n".join(",".join(row) for row in [header, *rows]) + "\n", encoding="utf-8")
+            dataset = ingest_csv_file(csv_file, tmp_path.joinpath("dataset"))
+        datasets.append(dataset)
+        return dataset
+
+    yield _build
+
+    for dataset in datasets:
+        dataset.close()
+
+
+def test_integer_column_with_missing_values_stays_integer(build):
+    # A second column, since a row with a single empty value is a blank line in a CSV file.
+    dataset = build(["value", "name"], [["1000", "a"], ["", "b"], ["2", "c"]])
+
+    assert dataset.column_type("value") == ColumnType.Integer
+    assert dataset.column_values("value") == [1000, None, 2]
+    assert list(dataset.iter_rows()) == [[1000, "a"], [None, "b"], [2, "c"]]
+    assert list(dataset.missing_mask("value")) == [0, 1, 0]
+
+
+def test_integer_column_without_missing_values_has_no_mask(build):
+    dataset = build(["value"], [["1"], ["-2"], ["+3"]])
+
+    assert dataset.column_values("value") == [1, -2, 3]
+    assert dataset.missing_mask("value") is None
+
+
+@pytest.mark.parametrize("value", ["1_000", "nan", "NaN", "inf", "-Infinity", "007", "1e999", "٣", "0x10", "."])
+def test_values_that_python_parses_but_are_not_plain_numbers_stay_strings(build, value):
+    dataset = build(["value"], [["1"], [value]])
+
+    assert dataset.column_type("value") == ColumnType.String
+    assert dataset.column_values("value") == ["1", value]
+
+
+def test_float_column(build):
+    dataset = build(["value", "name"], [["1", "a"], ["2.5", "b"], ["", "c"], ["-.5", "d"], ["1e3", "e"]])
+
+    assert dataset.column_type("value") == ColumnType.Float
+    assert dataset.column_values("value") == [1.0, 2.5, None, -0.5, 1000.0]
+
+
+def test_numeric_values_has_nan_where_missing(build):
+    dataset = build(["value", "name"], [["1", "a"], ["", "b"], ["3", "c"]])
+
+    values = list(dataset.numeric_values("value"))
+    assert values[0] == 1 and values[2] == 3
+    assert values[1] != values[1]
+
+
+def test_integer_too_big_for_int64_stays_string(build):
+    dataset = build(["id"], [["1"], [str(2 ** 63)]])
+
+    assert dataset.column_type("id") == ColumnType.String
+    assert dataset.column_values("id") == ["1", str(2 ** 63)]
@@ -0,0 +1,138 @@
+import pytest
+
+from src.ai_tasks.types import ChatContextItem
+from src.ai_utils.context_window import ContextWindowManager
+
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+
+def _manager(max_tokens: int, **kwargs) -> ContextWindowManager:
+    # One token per word, and no overhead per message, so the counts are easy to follow.
+    return ContextWindowManager(max_tokens, token_counter=_words, tokens_per_message=0, **kwargs)
+
+
+def _message(role: str, words: int, name: str) -> ChatContextItem:
+    return ChatContextItem(role=role, content=" ".join([name] * words))
+
+
+def _names(context):
+    return [message.content.split()[0] for message in context]
+
+
+@pytest.fixture
+def context():
+    # 2 + 4 * 5 = 22 tokens.
+    return [
+        _message("system", 2, "system"),
+        _message("user", 5, "q1"),
+        _message("assistant", 5, "a1"),
+        _message("user", 5, "q2"),
+        _message("assistant", 5, "a2"),
+    ]
+
+
+def test_a_context_within_budget_is_kept_as_is(context):
+    assert _manager(22).fit(context) == context
+
+
+def test_the_oldest_messages_are_dropped_first(context):
+    fitted = _manager(12).fit(context)
+
+    assert _names(fitted) == ["system", "q2", "a2"]
+    # The original is not changed.
+    assert len(context) == 5
+
+
+def test_the_system_message_and_the_latest_message_are_always_kept(context):
+    assert _names(_manager(1).fit(context)) == ["system", "a2"]
+
+
+def test_without_a_system_message_the_first_message_can_be_dropped(context):
+    assert _names(_manager(10).fit(context[1:])) == ["q2", "a2"]
+
+
+def test_the_tokens_reserved_for_the_completion_are_left_free(context):
+    assert _names(_manager(22, reserved_for_completion=10).fit(context)) == ["system", "q2", "a2"]
+
+
+def test_dropped_messages_are_replaced_by_their_summary(context):
+    summarized = []
+
+    def summarizer(messages):
+        summarized.append(_names(messages))
+        return "short"
+
+    context[1] = _message("user", 10, "q1")
+
+    # Without q1, it's 17 tokens. With "Summary of the earlier conversation: short" (6 tokens), 23.
+    fitted = _manager(23, summarizer=summarizer).fit(context)
+
+    assert summarized == [["q1"]]
+    assert _names(fitted) == ["system", "Summary", "a1", "q2", "a2"]
+    assert fitted[1].role == "system"
+    assert fitted[1].content.endswith("short")
+
+
+def test_one_more_message_is_dropped_to_make_room_for_the_summary(context):
+    summarized = []
+
+    def summarizer(messages):
+        summarized.append(_names(messages))
+        # "Summary of the earlier conversation: x" is 6 tokens.
+        return "x"
+
+    fitted = _manager(20, summarizer=summarizer).fit(context)
+
+    # q1 alone was enough to fit, but not with the summary. a1 goes too, so it has to be in the summary.
+    assert summarized == [["q1"], ["q1", "a1"]]
+    assert _names(fitted) == ["system", "Summary", "q2", "a2"]
+
+
+def test_a_summary_that_does_not_fit_is_left_out(context):
+    fitted = _manager(12, summarizer=lambda _: "a summary that is way too long to fit").fit(context)
+
+    # q2 was dropped to make room for the summary, but there still wasn't enough, so it's back.
+    assert _names(fitted) == ["system", "q2", "a2"]
+
+
+@pytest.mark.parametrize("summary", [None, ""])
+def test_without_a_summary_the_messages_are_just_dropped(context, summary):
+    assert _names(_manager(12, summarizer=lambda _: summary).fit(context)) == ["system", "q2", "a2"]
+
+
+def test_each_message_is_counted_only_once():
+    counted = []
+
+    def counter(text):
+        counted.append(text)
+        return _words(text)
+
+    manager = ContextWindowManager(100, token_counter=counter, tokens_per_message=4)
+    message = _message("user", 3, "q1")
+
+    assert manager.count_message(message) == 7
+    assert manager.count_context([message, message.model_copy()]) == 14
+    assert counted == [message.content]
+
+
+def test_only_the_last_counts_are_cached():
+    counted = []
+
+    def counter(text):
+        counted.append(text)
+        return _words(text)
+
+    manager = ContextWindowManager(100, token_counter=counter, max_cached_messages=1)
+    first, second = _message("user", 1, "first"), _message("user", 1, "second")
+
+    for message in [first, second, first]:
+        manager.count_message(message)
+
+    assert counted == ["first", "second", "first"]
+
+
+def test_the_budget_must_leave_room_for_the_context():
+    with pytest.raises(ValueError):
+        ContextWindowManager(100, reserved_for_completion=100, token_counter=_words)
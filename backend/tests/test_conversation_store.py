@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from src.ai_tasks.types import ChatContextItem
+from src.conversations.conversation_store import ConversationConflictError, FileConversationStore, \
+    MemoryConversationStore, SqliteConversationStore
+
+
+@pytest.fixture(params=["memory", "sqlite", "file"])
+def store_factory(request, tmp_path):
+    def create(max_conversations: int = 1000):
+        if request.param == "sqlite":
+            return SqliteConversationStore(tmp_path.joinpath("conversations.sqlite"), max_conversations)
+
+        if request.param == "file":
+            return FileConversationStore(tmp_path.joinpath("conversations"), max_conversations)
+
+        return MemoryConversationStore(max_conversations=max_conversations)
+
+    return create
+
+
+def _messages(*contents: str):
+    return [ChatContextItem(role="user", content=content) for content in contents]
+
+
+def test_each_save_makes_a_new_version(store_factory):
+    store = store_factory()
+
+    assert store.get("conversation") is None
+
+    store.save("conversation", _messages("first"), 0)
+    messages, version = store.get("conversation")
+    store.save("conversation", messages + _messages("second"), version)
+
+    assert store.get("conversation") == (_messages("first", "second"), version + 1)
+
+
+def test_only_one_of_two_turns_based_on_the_same_version_is_saved(store_factory):
+    store = store_factory()
+    store.save("conversation", _messages("first"), 0)
+    messages, version = store.get("conversation")
+
+    store.save("conversation", messages + _messages("turn a"), version)
+
+    with pytest.raises(ConversationConflictError):
+        store.save("conversation", messages + _messages("turn b"), version)
+
+    assert store.get("conversation")[0] == _messages("first", "turn a")
+
+
+def test_a_new_conversation_cannot_replace_an_existing_one(store_factory):
+    store = store_factory()
+    store.save("conversation", _messages("first"), 0)
+
+    with pytest.raises(ConversationConflictError):
+        store.save("conversation", _messages("other"), 0)
+
+
+def test_a_turn_of_a_deleted_conversation_is_not_saved(store_factory):
+    store = store_factory()
+    store.save("conversation", _messages("first"), 0)
+    _, version = store.get("conversation")
+
+    assert store.delete("conversation")
+    assert not store.delete("conversation")
+
+    with pytest.raises(ConversationConflictError):
+        store.save("conversation", _messages("first", "second"), version)
+
+
+def test_the_least_recently_used_conversation_is_evicted(store_factory, tmp_path):
+    store = store_factory(max_conversations=2)
+
+    store.save("a", _messages("a"), 0)
+    store.save("b", _messages("b"), 0)
+    # A new turn makes "a" the most recently used.
+    store.save("a", _messages("a", "a"), 1)
+    if isinstance(store, FileConversationStore):
+        # The file store goes by the modification time, which may not change between saves this fast.
+        os.utime(tmp_path.joinpath("conversations", "b.json"), (0, 0))
+
+    store.save("c", _messages("c"), 0)
+
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.get("c") is not None
+
+
+def test_a_turn_being_saved_by_someone_else_is_a_conflict(tmp_path):
+    store = FileConversationStore(tmp_path)
+    store.save("conversation", _messages("first"), 0)
+
+    tmp_path.joinpath("conversation.json.lock").touch()
+
+    with pytest.raises(ConversationConflictError):
+        store.save("conversation", _messages("first", "second"), 1)
+
+
+def test_a_lock_left_behind_by_a_dead_worker_is_ignored(tmp_path):
+    store = FileConversationStore(tmp_path)
+    store.save("conversation", _messages("first"), 0)
+
+    lock_file = tmp_path.joinpath("conversation.json.lock")
+    lock_file.touch()
+    os.utime(lock_file, (0, 0))
+
+    store.save("conversation", _messages("first", "second"), 1)
+
+    assert store.get("conversation") == (_messages("first", "second"), 2)
+    assert not lock_file.exists()
+
+
+def test_the_file_store_rejects_ids_that_escape_its_folder(tmp_path):
+    store = FileConversationStore(tmp_path.joinpath("conversations"))
+
+    with pytest.raises(ValueError):
+        store.get("../conversation")
@@ -0,0 +1,133 @@
+from datetime import datetime
+
+import pytest
+
+from src.datasets.encoders import chunk_table, encode_table, encoding_report, records_to_table
+from src.datasets.types import DatasetEncoding
+
+_COLUMNS = ["name", "team", "score"]
+_ROWS = [
+    ["Ana", "red", 10],
+    ["Bruno, Jr.", "red", 7.5],
+    ["Carla", "blue", None],
+    ["Davi | Dan", "red", 3],
+]
+
+
+def _characters(text: str) -> int:
+    return len(text)
+
+
+def test_records_to_table():
+    columns, rows = records_to_table([{"a": 1, "b": 2}, {"b": 3, "c": 4}])
+
+    assert columns == ["a", "b", "c"]
+    assert rows == [[1, 2, None], [None, 3, 4]]
+
+
+def test_csv():
+    assert encode_table(_COLUMNS, _ROWS, DatasetEncoding.Csv) == (
+        "name,team,score\n"
+        "Ana,red,10\n"
+        "\"Bruno, Jr.\",red,7.5\n"
+        "Carla,blue,\n"
+        "Davi | Dan,red,3"
+    )
+
+
+def test_tsv():
+    assert encode_table(_COLUMNS, _ROWS[:1], DatasetEncoding.Tsv) == "name\tteam\tscore\nAna\tred\t10"
+
+
+def test_markdown_escapes_the_separators():
+    assert encode_table(_COLUMNS, _ROWS[3:], DatasetEncoding.Markdown) == (
+        "| name | team | score |\n"
+        "|---|---|---|\n"
+        "| Davi \\| Dan | red | 3 |"
+    )
+
+
+def test_columnar_dictionary_encodes_the_columns_with_few_distinct_values():
+    assert encode_table(_COLUMNS, _ROWS, DatasetEncoding.Columnar) == (
+        "rows: 4\n"
+        "name: Ana,\"Bruno, Jr.\",Carla,Davi | Dan\n"
+        "team {0=red,1=blue}: 0,0,1,0\n"
+        "score: 10,7.5,,3"
+    )
+
+
+def test_python():
+    assert encode_table(["when"], [[datetime(2024, 3, 1, 12, 30)]], DatasetEncoding.Python) == \
+        "[{'when': '2024-03-01 12:30:00.000000'}]"
+
+
+def test_auto_picks_the_cheapest_encoding():
+    encoded = encode_table(_COLUMNS, iter(_ROWS), DatasetEncoding.Auto, token_counter=_characters)
+
+    report = encoding_report(_COLUMNS, _ROWS, token_counter=_characters)
+    cheapest = next(iter(report))
+
+    assert encoded == encode_table(_COLUMNS, _ROWS, DatasetEncoding(cheapest))
+    assert list(report.values()) == sorted(report.values())
+    assert set(report.keys()) == {encoding.value for encoding in DatasetEncoding if encoding != DatasetEncoding.Auto}
+
+
+def _rows(count: int):
+    return [[f"name {index}", index] for index in range(count)]
+
+
+@pytest.mark.parametrize("encoding", [DatasetEncoding.Csv, DatasetEncoding.Markdown, DatasetEncoding.Python])
+def test_chunks_fit_and_cover_every_row_once(encoding):
+    rows = _rows(50)
+
+    chunks = list(chunk_table(["name", "value"], rows, max_tokens=200, encoding=encoding, token_counter=_characters))
+
+    assert len(chunks) > 1
+    # Contiguous, in order, and nothing left out.
+    assert [start for start, _, _ in chunks] == [0] + [end for _, end, _ in chunks[:-1]]
+    assert chunks[-1][1] == len(rows)
+
+    for start, end, text in chunks:
+        assert _characters(text) <= 200
+        assert text == encode_table(["name", "value"], rows[start:end], encoding)
+
+
+def test_a_chunk_that_is_bigger_than_estimated_is_split_in_half():
+    # The rows are picked by their size as CSV, but in markdown they're about twice as big.
+    chunks = list(chunk_table(
+        ["name", "value"], _rows(8), max_tokens=120, encoding=DatasetEncoding.Markdown, token_counter=_characters
+    ))
+
+    csv_chunks = list(chunk_table(["name", "value"], _rows(8), max_tokens=120, token_counter=_characters))
+    first_csv_chunk_rows = csv_chunks[0][1]
+
+    assert chunks[0][1] == first_csv_chunk_rows // 2
+    assert all(_characters(text) <= 120 for _, _, text in chunks)
+
+
+def test_a_row_that_does_not_fit_is_sent_alone():
+    rows = [["short", 1], ["x" * 500, 2], ["short", 3]]
+
+    chunks = list(chunk_table(["name", "value"], rows, max_tokens=100, token_counter=_characters))
+
+    assert [(start, end) for start, end, _ in chunks] == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_rows_are_read_as_needed():
+    read = []
+
+    def rows():
+        for row in _rows(1000):
+            read.append(row)
+            yield row
+
+    chunks = chunk_table(["name", "value"], rows(), max_tokens=100, token_counter=_characters)
+    _, end, _ = next(chunks)
+
+    # Only the rows of the first chunk, plus the one that didn't fit in it.
+    assert len(read) == end + 1
+
+
+def test_max_tokens_must_be_positive():
+    with pytest.raises(ValueError):
+        list(chunk_table(["name"], [["a"]], max_tokens=0))
@@ -0,0 +1,132 @@
+from datetime import datetime, timezone
+from enum import Enum
+
+import pytest
+
+from src.ai_tasks.chat_request import ChatMessage, ChatRequest
+from src.ai_tasks.types import ChatContextItem
+from src.shared import json_codec
+from src.shared.json_codec import configure_json_backend, dumps, encode, get_json_backend, loads
+from src.shared.types import JsonBackend
+
+
+class _Color(Enum):
+    Red = "red"
+
+
+class _Plain:
+    def __init__(self):
+        self.name = "plain"
+
+
+@pytest.fixture(params=[JsonBackend.Json, JsonBackend.Orjson])
+def backend(request, monkeypatch):
+    if request.param == JsonBackend.Orjson:
+        pytest.importorskip("orjson")
+
+    # Put back the one in use when the test is done.
+    monkeypatch.setattr(json_codec, "_json_backend", get_json_backend())
+    return configure_json_backend(request.param)
+
+
+def test_round_trip(backend):
+    obj = {"text": "ação ✓", "numbers": [1, 2.5], "nothing": None, "yes": True}
+
+    encoded = dumps(obj)
+
+    assert isinstance(encoded, bytes)
+    # Compact, and the non-ASCII characters are not escaped.
+    assert b" " not in encoded.replace("ação ✓".encode("utf-8"), b"")
+    assert "ação ✓".encode("utf-8") in encoded
+    assert loads(encoded) == obj
+    assert loads(encoded.decode("utf-8")) == obj
+
+
+def test_what_the_library_cant_encode_on_its_own(backend):
+    moment = datetime(2024, 3, 1, 10, 0, tzinfo=timezone.utc)
+
+    decoded = loads(dumps({
+        "model": ChatContextItem(role="user", content="hi"),
+        "message": ChatMessage("user", "hi"),
+        "moment": moment,
+        "color": _Color.Red,
+        "plain": _Plain(),
+        1: "not a string key",
+    }))
+
+    assert decoded == {
+        "model": {"role": "user", "content": "hi"},
+        "message": {"role": "user", "content": "hi"},
+        "moment": moment.isoformat(),
+        "color": "red",
+        "plain": {"name": "plain"},
+        "1": "not a string key",
+    }
+
+
+def test_default_is_used_for_the_rest(backend):
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
+
+    assert loads(dumps({"value": {1, 2} - {1, 2}}, default=str)) == {"value": "set()"}
+
+
+def test_invalid_json_is_a_value_error(backend):
+    with pytest.raises(ValueError):
+        loads(b"{not json")
+
+
+def test_pydantic_models_are_encoded_with_their_fields(backend):
+    assert loads(dumps(ChatContextItem(role="user", content="hi"))) == {"role": "user", "content": "hi"}
+
+
+def test_configure_json_backend(monkeypatch):
+    monkeypatch.setattr(json_codec, "_json_backend", get_json_backend())
+
+    assert configure_json_backend("json") == JsonBackend.Json
+    assert get_json_backend() == JsonBackend.Json
+
+    monkeypatch.setattr(json_codec, "_ORJSON_AVAILABLE", False)
+
+    assert configure_json_backend() == JsonBackend.Json
+
+    with pytest.raises(ValueError):
+        configure_json_backend(JsonBackend.Orjson)
+
+    with pytest.raises(ValueError):
+        configure_json_backend("yaml")
+
+
+def test_chat_request_is_encoded_once():
+    request = ChatRequest.from_context([ChatContextItem(role="user", content="hi")], model="model-a")
+
+    encoded = request.encoded()
+
+    assert request.encoded() is encoded
+    assert encoded.body == encode(request.to_dict()).body
+    assert loads(encoded.body) == {
+        "messages": [{"role": "user", "content": "hi"}],
+        "model": "model-a",
+        "stream": False
+    }
+
+
+def test_chat_request_with_model():
+    request = ChatRequest([ChatMessage("user", "hi")], model="model-a", stream=True)
+    request.encoded()
+
+    assert request.with_model("model-a") is request
+
+    other = request.with_model("model-b")
+
+    assert other.messages == request.messages
+    assert other.stream
+    assert loads(other.encoded().body)["model"] == "model-b"
+    # The original one is never changed.
+    assert loads(request.encoded().body)["model"] == "model-a"
+
+
+def test_chat_message_equality():
+    assert ChatMessage("user", "hi") == ChatMessage("user", "hi")
+    assert ChatMessage("user", "hi") != ChatMessage("assistant", "hi")
+    assert ChatMessage("user", "hi") != ChatContextItem(role="user", content="hi")
@@ -0,0 +1,169 @@
+import gzip
+import json
+
+import pytest
+
+from src.shared import log_index as log_index_module
+from src.shared.log_index import InteractionLogIndex
+
+# The clock fixture (see conftest) replaces the time of the module.
+uses_clock = pytest.mark.parametrize("clock", [log_index_module], indirect=True)
+
+_DAY = "2024-03-01"
+
+
+def _record(number: int, model: str = "model-a", latency: float = 1.0, **fields) -> dict:
+    return {
+        "logged_at": f"{_DAY}T10:00:{number:02d}+00:00",
+        "number": number,
+        "api_response": {"model": model, "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}},
+        "parsed_response": {"config": {"provider": "provider-a"}},
+        "latency_seconds": latency,
+        **fields,
+    }
+
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record).encode("utf-8") + b"\n"
+
+
+@pytest.fixture
+def log_folder(tmp_path):
+    tmp_path.joinpath(_DAY).mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def index(log_folder):
+    return InteractionLogIndex(log_folder, db_file=log_folder.joinpath("index.sqlite"))
+
+
+def _segment(log_folder, name: str = "interactions-20240301100000000000-1.jsonl"):
+    return log_folder.joinpath(_DAY, name)
+
+
+def _numbers(index: InteractionLogIndex):
+    return sorted(index.get_record(entry.id)["number"] for entry in index.query(limit=1000))
+
+
+def test_only_the_new_lines_are_read_on_each_refresh(log_folder, index):
+    segment = _segment(log_folder)
+    segment.write_bytes(_line(_record(1)) + _line(_record(2)))
+
+    assert index.refresh(force=True) == 2
+    assert index.refresh(force=True) == 0
+
+    with open(segment, "ab") as stream:
+        stream.write(_line(_record(3)))
+
+    assert index.refresh(force=True) == 1
+    assert _numbers(index) == [1, 2, 3]
+
+
+def test_a_half_written_line_is_left_for_the_next_refresh(log_folder, index):
+    segment = _segment(log_folder)
+    line = _line(_record(2))
+    segment.write_bytes(_line(_record(1)) + line[:10])
+
+    assert index.refresh(force=True) == 1
+
+    with open(segment, "ab") as stream:
+        stream.write(line[10:])
+
+    assert index.refresh(force=True) == 1
+    assert _numbers(index) == [1, 2]
+
+
+def test_a_gzipped_segment_is_read_while_it_is_being_written(log_folder, index):
+    segment = _segment(log_folder, "interactions-20240301100000000000-1.jsonl.gz")
+    line = _line(_record(2))
+
+    with gzip.open(segment, "ab") as stream:
+        stream.write(_line(_record(1)) + line[:10])
+        # What the writer does after every batch. The file has no end yet.
+        stream.flush()
+
+        assert index.refresh(force=True) == 1
+
+        stream.write(line[10:])
+        stream.flush()
+
+        assert index.refresh(force=True) == 1
+
+    assert _numbers(index) == [1, 2]
+
+
+def test_a_broken_line_is_skipped(log_folder, index):
+    _segment(log_folder).write_bytes(_line(_record(1)) + b"{not json\n" + _line(_record(2)))
+
+    assert index.refresh(force=True) == 2
+    assert _numbers(index) == [1, 2]
+
+
+def test_legacy_files_are_indexed(log_folder, index):
+    record = _record(1)
+    del record["logged_at"]
+    log_folder.joinpath(_DAY, "20240301103000000000-some-id.json").write_text(json.dumps(record))
+
+    assert index.refresh(force=True) == 1
+
+    [entry] = index.query()
+    assert entry.logged_at == f"{_DAY}T10:30:00+00:00"
+    assert index.get_record(entry.id) == record
+
+
+@uses_clock
+def test_queries_refresh_the_index_at_most_once_per_interval(log_folder, clock):
+    index = InteractionLogIndex(log_folder, db_file=log_folder.joinpath("index.sqlite"), min_refresh_interval_seconds=5)
+    segment = _segment(log_folder)
+    segment.write_bytes(_line(_record(1)))
+
+    assert len(index.query()) == 1
+
+    with open(segment, "ab") as stream:
+        stream.write(_line(_record(2)))
+
+    assert len(index.query()) == 1
+
+    clock.advance(5)
+    assert len(index.query()) == 2
+
+
+def test_query_filters_and_order(log_folder, index):
+    _segment(log_folder).write_bytes(b"".join([
+        _line(_record(1, model="model-a", conversation_id="c1")),
+        _line(_record(2, model="model-b")),
+        _line(_record(3, model="model-a")),
+    ]))
+
+    # Newest first.
+    assert [entry.model for entry in index.query()] == ["model-a", "model-b", "model-a"]
+    assert len(index.query(model="model-a")) == 2
+    assert len(index.query(conversation_id="c1")) == 1
+    assert len(index.query(since=f"{_DAY}T10:00:02", until=f"{_DAY}T10:00:03")) == 1
+    assert len(index.query(limit=1)) == 1
+
+    entry = index.query(model="model-b")[0]
+    assert (entry.provider, entry.prompt_tokens, entry.total_tokens) == ("provider-a", 10, 15)
+
+
+def test_stats(log_folder, index):
+    # model-a: latencies 1 to 10, model-b: a single one, without latency.
+    records = [_record(number, latency=float(number)) for number in range(1, 11)]
+    records.append(_record(11, model="model-b", latency=None))
+    _segment(log_folder).write_bytes(b"".join(_line(record) for record in records))
+
+    stats = {entry.group: entry for entry in index.stats(group_by="model")}
+
+    model_a = stats["model-a"]
+    assert (model_a.count, model_a.prompt_tokens, model_a.total_tokens) == (10, 100, 150)
+    assert model_a.latency_avg == pytest.approx(5.5)
+    # Nearest rank.
+    assert (model_a.latency_p50, model_a.latency_p95, model_a.latency_p99) == (5, 10, 10)
+
+    model_b = stats["model-b"]
+    assert model_b.count == 1
+    assert model_b.latency_avg is None and model_b.latency_p50 is None
+
+    [day] = index.stats(group_by="day")
+    assert (day.group, day.count, day.latency_p50) == (_DAY, 11, 5)
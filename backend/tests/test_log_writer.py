@@ -0,0 +1,94 @@
+import json
+import queue
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from src.shared import log_writer as log_writer_module
+from src.shared.log_writer import BufferedJsonlLogger
+
+
+def _timestamp(iso: str) -> float:
+    return datetime.fromisoformat(iso).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _read_folder(folder) -> list:
+    return [json.loads(line) for file in sorted(folder.glob("*.jsonl")) for line in file.read_text().splitlines()]
+
+
+@pytest.fixture
+def logger(tmp_path):
+    logger = BufferedJsonlLogger(tmp_path, flush_interval_seconds=0.01)
+    yield logger
+    logger.close()
+
+
+def test_records_are_written_when_closed(tmp_path, logger):
+    for number in range(3):
+        logger.log({"number": number})
+
+    logger.close()
+
+    days = list(tmp_path.iterdir())
+    assert len(days) == 1
+    assert [record["number"] for record in _read_folder(days[0])] == [0, 1, 2]
+    assert logger.written == 3
+
+
+@pytest.fixture
+def far_from_utc(monkeypatch):
+    # The day of the folder must not depend on the timezone of the server.
+    if not hasattr(time, "tzset"):
+        pytest.skip("Can't change the timezone on this platform.")
+
+    monkeypatch.setenv("TZ", "Pacific/Kiritimati")  # UTC+14
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_the_day_folder_is_in_utc_and_follows_each_record(tmp_path, logger, far_from_utc):
+    logger._write_batch([
+        (_timestamp("2024-03-01T23:59:59"), {"number": 1}),
+        (_timestamp("2024-03-02T00:00:01"), {"number": 2}),
+    ])
+    logger.close()
+
+    assert sorted(folder.name for folder in tmp_path.iterdir()) == ["2024-03-01", "2024-03-02"]
+    assert _read_folder(tmp_path.joinpath("2024-03-01")) == [
+        {"logged_at": "2024-03-01T23:59:59+00:00", "number": 1}
+    ]
+    assert _read_folder(tmp_path.joinpath("2024-03-02")) == [
+        {"logged_at": "2024-03-02T00:00:01+00:00", "number": 2}
+    ]
+
+
+def test_drop_oldest_never_drops_the_stop_marker(tmp_path):
+    logger = BufferedJsonlLogger(tmp_path, max_queue_size=1, overflow_policy="drop_oldest")
+    logger.close()
+
+    # As if close() put the marker in the (full) queue right after log() checked it was still open.
+    logger._queue = queue.Queue(maxsize=1)
+    logger._queue.put(log_writer_module._STOP)
+    logger._closed.clear()
+
+    logger.log({"number": 1})
+
+    assert logger._queue.get_nowait() is log_writer_module._STOP
+    assert logger.dropped == 1
+
+
+def test_drop_oldest_makes_room_for_the_new_record(tmp_path):
+    logger = BufferedJsonlLogger(tmp_path, max_queue_size=1, overflow_policy="drop_oldest")
+    logger.close()
+
+    logger._queue = queue.Queue(maxsize=1)
+    logger._queue.put((0, {"number": 1}))
+    logger._closed.clear()
+
+    logger.log({"number": 2})
+
+    assert logger._queue.get_nowait()[1] == {"number": 2}
+    assert logger.dropped == 1
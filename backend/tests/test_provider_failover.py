@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+from src.ai_tasks.ai_tasks import AiTasks
+from src.ai_tasks.async_ai_tasks import AsyncAiTasks
+from src.ai_tasks import provider_pool as provider_pool_module
+from src.ai_tasks.provider_pool import ProviderPool, get_failure_cooldown, is_provider_failure
+from src.ai_tasks.types import AiProvider
+from src.decorators.retry import CircuitOpenError
+
+_URL = "http://provider.test/v1/chat/completions"
+
+
+def _requests_error(status_code: int, headers: dict = None) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status_code}", response=response)
+
+
+def _httpx_error(status_code: int, headers: dict = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", _URL)
+    return httpx.HTTPStatusError(
+        f"{status_code}", request=request, response=httpx.Response(status_code, headers=headers, request=request)
+    )
+
+
+@pytest.mark.parametrize("error", [
+    _requests_error(500), _requests_error(503), _httpx_error(502),
+    _requests_error(401), _requests_error(403), _requests_error(429), _httpx_error(401), _httpx_error(429),
+    requests.Timeout(), requests.ConnectionError(),
+    httpx.ReadTimeout("timeout"), httpx.ConnectError("refused"),
+    CircuitOpenError("provider", 10),
+])
+def test_provider_failures(error):
+    assert is_provider_failure(error)
+
+
+@pytest.mark.parametrize("error", [
+    _requests_error(400), _requests_error(404), _httpx_error(400), _httpx_error(404), _httpx_error(422),
+    ValueError("bad response"),
+])
+def test_not_provider_failures(error):
+    assert not is_provider_failure(error)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (_requests_error(429, {"Retry-After": "120"}), 120),
+    (_httpx_error(429, {"retry-after-ms": "1500"}), 1.5),
+    (_httpx_error(503, {"Retry-After": "30"}), 30),
+    (_requests_error(429), None),
+    (_requests_error(401, {"Retry-After": "120"}), None),
+    (httpx.ReadTimeout("timeout"), None),
+])
+def test_failure_cooldown_is_the_retry_after(error, expected):
+    assert get_failure_cooldown(error) == expected
+
+
+def _pool() -> ProviderPool:
+    return ProviderPool(
+        [AiProvider(name=name, api_endpoint=_URL, api_key="key", model="model") for name in ["first", "second"]],
+        hedge_percentile=None
+    )
+
+
+def _tasks(cls, pool: ProviderPool):
+    return cls(api_endpoint=_URL, api_key="key", default_model="model", response_logger=lambda _: None,
+               provider_pool=pool)
+
+
+def _failures(pool: ProviderPool) -> int:
+    return sum(stats.failures for stats in pool.stats())
+
+
+def test_a_4xx_is_raised_right_away_without_failing_over():
+    pool = _pool()
+    tasks = _tasks(AiTasks, pool)
+    called = []
+
+    def post(provider, payload):
+        called.append(provider.name)
+        raise _requests_error(400)
+
+    tasks._post_to_provider = post
+
+    with pytest.raises(requests.HTTPError):
+        tasks._post_request_to_pool(payload=None)
+
+    assert len(called) == 1
+    assert _failures(pool) == 0
+
+
+def test_a_5xx_fails_over_to_the_next_provider():
+    pool = _pool()
+    tasks = _tasks(AiTasks, pool)
+    called = []
+
+    def post(provider, payload):
+        called.append(provider.name)
+        if len(called) == 1:
+            raise _requests_error(503)
+        return {"choices": []}
+
+    tasks._post_to_provider = post
+
+    json_response, _ = tasks._post_request_to_pool(payload=None)
+
+    assert json_response == {"choices": []}
+    assert len(called) == 2
+    assert _failures(pool) == 1
+
+
+def test_async_a_4xx_is_raised_right_away_without_failing_over():
+    pool = _pool()
+    tasks = _tasks(AsyncAiTasks, pool)
+    called = []
+
+    async def post(provider, payload):
+        called.append(provider.name)
+        raise _httpx_error(422)
+
+    tasks._post_to_provider = post
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(tasks._post_request_to_pool(payload=None))
+
+    assert len(called) == 1
+    assert _failures(pool) == 0
+
+
+def test_async_a_timeout_fails_over_to_the_next_provider():
+    pool = _pool()
+    tasks = _tasks(AsyncAiTasks, pool)
+    called = []
+
+    async def post(provider, payload):
+        called.append(provider.name)
+        if len(called) == 1:
+            raise httpx.ReadTimeout("timeout")
+        return {"choices": []}
+
+    tasks._post_to_provider = post
+
+    json_response, _ = asyncio.run(tasks._post_request_to_pool(payload=None))
+
+    assert json_response == {"choices": []}
+    assert len(called) == 2
+    assert _failures(pool) == 1
+
+
+def test_a_429_fails_over_and_leaves_the_provider_out_for_its_retry_after():
+    pool = _pool()
+    tasks = _tasks(AiTasks, pool)
+    called = []
+
+    def post(provider, payload):
+        called.append(provider.name)
+        if len(called) == 1:
+            raise _requests_error(429, {"Retry-After": "120"})
+        return {"choices": []}
+
+    tasks._post_to_provider = post
+
+    json_response, _ = tasks._post_request_to_pool(payload=None)
+
+    assert json_response == {"choices": []}
+    assert len(called) == 2
+    assert [stats.name for stats in pool.stats() if not stats.available] == [called[0]]
+
+
+@pytest.mark.parametrize("clock", [provider_pool_module], indirect=True)
+def test_the_cooldown_given_by_the_provider_replaces_the_default(clock):
+    pool = _pool()
+
+    pool.record_failure(pool.providers[0], cooldown_seconds=120)
+
+    clock.advance(pool.failure_cooldown_seconds + 1)
+    assert not pool.stats()[0].available
+
+    clock.advance(120)
+    assert pool.stats()[0].available
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import src.shared.rate_limiter as rate_limiter_module
+from src.shared.rate_limiter import AsyncRateLimiter, RateLimiter
+
+# How long we wait to be sure a request is being held (and, for the ones that shouldn't be, the max wait).
+HELD_SECONDS = 0.1
+
+
+# The clock fixture (see conftest) replaces the time of the module.
+uses_clock = pytest.mark.parametrize("clock", [rate_limiter_module], indirect=True)
+
+
+class _Request:
+    """
+    A request in a thread: goes through the limiter and stays in flight until finish() is called.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, tokens: int = 0):
+        self.sent = threading.Event()
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(rate_limiter, tokens), daemon=True)
+        self._thread.start()
+
+    def _run(self, rate_limiter: RateLimiter, tokens: int):
+        with rate_limiter.limit(tokens):
+            self.sent.set()
+            self._finished.wait()
+
+    def is_held(self) -> bool:
+        return not self.sent.wait(HELD_SECONDS)
+
+    def finish(self):
+        self._finished.set()
+        self._thread.join(timeout=5)
+
+
+def test_max_concurrency_holds_the_requests_until_one_finishes():
+    rate_limiter = RateLimiter(max_concurrency=1)
+    first = _Request(rate_limiter)
+    assert first.sent.wait(5)
+
+    second = _Request(rate_limiter)
+    assert second.is_held()
+
+    first.finish()
+    assert second.sent.wait(5)
+    second.finish()
+    assert rate_limiter.in_flight == 0
+
+
+@uses_clock
+def test_requests_per_minute(clock):
+    rate_limiter = RateLimiter(requests_per_minute=2)
+    requests = [_Request(rate_limiter) for _ in range(2)]
+    assert all(request.sent.wait(5) for request in requests)
+
+    third = _Request(rate_limiter)
+    assert third.is_held()
+
+    # A request per 30 seconds is refilled. (Notifying, since the limiter sleeps on the real clock)
+    clock.advance(30)
+    rate_limiter.update_from_response(200, httpx.Headers())
+    assert third.sent.wait(5)
+
+    for request in [*requests, third]:
+        request.finish()
+
+
+@uses_clock
+def test_tokens_given_back_let_the_next_request_go(clock):
+    rate_limiter = RateLimiter(tokens_per_minute=100)
+    first = _Request(rate_limiter, tokens=80)
+    assert first.sent.wait(5)
+
+    second = _Request(rate_limiter, tokens=50)
+    assert second.is_held()
+
+    # The first one used way less than estimated.
+    rate_limiter.record_usage(estimated_tokens=80, used_tokens=10)
+    assert second.sent.wait(5)
+
+    first.finish()
+    second.finish()
+
+
+@uses_clock
+def test_the_first_in_line_is_not_passed_by_smaller_requests(clock):
+    rate_limiter = RateLimiter(tokens_per_minute=100)
+    first = _Request(rate_limiter, tokens=80)
+    assert first.sent.wait(5)
+
+    big = _Request(rate_limiter, tokens=50)
+    assert big.is_held()
+
+    # There are enough tokens for this one, but it arrived later.
+    small = _Request(rate_limiter, tokens=10)
+    assert small.is_held()
+
+    clock.advance(60)
+    rate_limiter.update_from_response(200, httpx.Headers())
+    assert big.sent.wait(5)
+    assert small.sent.wait(5)
+
+    for request in [first, big, small]:
+        request.finish()
+
+
+@uses_clock
+def test_a_429_holds_everyone_for_the_retry_after(clock):
+    rate_limiter = RateLimiter()
+    rate_limiter.update_from_response(429, httpx.Headers({"Retry-After": "5"}))
+
+    request = _Request(rate_limiter)
+    assert request.is_held()
+
+    clock.advance(5)
+    rate_limiter.update_from_response(200, httpx.Headers())
+    assert request.sent.wait(5)
+    request.finish()
+
+
+@uses_clock
+def test_the_limits_are_learned_from_the_headers(clock):
+    rate_limiter = RateLimiter()
+    rate_limiter.update_from_response(200, httpx.Headers({
+        "x-ratelimit-limit-requests": "60",
+        "x-ratelimit-remaining-requests": "0",
+    }))
+
+    request = _Request(rate_limiter)
+    assert request.is_held()
+
+    # 60 per minute: one per second.
+    clock.advance(1)
+    rate_limiter.update_from_response(200, httpx.Headers())
+    assert request.sent.wait(5)
+    request.finish()
+
+
+@pytest.mark.parametrize("settings", [
+    {"requests_per_minute": 0}, {"tokens_per_minute": 0}, {"max_concurrency": 0}
+])
+def test_rate_limiter_rejects_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        RateLimiter(**settings)
+
+
+def test_async_max_concurrency_and_cancelled_waiters():
+    async def scenario():
+        rate_limiter = AsyncRateLimiter(max_concurrency=1)
+        release_first = asyncio.Event()
+        sent = []
+
+        async def request(name: str, release: asyncio.Event = None):
+            async with rate_limiter.limit():
+                sent.append(name)
+                if release is not None:
+                    await release.wait()
+
+        first = asyncio.create_task(request("first", release_first))
+        cancelled = asyncio.create_task(request("cancelled"))
+        last = asyncio.create_task(request("last"))
+        await asyncio.sleep(HELD_SECONDS)
+        assert sent == ["first"]
+
+        # The one that was first in line gives up. It must not block the ones behind it.
+        cancelled.cancel()
+        release_first.set()
+        await asyncio.wait_for(asyncio.gather(first, last), timeout=5)
+
+        assert cancelled.cancelled()
+        assert sent == ["first", "last"]
+        assert rate_limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_async_cancelled_in_flight_request_frees_its_slot():
+    async def scenario():
+        rate_limiter = AsyncRateLimiter(max_concurrency=1)
+        started = asyncio.Event()
+
+        async def hang():
+            async with rate_limiter.limit():
+                started.set()
+                await asyncio.Event().wait()
+
+        task = asyncio.create_task(hang())
+        await started.wait()
+        task.cancel()
+
+        async def quick():
+            async with rate_limiter.limit():
+                return True
+
+        assert await asyncio.wait_for(quick(), timeout=5)
+        assert rate_limiter.in_flight == 0
+
+    asyncio.run(scenario())
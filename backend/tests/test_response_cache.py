@@ -0,0 +1,118 @@
+import pytest
+
+from src.ai_tasks import response_cache as response_cache_module
+from src.ai_tasks.chat_request import ChatRequest
+from src.ai_tasks.response_cache import MemoryResponseCache, ResponseCache, SqliteResponseCache
+from src.ai_tasks.types import ChatContextItem
+
+# The clock fixture (see conftest) replaces the time of the module.
+uses_clock = pytest.mark.parametrize("clock", [response_cache_module], indirect=True)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache_factory(request, tmp_path):
+    def create(max_entries: int = 100, ttl_seconds=60):
+        if request.param == "sqlite":
+            return SqliteResponseCache(tmp_path.joinpath("responses.sqlite"), max_entries, ttl_seconds)
+
+        return MemoryResponseCache(max_entries, ttl_seconds)
+
+    return create
+
+
+def _response(content: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def test_a_cached_response_is_returned_as_a_copy(cache_factory):
+    cache = cache_factory()
+    cache.set("key", _response("hi"))
+
+    response = cache.get("key")
+    response["choices"].clear()
+
+    assert cache.get("key") == _response("hi")
+    assert cache.get("other") is None
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (2, 1, 1)
+
+
+def test_setting_a_key_again_replaces_the_response(cache_factory):
+    cache = cache_factory()
+    cache.set("key", _response("first"))
+    cache.set("key", _response("second"))
+
+    assert cache.get("key") == _response("second")
+    assert cache.stats().entries == 1
+
+
+@uses_clock
+def test_responses_expire_after_the_ttl(cache_factory, clock):
+    cache = cache_factory(ttl_seconds=60)
+    cache.set("key", _response("hi"))
+
+    clock.advance(60)
+    assert cache.get("key") == _response("hi")
+
+    clock.advance(1)
+    assert cache.get("key") is None
+    assert cache.stats().entries == 0
+
+
+@uses_clock
+def test_without_a_ttl_responses_are_kept_until_evicted(cache_factory, clock):
+    cache = cache_factory(ttl_seconds=None)
+    cache.set("key", _response("hi"))
+
+    clock.advance(365 * 24 * 60 * 60)
+
+    assert cache.get("key") == _response("hi")
+
+
+@uses_clock
+def test_the_least_recently_used_response_is_evicted(cache_factory, clock):
+    cache = cache_factory(max_entries=2)
+    cache.set("a", _response("a"))
+    clock.advance(1)
+    cache.set("b", _response("b"))
+    clock.advance(1)
+    # Reading "a" makes "b" the least recently used.
+    cache.get("a")
+    clock.advance(1)
+
+    cache.set("c", _response("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") == _response("a")
+    assert cache.get("c") == _response("c")
+
+
+def test_clear(cache_factory):
+    cache = cache_factory()
+    cache.set("key", _response("hi"))
+
+    cache.clear()
+
+    assert cache.get("key") is None
+    assert cache.stats().entries == 0
+
+
+def test_the_sqlite_cache_is_shared_and_survives_restarts(tmp_path):
+    SqliteResponseCache(tmp_path.joinpath("responses.sqlite")).set("key", _response("hi"))
+
+    assert SqliteResponseCache(tmp_path.joinpath("responses.sqlite")).get("key") == _response("hi")
+
+
+def _request(content: str, model: str = "model", stream: bool = False) -> ChatRequest:
+    return ChatRequest.from_context([ChatContextItem(role="user", content=content)], model, stream)
+
+
+def test_the_same_request_gets_the_same_key():
+    key = ResponseCache.build_key("http://a", _request("hi"))
+
+    # Streamed or not, the answer is the same.
+    assert ResponseCache.build_key("http://a", _request("hi", stream=True)) == key
+    assert ResponseCache.build_key("http://b", _request("hi")) != key
+    assert ResponseCache.build_key("http://a", _request("hi", model="other")) != key
+    assert ResponseCache.build_key("http://a", _request("hello")) != key
@@ -0,0 +1,171 @@
+import pytest
+
+import src.decorators.retry as retry_module
+from src.decorators.retry import CircuitBreaker, CircuitOpenError, RetryBudget
+from src.decorators.types import CircuitState
+
+
+# The clock fixture (see conftest) replaces the time of the module.
+uses_clock = pytest.mark.parametrize("clock", [retry_module], indirect=True)
+
+
+def _open_circuit(circuit_breaker: CircuitBreaker):
+    for _ in range(circuit_breaker.failure_threshold):
+        circuit_breaker.before_call()
+        circuit_breaker.record_failure()
+
+
+@uses_clock
+def test_circuit_opens_after_the_failure_threshold(clock):
+    circuit_breaker = CircuitBreaker(name="ai", failure_threshold=3, recovery_timeout=30)
+
+    for _ in range(2):
+        circuit_breaker.before_call()
+        circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitState.Closed
+
+    circuit_breaker.before_call()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitState.Open
+
+    clock.advance(10)
+    with pytest.raises(CircuitOpenError) as error:
+        circuit_breaker.before_call()
+    assert error.value.name == "ai"
+    assert error.value.retry_in == pytest.approx(20)
+
+
+@uses_clock
+def test_a_success_resets_the_failures(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=2)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == CircuitState.Closed
+
+
+@uses_clock
+def test_half_open_only_lets_the_probes_through(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, half_open_max_calls=2)
+    _open_circuit(circuit_breaker)
+
+    clock.advance(30)
+    assert circuit_breaker.state == CircuitState.HalfOpen
+
+    circuit_breaker.before_call()
+    circuit_breaker.before_call()
+    with pytest.raises(CircuitOpenError) as error:
+        circuit_breaker.before_call()
+    assert error.value.retry_in == 0
+
+
+@uses_clock
+def test_a_successful_probe_closes_the_circuit(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+    _open_circuit(circuit_breaker)
+    clock.advance(30)
+
+    circuit_breaker.before_call()
+    circuit_breaker.record_success()
+
+    assert circuit_breaker.state == CircuitState.Closed
+    circuit_breaker.before_call()
+    circuit_breaker.before_call()
+
+
+@uses_clock
+def test_a_failed_probe_opens_the_circuit_again(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+    _open_circuit(circuit_breaker)
+    clock.advance(30)
+
+    # A single failure is enough while half-open.
+    circuit_breaker.before_call()
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == CircuitState.Open
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_call()
+
+
+@uses_clock
+def test_release_gives_the_probe_back(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, half_open_max_calls=1)
+    _open_circuit(circuit_breaker)
+    clock.advance(30)
+
+    circuit_breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_call()
+
+    # E.g.: the probe was cancelled. Someone else can check the upstream.
+    circuit_breaker.release()
+    circuit_breaker.before_call()
+    assert circuit_breaker.state == CircuitState.HalfOpen
+
+
+@uses_clock
+def test_release_without_probes_does_nothing(clock):
+    circuit_breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30, half_open_max_calls=1)
+    circuit_breaker.release()
+    _open_circuit(circuit_breaker)
+    clock.advance(30)
+
+    circuit_breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_call()
+
+
+@pytest.mark.parametrize("settings", [
+    {"failure_threshold": 0}, {"recovery_timeout": -1}, {"half_open_max_calls": 0}
+])
+def test_circuit_breaker_rejects_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        CircuitBreaker(**settings)
+
+
+@uses_clock
+def test_retry_budget_always_allows_the_min_retries(clock):
+    budget = RetryBudget(ratio=0, min_retries_per_second=0.5, window_seconds=10)
+
+    assert [budget.try_retry() for _ in range(6)] == [True] * 5 + [False]
+
+
+@uses_clock
+def test_retry_budget_grows_with_the_calls(clock):
+    budget = RetryBudget(ratio=0.2, min_retries_per_second=0, window_seconds=10)
+
+    assert not budget.try_retry()
+
+    for _ in range(10):
+        budget.record_call()
+
+    assert [budget.try_retry() for _ in range(3)] == [True, True, False]
+
+
+@uses_clock
+def test_retry_budget_forgets_what_is_out_of_the_window(clock):
+    budget = RetryBudget(ratio=0.5, min_retries_per_second=0, window_seconds=10)
+    for _ in range(2):
+        budget.record_call()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+
+    # The calls and the retry are gone, so there's no budget until new calls come in.
+    clock.advance(11)
+    assert not budget.try_retry()
+
+    for _ in range(2):
+        budget.record_call()
+    assert budget.try_retry()
+
+
+@pytest.mark.parametrize("settings", [
+    {"ratio": -0.1}, {"min_retries_per_second": -1}, {"window_seconds": 0}
+])
+def test_retry_budget_rejects_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        RetryBudget(**settings)
@@ -0,0 +1,143 @@
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from pathlib import PurePosixPath
+from types import MappingProxyType
+from uuid import UUID
+
+import pytest
+from pydantic import BaseModel
+
+from src.shared.serializer import serialize_to_dict
+
+
+class _Color(Enum):
+    Red = "red"
+
+
+class _StrColor(str, Enum):
+    Blue = "blue"
+
+
+class _List(list):
+    pass
+
+
+class _Text(str):
+    pass
+
+
+_Point = namedtuple("_Point", "x y")
+
+
+@dataclass
+class _Record:
+    name: str
+    created_at: datetime
+    tags: set
+
+
+class _Model(BaseModel):
+    name: str
+    color: _Color
+
+
+class _Object:
+    def __init__(self):
+        self.value = Decimal("1.5")
+        self.path = PurePosixPath("/tmp/file.csv")
+
+
+@pytest.mark.parametrize("value, expected", [
+    (OrderedDict(x=1), {"x": 1}),
+    ({"a": Counter("aab")}, {"a": {"a": 2, "b": 1}}),
+    (defaultdict(list, a=[1]), {"a": [1]}),
+    (_List([1, 2]), [1, 2]),
+    ({"items": _List([OrderedDict(y=2)])}, {"items": [{"y": 2}]}),
+    (MappingProxyType({"k": (1, 2)}), {"k": [1, 2]}),
+    (deque([1, 2]), [1, 2]),
+    (range(3), [0, 1, 2]),
+    (_Point(1, 2), [1, 2]),
+    ([b"bytes"], [b"bytes"]),
+])
+def test_mappings_and_sequences_of_any_type(value, expected):
+    result = serialize_to_dict(value)
+
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_subclasses_of_primitives_are_kept():
+    assert isinstance(serialize_to_dict({"text": _Text("text")})["text"], str)
+
+
+def test_values_are_converted():
+    uuid = UUID("12345678-1234-5678-1234-567812345678")
+    value = {
+        "date": date(2024, 1, 2),
+        "enum": _Color.Red,
+        "str_enum": _StrColor.Blue,
+        "uuid": uuid,
+        "record": _Record(name="a", created_at=datetime(2024, 1, 2, 3, 4, 5), tags={"x"}),
+        "model": _Model(name="b", color=_Color.Red),
+        "object": _Object(),
+    }
+
+    assert serialize_to_dict(value) == {
+        "date": "2024-01-02",
+        "enum": "red",
+        "str_enum": "blue",
+        "uuid": str(uuid),
+        "record": {"name": "a", "created_at": "2024-01-02T03:04:05", "tags": ["x"]},
+        "model": {"name": "b", "color": "red"},
+        "object": {"value": "1.5", "path": "/tmp/file.csv"},
+    }
+
+
+def test_no_depth_limit():
+    value = leaf = []
+    for _ in range(5000):
+        child = _List()
+        leaf.append(child)
+        leaf = child
+    leaf.append(OrderedDict(level=_Color.Red))
+
+    result = serialize_to_dict(value)
+
+    for _ in range(5000):
+        result = result[0]
+    assert result == [{"level": "red"}]
+
+
+@pytest.mark.parametrize("depth", [1, 500])
+def test_circular_references_raise(depth):
+    value = leaf = {}
+    for _ in range(depth):
+        leaf["child"] = {}
+        leaf = leaf["child"]
+    leaf["loop"] = value
+
+    with pytest.raises(ValueError):
+        serialize_to_dict(value)
+
+
+def test_circular_references_through_subclasses_raise():
+    value = OrderedDict()
+    value["self"] = _List([value])
+
+    with pytest.raises(ValueError):
+        serialize_to_dict(value)
+
+
+def test_shared_references_are_not_circular():
+    shared = OrderedDict(x=[1])
+
+    assert serialize_to_dict([shared, {"again": shared}]) == [{"x": [1]}, {"again": {"x": [1]}}]
+
+
+def test_primitives_are_returned_as_they_are():
+    assert serialize_to_dict(None) is None
+    assert serialize_to_dict("text") == "text"
+    assert serialize_to_dict(1.5) == 1.5
@@ -0,0 +1,149 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from src.ai_tasks.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_the_result_and_get_their_own_copy():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def function():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": [42]}
+
+    def caller():
+        results.append(single_flight.do("key", function))
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+
+    while single_flight.coalesced < 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(calls) == 1
+    assert results == [{"answer": [42]}] * 3
+    results[1]["answer"].append(0)
+    assert results[0]["answer"] == [42] and results[2]["answer"] == [42]
+
+
+def test_everyone_waiting_gets_the_error_and_the_next_call_runs_again():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("upstream is down")
+
+    def caller():
+        try:
+            single_flight.do("key", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+
+    while single_flight.coalesced < 1:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert [str(e) for e in errors] == ["upstream is down"] * 2
+    assert single_flight.do("key", lambda: "back") == "back"
+
+
+def test_async_error_goes_to_everyone_and_the_key_is_released():
+    async def scenario():
+        single_flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("upstream is down")
+
+        callers = [asyncio.create_task(single_flight.do("key", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [str(e) for e in results] == ["upstream is down"] * 2
+        assert single_flight.coalesced == 1
+
+        async def working():
+            return "back"
+
+        assert await single_flight.do("key", working) == "back"
+
+    asyncio.run(scenario())
+
+
+def test_async_cancelling_the_first_caller_does_not_cancel_the_call():
+    async def scenario():
+        single_flight = AsyncSingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def function():
+            calls.append(1)
+            await release.wait()
+            return {"answer": 42}
+
+        first = asyncio.create_task(single_flight.do("key", function))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(single_flight.do("key", function))
+        await asyncio.sleep(0)
+
+        # E.g.: the client that started it disconnected.
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.wait_for(second, timeout=5) == {"answer": 42}
+        assert first.cancelled()
+        assert calls == [1]
+
+    asyncio.run(scenario())
+
+
+def test_async_error_nobody_waits_for_is_not_reported_as_unretrieved():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        unhandled = []
+        loop.set_exception_handler(lambda _, context: unhandled.append(context))
+
+        single_flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("upstream is down")
+
+        caller = asyncio.create_task(single_flight.do("key", failing))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # The warning comes when the task is collected.
+        gc.collect()
+
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        return unhandled
+
+    assert asyncio.run(scenario()) == []
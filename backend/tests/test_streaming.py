@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from src.ai_tasks.ai_tasks import AiTasks
+from src.ai_tasks.async_ai_tasks import AsyncAiTasks
+from src.ai_tasks.provider_pool import ProviderPool
+from src.ai_tasks.streaming import StreamCollector
+from src.ai_tasks.types import AiProvider
+
+_URL = "http://provider.test/v1/chat/completions"
+
+
+def _event(content: str = None, **fields) -> str:
+    return "data: " + json.dumps({"id": "chat-1", "model": "model", "choices": [{"delta": {"content": content}}],
+                                  **fields})
+
+
+# What an OpenAI-like API sends: a role-only delta, the content, keep-alives/comments, the usage and [DONE].
+_STREAM = [
+    _event(None), "", _event("Hel"), ": keep-alive", _event("lo"), "", _event("!"),
+    "data: " + json.dumps({"id": "chat-1", "model": "model", "choices": [], "usage": {"total_tokens": 7}}),
+    "data: [DONE]",
+]
+
+
+def test_collector_gives_back_the_new_text_of_each_line():
+    collector = StreamCollector()
+
+    deltas = [collector.feed_line(line) for line in _STREAM]
+
+    assert [delta for delta in deltas if delta] == ["Hel", "lo", "!"]
+    assert collector.to_response() == {
+        "id": "chat-1",
+        "model": "model",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}}],
+        "usage": {"total_tokens": 7},
+    }
+
+
+def test_collector_accepts_bytes():
+    collector = StreamCollector()
+
+    assert collector.feed_line(_event("olá").encode("utf-8")) == "olá"
+
+
+@pytest.mark.parametrize("line", [
+    'data: {"error": {"message": "overloaded"}}',
+    "data: {not json",
+    'data: {"choices": "nope"}',
+])
+def test_collector_rejects_errors_and_invalid_lines(line):
+    with pytest.raises(ValueError):
+        StreamCollector().feed_line(line)
+
+
+class _FakeStreamResponse:
+    """
+    Stands in for the (requests) response of a streamed request.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.encoding = None
+        self.closed = False
+
+    def iter_lines(self, decode_unicode: bool = False):
+        yield from self.lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+def _tasks(cls, provider_pool: ProviderPool = None):
+    return cls(api_endpoint=_URL, api_key="key", default_model="model", response_logger=lambda _: None,
+               provider_pool=provider_pool)
+
+
+def _check_chunks(chunks, question: str = "Hi?"):
+    assert [chunk.delta for chunk in chunks[:-1]] == ["Hel", "lo", "!"]
+    assert not any(chunk.done for chunk in chunks[:-1])
+
+    last = chunks[-1]
+    assert last.done and last.delta == ""
+    assert last.response.response == "Hello!"
+    assert [(item.role, item.content) for item in last.response.updated_context] == [
+        ("user", question), ("assistant", "Hello!")
+    ]
+
+
+def test_ask_a_question_stream():
+    tasks = _tasks(AiTasks)
+    response = _FakeStreamResponse(_STREAM)
+    payloads = []
+
+    def open_stream(provider, payload):
+        payloads.append(payload)
+        return response
+
+    tasks._open_stream = open_stream
+
+    _check_chunks(list(tasks.ask_a_question_stream("Hi?")))
+    assert payloads[0].stream
+    # Closed once the stream is over, so the connection goes back to the pool.
+    assert response.closed
+
+
+def test_async_ask_a_question_stream():
+    tasks = _tasks(AsyncAiTasks)
+    response = httpx.Response(200, content="\n".join(_STREAM).encode("utf-8"))
+
+    async def open_stream(provider, payload):
+        return response
+
+    tasks._open_stream = open_stream
+
+    async def collect():
+        return [chunk async for chunk in tasks.ask_a_question_stream("Hi?")]
+
+    _check_chunks(asyncio.run(collect()))
+    assert response.is_closed
+
+
+def test_async_stream_fails_over_before_it_starts():
+    providers = [AiProvider(name=name, api_endpoint=_URL, api_key="key", model="model") for name in ["a", "b"]]
+    tasks = _tasks(AsyncAiTasks, ProviderPool(providers, hedge_percentile=None))
+    opened = []
+
+    async def open_stream(provider, payload):
+        opened.append(provider.name)
+        if len(opened) == 1:
+            raise httpx.ConnectError("refused")
+        return httpx.Response(200, content="\n".join(_STREAM).encode("utf-8"))
+
+    tasks._open_stream = open_stream
+
+    async def collect():
+        return [chunk async for chunk in tasks.ask_a_question_stream("Hi?")]
+
+    chunks = asyncio.run(collect())
+
+    _check_chunks(chunks)
+    assert len(opened) == 2
+    assert chunks[-1].response.config.provider == opened[1]
@@ -0,0 +1,133 @@
+import math
+
+import pytest
+
+from src.datasets import summary
+from src.datasets.columnar import ColumnarDataset, ingest_csv_file
+from src.datasets.summary import summarize_dataset
+
+_HEADER = ["city", "age", "score", "label"]
+_ROWS = [
+    ["Lisbon", "20", "1.5", "1"],
+    ["Porto", "30", "", "0"],
+    ["Lisbon", "40", "3.5", "1"],
+    ["Faro", "50", "4.5", "0"],
+    ["Lisbon", "60", "5.5", "0"],
+]
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch) -> str:
+    """
+    Run the test with and without NumPy, since the summary has a code path for each.
+    """
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+
+    monkeypatch.setattr(summary, "_NUMPY_AVAILABLE", request.param == "numpy")
+    return request.param
+
+
+@pytest.fixture
+def dataset():
+    dataset = ColumnarDataset.from_rows(_HEADER, _ROWS)
+    yield dataset
+    dataset.close()
+
+
+def _as_list(values):
+    return [float(value) if isinstance(value, float) else int(value) for value in values]
+
+
+def test_describe(backend, dataset):
+    stats = summary._describe(summary._numeric_column(dataset, _HEADER.index("age")))
+
+    assert stats["count"] == 5
+    assert stats["mean"] == 40
+    assert stats["std"] == pytest.approx(math.sqrt(250))
+    assert (stats["min"], stats["p25"], stats["median"], stats["p75"], stats["max"]) == (20, 30, 40, 50, 60)
+
+
+def test_describe_skips_missing_values(backend, dataset):
+    stats = summary._describe(summary._numeric_column(dataset, _HEADER.index("score")))
+
+    assert stats["count"] == 4
+    assert stats["mean"] == pytest.approx(3.75)
+    # Interpolated, like NumPy does.
+    assert stats["p25"] == pytest.approx(3.0)
+    assert stats["median"] == pytest.approx(4.0)
+
+
+def test_describe_of_a_single_value_has_no_std(backend):
+    dataset = ColumnarDataset.from_rows(["value", "name"], [["7", "a"], ["", "b"]])
+
+    stats = summary._describe(summary._numeric_column(dataset, 0))
+
+    assert (stats["count"], stats["mean"], stats["std"]) == (1, 7, None)
+
+
+def test_category_codes_are_sorted_by_how_common_they_are(backend, dataset):
+    labels, codes = summary._category_codes(dataset, _HEADER.index("city"))
+
+    assert labels == ["Lisbon", "Porto", "Faro"]
+    assert _as_list(codes) == [0, 1, 0, 2, 0]
+
+
+def test_integer_columns_with_few_values_are_categories(backend, dataset):
+    labels, codes = summary._category_codes(dataset, _HEADER.index("label"))
+
+    assert _as_list(labels) == [0, 1]
+    assert _as_list(codes) == [1, 0, 1, 0, 0]
+
+
+def test_columns_with_too_many_values_are_not_categories(backend, monkeypatch, dataset):
+    monkeypatch.setattr(summary, "SUMMARY_MAX_CATEGORIES", 2)
+
+    assert summary._category_codes(dataset, _HEADER.index("city")) is None
+    assert summary._category_codes(dataset, _HEADER.index("age")) is None
+
+
+def test_group_stats(backend, dataset):
+    _, codes = summary._category_codes(dataset, _HEADER.index("city"))
+
+    counts, means = summary._group_stats(codes, 3, dataset.numeric_values(_HEADER.index("score")))
+
+    assert counts == [3, 1, 1]
+    # Porto has only a missing score.
+    assert means[0] == pytest.approx((1.5 + 3.5 + 5.5) / 3)
+    assert math.isnan(means[1])
+    assert means[2] == pytest.approx(4.5)
+
+
+def test_correlation(backend, dataset):
+    ages = dataset.numeric_values(_HEADER.index("age"))
+
+    assert summary._correlation(ages, [value * 2 + 1 for value in ages]) == pytest.approx(1)
+    assert summary._correlation(ages, [-value for value in ages]) == pytest.approx(-1)
+    # Only the rows where both have values: (20, 1.5), (40, 3.5), (50, 4.5), (60, 5.5), which are on a line.
+    assert summary._correlation(ages, dataset.numeric_values(_HEADER.index("score"))) == pytest.approx(1)
+
+
+def test_correlation_is_none_without_variation(backend):
+    assert summary._correlation([1.0, 2.0, 3.0], [5.0, 5.0, 5.0]) is None
+    assert summary._correlation([1.0, math.nan], [2.0, 3.0]) is None
+
+
+def test_summary_is_the_same_with_and_without_numpy(monkeypatch, tmp_path):
+    pytest.importorskip("numpy")
+    csv_file = tmp_path.joinpath("data.csv")
+    csv_file.write_text("\n".join(",".join(row) for row in [_HEADER, *_ROWS]) + "\n", encoding="utf-8")
+
+    # Memory-mapped, like the uploaded files.
+    dataset = ingest_csv_file(csv_file, tmp_path.joinpath("dataset"))
+    try:
+        summaries = []
+        for numpy_available in [False, True]:
+            monkeypatch.setattr(summary, "_NUMPY_AVAILABLE", numpy_available)
+            summaries.append(summarize_dataset(dataset, sample_rows=3))
+    finally:
+        dataset.close()
+
+    assert summaries[0] == summaries[1]
+    assert "Rows per city" in summaries[0]
+    assert "stratified by label" in summaries[0]
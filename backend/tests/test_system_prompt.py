@@ -0,0 +1,31 @@
+from src.ai_tasks.types import ChatContextItem
+from src.ai_utils.system_prompt import context_prefix_hash, context_prompt_label, register_prompt
+
+
+def _context(system_prompt: str = None):
+    messages = [ChatContextItem(role="user", content="Hi!")]
+    if system_prompt is not None:
+        messages.insert(0, ChatContextItem(role="system", content=system_prompt))
+    return messages
+
+
+def test_known_prompts_are_labeled_by_name():
+    register_prompt("agent:test", "You are a test agent.")
+
+    assert context_prompt_label(_context("You are a test agent.")) == "agent:test"
+
+
+def test_unknown_prompts_share_a_single_label():
+    labels = {context_prompt_label(_context(f"Prompt number {i}.")) for i in range(100)}
+
+    assert labels == {"other"}
+
+
+def test_no_system_prompt():
+    assert context_prompt_label(_context()) == "none"
+    assert context_prefix_hash(_context()) is None
+
+
+def test_the_hash_only_depends_on_the_text():
+    assert context_prefix_hash(_context("Same.")) == context_prefix_hash(_context("Same."))
+    assert context_prefix_hash(_context("Same.")) != context_prefix_hash(_context("Different."))
@@ -0,0 +1,43 @@
+import os
+import time
+
+from src.datasets.upload_store import UploadStore, ORPHAN_GRACE_PERIOD_SECONDS, TEMPORARY_UPLOAD_SUFFIX
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_stale_temporary_uploads_and_orphan_folders_are_removed(tmp_path):
+    stale_upload = tmp_path.joinpath(f"stale{TEMPORARY_UPLOAD_SUFFIX}")
+    recent_upload = tmp_path.joinpath(f"recent{TEMPORARY_UPLOAD_SUFFIX}")
+    stale_folder = tmp_path.joinpath("orphan")
+    other_file = tmp_path.joinpath("notes.txt")
+
+    for file in [stale_upload, recent_upload, other_file]:
+        file.write_text("a,b\n1,2\n")
+    stale_folder.mkdir()
+
+    for path in [stale_upload, stale_folder, other_file]:
+        _age(path, ORPHAN_GRACE_PERIOD_SECONDS + 60)
+
+    UploadStore(folder=tmp_path)
+
+    assert not stale_upload.exists()
+    assert not stale_folder.exists()
+    # Still being received (maybe by another worker), and not ours.
+    assert recent_upload.exists()
+    assert other_file.exists()
+
+
+def test_ingested_uploads_are_kept(tmp_path):
+    csv_file = tmp_path.joinpath("data.csv")
+    csv_file.write_text("a,b\n1,2\n")
+    store = UploadStore(folder=tmp_path.joinpath("uploads"))
+    file_id = store.add_csv_file(csv_file)
+    _age(store.folder.joinpath(file_id), ORPHAN_GRACE_PERIOD_SECONDS + 60)
+
+    reopened = UploadStore(folder=store.folder)
+
+    assert reopened.get(file_id).column_values("a") == [1]
@@ -83,6 +83,12 @@ const App: React.FC = () => {
         setMessages((prevState) => [...prevState, newMessage]);
     };
 
+    const handleUpdateMessage = (id: string, text: string, isStreaming: boolean) => {
+        setMessages((prevState) =>
+            prevState.map((message) => (message.id === id ? { ...message, text, isStreaming } : message))
+        );
+    };
+
     const checkAgentType = () => {
         const agentType = process.env.REACT_APP_AGENT_TYPE;
 
@@ -139,7 +145,7 @@ const App: React.FC = () => {
                 <AppContainer>
                     <Header otherUser={userB} themeMode={themeMode} toggleTheme={toggleTheme} />
                     <MessageList messages={messages} currentUser={userA} otherUser={userB} />
-                    <MessageInput onSendMessage={handleSendMessage} currentUser={userA} />
+                    <MessageInput onSendMessage={handleSendMessage} onUpdateMessage={handleUpdateMessage} currentUser={userA} />
                 </AppContainer>
             )}
         </ThemeProvider>
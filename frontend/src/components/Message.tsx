@@ -67,6 +67,16 @@ const MessageText = styled.div`
     white-space: pre-wrap; /* Preserve line breaks */
 `;
 
+const StreamingCursor = styled.span`
+    animation: blink 1s step-start infinite;
+
+    @keyframes blink {
+        50% {
+            opacity: 0;
+        }
+    }
+`;
+
 const IconContainer = styled.div`
     cursor: pointer;
     color: gray;
@@ -124,6 +134,7 @@ const Message: React.FC<MessageProps> = ({ message, currentUser, otherUser }) =>
                 </MessageHeader>
                 <MessageText>
                     {parsedMessage}
+                    {message.isStreaming && <StreamingCursor>▍</StreamingCursor>}
                     <IconContainer className="icon-container" onClick={() => handleCopyClick(message.id)}>
                         <ClipboardIcon isVisible={copiedMessageId !== message.id} />
                         <CheckIcon isVisible={copiedMessageId === message.id} />
@@ -134,4 +145,5 @@ const Message: React.FC<MessageProps> = ({ message, currentUser, otherUser }) =>
     );
 };
 
-export default Message;
+// Memoized, so while an answer is streaming only the message being updated gets re-rendered.
+export default React.memo(Message);
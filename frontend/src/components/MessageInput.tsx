@@ -2,7 +2,8 @@ import React, { useRef, useState } from 'react';
 import styled from 'styled-components';
 import { FaPaperclip, FaPaperPlane, FaTimes } from 'react-icons/fa';
 import axios from 'axios';
-import { AiResponse, ChatContextItem, Message as MessageType, UploadDatafileResponse, User } from '../types/types';
+import { ConversationTurnResponse, Message as MessageType, UploadDatafileResponse, User } from '../types/types';
+import { postAndStream } from '../utils/streaming';
 
 const InputContainer = styled.div`
     display: flex;
@@ -135,11 +136,13 @@ const Hint = styled.span`
 
 interface MessageInputProps {
     onSendMessage: (message: MessageType) => void;
+    onUpdateMessage: (id: string, text: string, isStreaming: boolean) => void;
     currentUser: User;
 }
 
-const MessageInput: React.FC<MessageInputProps> = ({ onSendMessage, currentUser }) => {
-    const [context, setContext] = useState<ChatContextItem[] | null>(null);
+const MessageInput: React.FC<MessageInputProps> = ({ onSendMessage, onUpdateMessage, currentUser }) => {
+    // The context of the conversation is kept by the server. We only need to know which conversation we're in.
+    const [conversationId, setConversationId] = useState<string | null>(null);
     const [message, setMessage] = useState('');
     const [selectedFile, setSelectedFile] = useState<File | null>(null);
     const [query, setQuery] = useState('');
@@ -177,7 +180,7 @@ const MessageInput: React.FC<MessageInputProps> = ({ onSendMessage, currentUser
             let payload;
 
             if (isDataAnalyst) {
-                endpoint = '/analyze-data';
+                endpoint = '/conversations/analyze-data';
                 payload = {
                     question_or_prompt: message,
                     data: null,
@@ -185,14 +188,14 @@ const MessageInput: React.FC<MessageInputProps> = ({ onSendMessage, currentUser
                     data_before_prompt: false,
                     query: query,
                     file_id: fileId,
-                    context,
+                    conversation_id: conversationId,
                 };
             } else {
-                endpoint = '/ask-question';
+                endpoint = '/conversations/ask-question/stream';
                 payload = {
                     question_or_prompt: message,
                     character_name: agentType,
-                    context,
+                    conversation_id: conversationId,
                     ruleset: process.env.REACT_APP_CHAT_RULESET,
                 };
             }
@@ -207,21 +210,45 @@ const MessageInput: React.FC<MessageInputProps> = ({ onSendMessage, currentUser
             onSendMessage(newMessage);
 
             try {
-                const response = await axios.post<AiResponse>(`${apiUrl}${endpoint}`, payload);
-                const aiResponse = response.data.response;
-
-                setContext(response.data.updated_context);
-
-                setMessage(''); // Clear the message after sending the message
-
-                const aiMessage: MessageType = {
-                    id: String(Date.now() + 1),
-                    senderId: 'ai',
-                    text: aiResponse,
-                    timestamp: new Date(),
-                };
-
-                onSendMessage(aiMessage);
+                if (isDataAnalyst) {
+                    const response = await axios.post<ConversationTurnResponse>(`${apiUrl}${endpoint}`, payload);
+                    const aiResponse = response.data.response;
+
+                    setConversationId(response.data.conversation_id);
+
+                    setMessage(''); // Clear the message after sending the message
+
+                    const aiMessage: MessageType = {
+                        id: String(Date.now() + 1),
+                        senderId: 'ai',
+                        text: aiResponse,
+                        timestamp: new Date(),
+                    };
+
+                    onSendMessage(aiMessage);
+                } else {
+                    // Show the answer while it's being generated, instead of waiting for all of it.
+                    const aiMessageId = String(Date.now() + 1);
+                    let streamedText = '';
+
+                    setMessage(''); // Clear the message after sending the message
+
+                    onSendMessage({
+                        id: aiMessageId,
+                        senderId: 'ai',
+                        text: streamedText,
+                        timestamp: new Date(),
+                        isStreaming: true,
+                    });
+
+                    const response = await postAndStream(`${apiUrl}${endpoint}`, payload, (delta) => {
+                        streamedText += delta;
+                        onUpdateMessage(aiMessageId, streamedText, true);
+                    });
+
+                    setConversationId(response.conversation_id);
+                    onUpdateMessage(aiMessageId, response.response, false);
+                }
             } catch (error) {
                 console.error('Message sending error:', error);
                 alert('Failed to send message.');
@@ -18,8 +18,11 @@ interface MessageListProps {
 const MessageList: React.FC<MessageListProps> = ({ messages, currentUser, otherUser }) => {
     const messagesEndRef = useRef<HTMLDivElement>(null);
 
+    const isStreaming = messages.some((message) => message.isStreaming);
+
     const scrollToBottom = () => {
-        messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+        // Smooth scrolling on every streamed piece of text would keep restarting the animation, so we jump instead.
+        messagesEndRef.current?.scrollIntoView({ behavior: isStreaming ? 'auto' : 'smooth' });
     };
 
     useEffect(scrollToBottom, [messages]);
@@ -9,6 +9,7 @@ export interface Message {
     senderId: string;
     text: string;
     timestamp: Date;
+    isStreaming?: boolean;
 }
 
 export interface ChatContextItem {
@@ -27,6 +28,19 @@ export interface AiResponse {
     config: AiGeneratorConfig;
 }
 
+export interface ConversationTurnResponse {
+    conversation_id: string;
+    response: string;
+    new_messages: ChatContextItem[];
+    config: AiGeneratorConfig;
+}
+
+export interface ConversationStreamChunk {
+    delta: string;
+    done: boolean;
+    response: ConversationTurnResponse | null;
+}
+
 export interface UploadDatafileResponse {
     file_id: string;
 }
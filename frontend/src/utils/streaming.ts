@@ -0,0 +1,61 @@
+import { ConversationStreamChunk, ConversationTurnResponse } from '../types/types';
+
+/**
+ * Posts the payload to a streaming endpoint (server-sent events) and calls onDelta with every piece of text as it
+ * arrives. Resolves with the complete response once the AI is done answering.
+ */
+export const postAndStream = async (
+    url: string,
+    payload: object,
+    onDelta: (delta: string) => void
+): Promise<ConversationTurnResponse> => {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload),
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line. The last piece might be incomplete, so we keep it for the next read.
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+
+        for (const event of events) {
+            const lines = event.split('\n');
+            const isError = lines.some((line) => line.startsWith('event: error'));
+            const data = lines
+                .filter((line) => line.startsWith('data:'))
+                .map((line) => line.slice('data:'.length))
+                .join('\n');
+
+            if (!data) continue;
+
+            if (isError) {
+                throw new Error(JSON.parse(data).detail);
+            }
+
+            const chunk: ConversationStreamChunk = JSON.parse(data);
+
+            if (chunk.done && chunk.response) {
+                return chunk.response;
+            }
+
+            onDelta(chunk.delta);
+        }
+    }
+
+    throw new Error('The stream ended before the AI finished answering.');
+};